@@ -13,12 +13,19 @@ Integración en sistema_web.py:
     from academia_cepru import tab_academia_cepru
 """
 
+from datetime import datetime
+from pathlib import Path
+
 import streamlit as st
 
 from fichas_historia import (generar_ficha_texto, generar_banco_preguntas,
                              generar_juegos_educativos,
                              balancear, muestrear, TAMANOS_EXAMEN,
-                             contar_espacios, LETRAS, _PATRON)
+                             contar_espacios, LETRAS, _PATRON,
+                             LOGO_PATH, LOGO_MARCA_AGUA)
+from cache_pdfs import CachePDF
+from paquetes_cepru import (construir_paquete, renderizar, limpiar_viejos,
+                            CARPETA_DEFECTO)
 
 try:
     from fichas_algebra import generar_ficha_algebra
@@ -26,6 +33,37 @@ except ImportError:
     generar_ficha_algebra = None
 
 
+PROFESOR_DEFECTO = "Prof. Alexander Córdova"
+
+
+# ---------------------------------------------------------------
+# Caché en disco de los PDF generados (ver cache_pdfs.py). Una misma
+# ficha/banco con los mismos datos sale de la caché ya cifrada, sin
+# ReportLab ni pypdf.
+# ---------------------------------------------------------------
+@st.cache_resource
+def _cache_pdfs():
+    return CachePDF(recursos=(LOGO_PATH, LOGO_MARCA_AGUA))
+
+
+def pdf_cacheado(generador, *args, **kwargs):
+    """generador(*args, **kwargs) servido desde la caché en disco. Si la
+    caché no está disponible, se genera directamente."""
+    try:
+        cache = _cache_pdfs()
+    except Exception:
+        return generador(*args, **kwargs)
+    return cache.obtener(generador, *args, **kwargs)
+
+
+def _tema_examen(tema, cantidad, semilla):
+    """Tema con `cantidad` preguntas muestreadas con `semilla` y con las
+    claves repartidas entre las cinco letras."""
+    muestra = muestrear(tema["preguntas"], min(cantidad, len(tema["preguntas"])),
+                        semilla=semilla)
+    return {**tema, "preguntas": balancear(muestra)}
+
+
 _NOMBRES_CORTOS_CURSO = {
     "ceh": "Historia", "cef": "Filosofia", "ceg": "Geografia",
     "cec": "Civica", "cecc": "Comunicativa", "cee": "Economia",
@@ -145,121 +183,158 @@ PENDIENTES = ["🔢 Aritmética"]
 
 def _generar_zip_curso(balotas, area_pie, pfx, grado_txt, profesor_txt,
                        con_claves):
-    """Genera un ZIP en memoria con la ficha y el banco de preguntas de
-    TODOS los temas de un curso, listo para subir a una carpeta."""
-    import zipfile, io as _io
+    """Genera un ZIP con la ficha y el banco de preguntas de TODOS los
+    temas de un curso, listo para subir a una carpeta."""
+    import tempfile
 
-    buf = _io.BytesIO()
     version = "Docente" if con_claves else "Alumno"
     _, tamano_defecto = list(TAMANOS_EXAMEN.items())[0]  # 20 preguntas
-
-    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
-        for tema in balotas:
-            try:
-                ficha_pdf = generar_ficha_texto(
-                    tema, con_claves, grado_txt,
-                    area=area_pie, profesor=profesor_txt)
-                nombre_ficha = _nombre_archivo(pfx, tema, "Ficha", version)
-                zf.writestr(nombre_ficha, ficha_pdf)
-            except Exception:
-                pass
-            try:
-                cantidad = min(tamano_defecto, len(tema["preguntas"]))
-                muestra = muestrear(tema["preguntas"], cantidad, semilla=0)
-                preg = balancear(muestra)
-                tema_b = {**tema, "preguntas": preg}
-                banco_pdf = generar_banco_preguntas(
-                    tema_b, con_claves, grado_txt,
-                    area=area_pie, profesor=profesor_txt)
-                nombre_banco = _nombre_archivo(pfx, tema, "Banco", version)
-                zf.writestr(nombre_banco, banco_pdf)
-            except Exception:
-                pass
-
-    buf.seek(0)
-    return buf.getvalue()
-
-
-def _generar_paquete_admin(area, tipos, grado_txt, profesor_txt,
-                           reportar_progreso=None):
-    """Genera un ZIP con TODO lo que el administrador haya marcado para
-    un curso: fichas en blanco, fichas completas, examenes de 20/40
-    preguntas (alumno y docente), y el banco completo del curso.
-    'reportar_progreso' es una funcion opcional callback(fraccion, texto)
-    para actualizar una barra de progreso en la interfaz."""
-    import zipfile, io as _io
-
+    kw = {"area": area_pie, "profesor": profesor_txt}
+    documentos = []
+    for tema in balotas:
+        documentos.append((_nombre_archivo(pfx, tema, "Ficha", version),
+                           generar_ficha_texto, (tema, con_claves, grado_txt), kw))
+        documentos.append((_nombre_archivo(pfx, tema, "Banco", version),
+                           generar_banco_preguntas,
+                           (_tema_examen(tema, tamano_defecto, 0), con_claves,
+                            grado_txt), kw))
+    with tempfile.TemporaryDirectory() as carpeta:
+        ruta = Path(carpeta) / f"{pfx}.zip"
+        construir_paquete(documentos, ruta, cache=_cache_pdfs())
+        return ruta.read_bytes()
+
+
+def _documentos_curso(area, tipos, grado_txt, profesor_txt, carpeta=""):
+    """[(nombre_en_zip, generador, args, kwargs)] de TODO lo que el
+    administrador haya marcado para un curso: fichas en blanco, fichas
+    completas, exámenes de 20/40 preguntas (alumno y docente) y el banco
+    completo del curso."""
     balotas = area["balotas"]
     pfx = area["prefijo"]
-    area_pie = area["area_pie"]
-    buf = _io.BytesIO()
-    total_pasos = len(balotas) + (1 if tipos.get("banco_completo") else 0)
-    paso_actual = 0
-
-    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
-        for tema in balotas:
-            paso_actual += 1
-            if reportar_progreso:
-                reportar_progreso(paso_actual / total_pasos,
-                                  f"{area_pie} · Tema {tema['num']}")
-            if tipos.get("ficha_blanco"):
-                try:
-                    pdf = generar_ficha_texto(tema, False, grado_txt,
-                                              area=area_pie, profesor=profesor_txt)
-                    zf.writestr(_nombre_archivo(pfx, tema, "Ficha", "Alumno"), pdf)
-                except Exception:
-                    pass
-            if tipos.get("ficha_completa"):
-                try:
-                    pdf = generar_ficha_texto(tema, True, grado_txt,
-                                              area=area_pie, profesor=profesor_txt)
-                    zf.writestr(_nombre_archivo(pfx, tema, "Ficha", "Docente"), pdf)
-                except Exception:
-                    pass
-            for tam, etiqueta in [(20, "Ex20"), (40, "Ex40")]:
-                if tipos.get(f"examen{tam}"):
-                    try:
-                        cantidad = min(tam, len(tema["preguntas"]))
-                        muestra = muestrear(tema["preguntas"], cantidad, semilla=tam)
-                        preg = balancear(muestra)
-                        tema_b = {**tema, "preguntas": preg}
-                        curso_corto = _NOMBRES_CORTOS_CURSO.get(pfx, pfx)
-                        pdf_a = generar_banco_preguntas(
-                            tema_b, False, grado_txt, area=area_pie, profesor=profesor_txt)
-                        zf.writestr(
-                            f"Yachay_{curso_corto}_T{tema['num']}_{etiqueta}_A.pdf", pdf_a)
-                        pdf_d = generar_banco_preguntas(
-                            tema_b, True, grado_txt, area=area_pie, profesor=profesor_txt)
-                        zf.writestr(
-                            f"Yachay_{curso_corto}_T{tema['num']}_{etiqueta}_D.pdf", pdf_d)
-                    except Exception:
-                        pass
-
-        if tipos.get("banco_completo"):
-            paso_actual += 1
-            if reportar_progreso:
-                reportar_progreso(paso_actual / total_pasos,
-                                  f"{area_pie} · Banco completo del curso")
-            try:
-                todas_preguntas = []
-                for t in balotas:
-                    todas_preguntas.extend(t["preguntas"])
-                todas_balanceadas = balancear(todas_preguntas)
-                tema_mega = {"num": "TODOS", "titulo": "Banco Completo del Curso",
-                            "preguntas": todas_balanceadas, "secciones": [],
-                            "cuadros": []}
-                curso_corto = _NOMBRES_CORTOS_CURSO.get(pfx, pfx)
-                pdf_a = generar_banco_preguntas(tema_mega, False, grado_txt,
-                                                area=area_pie, profesor=profesor_txt)
-                zf.writestr(f"Yachay_{curso_corto}_BANCO_COMPLETO_A.pdf", pdf_a)
-                pdf_d = generar_banco_preguntas(tema_mega, True, grado_txt,
-                                                area=area_pie, profesor=profesor_txt)
-                zf.writestr(f"Yachay_{curso_corto}_BANCO_COMPLETO_D.pdf", pdf_d)
-            except Exception:
-                pass
-
-    buf.seek(0)
-    return buf.getvalue()
+    curso_corto = _NOMBRES_CORTOS_CURSO.get(pfx, pfx)
+    kw = {"area": area["area_pie"], "profesor": profesor_txt}
+    docs = []
+    for tema in balotas:
+        if tipos.get("ficha_blanco"):
+            docs.append((_nombre_archivo(pfx, tema, "Ficha", "Alumno"),
+                         generar_ficha_texto, (tema, False, grado_txt), kw))
+        if tipos.get("ficha_completa"):
+            docs.append((_nombre_archivo(pfx, tema, "Ficha", "Docente"),
+                         generar_ficha_texto, (tema, True, grado_txt), kw))
+        for tam, etiqueta in [(20, "Ex20"), (40, "Ex40")]:
+            if tipos.get(f"examen{tam}"):
+                tema_b = _tema_examen(tema, tam, tam)
+                for con_claves, version in ((False, "A"), (True, "D")):
+                    docs.append((
+                        f"Yachay_{curso_corto}_T{tema['num']}_{etiqueta}_{version}.pdf",
+                        generar_banco_preguntas, (tema_b, con_claves, grado_txt), kw))
+    if tipos.get("banco_completo"):
+        todas_preguntas = []
+        for t in balotas:
+            todas_preguntas.extend(t["preguntas"])
+        tema_mega = {"num": "TODOS", "titulo": "Banco Completo del Curso",
+                     "preguntas": balancear(todas_preguntas), "secciones": [],
+                     "cuadros": []}
+        for con_claves, version in ((False, "A"), (True, "D")):
+            docs.append((f"Yachay_{curso_corto}_BANCO_COMPLETO_{version}.pdf",
+                         generar_banco_preguntas, (tema_mega, con_claves, grado_txt), kw))
+    return [(f"{carpeta}/{nombre}" if carpeta else nombre, gen, args, kw_)
+            for nombre, gen, args, kw_ in docs]
+
+
+def _generar_paquete_admin(areas, tipos, grado_txt, profesor_txt, destino,
+                           reportar_progreso=None):
+    """Genera en el archivo `destino` un ZIP con lo marcado para uno o
+    varios cursos; con varios, cada curso va en su carpeta. Los PDF se
+    generan en paralelo (paquetes_cepru.py) y se escriben al ZIP a
+    medida que terminan. 'reportar_progreso' es una función opcional
+    callback(fraccion, texto) para la barra de progreso.
+    Devuelve {'archivos', 'errores', 'desde_cache', 'segundos'}."""
+    documentos = []
+    for area in areas:
+        carpeta = (f"{area['prefijo']}_{area['area_pie'].strip()}"
+                   if len(areas) > 1 else "")
+        documentos += _documentos_curso(area, tipos, grado_txt, profesor_txt,
+                                        carpeta)
+    return construir_paquete(documentos, destino, cache=_cache_pdfs(),
+                             reportar_progreso=reportar_progreso)
+
+
+def _tareas_precalentar(areas, grupos, profesor):
+    """(generador, args, kwargs) de los PDF que se piden sin cambiar
+    nada: la página de cada tema (fichas, examen de 20 con la muestra
+    inicial y juegos) y el Centro de Descargas (exámenes de 20 y 40)."""
+    tareas = []
+    for area in areas:
+        area_pie = area["area_pie"]
+        for grupo in grupos:
+            for tema in area["balotas"]:
+                for con_claves in (False, True):
+                    kw = {"area": area_pie, "profesor": profesor}
+                    if area.get("combinado"):
+                        if generar_ficha_algebra is not None:
+                            tareas.append((generar_ficha_algebra,
+                                           (tema, con_claves, grupo), kw))
+                        continue
+                    tareas.append((generar_ficha_texto,
+                                   (tema, con_claves, grupo), kw))
+                    for tam, semilla in ((20, 0), (20, 20), (40, 40)):
+                        tareas.append((generar_banco_preguntas,
+                                       (_tema_examen(tema, tam, semilla),
+                                        con_claves, grupo), kw))
+                    tareas.append((generar_juegos_educativos,
+                                   (tema, con_claves, grupo), {"area": area_pie}))
+    return tareas
+
+
+def precalentar_cache(grupos=("", "GRUPO CD"), profesor=PROFESOR_DEFECTO,
+                      areas=None, reportar_progreso=None):
+    """Genera de antemano todas las fichas/bancos/juegos de todos los
+    temas para los grupos indicados, así el primer clic del día ya sale
+    de la caché. Lo que ya está en caché no se vuelve a generar.
+    Devuelve {'total', 'generados', 'errores'}."""
+    tareas = _tareas_precalentar(AREAS_CEPRU if areas is None else areas,
+                                 grupos, profesor)
+    res = {"total": len(tareas), "generados": 0, "errores": 0}
+    hechos = 0
+
+    def _listo(_, datos, desde_cache):
+        nonlocal hechos
+        hechos += 1
+        if not desde_cache:
+            res["generados" if datos else "errores"] += 1
+        if reportar_progreso:
+            reportar_progreso(hechos / max(len(tareas), 1),
+                              f"Precalentando {hechos}/{len(tareas)}…")
+
+    renderizar([(i, *t) for i, t in enumerate(tareas)], cache=_cache_pdfs(),
+               al_terminar=_listo)
+    if reportar_progreso:
+        reportar_progreso(1.0, "Caché lista")
+    return res
+
+
+def _seccion_cache_pdfs():
+    """Estado de la caché de PDFs y botón para precalentarla."""
+    try:
+        cache = _cache_pdfs()
+    except Exception:
+        return
+    est = cache.estadisticas()
+    st.caption(f"⚡ Caché de PDFs: {est['entradas']} archivos · "
+               f"{est['bytes'] / 1048576:.0f} de "
+               f"{est['max_bytes'] / 1048576:.0f} MB · "
+               f"{est['aciertos']} servidos desde caché en esta sesión")
+    if st.button("⚡ Precalentar todos los cursos", key="admin_dm_precalentar",
+                 use_container_width=True):
+        barra = st.progress(0.0, text="Iniciando…")
+        res = precalentar_cache(
+            grupos=("", st.session_state.get("admin_dm_grado", "GRUPO CD")),
+            reportar_progreso=lambda f, t: barra.progress(min(f, 1.0), text=t))
+        st.success(f"✅ {res['generados']} PDF nuevos en caché "
+                   f"({res['total'] - res['generados'] - res['errores']} ya estaban"
+                   + (f", {res['errores']} con error" if res['errores'] else "")
+                   + ").")
 
 
 def _seccion_descarga_masiva_admin():
@@ -318,7 +393,7 @@ def _seccion_descarga_masiva_admin():
             profesor_dm = st.text_input(
                 "Nombre del profesor (solo texto impreso en el PDF — "
                 "no filtra contenido):",
-                value="Prof. Alexander Córdova", key="admin_dm_profesor")
+                value=PROFESOR_DEFECTO, key="admin_dm_profesor")
 
         # ── Opción 2: solo el banco completo, sin mas opciones ────
         if opcion == "📚 El banco COMPLETO de preguntas de un curso":
@@ -357,34 +432,31 @@ def _seccion_descarga_masiva_admin():
             st.info("Marca al menos una opción arriba para generar el paquete.")
         elif st.button("🚀 GENERAR", type="primary",
                        use_container_width=True, key="admin_dm_generar"):
-            import zipfile, io as _io_mega
+            nombre_zip = ("Yachay_TODO_PREU.zip"
+                         if opcion == "🗂️ TODOS los cursos juntos (para administración)"
+                         else f"Yachay_{cursos_incluir[0]['prefijo']}_PAQUETE.zip")
+            limpiar_viejos()
+            ruta_zip = Path(CARPETA_DEFECTO) / (
+                f"{Path(nombre_zip).stem}_{datetime.now():%Y%m%d_%H%M%S}.zip")
 
             barra = st.progress(0.0, text="Iniciando…")
-            buf_mega = _io_mega.BytesIO()
-            with zipfile.ZipFile(buf_mega, "w", zipfile.ZIP_DEFLATED) as zf_mega:
-                for idx_curso, area_dm in enumerate(cursos_incluir):
-                    def _callback(frac, texto, idx=idx_curso, n=len(cursos_incluir)):
-                        frac_global = (idx + frac) / n
-                        barra.progress(min(frac_global, 1.0), text=texto)
-
-                    zip_curso_bytes = _generar_paquete_admin(
-                        area_dm, tipos_sel, grado_dm, profesor_dm,
-                        reportar_progreso=_callback)
-                    zf_mega.writestr(
-                        f"{area_dm['prefijo']}_{area_dm['area_pie'].strip()}.zip",
-                        zip_curso_bytes)
+            res = _generar_paquete_admin(
+                cursos_incluir, tipos_sel, grado_dm, profesor_dm, ruta_zip,
+                reportar_progreso=lambda f, t: barra.progress(min(f, 1.0), text=t))
             barra.progress(1.0, text="¡Listo!")
-            buf_mega.seek(0)
 
-            nombre_zip = ("Yachay_TODO_PREU.zip"
-                         if opcion == "🗂️ TODOS los cursos juntos (para administración)"
-                         else f"Yachay_{cursos_incluir[0]['prefijo']}_PAQUETE.zip")
-            st.success("✅ Paquete generado. Descárgalo abajo antes de salir "
-                      "de esta página.")
-            st.download_button("⬇️ Descargar", data=buf_mega.getvalue(),
-                              file_name=nombre_zip, mime="application/zip",
-                              use_container_width=True, type="primary",
-                              key="admin_dm_descargar")
+            st.success(f"✅ Paquete generado: {res['archivos']} PDF en "
+                      f"{res['segundos']} s ({res['desde_cache']} desde la caché"
+                      + (f", {res['errores']} no se pudieron generar"
+                         if res['errores'] else "")
+                      + "). Descárgalo abajo antes de salir de esta página.")
+            with open(ruta_zip, "rb") as f_zip:
+                st.download_button("⬇️ Descargar", data=f_zip,
+                                  file_name=nombre_zip, mime="application/zip",
+                                  use_container_width=True, type="primary",
+                                  key="admin_dm_descargar")
+
+        _seccion_cache_pdfs()
 
 
 def tab_academia_cepru(config=None):
@@ -463,7 +535,7 @@ def _render_curso(balotas, area_pie, pfx, combinado=False):
     with c_p:
         profesor_txt = st.text_input(
             "Nombre del profesor (solo texto impreso, no filtra contenido):",
-            value="Prof. Alexander Córdova", key=f"{pfx}_prof")
+            value=PROFESOR_DEFECTO, key=f"{pfx}_prof")
 
     st.markdown("##### Descargar este tema")
     st.caption("Para descargar el curso completo o el banco de "
@@ -475,15 +547,15 @@ def _render_curso(balotas, area_pie, pfx, combinado=False):
         try:
             st.download_button(
                 "📄 Versión del alumno",
-                data=generar_ficha_texto(tema, False, grado_txt,
-                                         area=area_pie, profesor=profesor_txt),
+                data=pdf_cacheado(generar_ficha_texto, tema, False, grado_txt,
+                                  area=area_pie, profesor=profesor_txt),
                 file_name=_nombre_archivo(pfx, tema, "Ficha", "Alumno"),
                 mime="application/pdf", use_container_width=True,
                 type="primary", key=f"{pfx}_fa")
             st.download_button(
                 "🔑 Versión del docente (con claves)",
-                data=generar_ficha_texto(tema, True, grado_txt,
-                                         area=area_pie, profesor=profesor_txt),
+                data=pdf_cacheado(generar_ficha_texto, tema, True, grado_txt,
+                                  area=area_pie, profesor=profesor_txt),
                 file_name=_nombre_archivo(pfx, tema, "Ficha", "Docente"),
                 mime="application/pdf", use_container_width=True,
                 key=f"{pfx}_fd")
@@ -515,28 +587,26 @@ def _render_curso(balotas, area_pie, pfx, combinado=False):
                                  use_container_width=True):
                         st.session_state[_clave_semilla] += 1
 
-            _muestra = muestrear(tema["preguntas"], cantidad,
-                                 semilla=st.session_state[_clave_semilla])
-            preg = balancear(_muestra)
-            tema_b = {**tema, "preguntas": preg}
+            tema_b = _tema_examen(tema, cantidad, st.session_state[_clave_semilla])
             st.download_button(
                 "📝 Examen para el alumno",
-                data=generar_banco_preguntas(tema_b, False, grado_txt,
-                                             area=area_pie, profesor=profesor_txt),
+                data=pdf_cacheado(generar_banco_preguntas, tema_b, False, grado_txt,
+                                  area=area_pie, profesor=profesor_txt),
                 file_name=_nombre_archivo(pfx, tema, "Banco", "Alumno"),
                 mime="application/pdf", use_container_width=True,
                 type="primary", key=f"{pfx}_pa")
             st.download_button(
                 "🔑 Con claves para el docente",
-                data=generar_banco_preguntas(tema_b, True, grado_txt,
-                                             area=area_pie, profesor=profesor_txt),
+                data=pdf_cacheado(generar_banco_preguntas, tema_b, True, grado_txt,
+                                  area=area_pie, profesor=profesor_txt),
                 file_name=_nombre_archivo(pfx, tema, "Banco", "Docente"),
                 mime="application/pdf", use_container_width=True,
                 key=f"{pfx}_pd")
         except Exception as e:
             st.error(f"No se pudo generar el banco: {e}")
 
-    _pdf_juegos_prueba = generar_juegos_educativos(tema, False, grado_txt, area=area_pie)
+    _pdf_juegos_prueba = pdf_cacheado(generar_juegos_educativos, tema, False,
+                                      grado_txt, area=area_pie)
     if _pdf_juegos_prueba is not None:
         st.markdown("##### 🎮 Juegos educativos (descarga aparte, opcional)")
         st.caption("Sudoku · Sopa de Letras · Mapa Mental · Crucigrama · "
@@ -554,7 +624,8 @@ def _render_curso(balotas, area_pie, pfx, combinado=False):
         with dj2:
             st.download_button(
                 "🔑 Juegos — con claves (docente)",
-                data=generar_juegos_educativos(tema, True, grado_txt, area=area_pie),
+                data=pdf_cacheado(generar_juegos_educativos, tema, True,
+                                  grado_txt, area=area_pie),
                 file_name=_nombre_archivo(pfx, tema, "Juegos", "Docente"),
                 mime="application/pdf", use_container_width=True,
                 key=f"{pfx}_jd")
@@ -598,7 +669,7 @@ def _render_curso_combinado(balotas, area_pie, pfx):
     with c_p:
         profesor_txt = st.text_input(
             "Nombre del profesor (solo texto impreso, no filtra contenido):",
-            value="Prof. Alexander Córdova", key=f"{pfx}_prof")
+            value=PROFESOR_DEFECTO, key=f"{pfx}_prof")
 
     st.markdown("---")
     st.caption("Esta ficha combina teoría (para completar) y ejercicios "
@@ -610,8 +681,8 @@ def _render_curso_combinado(balotas, area_pie, pfx):
         try:
             st.download_button(
                 "📄 Versión del alumno (para completar)",
-                data=generar_ficha_algebra(tema, False, grado_txt,
-                                           area=area_pie, profesor=profesor_txt),
+                data=pdf_cacheado(generar_ficha_algebra, tema, False, grado_txt,
+                                  area=area_pie, profesor=profesor_txt),
                 file_name=_nombre_archivo(pfx, tema, "Ficha", "Alumno"),
                 mime="application/pdf", use_container_width=True,
                 type="primary", key=f"{pfx}_fa")
@@ -621,8 +692,8 @@ def _render_curso_combinado(balotas, area_pie, pfx):
         try:
             st.download_button(
                 "🔑 Versión del docente (con respuestas)",
-                data=generar_ficha_algebra(tema, True, grado_txt,
-                                           area=area_pie, profesor=profesor_txt),
+                data=pdf_cacheado(generar_ficha_algebra, tema, True, grado_txt,
+                                  area=area_pie, profesor=profesor_txt),
                 file_name=_nombre_archivo(pfx, tema, "Ficha", "Docente"),
                 mime="application/pdf", use_container_width=True,
                 key=f"{pfx}_fd")
@@ -638,3 +709,15 @@ def _render_curso_combinado(balotas, area_pie, pfx):
             st.markdown("**Ejercicios propuestos:**")
             for i, ej in enumerate(tema["ejercicios"], start=1):
                 st.markdown(f"{i}. {ej['enunciado']}")
+
+
+if __name__ == "__main__":
+    # python academia_cepru.py ["GRUPO CD" ...]  → precalienta la caché de
+    # PDFs (p. ej. desde un cron nocturno) con los grupos indicados.
+    import sys
+    _grupos = tuple(sys.argv[1:]) or ("", "GRUPO CD")
+    _res = precalentar_cache(
+        grupos=_grupos,
+        reportar_progreso=lambda f, t: print(f"\r{t}", end="", flush=True))
+    print(f"\n{_res['generados']} generados, {_res['errores']} errores, "
+          f"{_res['total']} en total — {_cache_pdfs().estadisticas()}")
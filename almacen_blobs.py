@@ -0,0 +1,268 @@
+"""
+YACHAY PRO — Almacén de archivos direccionado por contenido (SHA-256)
+Escudos, fondo, MP3 de pausa activa y fotos se guardaban como base64 dentro
+de celdas de Google Sheets: 33 % más grandes, partidos en trozos de 45 000
+caracteres y obligando a bajar la hoja entera para recuperar un archivo.
+
+Aquí cada archivo se guarda UNA vez con su hash SHA-256 como nombre:
+    - caché local en disco  (blobs_cache/ab/abcdef...)
+    - backend durable       (Drive en producción, una carpeta local en pruebas)
+En Sheets solo queda una fila de metadatos que apunta al hash. Subir dos
+veces el mismo escudo no vuelve a transferir nada, y los archivos se copian
+por bloques: nunca se arma el contenido completo como str de Python.
+
+Este módulo no depende de Streamlit: google_sync.GoogleSync.blobs() arma
+la instancia del proceso con el backend de Drive.
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+
+BLOQUE = 1024 * 1024   # 1 MB por lectura / parte de subida
+CARPETA_CACHE = "blobs_cache"
+
+
+def _hash_valido(h):
+    return isinstance(h, str) and len(h) == 64 and all(
+        c in '0123456789abcdef' for c in h)
+
+
+def sha256_archivo(ruta):
+    """Hash SHA-256 (hex) de un archivo, leído por bloques."""
+    h = hashlib.sha256()
+    with open(ruta, 'rb') as f:
+        for bloque in iter(lambda: f.read(BLOQUE), b''):
+            h.update(bloque)
+    return h.hexdigest()
+
+
+def meta_blob(h, tam, nombre='', mime='application/octet-stream', **extra):
+    """Texto JSON de la fila de metadatos que se guarda en Sheets."""
+    meta = {'sha256': h, 'tam': int(tam), 'nombre': nombre, 'mime': mime}
+    meta.update(extra)
+    return json.dumps(meta, ensure_ascii=False)
+
+
+# ================================================================
+# BACKENDS DURABLES
+# ================================================================
+class BackendDirectorio:
+    """Copia durable en una carpeta local (pruebas, o un servidor con
+    disco persistente)."""
+
+    def __init__(self, carpeta):
+        self.carpeta = Path(carpeta)
+
+    def _ruta(self, h):
+        return self.carpeta / h
+
+    def existe(self, h):
+        return self._ruta(h).exists()
+
+    def subir(self, h, ruta, mime=None):
+        self.carpeta.mkdir(parents=True, exist_ok=True)
+        tmp = self._ruta(h).with_suffix('.tmp')
+        shutil.copyfile(ruta, tmp)
+        os.replace(tmp, self._ruta(h))
+
+    def descargar(self, h, destino):
+        """Escribe el contenido en el archivo abierto `destino`."""
+        with open(self._ruta(h), 'rb') as f:
+            shutil.copyfileobj(f, destino, BLOQUE)
+
+
+class BackendDrive:
+    """Un archivo 'blob_<sha256>' por contenido en una carpeta de Drive
+    (compartida con la cuenta de servicio: la cuenta de servicio no tiene
+    cuota propia). Sube y baja por partes de 1 MB con la API resumible,
+    leyendo desde / escribiendo a disco."""
+
+    def __init__(self, drive, carpeta_id):
+        self.drive = drive
+        self.carpeta_id = carpeta_id
+        self._ids = {}   # hash → file_id ya conocido
+        self._lock = threading.Lock()
+
+    def _buscar(self, h):
+        with self._lock:
+            if h in self._ids:
+                return self._ids[h]
+        q = f"name='blob_{h}' and trashed=false"
+        if self.carpeta_id:
+            q += f" and '{self.carpeta_id}' in parents"
+        resp = self.drive.files().list(
+            q=q, fields='files(id)', pageSize=1,
+            supportsAllDrives=True, includeItemsFromAllDrives=True).execute()
+        archivos = resp.get('files', [])
+        file_id = archivos[0]['id'] if archivos else None
+        if file_id:
+            with self._lock:
+                self._ids[h] = file_id
+        return file_id
+
+    def existe(self, h):
+        return self._buscar(h) is not None
+
+    def subir(self, h, ruta, mime=None):
+        from googleapiclient.http import MediaFileUpload
+        metadata = {'name': f"blob_{h}"}
+        if self.carpeta_id:
+            metadata['parents'] = [self.carpeta_id]
+        media = MediaFileUpload(str(ruta),
+                                mimetype=mime or 'application/octet-stream',
+                                resumable=True, chunksize=BLOQUE)
+        solicitud = self.drive.files().create(
+            body=metadata, media_body=media, fields='id',
+            supportsAllDrives=True)
+        archivo = None
+        fallos_seguidos = 0
+        while archivo is None:
+            try:
+                _, archivo = solicitud.next_chunk()
+                fallos_seguidos = 0
+            except Exception:
+                # Se reintenta solo la parte que falló, no todo el archivo
+                fallos_seguidos += 1
+                if fallos_seguidos >= 3:
+                    raise
+                time.sleep(1.5 * fallos_seguidos)
+        with self._lock:
+            self._ids[h] = archivo.get('id')
+
+    def descargar(self, h, destino):
+        from googleapiclient.http import MediaIoBaseDownload
+        file_id = self._buscar(h)
+        if not file_id:
+            raise FileNotFoundError(f"blob_{h} no está en Drive")
+        solicitud = self.drive.files().get_media(fileId=file_id,
+                                                 supportsAllDrives=True)
+        descargador = MediaIoBaseDownload(destino, solicitud,
+                                          chunksize=BLOQUE)
+        listo = False
+        while not listo:
+            _, listo = descargador.next_chunk()
+
+
+# ================================================================
+# ALMACÉN
+# ================================================================
+class AlmacenBlobs:
+    """Caché local + backend durable opcional. Sin backend, los archivos
+    solo viven en el disco local (que Streamlit Cloud borra al reiniciar):
+    quien llama debe revisar `durable` antes de dejar de guardar la copia
+    anterior."""
+
+    def __init__(self, carpeta=CARPETA_CACHE, backend=None):
+        self.carpeta = Path(carpeta)
+        self.backend = backend
+        self._lock = threading.Lock()
+        self.stats = {'guardados': 0, 'duplicados': 0, 'subidas': 0,
+                      'descargas': 0, 'aciertos_cache': 0}
+
+    @property
+    def durable(self):
+        return self.backend is not None
+
+    def _sumar(self, campo):
+        with self._lock:
+            self.stats[campo] += 1
+
+    def ruta_cache(self, h):
+        return self.carpeta / h[:2] / h
+
+    # ── Escritura ────────────────────────────────────────────────
+    def guardar_stream(self, origen, mime=None):
+        """Copia un archivo abierto (modo binario) al almacén, calculando
+        el hash mientras se escribe. Devuelve (sha256, tamaño)."""
+        self.carpeta.mkdir(parents=True, exist_ok=True)
+        tmp = self.carpeta / f".entrada_{os.getpid()}_{threading.get_ident()}.tmp"
+        h = hashlib.sha256()
+        tam = 0
+        try:
+            with open(tmp, 'wb') as dst:
+                for bloque in iter(lambda: origen.read(BLOQUE), b''):
+                    h.update(bloque)
+                    dst.write(bloque)
+                    tam += len(bloque)
+            digest = h.hexdigest()
+            destino = self.ruta_cache(digest)
+            if destino.exists():
+                self._sumar('duplicados')
+            else:
+                destino.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(tmp, destino)
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+        self._sumar('guardados')
+        if self.backend is not None and not self.backend.existe(digest):
+            self.backend.subir(digest, destino, mime)
+            self._sumar('subidas')
+        return digest, tam
+
+    def guardar_archivo(self, ruta, mime=None):
+        """(sha256, tamaño) de un archivo del disco ya guardado."""
+        with open(ruta, 'rb') as f:
+            return self.guardar_stream(f, mime)
+
+    def guardar_bytes(self, datos, mime=None):
+        """(sha256, tamaño) de un contenido que ya está en memoria."""
+        import io
+        return self.guardar_stream(io.BytesIO(datos), mime)
+
+    # ── Lectura ──────────────────────────────────────────────────
+    def ruta(self, h):
+        """Ruta local del contenido (lo baja del backend si hace falta y
+        verifica el hash). None si no está disponible."""
+        if not _hash_valido(h):
+            return None
+        destino = self.ruta_cache(h)
+        if destino.exists():
+            self._sumar('aciertos_cache')
+            return destino
+        if self.backend is None:
+            return None
+        destino.parent.mkdir(parents=True, exist_ok=True)
+        tmp = destino.with_name(
+            f".{h}_{os.getpid()}_{threading.get_ident()}.tmp")
+        try:
+            with open(tmp, 'wb') as f:
+                self.backend.descargar(h, f)
+            if sha256_archivo(tmp) != h:
+                return None
+            os.replace(tmp, destino)
+        except Exception:
+            return None
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+        self._sumar('descargas')
+        return destino
+
+    def existe(self, h):
+        return self.ruta(h) is not None
+
+    def restaurar(self, h, destino):
+        """Copia el contenido a `destino` (escritura atómica)."""
+        origen = self.ruta(h)
+        if origen is None:
+            return False
+        destino = Path(destino)
+        if destino.parent and not destino.parent.exists():
+            destino.parent.mkdir(parents=True, exist_ok=True)
+        tmp = destino.with_name(destino.name + '.tmp')
+        shutil.copyfile(origen, tmp)
+        os.replace(tmp, destino)
+        return True
+
+    def leer_bytes(self, h):
+        """Contenido completo en memoria (solo para archivos chicos: fotos)."""
+        origen = self.ruta(h)
+        if origen is None:
+            return None
+        with open(origen, 'rb') as f:
+            return f.read()
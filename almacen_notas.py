@@ -0,0 +1,585 @@
+"""
+YACHAY PRO — Almacén de notas indexado (SQLite en modo WAL)
+Antes las notas vivían en tres JSON que se leían y reescribían completos:
+    - historial_evaluaciones.json  {clave: evaluación con su ranking}
+    - resultados_examenes.json     {docente: [resultado por alumno]}
+    - resultados.json              [resultado por alumno]
+(y notas.json, solo lectura). Guardar una evaluación reescribía todo el
+historial; el reporte por grado, el portal de padres y la orientación
+vocacional recorrían TODAS las evaluaciones por cada alumno.
+
+AlmacenNotas guarda lo mismo en una base SQLite:
+    evaluaciones  una fila por evaluación del historial (y por hoja de
+                  notas.json), con el documento original en `doc`
+    resultados    una fila por resultado de alumno (exámenes y reportes)
+    puntajes      una fila por alumno × área × evaluación/resultado
+    respuestas    cadenas de respuestas y claves por alumno × área
+con índices por DNI, grado + periodo y docente. Guardar es un UPSERT de
+una evaluación; las consultas usan los índices.
+
+Migración: la primera vez (y cada vez que un JSON cambia por fuera, p. ej.
+al restaurarlo desde Drive o Sheets) se importa el archivo. Los JSON se
+siguen escribiendo como exportación (exportar_archivos) para los respaldos
+en Drive / Config y el ZIP de backup; la firma de lo exportado queda en la
+tabla meta para no volver a importarlo.
+
+Este módulo no depende de Streamlit: sistema_web.py mantiene la instancia
+del proceso (st.cache_resource) y programa las exportaciones.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+# Fuentes de notas y su archivo JSON de siempre
+ARCHIVOS_NOTAS = {
+    'historial': 'historial_evaluaciones.json',
+    'examen': 'resultados_examenes.json',
+    'reporte': 'resultados.json',
+    'notas': 'notas.json',
+}
+# notas.json ya no lo escribe nadie: se importa pero no se exporta
+EXPORTABLES = ('historial', 'examen', 'reporte')
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS evaluaciones (
+    fuente TEXT NOT NULL, clave TEXT NOT NULL, tipo TEXT, docente TEXT,
+    grado TEXT, periodo TEXT, titulo TEXT, fecha TEXT, n INTEGER,
+    doc TEXT NOT NULL, PRIMARY KEY (fuente, clave));
+CREATE INDEX IF NOT EXISTS ix_eval_grado ON evaluaciones (grado, periodo);
+CREATE INDEX IF NOT EXISTS ix_eval_docente ON evaluaciones (docente);
+
+CREATE TABLE IF NOT EXISTS resultados (
+    id INTEGER PRIMARY KEY, fuente TEXT NOT NULL, docente TEXT, dni TEXT,
+    nombre TEXT, grado TEXT, periodo TEXT, titulo TEXT, fecha TEXT,
+    promedio REAL, huella TEXT NOT NULL, doc TEXT NOT NULL,
+    UNIQUE (fuente, huella));
+CREATE INDEX IF NOT EXISTS ix_res_dni ON resultados (dni);
+CREATE INDEX IF NOT EXISTS ix_res_docente ON resultados (fuente, docente);
+CREATE INDEX IF NOT EXISTS ix_res_grado ON resultados (grado, periodo);
+
+CREATE TABLE IF NOT EXISTS puntajes (
+    fuente TEXT NOT NULL, ref TEXT NOT NULL, dni TEXT, nombre_n TEXT,
+    grado TEXT, periodo TEXT, docente TEXT, titulo TEXT, fecha TEXT,
+    area TEXT, nota TEXT, valor REAL, correctas INTEGER, total INTEGER,
+    puesto TEXT, medalla TEXT, n INTEGER);
+CREATE INDEX IF NOT EXISTS ix_punt_dni ON puntajes (dni);
+CREATE INDEX IF NOT EXISTS ix_punt_nombre ON puntajes (nombre_n);
+CREATE INDEX IF NOT EXISTS ix_punt_grado ON puntajes (grado, periodo);
+CREATE INDEX IF NOT EXISTS ix_punt_docente ON puntajes (docente);
+CREATE INDEX IF NOT EXISTS ix_punt_ref ON puntajes (fuente, ref);
+
+CREATE TABLE IF NOT EXISTS respuestas (
+    resultado INTEGER NOT NULL, dni TEXT, area TEXT, respuestas TEXT,
+    claves TEXT);
+CREATE INDEX IF NOT EXISTS ix_resp_dni ON respuestas (dni);
+CREATE INDEX IF NOT EXISTS ix_resp_resultado ON respuestas (resultado);
+
+CREATE TABLE IF NOT EXISTS meta (clave TEXT PRIMARY KEY, valor TEXT);
+"""
+
+
+def _texto(v):
+    return '' if v is None else str(v).strip()
+
+
+def _valor(nota):
+    """Nota numérica o None (literales como 'AD', vacío, 'NSP')."""
+    try:
+        return float(str(nota).strip())
+    except (TypeError, ValueError):
+        return None
+
+
+def _firma(ruta):
+    try:
+        st_r = os.stat(ruta)
+    except OSError:
+        return None
+    return f"{st_r.st_mtime_ns}:{st_r.st_size}"
+
+
+def _nombres_areas(areas):
+    """Las áreas de una evaluación pueden ser dicts {'nombre'} o textos."""
+    nombres = []
+    for a in areas or []:
+        n = _texto(a.get('nombre', '')) if isinstance(a, dict) else _texto(a)
+        if n:
+            nombres.append(n)
+    return nombres
+
+
+class AlmacenNotas:
+
+    def __init__(self, ruta='notas.sqlite3', archivos=None, cada=5.0):
+        self.ruta = Path(ruta)
+        self.archivos = dict(archivos or ARCHIVOS_NOTAS)
+        self.cada = cada
+        self._lock = threading.RLock()
+        self._con = sqlite3.connect(str(self.ruta), check_same_thread=False,
+                                    timeout=30)
+        self._con.execute('PRAGMA journal_mode=WAL')
+        self._con.execute('PRAGMA synchronous=NORMAL')
+        self._con.executescript(_ESQUEMA)
+        self._con.commit()
+        self._revisado = 0.0
+        self._data_version = None
+        self._cache = {}
+        self.version = 0
+
+    # ------------------------------------------------------------
+    # Infraestructura
+    # ------------------------------------------------------------
+    def _cambio(self):
+        """Llamar tras cada escritura propia: invalida las consultas en caché."""
+        self._cache.clear()
+        self.version += 1
+
+    def _en_cache(self, clave, calcular):
+        """Resultado memorizado hasta la próxima escritura (propia o de
+        otro proceso: PRAGMA data_version cambia con commits ajenos)."""
+        with self._lock:
+            dv = self._con.execute('PRAGMA data_version').fetchone()[0]
+            if dv != self._data_version:
+                self._data_version = dv
+                self._cache.clear()
+            if clave not in self._cache:
+                self._cache[clave] = calcular()
+            return self._cache[clave]
+
+    def _meta(self, clave, valor=None):
+        if valor is None:
+            fila = self._con.execute('SELECT valor FROM meta WHERE clave=?',
+                                     (clave,)).fetchone()
+            return fila[0] if fila else None
+        self._con.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', (clave, valor))
+
+    # ------------------------------------------------------------
+    # Filas de puntajes
+    # ------------------------------------------------------------
+    def _puntajes_evaluacion(self, fuente, clave, ev):
+        """Una fila por alumno × área del ranking. Sin áreas (QAWAY) se
+        guarda el promedio con área ''."""
+        areas = _nombres_areas(ev.get('areas'))
+        ranking = [f for f in ev.get('ranking') or [] if isinstance(f, dict)]
+        comun = (_texto(ev.get('grado')), _texto(ev.get('periodo', ev.get('bimestre', ''))),
+                 _texto(ev.get('docente')), _texto(ev.get('titulo')),
+                 _texto(ev.get('fecha')))
+        filas = []
+        for f in ranking:
+            dni = _texto(f.get('DNI', f.get('dni', '')))
+            nombre_n = _texto(f.get('Nombre', f.get('nombre', ''))).upper()
+            puesto = _texto(f.get('Puesto', f.get('puesto', '')))
+            medalla = _texto(f.get('Medalla', f.get('medalla', '')))
+            if areas:
+                notas = [(a, f[a]) for a in areas if f.get(a, '') != '']
+            else:
+                notas = [('', f.get('promedio', f.get('Promedio', f.get('nota', ''))))]
+            for area, nota in notas:
+                filas.append((fuente, clave, dni, nombre_n) + comun +
+                             (area, _texto(nota), _valor(nota), f.get('correctas'),
+                              f.get('total'), puesto, medalla, len(ranking)))
+        return filas
+
+    def _puntajes_notas(self, clave, hoja):
+        """Hojas de notas.json: {'grado', 'area', 'notas': {dni o nombre: nota}}."""
+        comun = (_texto(hoja.get('grado')),
+                 _texto(hoja.get('periodo', hoja.get('bimestre', ''))),
+                 _texto(hoja.get('docente')), _texto(hoja.get('titulo')),
+                 _texto(hoja.get('fecha')))
+        notas = hoja.get('notas') if isinstance(hoja.get('notas'), dict) else {}
+        return [('notas', clave, _texto(k), _texto(k).upper()) + comun +
+                (_texto(hoja.get('area')), _texto(n), _valor(n), None, None,
+                 '', '', len(notas))
+                for k, n in notas.items()]
+
+    def _puntajes_resultado(self, fuente, rid, docente, r):
+        areas = r.get('areas', [])
+        if isinstance(areas, dict):
+            areas = [{'nombre': k, 'nota': v} for k, v in areas.items()]
+        comun = (_texto(r.get('grado')),
+                 _texto(r.get('periodo', r.get('bimestre', r.get('semana', '')))),
+                 docente, _texto(r.get('titulo')), _texto(r.get('fecha')))
+        filas, resp = [], []
+        dni = _texto(r.get('dni'))
+        for a in areas if isinstance(areas, list) else []:
+            if not isinstance(a, dict):
+                continue
+            area = _texto(a.get('nombre', a.get('area', ''))) or 'General'
+            nota = a.get('nota', a.get('calificacion', ''))
+            filas.append((fuente, str(rid), dni, _texto(r.get('nombre')).upper()) +
+                         comun + (area, _texto(nota), _valor(nota), a.get('correctas'),
+                                  a.get('total'), '', '', None))
+            detalle = a.get('detalle') or []
+            if detalle:
+                resp.append((rid, dni, area,
+                             ''.join(str(d.get('r', '')) for d in detalle),
+                             ''.join(str(d.get('c', '')) for d in detalle)))
+        return filas, resp
+
+    def _insertar_puntajes(self, filas):
+        self._con.executemany(
+            'INSERT INTO puntajes VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)', filas)
+
+    # ------------------------------------------------------------
+    # Escritura
+    # ------------------------------------------------------------
+    def _upsert_evaluacion(self, fuente, clave, ev):
+        clave = str(clave)
+        self._con.execute('DELETE FROM puntajes WHERE fuente=? AND ref=?', (fuente, clave))
+        self._con.execute(
+            'INSERT OR REPLACE INTO evaluaciones VALUES (?,?,?,?,?,?,?,?,?,?)',
+            (fuente, clave, _texto(ev.get('tipo', ev.get('tipo_evaluacion', ''))),
+             _texto(ev.get('docente')), _texto(ev.get('grado')),
+             _texto(ev.get('periodo', ev.get('bimestre', ''))), _texto(ev.get('titulo')),
+             _texto(ev.get('fecha')), len(ev.get('ranking') or ev.get('notas') or []),
+             json.dumps(ev, ensure_ascii=False, default=str)))
+        if fuente == 'notas':
+            self._insertar_puntajes(self._puntajes_notas(clave, ev))
+        else:
+            self._insertar_puntajes(self._puntajes_evaluacion(fuente, clave, ev))
+
+    def _insertar_resultado(self, fuente, docente, r):
+        """Inserta un resultado; False si ya estaba (misma huella)."""
+        docente = _texto(docente)
+        doc = json.dumps(r, ensure_ascii=False, default=str, sort_keys=True)
+        # '_docente' queda fuera de la huella: resultados() lo agrega al
+        # exportar el reporte y, sin esto, reimportar el mismo archivo
+        # duplicaría cada resultado.
+        propio = {k: v for k, v in r.items() if k != '_docente'}
+        propio = json.dumps(propio, ensure_ascii=False, default=str, sort_keys=True)
+        huella = hashlib.sha1(f"{docente}\n{propio}".encode('utf-8')).hexdigest()
+        cur = self._con.execute(
+            'INSERT OR IGNORE INTO resultados (fuente, docente, dni, nombre, grado,'
+            ' periodo, titulo, fecha, promedio, huella, doc)'
+            ' VALUES (?,?,?,?,?,?,?,?,?,?,?)',
+            (fuente, docente, _texto(r.get('dni')), _texto(r.get('nombre')),
+             _texto(r.get('grado')), _texto(r.get('periodo', r.get('bimestre', ''))),
+             _texto(r.get('titulo')), _texto(r.get('fecha')),
+             _valor(r.get('promedio_general')), huella, doc))
+        if not cur.rowcount:
+            return False
+        filas, resp = self._puntajes_resultado(fuente, cur.lastrowid, docente, r)
+        self._insertar_puntajes(filas)
+        self._con.executemany('INSERT INTO respuestas VALUES (?,?,?,?,?)', resp)
+        return True
+
+    def guardar_evaluacion(self, clave, ev, fuente='historial'):
+        """Crea o reemplaza una evaluación del historial."""
+        with self._lock:
+            with self._con:
+                self._upsert_evaluacion(fuente, clave, ev)
+            self._cambio()
+
+    def eliminar_evaluacion(self, clave, fuente='historial'):
+        with self._lock:
+            with self._con:
+                self._con.execute('DELETE FROM evaluaciones WHERE fuente=? AND clave=?',
+                                  (fuente, str(clave)))
+                self._con.execute('DELETE FROM puntajes WHERE fuente=? AND ref=?',
+                                  (fuente, str(clave)))
+            self._cambio()
+
+    def agregar_resultados(self, fuente, docente, resultados):
+        """Agrega resultados por alumno ('examen' o 'reporte') en una sola
+        transacción. Devuelve cuántos eran nuevos."""
+        n = 0
+        with self._lock:
+            with self._con:
+                for r in resultados:
+                    if isinstance(r, dict):
+                        n += self._insertar_resultado(fuente, docente or r.get('_docente', ''), r)
+            self._cambio()
+        return n
+
+    def _borrar_resultados(self, donde, params):
+        ids = [str(f[0]) for f in self._con.execute(
+            f'SELECT id FROM resultados WHERE {donde}', params)]
+        for i in range(0, len(ids), 500):
+            lote = ids[i:i + 500]
+            marcas = ','.join('?' * len(lote))
+            self._con.execute(f'DELETE FROM respuestas WHERE resultado IN ({marcas})', lote)
+            self._con.execute(
+                f"DELETE FROM puntajes WHERE fuente IN ('examen','reporte') AND ref IN ({marcas})",
+                lote)
+        self._con.execute(f'DELETE FROM resultados WHERE {donde}', params)
+        return len(ids)
+
+    def limpiar_resultados(self, fuente, docente=None):
+        """Borra los resultados de una fuente (de un docente, o todos)."""
+        with self._lock:
+            with self._con:
+                if docente is None:
+                    n = self._borrar_resultados('fuente=?', (fuente,))
+                else:
+                    n = self._borrar_resultados('fuente=? AND docente=?', (fuente, docente))
+            self._cambio()
+        return n
+
+    def eliminar_dni(self, dni):
+        """Borra todas las notas de un DNI (coincidencia exacta): sus
+        resultados, sus filas en los rankings del historial y sus notas."""
+        dni = _texto(dni)
+        if not dni:
+            return 0
+        with self._lock:
+            with self._con:
+                n = self._borrar_resultados('dni=?', (dni,))
+                refs = self._con.execute(
+                    "SELECT DISTINCT fuente, ref FROM puntajes WHERE dni=?"
+                    " AND fuente IN ('historial','notas')", (dni,)).fetchall()
+                for fuente, clave in refs:
+                    fila = self._con.execute(
+                        'SELECT doc FROM evaluaciones WHERE fuente=? AND clave=?',
+                        (fuente, clave)).fetchone()
+                    if fila is None:
+                        continue
+                    ev = json.loads(fila[0])
+                    if fuente == 'notas':
+                        ev['notas'] = {k: v for k, v in (ev.get('notas') or {}).items()
+                                       if _texto(k) != dni}
+                    else:
+                        ev['ranking'] = [f for f in ev.get('ranking') or []
+                                         if not isinstance(f, dict)
+                                         or _texto(f.get('DNI', f.get('dni', ''))) != dni]
+                    self._upsert_evaluacion(fuente, clave, ev)
+                    n += 1
+            self._cambio()
+        return n
+
+    def vaciar(self):
+        """Borra TODAS las notas (exportables; notas.json queda igual)."""
+        with self._lock:
+            with self._con:
+                self._con.execute("DELETE FROM evaluaciones WHERE fuente='historial'")
+                self._con.execute("DELETE FROM puntajes WHERE fuente<>'notas'")
+                self._con.execute('DELETE FROM respuestas')
+                self._con.execute('DELETE FROM resultados')
+            self._cambio()
+
+    # ------------------------------------------------------------
+    # Consultas
+    # ------------------------------------------------------------
+    def evaluaciones(self, grado=None, docente=None, periodo=None, fuente='historial'):
+        """{clave: evaluación} en el formato de historial_evaluaciones.json,
+        ordenado por clave, filtrado por los índices."""
+        filtros, params = ['fuente=?'], [fuente]
+        for campo, v in (('grado', grado), ('docente', docente), ('periodo', periodo)):
+            if v is not None:
+                filtros.append(f'{campo}=?')
+                params.append(v)
+        sql = f"SELECT clave, doc FROM evaluaciones WHERE {' AND '.join(filtros)} ORDER BY clave"
+
+        def _leer():
+            with self._lock:
+                return {c: json.loads(d) for c, d in self._con.execute(sql, params)}
+        return dict(self._en_cache(("ev", sql, tuple(params)), _leer))
+
+    def valores(self, campo, fuente='historial'):
+        """Valores distintos de 'grado', 'docente' o 'periodo' (filtros)."""
+        if campo not in ('grado', 'docente', 'periodo'):
+            raise ValueError(campo)
+        with self._lock:
+            return [f[0] for f in self._con.execute(
+                f'SELECT DISTINCT {campo} FROM evaluaciones WHERE fuente=? ORDER BY 1',
+                (fuente,))]
+
+    def resultados(self, fuente='examen', docente=None, dni=None):
+        """Resultados por alumno en orden de llegada; cada uno con
+        '_docente' (como cargar_todos_resultados)."""
+        filtros, params = ['fuente=?'], [fuente]
+        if docente is not None:
+            filtros.append('docente=?')
+            params.append(docente)
+        if dni is not None:
+            filtros.append('dni=?')
+            params.append(_texto(dni))
+        with self._lock:
+            filas = self._con.execute(
+                f"SELECT docente, doc FROM resultados WHERE {' AND '.join(filtros)} ORDER BY id",
+                params).fetchall()
+        salida = []
+        for docente_r, doc in filas:
+            r = json.loads(doc)
+            r.setdefault('_docente', docente_r)
+            salida.append(r)
+        return salida
+
+    def _notas(self, donde, params, fuentes, anio):
+        filtros = [donde]
+        if fuentes:
+            filtros.append(f"fuente IN ({','.join('?' * len(fuentes))})")
+            params += list(fuentes)
+        if anio:
+            filtros.append('fecha LIKE ?')
+            params.append(f'{anio}%')
+        with self._lock:
+            cur = self._con.execute(
+                'SELECT fuente, ref, dni, nombre_n, grado, periodo, docente, titulo, fecha,'
+                ' area, nota, valor, correctas, total, puesto, medalla, n FROM puntajes'
+                f" WHERE {' AND '.join(filtros)} ORDER BY rowid", params)
+            columnas = [c[0] for c in cur.description]
+            return [dict(zip(columnas, f)) for f in cur]
+
+    def notas_alumno(self, dni, nombre=None, fuentes=None, anio=None):
+        """Todas las notas de un alumno (por DNI o, si se da, por nombre):
+        [{'fuente', 'ref', 'area', 'nota' (texto), 'valor' (float|None),
+        'grado', 'periodo', 'titulo', 'fecha', 'puesto', 'medalla', 'n'}]."""
+        if nombre:
+            return self._notas('(dni=? OR nombre_n=?)',
+                               [_texto(dni), _texto(nombre).upper()], fuentes, anio)
+        return self._notas('dni=?', [_texto(dni)], fuentes, anio)
+
+    def notas_alumnos(self, dnis, fuentes=None, anio=None):
+        """{dni: [notas]} de varios alumnos con una consulta por lote."""
+        dnis = [_texto(d) for d in dnis if _texto(d)]
+        salida = {d: [] for d in dnis}
+        for i in range(0, len(dnis), 500):
+            lote = dnis[i:i + 500]
+            for fila in self._notas(f"dni IN ({','.join('?' * len(lote))})",
+                                    list(lote), fuentes, anio):
+                salida[fila['dni']].append(fila)
+        return salida
+
+    def promedios_por_area(self, dnis, grado=None, fuentes=('historial',)):
+        """{dni: {área: promedio}} con las notas > 0 de las evaluaciones."""
+        dnis = [_texto(d) for d in dnis if _texto(d)]
+        salida = {d: {} for d in dnis}
+        for i in range(0, len(dnis), 500):
+            lote = dnis[i:i + 500]
+            filtros = [f"dni IN ({','.join('?' * len(lote))})", 'valor > 0', "area <> ''",
+                       f"fuente IN ({','.join('?' * len(fuentes))})"]
+            params = list(lote) + list(fuentes)
+            if grado is not None:
+                filtros.append('grado=?')
+                params.append(grado)
+            with self._lock:
+                for dni, area, prom in self._con.execute(
+                        f"SELECT dni, area, AVG(valor) FROM puntajes WHERE {' AND '.join(filtros)}"
+                        ' GROUP BY dni, area', params):
+                    salida[dni][area] = round(prom, 1)
+        return salida
+
+    def areas_con_notas(self, grado, fuente='notas'):
+        """{área: nº de hojas con notas} de un grado."""
+        with self._lock:
+            return dict(self._con.execute(
+                "SELECT json_extract(doc, '$.area'), COUNT(*) FROM evaluaciones"
+                ' WHERE fuente=? AND grado=? GROUP BY 1 ORDER BY MIN(rowid)',
+                (fuente, grado)).fetchall())
+
+    def notas_grado(self, grado, fuente='notas'):
+        """{dni o nombre (como se registró): [notas numéricas]} de un grado."""
+        salida = {}
+        with self._lock:
+            for dni, valor in self._con.execute(
+                    'SELECT dni, valor FROM puntajes WHERE fuente=? AND grado=?'
+                    ' AND valor IS NOT NULL ORDER BY rowid', (fuente, grado)):
+                salida.setdefault(dni, []).append(valor)
+        return salida
+
+    def respuestas_alumno(self, dni):
+        """[{'resultado', 'area', 'respuestas', 'claves'}] de un alumno."""
+        with self._lock:
+            return [{'resultado': r, 'area': a, 'respuestas': rs, 'claves': c}
+                    for r, a, rs, c in self._con.execute(
+                        'SELECT resultado, area, respuestas, claves FROM respuestas'
+                        ' WHERE dni=? ORDER BY rowid', (_texto(dni),))]
+
+    def estadisticas(self):
+        with self._lock:
+            cuenta = lambda t: self._con.execute(f'SELECT COUNT(*) FROM {t}').fetchone()[0]
+            return {t: cuenta(t) for t in ('evaluaciones', 'resultados', 'puntajes',
+                                           'respuestas')}
+
+    # ------------------------------------------------------------
+    # Migración / sincronización con los JSON
+    # ------------------------------------------------------------
+    def _importar(self, fuente, datos):
+        if fuente == 'historial':
+            for clave, ev in (datos.items() if isinstance(datos, dict) else []):
+                if isinstance(ev, dict):
+                    self._upsert_evaluacion('historial', clave, ev)
+        elif fuente == 'notas':
+            # Solo lectura: el archivo manda
+            self._con.execute("DELETE FROM evaluaciones WHERE fuente='notas'")
+            self._con.execute("DELETE FROM puntajes WHERE fuente='notas'")
+            for clave, hoja in (datos.items() if isinstance(datos, dict) else []):
+                if isinstance(hoja, dict):
+                    self._upsert_evaluacion('notas', clave, hoja)
+        else:
+            if isinstance(datos, list):
+                # Formato viejo (lista): resultados_examenes → docente 'migrado'
+                grupos = {'migrado' if fuente == 'examen' else None: datos}
+            elif isinstance(datos, dict):
+                grupos = {d: l for d, l in datos.items() if isinstance(l, list)}
+            else:
+                grupos = {}
+            for docente, lista in grupos.items():
+                for r in lista:
+                    if isinstance(r, dict):
+                        self._insertar_resultado(fuente, docente or r.get('_docente', ''), r)
+
+    def sincronizar_archivos(self, forzar=False):
+        """Importa los JSON nuevos o cambiados por fuera (primera vez,
+        restauración desde la nube, ZIP de backup). Lo del archivo se
+        agrega o reemplaza por clave; lo que solo está en la base se
+        conserva. Como mucho una revisión cada `cada` segundos."""
+        ahora = time.monotonic()
+        if not forzar and ahora - self._revisado < self.cada:
+            return []
+        self._revisado = ahora
+        importadas = []
+        with self._lock:
+            for fuente, ruta in self.archivos.items():
+                firma = _firma(ruta)
+                if firma is None or firma == self._meta(f'firma:{fuente}'):
+                    continue
+                try:
+                    with open(ruta, 'r', encoding='utf-8') as f:
+                        datos = json.load(f)
+                except Exception:
+                    continue
+                with self._con:
+                    self._importar(fuente, datos)
+                    self._meta(f'firma:{fuente}', firma)
+                importadas.append(fuente)
+            if importadas:
+                self._cambio()
+        return importadas
+
+    def exportar(self, fuente):
+        """Contenido del JSON de siempre para `fuente`."""
+        if fuente == 'historial':
+            return dict(self.evaluaciones())
+        if fuente == 'examen':
+            salida = {}
+            with self._lock:
+                for docente, doc in self._con.execute(
+                        "SELECT docente, doc FROM resultados WHERE fuente='examen' ORDER BY id"):
+                    salida.setdefault(docente, []).append(json.loads(doc))
+            return salida
+        return self.resultados(fuente)
+
+    def exportar_archivos(self, fuentes=EXPORTABLES):
+        """Escribe los JSON desde la base (escritura atómica) y anota su
+        firma para no reimportarlos. Devuelve {fuente: datos exportados}."""
+        exportados = {}
+        for fuente in fuentes:
+            ruta = Path(self.archivos[fuente])
+            with self._lock:
+                datos = self.exportar(fuente)
+                tmp = ruta.with_name(ruta.name + '.tmp')
+                try:
+                    with open(tmp, 'w', encoding='utf-8') as f:
+                        json.dump(datos, f, ensure_ascii=False, indent=2, default=str)
+                    os.replace(tmp, ruta)
+                except Exception:
+                    continue
+                with self._con:
+                    self._meta(f'firma:{fuente}', _firma(ruta))
+            exportados[fuente] = datos
+        return exportados
@@ -0,0 +1,136 @@
+"""
+YACHAY PRO — Almacén columnar (Parquet) para matrícula y docentes
+La copia canónica de cada tabla es un archivo Parquet (matricula.parquet,
+docentes.parquet) que se lee con memory-map. El XLSX solo se usa en los
+bordes: se IMPORTA si aparece uno más nuevo que el Parquet (primer arranque
+con datos antiguos, restauración de un backup) y se EXPORTA para backups y
+botones de descarga.
+
+Parsear matricula.xlsx con openpyxl cuesta cientos de ms; el Parquet se
+abre en pocos ms y, dentro del mismo proceso, mientras el archivo no cambie
+en disco se reutiliza la tabla ya cargada sin volver a leerlo.
+
+Si pyarrow no está instalado, todo vuelve al comportamiento anterior
+(leer y escribir el XLSX directamente).
+"""
+import io
+import os
+import threading
+from pathlib import Path
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    HAS_ARROW = True
+except ImportError:
+    HAS_ARROW = False
+
+_lock = threading.Lock()
+_cache = {}  # ruta parquet → (firma en disco, DataFrame)
+
+
+def ruta_parquet(ruta_xlsx):
+    """matricula.xlsx → matricula.parquet"""
+    return str(Path(ruta_xlsx).with_suffix('.parquet'))
+
+
+def _firma(ruta):
+    st_r = os.stat(ruta)
+    return (st_r.st_mtime_ns, st_r.st_size)
+
+
+def _xlsx_mas_nuevo(ruta_xlsx, ruta_pq):
+    """True si hay un XLSX más reciente que el Parquet (se subió o
+    restauró a mano) y por lo tanto hay que reimportarlo."""
+    try:
+        return os.stat(ruta_xlsx).st_mtime_ns > os.stat(ruta_pq).st_mtime_ns
+    except OSError:
+        return False
+
+
+def _leer_xlsx(ruta_xlsx):
+    df = pd.read_excel(ruta_xlsx, dtype=str, engine='openpyxl')
+    df.columns = df.columns.str.strip()
+    return df
+
+
+def _escribir_parquet(df, ruta_pq):
+    """Todas las columnas como texto (igual que read_excel(dtype=str));
+    las celdas vacías quedan como nulos. Escritura atómica."""
+    df_w = pd.DataFrame({
+        str(c): df[c].map(lambda v: None if pd.isna(v) else str(v))
+        for c in df.columns
+    })
+    tabla = pa.Table.from_pandas(df_w, preserve_index=False)
+    tmp = ruta_pq + '.tmp'
+    pq.write_table(tabla, tmp)
+    os.replace(tmp, ruta_pq)
+
+
+def _cachear(ruta_pq, df):
+    with _lock:
+        _cache[ruta_pq] = (_firma(ruta_pq), df)
+
+
+def leer_tabla(ruta_xlsx):
+    """DataFrame de la tabla (columnas texto, vacíos = NaN), o None si no
+    existe ni el Parquet ni el XLSX. Devuelve siempre una copia: quien
+    llama puede modificarla sin tocar la versión en caché."""
+    rp = ruta_parquet(ruta_xlsx)
+    if HAS_ARROW and Path(rp).exists() and not _xlsx_mas_nuevo(ruta_xlsx, rp):
+        firma = _firma(rp)
+        with _lock:
+            hit = _cache.get(rp)
+        if hit is None or hit[0] != firma:
+            tabla = pq.read_table(rp, memory_map=True)
+            df = tabla.to_pandas()
+            # pyarrow entrega None en los nulos; read_excel entregaba NaN
+            df = df.where(df.notna(), float('nan'))
+            with _lock:
+                _cache[rp] = (firma, df)
+            hit = (firma, df)
+        return hit[1].copy()
+    if Path(ruta_xlsx).exists():
+        df = _leer_xlsx(ruta_xlsx)
+        if HAS_ARROW:
+            try:
+                _escribir_parquet(df, rp)
+                _cachear(rp, df.copy())
+            except Exception:
+                pass
+        return df
+    return None
+
+
+def guardar_tabla(df, ruta_xlsx):
+    """Guarda la tabla en su Parquet canónico. Sin pyarrow (o si la
+    escritura falla) se guarda como XLSX y, en último caso, CSV."""
+    if HAS_ARROW:
+        rp = ruta_parquet(ruta_xlsx)
+        try:
+            _escribir_parquet(df, rp)
+            _cachear(rp, df.copy())
+            return
+        except Exception:
+            pass
+    try:
+        df.to_excel(ruta_xlsx, index=False, engine='openpyxl')
+    except Exception:
+        df.to_csv(str(ruta_xlsx).replace('.xlsx', '.csv'), index=False)
+
+
+def existe_tabla(ruta_xlsx):
+    return Path(ruta_parquet(ruta_xlsx)).exists() or Path(ruta_xlsx).exists()
+
+
+def exportar_xlsx_bytes(ruta_xlsx):
+    """Bytes de un XLSX con el contenido actual de la tabla (para backups
+    y descargas). None si la tabla no existe."""
+    df = leer_tabla(ruta_xlsx)
+    if df is None:
+        return None
+    buf = io.BytesIO()
+    df.to_excel(buf, index=False, engine='openpyxl')
+    return buf.getvalue()
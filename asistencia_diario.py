@@ -0,0 +1,385 @@
+"""
+YACHAY PRO — Diario de Asistencias (solo-agregar)
+Cada escaneo QR/código de barras agrega UNA línea al diario del día
+(asistencias_diario/AAAA-MM-DD.jsonl), con fsync, en vez de cargar y
+reescribir todo asistencias.json. El costo de registrar una asistencia es
+el mismo en marzo que en noviembre.
+
+Capas de lectura (la de más abajo gana):
+    1. asistencias.json          → histórico consolidado (backups antiguos,
+                                   restauraciones desde Drive / Sheets)
+    2. asistencias_diario/F.json → foto compactada de un día cerrado
+    3. asistencias_diario/F.jsonl→ diario de eventos del día (append-only)
+
+Los días anteriores a hoy se compactan solos en su foto diaria la primera
+vez que se registra o se lee algo en un día nuevo.
+
+Este módulo no depende de Streamlit: sistema_web.py mantiene UNA instancia
+por proceso (st.cache_resource) compartida por todas las sesiones.
+"""
+import json
+import os
+import threading
+from datetime import datetime
+from pathlib import Path
+
+CAMPOS_ASISTENCIA = ('entrada', 'salida', 'tardanza',
+                     'entrada_tarde', 'salida_tarde')
+
+
+def _registro_vacio(nombre='', es_docente=False):
+    return {
+        'nombre': nombre, 'entrada': '', 'salida': '',
+        'tardanza': '', 'entrada_tarde': '', 'salida_tarde': '',
+        'es_docente': es_docente,
+    }
+
+
+def _fecha_iso(fecha_key):
+    """Normaliza una clave de fecha ('AAAA-MM-DD' o 'DD/MM/AAAA') a
+    'AAAA-MM-DD'. Devuelve None si no se reconoce."""
+    fecha_key = str(fecha_key).strip()
+    for fmt in ('%Y-%m-%d', '%d/%m/%Y'):
+        try:
+            return datetime.strptime(fecha_key, fmt).strftime('%Y-%m-%d')
+        except ValueError:
+            continue
+    return None
+
+
+def _aplicar_evento(dia, ev):
+    """Aplica un evento del diario sobre el dict {dni: registro} del día."""
+    op = ev.get('op', 'set')
+    if op == 'borrar_dia':
+        dia.clear()
+        return
+    dni = str(ev.get('dni', '')).strip()
+    if not dni:
+        return
+    if op == 'borrar':
+        dia.pop(dni, None)
+        return
+    reg = dia.get(dni)
+    if reg is None:
+        reg = _registro_vacio(ev.get('nombre', ''),
+                              bool(ev.get('es_docente', False)))
+        dia[dni] = reg
+    if ev.get('nombre'):
+        reg['nombre'] = ev['nombre']
+    if 'es_docente' in ev:
+        reg['es_docente'] = bool(ev['es_docente'])
+    for campo, valor in (ev.get('campos') or {}).items():
+        reg[campo] = valor
+
+
+class DiarioAsistencias:
+    """Almacén de asistencias: diario por día + fotos compactadas.
+    Seguro para varios hilos (un lock por instancia) y para varios
+    procesos (cada evento es un write() O_APPEND de una sola línea)."""
+
+    def __init__(self, carpeta='asistencias_diario',
+                 archivo_historico='asistencias.json', reloj=None):
+        self.carpeta = Path(carpeta)
+        # reloj() → fecha de hoy 'AAAA-MM-DD' (sistema_web pasa la hora de
+        # Perú; el servidor de Streamlit Cloud corre en UTC).
+        self._reloj = reloj or (lambda: datetime.now().strftime('%Y-%m-%d'))
+        self.archivo_historico = Path(archivo_historico)
+        self._lock = threading.RLock()
+        # fecha → {'firma': mtime de la foto, 'offset': bytes del diario
+        #          ya aplicados, 'datos': {dni: registro}}
+        self._dias = {}
+        self._historico = {}
+        self._historico_firma = None
+        self._ultimo_dia_compactado = None
+        # funciones avisadas en cada escritura (ver suscribir)
+        self._oyentes = []
+
+    # ------------------------------------------------------------
+    # Rutas
+    # ------------------------------------------------------------
+    def _ruta_diario(self, fecha):
+        return self.carpeta / f"{fecha}.jsonl"
+
+    def _ruta_foto(self, fecha):
+        return self.carpeta / f"{fecha}.json"
+
+    # ------------------------------------------------------------
+    # Lectura
+    # ------------------------------------------------------------
+    def _cargar_historico(self):
+        """Histórico consolidado, releído solo si cambió en disco."""
+        try:
+            st_h = self.archivo_historico.stat()
+            firma = (st_h.st_mtime_ns, st_h.st_size)
+        except OSError:
+            self._historico, self._historico_firma = {}, None
+            return self._historico
+        if firma != self._historico_firma:
+            try:
+                with open(self.archivo_historico, 'r', encoding='utf-8') as f:
+                    crudo = json.load(f)
+            except Exception:
+                crudo = {}
+            historico = {}
+            for fk, fd in (crudo.items() if isinstance(crudo, dict) else []):
+                iso = _fecha_iso(fk)
+                if iso and isinstance(fd, dict):
+                    historico.setdefault(iso, {}).update(fd)
+            self._historico, self._historico_firma = historico, firma
+        return self._historico
+
+    def _estado_dia(self, fecha):
+        """Devuelve el dict vivo {dni: registro} del día, aplicando solo
+        las líneas del diario que se agregaron desde la última lectura."""
+        ruta_foto = self._ruta_foto(fecha)
+        ruta_diario = self._ruta_diario(fecha)
+        try:
+            firma_foto = ruta_foto.stat().st_mtime_ns
+        except OSError:
+            firma_foto = None
+        try:
+            tam_diario = ruta_diario.stat().st_size
+        except OSError:
+            tam_diario = 0
+
+        est = self._dias.get(fecha)
+        if est is None or est['firma'] != firma_foto or tam_diario < est['offset']:
+            # Primera lectura del día, o la foto/diario cambió por fuera
+            # (compactación en otro proceso): reconstruir desde cero.
+            base = {}
+            if firma_foto is not None:
+                try:
+                    with open(ruta_foto, 'r', encoding='utf-8') as f:
+                        base = json.load(f)
+                except Exception:
+                    base = {}
+            elif fecha in self._cargar_historico():
+                base = json.loads(json.dumps(self._historico[fecha]))
+            est = {'firma': firma_foto, 'offset': 0, 'datos': base}
+            self._dias[fecha] = est
+
+        if tam_diario > est['offset']:
+            with open(ruta_diario, 'rb') as f:
+                f.seek(est['offset'])
+                nuevo = f.read()
+            # Solo se consumen líneas completas: una escritura a medias de
+            # otro proceso se aplicará en la próxima lectura.
+            fin = nuevo.rfind(b'\n') + 1
+            for linea in nuevo[:fin].splitlines():
+                try:
+                    _aplicar_evento(est['datos'], json.loads(linea))
+                except Exception:
+                    continue
+            est['offset'] += fin
+        return est['datos']
+
+    def leer_dia(self, fecha):
+        """{dni: registro} de una fecha ('AAAA-MM-DD'). Devuelve una copia."""
+        fecha = _fecha_iso(fecha) or fecha
+        with self._lock:
+            self._compactar_dias_pasados()
+            return {k: dict(v) for k, v in self._estado_dia(fecha).items()}
+
+    def fechas(self):
+        """Todas las fechas con registros, ordenadas (formato AAAA-MM-DD)."""
+        with self._lock:
+            fechas = set(self._cargar_historico().keys())
+            if self.carpeta.exists():
+                for p in self.carpeta.iterdir():
+                    if p.suffix in ('.json', '.jsonl'):
+                        fechas.add(p.stem)
+            return sorted(f for f in fechas if _fecha_iso(f))
+
+    def leer_rango(self, fecha_ini=None, fecha_fin=None):
+        """{fecha: {dni: registro}} entre dos fechas ISO, ambas incluidas.
+        Sin límites devuelve TODO el historial. Los días vacíos se omiten."""
+        with self._lock:
+            self._compactar_dias_pasados()
+            resultado = {}
+            for fecha in self.fechas():
+                if fecha_ini and fecha < fecha_ini:
+                    continue
+                if fecha_fin and fecha > fecha_fin:
+                    continue
+                datos = self._estado_dia(fecha)
+                if datos:
+                    resultado[fecha] = {k: dict(v) for k, v in datos.items()}
+            return resultado
+
+    def leer_mes(self, anio, mes):
+        """{fecha: {dni: registro}} de un mes calendario."""
+        pref = f"{int(anio):04d}-{int(mes):02d}"
+        return self.leer_rango(f"{pref}-01", f"{pref}-31")
+
+    def leer_todo(self):
+        """Historial completo {fecha: {dni: registro}} — mismo formato que
+        tenía asistencias.json, para backups y reportes."""
+        return self.leer_rango()
+
+    def _firma_dia(self, fecha):
+        """Firma barata (solo stat, sin leer) del estado en disco de un
+        día: cambia con cualquier escritura de este o de otro proceso."""
+        try:
+            foto = self._ruta_foto(fecha).stat().st_mtime_ns
+        except OSError:
+            foto = None
+        try:
+            tam = self._ruta_diario(fecha).stat().st_size
+        except OSError:
+            tam = 0
+        self._cargar_historico()
+        return (foto, tam, self._historico_firma)
+
+    def firmas(self):
+        """{fecha: firma} de todas las fechas con registros, sin leer su
+        contenido. Sirve para saber qué días cambiaron desde la última vez."""
+        with self._lock:
+            self._compactar_dias_pasados()
+            self._cargar_historico()
+            fh = self._historico_firma
+            res = {f: (None, 0, fh) for f in self._historico}
+            if self.carpeta.exists():
+                with os.scandir(self.carpeta) as it:
+                    for entrada in it:
+                        fecha, ext = os.path.splitext(entrada.name)
+                        if ext not in ('.json', '.jsonl') or len(fecha) != 10:
+                            continue
+                        try:
+                            st_e = entrada.stat()
+                        except OSError:
+                            continue
+                        foto, tam, _ = res.get(fecha, (None, 0, fh))
+                        if ext == '.json':
+                            foto = st_e.st_mtime_ns
+                        else:
+                            tam = st_e.st_size
+                        res[fecha] = (foto, tam, fh)
+            return res
+
+    def suscribir(self, funcion):
+        """Registra funcion(fecha, dni, registro, firma_antes, firma_despues),
+        llamada dentro del lock después de cada escritura de este proceso.
+        `registro` es el registro completo ya actualizado (None al borrar
+        el día); `firma_despues` es None si otro proceso escribió en el
+        mismo día a la vez (el suscriptor debe releer ese día). Debe ser
+        rápida y no llamar de vuelta al diario."""
+        with self._lock:
+            self._oyentes.append(funcion)
+
+    def _avisar(self, fecha, dni, registro, antes, despues):
+        for funcion in self._oyentes:
+            try:
+                funcion(fecha, dni, registro, antes, despues)
+            except Exception:
+                pass
+
+    def historial_dni(self, dni):
+        """{fecha: registro} de una sola persona."""
+        dni = str(dni).strip()
+        return {f: d[dni] for f, d in self.leer_todo().items() if dni in d}
+
+    # ------------------------------------------------------------
+    # Escritura
+    # ------------------------------------------------------------
+    def _agregar_evento(self, fecha, evento):
+        """Agrega la línea y devuelve cuántos bytes escribió."""
+        self.carpeta.mkdir(parents=True, exist_ok=True)
+        linea = (json.dumps(evento, ensure_ascii=False) + '\n').encode('utf-8')
+        fd = os.open(self._ruta_diario(fecha),
+                     os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, linea)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        return len(linea)
+
+    def _escribir(self, fecha, dni, evento):
+        """Agrega el evento, lo aplica y avisa a los suscriptores."""
+        antes = self._firma_dia(fecha) if self._oyentes else None
+        escrito = self._agregar_evento(fecha, evento)
+        datos = self._estado_dia(fecha)
+        registro = dict(datos.get(dni, {})) if dni else None
+        if self._oyentes:
+            despues = self._firma_dia(fecha)
+            if despues[1] != antes[1] + escrito:
+                despues = None      # otro proceso escribió en medio
+            self._avisar(fecha, dni, registro, antes, despues)
+        return registro
+
+    def registrar(self, fecha, dni, nombre, campo, hora, es_docente=False):
+        """Registra un escaneo (entrada/salida/tardanza/...). Devuelve el
+        registro del día de ese DNI ya actualizado."""
+        campos = {campo: hora} if campo in CAMPOS_ASISTENCIA else {}
+        return self.actualizar(fecha, dni, campos, nombre=nombre,
+                               es_docente=es_docente)
+
+    def actualizar(self, fecha, dni, campos, nombre=None, es_docente=None):
+        """Corrige campos arbitrarios del registro de un DNI en una fecha
+        (ediciones manuales, 'modificado', 'modificado_por', ...)."""
+        fecha = _fecha_iso(fecha) or fecha
+        dni = str(dni).strip()
+        evento = {'dni': dni, 'campos': dict(campos)}
+        if nombre:
+            evento['nombre'] = nombre
+        if es_docente is not None:
+            evento['es_docente'] = bool(es_docente)
+        with self._lock:
+            self._compactar_dias_pasados()
+            return self._escribir(fecha, dni, evento)
+
+    def borrar_dia(self, fecha):
+        """Elimina todos los registros de una fecha."""
+        fecha = _fecha_iso(fecha) or fecha
+        with self._lock:
+            self._escribir(fecha, None, {'op': 'borrar_dia'})
+
+    def descartar_diarios(self):
+        """Elimina diarios y fotos diarias: se usa al restaurar un backup
+        completo, cuyo asistencias.json pasa a ser la única fuente."""
+        with self._lock:
+            if self.carpeta.exists():
+                for p in self.carpeta.iterdir():
+                    if p.suffix in ('.json', '.jsonl', '.tmp'):
+                        p.unlink(missing_ok=True)
+            self._dias.clear()
+            self._historico_firma = None
+
+    # ------------------------------------------------------------
+    # Compactación
+    # ------------------------------------------------------------
+    def compactar(self, fecha):
+        """Vuelca el diario de una fecha en su foto diaria (escritura
+        atómica) y elimina el diario."""
+        fecha = _fecha_iso(fecha) or fecha
+        ruta_diario = self._ruta_diario(fecha)
+        with self._lock:
+            if not ruta_diario.exists():
+                return False
+            datos = self._estado_dia(fecha)
+            ruta_foto = self._ruta_foto(fecha)
+            tmp = ruta_foto.with_suffix('.json.tmp')
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(datos, f, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, ruta_foto)
+            ruta_diario.unlink(missing_ok=True)
+            self._dias.pop(fecha, None)
+            return True
+
+    def _compactar_dias_pasados(self):
+        """Compacta los diarios de días anteriores a hoy. Se ejecuta una
+        sola vez por día y por proceso."""
+        hoy = self._reloj()
+        if self._ultimo_dia_compactado == hoy:
+            return
+        self._ultimo_dia_compactado = hoy
+        if not self.carpeta.exists():
+            return
+        for p in sorted(self.carpeta.glob('*.jsonl')):
+            if p.stem < hoy:
+                try:
+                    self.compactar(p.stem)
+                except Exception:
+                    pass
@@ -0,0 +1,428 @@
+"""
+YACHAY PRO — Resumen de Asistencias (tablas precalculadas)
+El ranking semanal, el Top del Mes, el análisis predictivo, el reporte
+mensual y el portal de padres recorrían TODO el historial en cada
+recarga: cada clave de fecha, con strptime, por cada alumno, y a veces
+un get_all_records() de la hoja Asistencias completa.
+
+ResumenAsistencias mantiene el resultado ya contado, en arreglos NumPy
+compactos indexados por (ordinal de persona × día hábil):
+    estado        0 sin registro · 1 puntual · 2 tardanza · 3 registrado
+                  (solo salida / corrección sin hora de entrada)
+    min_tarde     minutos después de la hora límite
+    primera/ultima primera y última marca del día (minutos desde 00:00)
+y por cada mes, los totales por persona (puntual, tardanza, registrado,
+minutos de tardanza), que se ajustan celda por celda.
+
+Se alimenta del DiarioAsistencias:
+    - cada escaneo de este proceso llega por suscripción y actualiza UNA
+      celda (más sus totales del mes) en la siguiente lectura;
+    - los cambios de otros procesos, compactaciones y restauraciones se
+      detectan por la firma (stat) de cada día, y solo ese día se recalcula.
+
+Los sábados y domingos no se cuentan (igual que antes en los rankings).
+
+Este módulo no depende de Streamlit: sistema_web.py mantiene UNA instancia
+por proceso (st.cache_resource) suscrita al diario.
+"""
+import threading
+import time
+from collections import deque
+from datetime import date
+
+import numpy as np
+
+from asistencia_diario import CAMPOS_ASISTENCIA
+
+SIN_REGISTRO, PUNTUAL, TARDANZA, REGISTRADO = 0, 1, 2, 3
+NOMBRES_ESTADO = {PUNTUAL: 'puntual', TARDANZA: 'tardanza',
+                  REGISTRADO: 'registrado'}
+HORA_LIMITE = 8 * 60 + 5    # 08:05, como el registro de la puerta
+
+# Columnas de los totales mensuales por persona
+_T_PUNTUAL, _T_TARDANZA, _T_REGISTRADO, _T_MIN_TARDE = range(4)
+
+
+def _minutos(hora):
+    """'HH:MM' / 'H:MM' / 'HH:MM:SS' → minutos desde 00:00 (None si no
+    es una hora)."""
+    h, sep, resto = str(hora or '').strip().partition(':')
+    if not sep:
+        return None
+    try:
+        return int(h) * 60 + int(resto[:2])
+    except ValueError:
+        return None
+
+
+def _hora(minutos):
+    return f"{minutos // 60:02d}:{minutos % 60:02d}" if minutos >= 0 else ''
+
+
+def _fecha_iso(fecha):
+    """Normaliza 'AAAA-MM-DD' o 'DD/MM/AAAA' por cortes de texto (sin
+    strptime). None si no se reconoce."""
+    fecha = str(fecha).strip()
+    if len(fecha) != 10:
+        return None
+    if fecha[4] == '-' and fecha[7] == '-':
+        return fecha
+    if fecha[2] == '/' and fecha[5] == '/':
+        return f"{fecha[6:]}-{fecha[3:5]}-{fecha[:2]}"
+    return None
+
+
+def _dia_habil(fecha):
+    try:
+        return date.fromisoformat(fecha).weekday() < 5
+    except ValueError:
+        return False
+
+
+class ResumenAsistencias:
+    """Agregados de asistencia por persona, día y mes, al día con el
+    diario. Seguro para varios hilos."""
+
+    def __init__(self, diario, hora_limite=HORA_LIMITE):
+        self.diario = diario
+        self.hora_limite = hora_limite
+        self._lock = threading.RLock()
+        # personas
+        self._ordinal = {}            # dni → fila
+        self._dnis = []
+        self._nombres = []
+        self._docente = np.zeros(64, dtype=bool)
+        # días hábiles: una columna por fecha, en orden de llegada
+        self._col = {}                # 'AAAA-MM-DD' → columna
+        self._fechas = []
+        self._mes_col = []            # columna → (anio, mes)
+        self._meses = {}              # (anio, mes) → {'cols', 'tot'}
+        self._dia_n = np.zeros(32, dtype=np.int32)   # personas con registro
+        forma = (64, 32)
+        self._estado = np.zeros(forma, dtype=np.int8)
+        self._min_tarde = np.zeros(forma, dtype=np.int16)
+        self._primera = np.full(forma, -1, dtype=np.int16)
+        self._ultima = np.full(forma, -1, dtype=np.int16)
+        # sincronización con el diario
+        self._firmas = {}             # fecha → firma aplicada
+        self._eventos = deque()       # avisos del diario aún sin aplicar
+        self._extra = {}              # fecha → {dni: registro} de otras fuentes
+        self._extra_version = {}
+        self._complemento_ts = 0.0    # última lectura de hoja / Drive
+
+    # ------------------------------------------------------------
+    # Capacidad
+    # ------------------------------------------------------------
+    def _crecer(self, filas, cols):
+        f0, c0 = self._estado.shape
+        if filas <= f0 and cols <= c0:
+            return
+        f1 = max(f0, 1 << (filas - 1).bit_length())
+        c1 = max(c0, 1 << (cols - 1).bit_length())
+        for nombre, relleno in (('_estado', 0), ('_min_tarde', 0),
+                                ('_primera', -1), ('_ultima', -1)):
+            viejo = getattr(self, nombre)
+            nuevo = np.full((f1, c1), relleno, dtype=viejo.dtype)
+            nuevo[:f0, :c0] = viejo
+            setattr(self, nombre, nuevo)
+        if f1 > f0:
+            docente = np.zeros(f1, dtype=bool)
+            docente[:f0] = self._docente
+            self._docente = docente
+            for m in self._meses.values():
+                tot = np.zeros((f1, 4), dtype=np.int32)
+                tot[:f0] = m['tot']
+                m['tot'] = tot
+        if c1 > c0:
+            dia_n = np.zeros(c1, dtype=np.int32)
+            dia_n[:c0] = self._dia_n
+            self._dia_n = dia_n
+
+    def _persona(self, dni, registro):
+        p = self._ordinal.get(dni)
+        if p is None:
+            p = len(self._dnis)
+            self._crecer(p + 1, len(self._fechas))
+            self._ordinal[dni] = p
+            self._dnis.append(dni)
+            self._nombres.append('')
+        if registro.get('nombre'):
+            self._nombres[p] = str(registro['nombre'])
+        if 'es_docente' in registro:
+            self._docente[p] = bool(registro['es_docente'])
+        return p
+
+    def _columna(self, fecha):
+        c = self._col.get(fecha)
+        if c is None:
+            c = len(self._fechas)
+            self._crecer(len(self._dnis), c + 1)
+            self._col[fecha] = c
+            self._fechas.append(fecha)
+            clave = (int(fecha[:4]), int(fecha[5:7]))
+            self._mes_col.append(clave)
+            mes = self._meses.get(clave)
+            if mes is None:
+                mes = self._meses[clave] = {
+                    'cols': [],
+                    'tot': np.zeros((self._estado.shape[0], 4), dtype=np.int32)}
+            mes['cols'].append(c)
+        return c
+
+    # ------------------------------------------------------------
+    # Celdas
+    # ------------------------------------------------------------
+    def _clasificar(self, registro):
+        """(estado, min_tarde, primera, ultima) de un registro del día."""
+        entrada = registro.get('entrada', '') or registro.get('tardanza', '')
+        tarde = bool(registro.get('tardanza', ''))
+        m_ent = _minutos(entrada)
+        if m_ent is not None and m_ent > self.hora_limite:
+            tarde = True
+        horas = [m for m in (_minutos(registro.get(c)) for c in CAMPOS_ASISTENCIA)
+                 if m is not None]
+        if tarde:
+            estado = TARDANZA
+        elif entrada:
+            estado = PUNTUAL
+        else:
+            estado = REGISTRADO
+        min_tarde = max(0, m_ent - self.hora_limite) if tarde and m_ent is not None else 0
+        return (estado, min_tarde,
+                min(horas) if horas else -1, max(horas) if horas else -1)
+
+    def _poner(self, p, c, estado, min_tarde=0, primera=-1, ultima=-1):
+        """Escribe una celda y ajusta los totales del mes y del día."""
+        viejo, viejo_mt = int(self._estado[p, c]), int(self._min_tarde[p, c])
+        if viejo != estado or viejo_mt != min_tarde:
+            tot = self._meses[self._mes_col[c]]['tot'][p]
+            tot[_T_PUNTUAL] += (estado == PUNTUAL) - (viejo == PUNTUAL)
+            tot[_T_TARDANZA] += (estado == TARDANZA) - (viejo == TARDANZA)
+            tot[_T_REGISTRADO] += (estado != 0) - (viejo != 0)
+            tot[_T_MIN_TARDE] += min_tarde - viejo_mt
+            self._dia_n[c] += (estado != 0) - (viejo != 0)
+        self._estado[p, c] = estado
+        self._min_tarde[p, c] = min_tarde
+        self._primera[p, c] = primera
+        self._ultima[p, c] = ultima
+
+    def _cargar_dia(self, fecha, datos):
+        """Recalcula la columna completa de un día."""
+        c = self._columna(fecha)
+        n = len(self._dnis)
+        for p in np.flatnonzero(self._estado[:n, c]):
+            if self._dnis[p] not in datos:
+                self._poner(int(p), c, SIN_REGISTRO)
+        for dni, registro in datos.items():
+            if isinstance(registro, dict):
+                p = self._persona(str(dni).strip(), registro)
+                self._poner(p, c, *self._clasificar(registro))
+
+    # ------------------------------------------------------------
+    # Sincronización con el diario
+    # ------------------------------------------------------------
+    def aviso(self, fecha, dni, registro, antes, despues):
+        """Suscriptor del diario: solo encola (se llama con el lock del
+        diario tomado; el trabajo se hace en la siguiente lectura)."""
+        self._eventos.append((fecha, dni, registro, antes, despues))
+
+    def _aplicar_eventos(self):
+        while self._eventos:
+            fecha, dni, registro, antes, despues = self._eventos.popleft()
+            if not _dia_habil(fecha):
+                continue
+            firma = self._firmas.get(fecha)
+            if dni is None:
+                self._cargar_dia(fecha, dict(self._extra.get(fecha, {})))
+                self._firmas.pop(fecha, None)
+                continue
+            p = self._persona(dni, registro)
+            self._poner(p, self._columna(fecha), *self._clasificar(registro))
+            # Si el día estaba al día justo antes de esta escritura, queda
+            # al día después; si no, se releerá entero.
+            if (firma is not None and despues is not None
+                    and firma == (antes, self._extra_version.get(fecha, 0))):
+                self._firmas[fecha] = (despues, firma[1])
+
+    def sincronizar(self):
+        """Aplica los escaneos pendientes y recalcula los días que
+        cambiaron por fuera (otro proceso, compactación, restauración)."""
+        firmas = self.diario.firmas()
+        with self._lock:
+            self._aplicar_eventos()
+            actuales = {f: (firma, self._extra_version.get(f, 0))
+                        for f, firma in firmas.items() if _dia_habil(f)}
+            for f in self._extra:
+                actuales.setdefault(f, (None, self._extra_version.get(f, 0)))
+            cambiados = [f for f, firma in actuales.items()
+                         if self._firmas.get(f) != firma]
+            for f in [f for f in self._firmas if f not in actuales]:
+                self._cargar_dia(f, {})
+                del self._firmas[f]
+        for f in cambiados:
+            datos = self.diario.leer_dia(f) if actuales[f][0] is not None else {}
+            with self._lock:
+                combinado = dict(self._extra.get(f, {}))
+                combinado.update(datos)
+                self._cargar_dia(f, combinado)
+                self._firmas[f] = actuales[f]
+
+    def complementar(self, dias):
+        """Suma registros de otras fuentes ({fecha: {dni: registro}}: hoja
+        Asistencias, backup de Drive) solo para las personas que el diario
+        NO tiene ese día. Lo del diario siempre gana."""
+        self.sincronizar()
+        with self._lock:
+            for fecha, personas in (dias or {}).items():
+                fecha = _fecha_iso(fecha)
+                if not fecha or not _dia_habil(fecha) or not isinstance(personas, dict):
+                    continue
+                c = self._col.get(fecha)
+                extra = self._extra.setdefault(fecha, {})
+                nuevos = 0
+                for dni, registro in personas.items():
+                    dni = str(dni).strip()
+                    if not dni or dni in extra or not isinstance(registro, dict):
+                        continue
+                    p = self._ordinal.get(dni)
+                    if c is not None and p is not None and self._estado[p, c]:
+                        continue
+                    extra[dni] = dict(registro)
+                    nuevos += 1
+                if nuevos:
+                    self._extra_version[fecha] = self._extra_version.get(fecha, 0) + 1
+                elif not extra:
+                    del self._extra[fecha]
+        self.sincronizar()
+
+    def complemento_vencido(self, intervalo):
+        """True si pasaron `intervalo` segundos desde la última lectura
+        de las fuentes remotas."""
+        return time.time() - self._complemento_ts >= intervalo
+
+    def reservar_complemento(self, intervalo, forzar=False):
+        """Anota que empieza una lectura de las fuentes remotas. Devuelve
+        False si ya hubo una hace menos de `intervalo` segundos (y no se
+        pidió `forzar`): así solo un hilo del proceso lee la hoja."""
+        with self._lock:
+            if not forzar and not self.complemento_vencido(intervalo):
+                return False
+            self._complemento_ts = time.time()
+            return True
+
+    # ------------------------------------------------------------
+    # Consultas
+    # ------------------------------------------------------------
+    def _top(self, puntual, tardanza, total, top):
+        """(top_alumnos, top_docentes) en el formato de siempre:
+        [{'nombre', 'puntual', 'tardanza', 'total'}], por más días
+        puntuales y luego menos tardanzas."""
+        n = len(self._dnis)
+        docente = self._docente[:n]
+        listas = []
+        for grupo in (~docente, docente):
+            filas = np.flatnonzero(grupo & (total > 0))
+            orden = filas[np.lexsort((tardanza[filas], -puntual[filas]))][:top]
+            listas.append([{'nombre': self._nombres[p], 'puntual': int(puntual[p]),
+                            'tardanza': int(tardanza[p]), 'total': int(total[p])}
+                           for p in orden])
+        return listas[0], listas[1]
+
+    def ranking(self, fecha_ini, fecha_fin, top=10):
+        """Ranking de puntualidad entre dos fechas ISO (incluidas).
+        Devuelve (top_alumnos, top_docentes, fechas con registro)."""
+        self.sincronizar()
+        with self._lock:
+            cols = sorted(c for f, c in self._col.items() if fecha_ini <= f <= fecha_fin)
+            dias = sorted(self._fechas[c] for c in cols if self._dia_n[c] > 0)
+            if not cols:
+                return [], [], dias
+            estado = self._estado[:len(self._dnis), cols]
+            alu, doc = self._top((estado == PUNTUAL).sum(1),
+                                 (estado == TARDANZA).sum(1),
+                                 (estado != 0).sum(1), top)
+            return alu, doc, dias
+
+    def ranking_mes(self, anio, mes, top=10):
+        """Top del Mes desde los totales mensuales. Devuelve
+        (top_alumnos, top_docentes, días con registro)."""
+        self.sincronizar()
+        with self._lock:
+            m = self._meses.get((int(anio), int(mes)))
+            if m is None:
+                return [], [], 0
+            tot = m['tot'][:len(self._dnis)]
+            alu, doc = self._top(tot[:, _T_PUNTUAL], tot[:, _T_TARDANZA],
+                                 tot[:, _T_REGISTRADO], top)
+            return alu, doc, int((self._dia_n[m['cols']] > 0).sum())
+
+    def resumen_anio(self, anio):
+        """{dni: {'puntual', 'tardanza', 'registrado', 'faltas',
+        'minutos_tarde', 'dias'}} del año, sumando los totales mensuales.
+        'dias' son los días hábiles con algún registro en el colegio y
+        'faltas' los de esos días en que la persona no registró."""
+        self.sincronizar()
+        with self._lock:
+            n = len(self._dnis)
+            tot = np.zeros((n, 4), dtype=np.int64)
+            dias = 0
+            for (a, _), m in self._meses.items():
+                if a == int(anio):
+                    tot += m['tot'][:n]
+                    dias += int((self._dia_n[m['cols']] > 0).sum())
+            return {dni: {'puntual': int(tot[p, _T_PUNTUAL]),
+                          'tardanza': int(tot[p, _T_TARDANZA]),
+                          'registrado': int(tot[p, _T_REGISTRADO]),
+                          'faltas': dias - int(tot[p, _T_REGISTRADO]),
+                          'minutos_tarde': int(tot[p, _T_MIN_TARDE]),
+                          'dias': dias}
+                    for p, dni in enumerate(self._dnis)}
+
+    def asistencia_mes(self, anio, mes, dnis=None):
+        """{dni: {'nombre', 'fechas': {fecha: {'entrada', 'salida'}}}} de
+        un mes, con la primera y la última marca de cada día. Con `dnis`
+        se limita a esas personas (y se incluyen aunque no tengan días)."""
+        self.sincronizar()
+        with self._lock:
+            m = self._meses.get((int(anio), int(mes)))
+            cols = sorted(m['cols']) if m else []
+            filas = ([(str(d).strip(), self._ordinal.get(str(d).strip())) for d in dnis]
+                     if dnis is not None else list(self._ordinal.items()))
+            res = {}
+            for dni, p in filas:
+                fechas = {}
+                if p is not None:
+                    for c in cols:
+                        if self._estado[p, c]:
+                            fechas[self._fechas[c]] = {
+                                'entrada': _hora(int(self._primera[p, c])),
+                                'salida': _hora(int(self._ultima[p, c]))}
+                if fechas or dnis is not None:
+                    res[dni] = {'nombre': self._nombres[p] if p is not None else '',
+                                'fechas': fechas}
+            return res
+
+    def historial(self, dni):
+        """Días con registro de una persona, del más reciente al más
+        antiguo: [{'fecha', 'estado', 'min_tarde', 'primera', 'ultima'}]."""
+        self.sincronizar()
+        with self._lock:
+            p = self._ordinal.get(str(dni).strip())
+            if p is None:
+                return []
+            cols = np.flatnonzero(self._estado[p, :len(self._fechas)])
+            dias = [{'fecha': self._fechas[c],
+                     'estado': NOMBRES_ESTADO[int(self._estado[p, c])],
+                     'min_tarde': int(self._min_tarde[p, c]),
+                     'primera': _hora(int(self._primera[p, c])),
+                     'ultima': _hora(int(self._ultima[p, c]))}
+                    for c in cols]
+            dias.sort(key=lambda d: d['fecha'], reverse=True)
+            return dias
+
+    def estadisticas(self):
+        with self._lock:
+            return {'personas': len(self._dnis), 'dias': len(self._fechas),
+                    'meses': len(self._meses),
+                    'bytes': int(self._estado.nbytes + self._min_tarde.nbytes
+                                 + self._primera.nbytes + self._ultima.nbytes)}
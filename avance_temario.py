@@ -462,12 +462,9 @@ def _leer_config_nube(clave):
     if gs is None:
         return None
     try:
-        ws = gs._get_hoja("config")
-        if ws is None:
-            return None
-        for row in ws.get_all_values():
-            if row and row[0] == clave:
-                return json.loads(row[1])
+        valor = gs.config().get(clave)
+        if valor is not None:
+            return json.loads(valor)
     except Exception:
         pass
     return None
@@ -478,16 +475,7 @@ def _escribir_config_nube(clave, valor):
     if gs is None:
         return False
     try:
-        ws = gs._get_hoja("config")
-        if ws is None:
-            return False
-        blob = json.dumps(valor, ensure_ascii=False)
-        for i, row in enumerate(ws.get_all_values()):
-            if row and row[0] == clave:
-                ws.update_cell(i + 1, 2, blob)
-                return True
-        ws.append_row([clave, blob])
-        return True
+        return gs.config().set(clave, json.dumps(valor, ensure_ascii=False))
     except Exception:
         return False
 
@@ -1528,12 +1516,9 @@ def _leer_resultados():
         gs = _gs()
         if gs is not None:
             try:
-                ws = gs._get_hoja("config")
-                if ws:
-                    for row in ws.get_all_values():
-                        if row and row[0] == "resultados_json":
-                            data = json.loads(row[1])
-                            break
+                valor = gs.config().get("resultados_json")
+                if valor is not None:
+                    data = json.loads(valor)
             except Exception:
                 data = []
 
@@ -2514,16 +2499,7 @@ def guardar_simulacros(data):
     if gs is None:
         return False
     try:
-        ws = gs._get_hoja("config")
-        if ws is None:
-            return False
-        blob = json.dumps(data, ensure_ascii=False)
-        for i, row in enumerate(ws.get_all_values()):
-            if row and row[0] == "simulacros_json":
-                ws.update_cell(i + 1, 2, blob)
-                return True
-        ws.append_row(["simulacros_json", blob])
-        return True
+        return gs.config().set("simulacros_json", json.dumps(data, ensure_ascii=False))
     except Exception:
         return False
 
@@ -2536,15 +2512,12 @@ def restaurar_simulacros_nube():
     if gs is None:
         return {}
     try:
-        ws = gs._get_hoja("config")
-        if ws is None:
-            return {}
-        for row in ws.get_all_values():
-            if row and row[0] == "simulacros_json":
-                data = json.loads(row[1])
-                with open(ARCHIVO_SIMULACROS, "w", encoding="utf-8") as f:
-                    json.dump(data, f, indent=2, ensure_ascii=False)
-                return data
+        valor = gs.config().get("simulacros_json")
+        if valor is not None:
+            data = json.loads(valor)
+            with open(ARCHIVO_SIMULACROS, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=2, ensure_ascii=False)
+            return data
     except Exception:
         pass
     return {}
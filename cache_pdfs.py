@@ -0,0 +1,296 @@
+"""
+YACHAY PRO — Caché en disco de PDFs generados (fichas y bancos CEPRU)
+Las fichas, bancos de preguntas y juegos de la Academia CEPRU dependen
+solo de sus argumentos (tema, con_claves, grupo, área, profesor, y la
+muestra de preguntas ya elegida), pero se rehacían con ReportLab y se
+volvían a cifrar con pypdf (_proteger_pdf) en CADA clic y en cada recarga
+de la página del curso.
+
+CachePDF guarda el PDF ya terminado (cifrado) en disco:
+    - clave = sha256 de (generador, versión del código, argumentos
+      normalizados con la firma de la función); la versión es el hash del
+      archivo .py del generador, de los módulos del repositorio que importa
+      (p. ej. fichas_algebra usa _proteger_pdf y _estilos de
+      fichas_historia) y de los recursos que usa (logos), así un cambio de
+      código o de logo invalida solo
+    - escritura atómica (archivo temporal + os.replace): otro hilo u otro
+      proceso nunca lee un PDF a medias
+    - límite de tamaño total con descarte LRU; la recencia se guarda en
+      el mtime de cada archivo y sobrevive a los reinicios
+    - un lock por clave: dos clics simultáneos (o dos paquetes ZIP con
+      los mismos documentos) generan el PDF una sola vez
+
+Este módulo no depende de Streamlit: academia_cepru.py mantiene la
+instancia del proceso (st.cache_resource).
+"""
+import ast
+import hashlib
+import inspect
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+CARPETA_DEFECTO = "cache_pdfs"
+MAX_BYTES_DEFECTO = 300 * 1024 * 1024
+
+
+def _hash_archivo(ruta):
+    try:
+        with open(ruta, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return ''
+
+
+def _fuentes_locales(fuente):
+    """El .py `fuente` y, recursivamente, los módulos de su misma carpeta
+    que importa (también los imports dentro de funciones), ordenados."""
+    raiz = Path(fuente).parent
+    pendientes, vistos = [Path(fuente)], set()
+    while pendientes:
+        ruta = pendientes.pop()
+        if ruta in vistos:
+            continue
+        vistos.add(ruta)
+        try:
+            arbol = ast.parse(ruta.read_bytes())
+        except (OSError, SyntaxError, ValueError):
+            continue
+        for nodo in ast.walk(arbol):
+            if isinstance(nodo, ast.Import):
+                nombres = [a.name for a in nodo.names]
+            elif isinstance(nodo, ast.ImportFrom) and nodo.module and not nodo.level:
+                nombres = [nodo.module]
+            else:
+                continue
+            for nombre in nombres:
+                candidata = raiz / f"{nombre.split('.')[0]}.py"
+                if candidata not in vistos and candidata.exists():
+                    pendientes.append(candidata)
+    return sorted(vistos)
+
+
+class CachePDF:
+
+    def __init__(self, carpeta=CARPETA_DEFECTO, max_bytes=MAX_BYTES_DEFECTO,
+                 recursos=()):
+        self.carpeta = Path(carpeta)
+        self.max_bytes = max_bytes
+        self.recursos = tuple(str(r) for r in recursos)
+        self._lock = threading.Lock()
+        self._locks_clave = {}
+        self._versiones = {}
+        self._lru = OrderedDict()          # clave → tamaño, de la más vieja a la más nueva
+        self._total = 0
+        self.stats = {'aciertos': 0, 'fallos': 0, 'descartes': 0,
+                      'segundos_generando': 0.0}
+        self._cargar_indice()
+
+    # ------------------------------------------------------------
+    # Índice LRU (desde el disco al arrancar)
+    # ------------------------------------------------------------
+    def _cargar_indice(self):
+        entradas = []
+        try:
+            for sub in os.scandir(self.carpeta):
+                if not sub.is_dir():
+                    continue
+                for e in os.scandir(sub.path):
+                    if e.name.endswith('.pdf'):
+                        st_e = e.stat()
+                        entradas.append((st_e.st_mtime_ns, e.name[:-4], st_e.st_size))
+                    elif e.name.endswith('.tmp'):
+                        # Restos de una escritura interrumpida
+                        try:
+                            os.remove(e.path)
+                        except OSError:
+                            pass
+        except OSError:
+            return
+        for _, clave, tam in sorted(entradas):
+            self._lru[clave] = tam
+            self._total += tam
+
+    def _ruta(self, clave):
+        return self.carpeta / clave[:2] / f"{clave}.pdf"
+
+    # ------------------------------------------------------------
+    # Claves
+    # ------------------------------------------------------------
+    def version(self, funcion):
+        """Hash del archivo donde está definido `funcion`, de los módulos
+        locales que importa + los recursos comunes (logos). Se calcula una
+        vez por proceso."""
+        nombre = f"{funcion.__module__}.{funcion.__qualname__}"
+        v = self._versiones.get(nombre)
+        if v is None:
+            try:
+                fuente = inspect.getsourcefile(funcion)
+            except TypeError:
+                fuente = None
+            partes = ([f"{r.name}:{_hash_archivo(r)}" for r in _fuentes_locales(fuente)]
+                      if fuente else [''])
+            partes += [_hash_archivo(r) for r in self.recursos]
+            v = self._versiones[nombre] = hashlib.sha256(
+                '|'.join(partes).encode()).hexdigest()[:16]
+        return v
+
+    def clave(self, funcion, *args, **kwargs):
+        """Clave estable: los argumentos se normalizan con la firma de la
+        función (posicional o por nombre, con los valores por defecto)."""
+        try:
+            ligados = inspect.signature(funcion).bind(*args, **kwargs)
+            ligados.apply_defaults()
+            argumentos = dict(ligados.arguments)
+        except (TypeError, ValueError):
+            argumentos = {'args': args, 'kwargs': kwargs}
+        texto = json.dumps([funcion.__module__, funcion.__qualname__,
+                            self.version(funcion), argumentos],
+                           sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(texto.encode('utf-8')).hexdigest()
+
+    # ------------------------------------------------------------
+    # Leer / generar
+    # ------------------------------------------------------------
+    def _leer(self, clave):
+        ruta = self._ruta(clave)
+        try:
+            with open(ruta, 'rb') as f:
+                datos = f.read()
+        except OSError:
+            with self._lock:
+                tam = self._lru.pop(clave, None)
+                if tam is not None:
+                    self._total -= tam
+            return None
+        try:
+            os.utime(ruta)   # recencia para el LRU tras un reinicio
+        except OSError:
+            pass
+        with self._lock:
+            if clave in self._lru:
+                self._lru.move_to_end(clave)
+            else:
+                # Lo escribió otro proceso
+                self._lru[clave] = len(datos)
+                self._total += len(datos)
+        return datos
+
+    def leer(self, clave):
+        """Bytes guardados con `clave` (ver clave()), o None."""
+        if clave not in self._lru and not self._ruta(clave).exists():
+            return None
+        datos = self._leer(clave)
+        if datos is not None:
+            self.stats['aciertos'] += 1
+        return datos
+
+    def guardar(self, clave, datos):
+        """Escritura atómica + descarte LRU hasta quedar bajo max_bytes."""
+        ruta = self._ruta(clave)
+        ruta.parent.mkdir(parents=True, exist_ok=True)
+        tmp = ruta.with_name(f"{ruta.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp, 'wb') as f:
+            f.write(datos)
+        os.replace(tmp, ruta)
+        with self._lock:
+            previo = self._lru.pop(clave, None)
+            if previo is not None:
+                self._total -= previo
+            self._lru[clave] = len(datos)
+            self._total += len(datos)
+            descartar = []
+            while self._total > self.max_bytes and len(self._lru) > 1:
+                viejo, tam = self._lru.popitem(last=False)
+                self._total -= tam
+                descartar.append(viejo)
+            self.stats['descartes'] += len(descartar)
+        for viejo in descartar:
+            try:
+                os.remove(self._ruta(viejo))
+            except OSError:
+                pass
+
+    def obtener(self, funcion, *args, **kwargs):
+        """Bytes del PDF desde la caché, o generados con
+        funcion(*args, **kwargs) y guardados. Si la función no devuelve
+        bytes (p. ej. None: "no aplica") se devuelve tal cual, sin cachear."""
+        clave = self.clave(funcion, *args, **kwargs)
+        datos = self._leer(clave) if clave in self._lru or self._ruta(clave).exists() else None
+        if datos is not None:
+            self.stats['aciertos'] += 1
+            return datos
+        with self._lock_clave(clave):
+            # Otro hilo pudo generarlo mientras esperábamos
+            datos = self._leer(clave) if clave in self._lru else None
+            if datos is not None:
+                self.stats['aciertos'] += 1
+                return datos
+            t0 = time.monotonic()
+            datos = funcion(*args, **kwargs)
+            self.registrar_generado(clave, datos, time.monotonic() - t0)
+        with self._lock:
+            self._locks_clave.pop(clave, None)
+        return datos
+
+    def registrar_generado(self, clave, datos, segundos):
+        """Cuenta un fallo (PDF generado, no leído) y lo guarda si son
+        bytes. Lo usa obtener() y quien genera fuera de él (el pool de
+        paquetes_cepru.py), así las estadísticas cuentan ambos caminos."""
+        with self._lock:
+            self.stats['fallos'] += 1
+            self.stats['segundos_generando'] += segundos
+        if isinstance(datos, (bytes, bytearray)) and datos:
+            try:
+                self.guardar(clave, bytes(datos))
+            except OSError:
+                pass
+
+    # ------------------------------------------------------------
+    # Locks por clave
+    # ------------------------------------------------------------
+    def _lock_clave(self, clave):
+        with self._lock:
+            return self._locks_clave.setdefault(clave, threading.Lock())
+
+    def reservar(self, clave, esperar=True):
+        """Toma el lock de `clave` (el mismo de obtener()) para generarla
+        fuera de la caché y lo devuelve; con esperar=False devuelve None
+        si otro hilo la está generando. Se suelta con liberar()."""
+        lock_clave = self._lock_clave(clave)
+        return lock_clave if lock_clave.acquire(blocking=esperar) else None
+
+    def liberar(self, clave, lock_clave):
+        with self._lock:
+            if self._locks_clave.get(clave) is lock_clave:
+                del self._locks_clave[clave]
+        lock_clave.release()
+
+    def contiene(self, funcion, *args, **kwargs):
+        clave = self.clave(funcion, *args, **kwargs)
+        with self._lock:
+            if clave in self._lru:
+                return True
+        return self._ruta(clave).exists()
+
+    # ------------------------------------------------------------
+    # Administración
+    # ------------------------------------------------------------
+    def estadisticas(self):
+        with self._lock:
+            return dict(self.stats, entradas=len(self._lru), bytes=self._total,
+                        max_bytes=self.max_bytes)
+
+    def vaciar(self):
+        with self._lock:
+            claves = list(self._lru)
+            self._lru.clear()
+            self._total = 0
+        for clave in claves:
+            try:
+                os.remove(self._ruta(clave))
+            except OSError:
+                pass
@@ -0,0 +1,175 @@
+"""
+YACHAY PRO — Caché de recursos gráficos (una por proceso)
+Escudos, fondo, logos de la academia, fuentes y códigos QR se usan en casi
+todos los PDF y carnets. Antes cada generador volvía a abrir el PNG del
+disco, a redimensionarlo y a probar las rutas de fuentes en cada llamada.
+
+Aquí se guardan ya decodificados, con clave = ruta + mtime + tamaño en
+disco + tamaño pedido: si el administrador sube un escudo nuevo, la clave
+cambia sola y la versión vieja termina saliendo por LRU.
+
+Los objetos devueltos son COMPARTIDOS entre sesiones e hilos: quien
+necesite modificar una imagen debe trabajar sobre una .copy().
+"""
+import io
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image, ImageFont
+
+MAX_ENTRADAS = 256
+
+_lock = threading.Lock()
+_entradas = OrderedDict()
+_stats = {'aciertos': 0, 'fallos': 0, 'descartes': 0}
+_NADA = object()   # se cachea también "no existe / no se pudo abrir"
+
+
+def _obtener(clave, fabrica):
+    """Valor cacheado para `clave`; si no está, lo crea con fabrica()."""
+    with _lock:
+        valor = _entradas.get(clave, _NADA)
+        if valor is not _NADA:
+            _entradas.move_to_end(clave)
+            _stats['aciertos'] += 1
+            return valor
+        _stats['fallos'] += 1
+    try:
+        valor = fabrica()
+    except Exception:
+        valor = None
+    with _lock:
+        _entradas[clave] = valor
+        _entradas.move_to_end(clave)
+        while len(_entradas) > MAX_ENTRADAS:
+            _entradas.popitem(last=False)
+            _stats['descartes'] += 1
+    return valor
+
+
+def firma(ruta):
+    """(ruta, mtime_ns, tamaño) o None si el archivo no existe."""
+    try:
+        st_r = os.stat(ruta)
+    except OSError:
+        return None
+    return (str(ruta), st_r.st_mtime_ns, st_r.st_size)
+
+
+def estadisticas():
+    with _lock:
+        return dict(_stats, entradas=len(_entradas), maximo=MAX_ENTRADAS)
+
+
+def limpiar():
+    with _lock:
+        _entradas.clear()
+
+
+# ------------------------------------------------------------------
+# Archivos e imágenes
+# ------------------------------------------------------------------
+def bytes_archivo(ruta):
+    """Contenido del archivo (bytes) o None."""
+    f = firma(ruta)
+    if f is None:
+        return None
+
+    def _leer():
+        with open(ruta, 'rb') as fh:
+            return fh.read()
+    return _obtener(('bytes',) + f, _leer)
+
+
+def imagen(ruta, tam=None, modo=None):
+    """Imagen PIL decodificada (opcionalmente convertida a `modo` y
+    redimensionada a `tam` con LANCZOS). NO modificarla: usar .copy()."""
+    f = firma(ruta)
+    if f is None:
+        return None
+
+    def _abrir():
+        datos = bytes_archivo(ruta)
+        img = Image.open(io.BytesIO(datos))
+        img.load()
+        if modo:
+            img = img.convert(modo)
+        if tam:
+            img = img.resize(tuple(tam), Image.LANCZOS)
+        return img
+    return _obtener(('imagen', modo, tuple(tam) if tam else None) + f, _abrir)
+
+
+def tamanio_imagen(ruta):
+    """(ancho, alto) en píxeles de la imagen, o None."""
+    img = imagen(ruta)
+    return img.size if img is not None else None
+
+
+def image_reader(ruta):
+    """ImageReader de ReportLab listo para canvas.drawImage, o None.
+    Se construye desde los bytes del archivo, igual que si se pasara la
+    ruta, pero sin volver a leer ni decodificar el PNG en cada PDF."""
+    f = firma(ruta)
+    if f is None:
+        return None
+
+    def _crear():
+        from reportlab.lib.utils import ImageReader
+        return ImageReader(io.BytesIO(bytes_archivo(ruta)))
+    return _obtener(('reader',) + f, _crear)
+
+
+def cacheado(clave, fabrica):
+    """Recurso derivado arbitrario (p. ej. el fondo del carnet con la
+    marca de agua). La clave debe incluir la firma() de los archivos de
+    los que depende."""
+    return _obtener(('derivado',) + tuple(clave), fabrica)
+
+
+# ------------------------------------------------------------------
+# Fuentes
+# ------------------------------------------------------------------
+def fuente(rutas, tam):
+    """ImageFont de la primera ruta existente de `rutas` en tamaño `tam`
+    (fallback: fuente por defecto de Pillow)."""
+    rutas = tuple(rutas)
+
+    def _cargar():
+        for ruta in rutas:
+            try:
+                if os.path.exists(ruta):
+                    return ImageFont.truetype(ruta, tam)
+            except Exception:
+                continue
+        try:
+            return ImageFont.load_default(size=tam)
+        except TypeError:
+            return ImageFont.load_default()
+    return _obtener(('fuente', rutas, int(tam)), _cargar)
+
+
+# ------------------------------------------------------------------
+# Códigos QR
+# ------------------------------------------------------------------
+def qr_imagen(datos, box_size=10, border=1):
+    """Imagen PIL del QR de `datos` (modo '1', como la genera qrcode).
+    NO modificarla."""
+    def _generar():
+        import qrcode
+        q = qrcode.QRCode(box_size=box_size, border=border)
+        q.add_data(datos)
+        q.make(fit=True)
+        return q.make_image(fill_color="black",
+                            back_color="white").get_image()
+    return _obtener(('qr', str(datos), box_size, border), _generar)
+
+
+def qr_png(datos, box_size=10, border=1):
+    """Bytes PNG del QR de `datos`."""
+    def _codificar():
+        buf = io.BytesIO()
+        qr_imagen(datos, box_size, border).save(buf, format='PNG')
+        return buf.getvalue()
+    return _obtener(('qr_png', str(datos), box_size, border), _codificar)
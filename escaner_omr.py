@@ -0,0 +1,1057 @@
+"""
+YACHAY PRO — Escáner de hojas de respuestas (OMR) y lector de QR
+Todo lo que lee imágenes sin interfaz: la plantilla de la hoja de
+respuestas (generar_hoja_respuestas), el escáner OMR (procesar_examen),
+la calificación por lote en varios procesos (procesar_lote_omr) y la
+decodificación de QR/Code128 de carnets y tarjetas QAWAY.
+
+Vive aparte de sistema_web.py para que los procesos del lote OMR puedan
+importar _omr_lote_trabajo: Streamlit ejecuta sistema_web.py como
+__main__ y un proceso hijo (forkserver/spawn) no lo puede importar sin
+volver a correr toda la aplicación.
+
+Este módulo no depende de Streamlit: sistema_web.py importa de aquí lo
+que usa la interfaz.
+"""
+import hashlib
+import io
+import os
+import re
+import threading
+import zipfile
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+try:
+    import cv2
+    HAS_CV2 = True
+except ImportError:
+    HAS_CV2 = False
+
+try:
+    from pyzbar.pyzbar import decode as pyzbar_decode, ZBarSymbol
+    # Los carnets solo llevan QR y Code128: no probar las demás simbologías
+    _ZBAR_SIMBOLOS = [ZBarSymbol.QRCODE, ZBarSymbol.CODE128]
+    HAS_PYZBAR = True
+except ImportError:
+    HAS_PYZBAR = False
+
+
+# ================================================================
+# DECODIFICACIÓN DE QR / CÓDIGOS DE BARRAS
+# ================================================================
+
+_QR_LADO_MAX = 1000        # Lado mayor del frame al decodificar
+_QR_LADO_DETECTOR = 640    # Lado mayor para el detector de cv2
+_QR_CACHE_MAX = 32
+_qr_cache = {}             # md5 de los bytes del frame → texto o None
+_qr_cache_lock = threading.Lock()
+
+
+def _zbar(img):
+    """pyzbar restringido a QR/Code128. Retorna el texto o None."""
+    if not HAS_PYZBAR:
+        return None
+    cod = pyzbar_decode(img, symbols=_ZBAR_SIMBOLOS)
+    if cod:
+        return cod[0].data.decode('utf-8')
+    return None
+
+
+def _detectar_qr_cv2(gray):
+    """QR con el detector de cv2 sobre una copia de ~640 px. Devuelve
+    (texto, puntos en coordenadas de `gray` o None). QRCodeDetectorAruco
+    (OpenCV >= 4.8) ubica los carnets girados que QRCodeDetector pierde y
+    tarda la mitad; con un OpenCV más viejo se usa QRCodeDetector."""
+    alto, ancho = gray.shape[:2]
+    escala = min(1.0, _QR_LADO_DETECTOR / max(alto, ancho))
+    chico = gray if escala >= 1.0 else cv2.resize(
+        gray, (int(ancho * escala), int(alto * escala)),
+        interpolation=cv2.INTER_AREA)
+    det = (cv2.QRCodeDetectorAruco() if hasattr(cv2, 'QRCodeDetectorAruco')
+           else cv2.QRCodeDetector())
+    texto, puntos, _ = det.detectAndDecode(chico)
+    if puntos is not None and len(puntos):
+        puntos = np.asarray(puntos, dtype=np.float32) / escala
+    else:
+        puntos = None
+    return texto, puntos
+
+
+def _decodificar_qr_cv2(ib):
+    """Decodifica en una sola imagen gris reducida (~1000px):
+    pyzbar → detector de cv2 → umbral adaptativo solo en la región
+    candidata. Como último recurso, pyzbar en resolución completa."""
+    gray_full = cv2.imdecode(np.frombuffer(ib, np.uint8), cv2.IMREAD_GRAYSCALE)
+    if gray_full is None:
+        return None
+    alto, ancho = gray_full.shape[:2]
+    escala = min(1.0, _QR_LADO_MAX / max(alto, ancho))
+    gray = gray_full if escala >= 1.0 else cv2.resize(
+        gray_full, (int(ancho * escala), int(alto * escala)),
+        interpolation=cv2.INTER_AREA)
+
+    texto = _zbar(gray)
+    if texto:
+        return texto
+
+    puntos = None
+    try:
+        texto, puntos = _detectar_qr_cv2(gray)
+        if texto:
+            return texto
+    except Exception:
+        puntos = None
+
+    if not HAS_PYZBAR:
+        # Sin zbar los pasos siguientes no tienen con qué leer: solo queda
+        # el código en negativo, también con cv2
+        try:
+            return _detectar_qr_cv2(cv2.bitwise_not(gray))[0] or None
+        except Exception:
+            return None
+
+    # Región candidata: el QR que el detector ubicó pero no pudo leer
+    # (ampliada 15%); sin ubicación, todo el frame reducido.
+    roi = gray
+    if puntos is not None and len(puntos):
+        pts = np.asarray(puntos).reshape(-1, 2)
+        x0, y0 = pts.min(axis=0)
+        x1, y1 = pts.max(axis=0)
+        mx, my = (x1 - x0) * 0.15, (y1 - y0) * 0.15
+        h, w = gray.shape[:2]
+        x0, y0 = max(0, int(x0 - mx)), max(0, int(y0 - my))
+        x1, y1 = min(w, int(x1 + mx)), min(h, int(y1 + my))
+        if x1 - x0 > 10 and y1 - y0 > 10:
+            roi = gray[y0:y1, x0:x1]
+    th = cv2.adaptiveThreshold(roi, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                               cv2.THRESH_BINARY, 31, 10)
+    texto = _zbar(th)
+    if texto:
+        return texto
+    # Código claro sobre fondo oscuro (carnet impreso en negativo, pantalla
+    # en modo oscuro): pyzbar y QRCodeDetector solo leen oscuro sobre claro
+    texto = _zbar(cv2.bitwise_not(th))
+    if texto:
+        return texto
+
+    # QR muy pequeño en el frame: la reducción pudo borrarlo
+    if escala < 1.0:
+        return _zbar(gray_full)
+    return None
+
+
+def decodificar_qr_imagen(ib):
+    """Texto del primer QR / código de barras del frame, o None.
+    Un mismo frame (st.camera_input lo reenvía en cada rerun) se
+    decodifica una sola vez."""
+    if not (HAS_PYZBAR or HAS_CV2):
+        return None
+    clave = hashlib.md5(ib).hexdigest()
+    with _qr_cache_lock:
+        if clave in _qr_cache:
+            return _qr_cache[clave]
+
+    texto = None
+    if HAS_CV2:
+        try:
+            texto = _decodificar_qr_cv2(ib)
+        except Exception:
+            texto = None
+    elif HAS_PYZBAR:
+        try:
+            img = Image.open(io.BytesIO(ib)).convert('L')
+            img.thumbnail((_QR_LADO_MAX, _QR_LADO_MAX))
+            texto = _zbar(img)
+        except Exception:
+            texto = None
+
+    with _qr_cache_lock:
+        _qr_cache[clave] = texto
+        while len(_qr_cache) > _QR_CACHE_MAX:
+            _qr_cache.pop(next(iter(_qr_cache)))
+    return texto
+
+
+_QR_AULA_NIVELES = (1600, 3200)   # Lado mayor de cada nivel de la pirámide
+_QR_AULA_MOSAICO = 1000           # Lado de cada mosaico (px)
+_qr_aula_cache = {}               # md5 del frame → lista de textos
+
+
+def _zbar_todos(img):
+    """Todos los QR/Code128 que pyzbar encuentra en la imagen."""
+    if not HAS_PYZBAR:
+        return []
+    return [c.data.decode('utf-8', 'ignore')
+            for c in pyzbar_decode(img, symbols=_ZBAR_SIMBOLOS)]
+
+
+def _cv2_multi(gray):
+    """cv2.QRCodeDetector.detectAndDecodeMulti (OpenCV >= 4.3)."""
+    try:
+        ok, textos, _, _ = cv2.QRCodeDetector().detectAndDecodeMulti(gray)
+    except Exception:
+        return []
+    return [t for t in (textos or []) if t] if ok else []
+
+
+def _origenes_mosaico(largo):
+    """Inicios de los mosaicos a lo largo de un eje: cada 75% del lado (25%
+    de solape) y uno final al ras del borde, para que las tarjetas de las
+    filas del fondo y del margen derecho también se lean a resolución de
+    mosaico."""
+    paso = int(_QR_AULA_MOSAICO * 0.75)
+    ultimo = max(0, largo - _QR_AULA_MOSAICO)
+    return sorted(set(range(0, ultimo, paso)) | {ultimo})
+
+
+def _decodificar_qrs_cv2(ib, esperados=None):
+    """Todos los códigos de una foto amplia (p. ej. el aula entera con
+    las tarjetas QAWAY en alto). Pirámide de resoluciones: primero la foto
+    reducida completa; si faltan códigos, mosaicos solapados a mayor
+    resolución, donde los QR lejanos (pequeños) sí se leen. Se detiene al
+    llegar a `esperados` códigos distintos."""
+    gray_full = cv2.imdecode(np.frombuffer(ib, np.uint8), cv2.IMREAD_GRAYSCALE)
+    if gray_full is None:
+        return []
+    encontrados = {}
+    alto, ancho = gray_full.shape[:2]
+    for nivel, lado in enumerate(_QR_AULA_NIVELES):
+        escala = min(1.0, lado / max(alto, ancho))
+        gray = gray_full if escala >= 1.0 else cv2.resize(
+            gray_full, (int(ancho * escala), int(alto * escala)),
+            interpolation=cv2.INTER_AREA)
+        h, w = gray.shape[:2]
+        if nivel == 0:
+            mosaicos = [gray]
+        else:
+            mosaicos = [gray[y:y + _QR_AULA_MOSAICO, x:x + _QR_AULA_MOSAICO]
+                        for y in _origenes_mosaico(h) for x in _origenes_mosaico(w)]
+        for mosaico in mosaicos:
+            for texto in _zbar_todos(mosaico) or _cv2_multi(mosaico):
+                encontrados.setdefault(texto, None)
+            if esperados and len(encontrados) >= esperados:
+                return list(encontrados)
+        if escala >= 1.0:
+            break
+    return list(encontrados)
+
+
+def decodificar_qrs_imagen(ib, esperados=None):
+    """Textos de TODOS los QR / códigos de barras del frame, sin repetir
+    (lista vacía si no hay ninguno). Igual que decodificar_qr_imagen, un
+    mismo frame se decodifica una sola vez."""
+    if not (HAS_PYZBAR or HAS_CV2):
+        return []
+    clave = hashlib.md5(ib).hexdigest()
+    with _qr_cache_lock:
+        if clave in _qr_aula_cache:
+            return list(_qr_aula_cache[clave])
+
+    textos = []
+    if HAS_CV2:
+        try:
+            textos = _decodificar_qrs_cv2(ib, esperados)
+        except Exception:
+            textos = []
+    elif HAS_PYZBAR:
+        try:
+            img = Image.open(io.BytesIO(ib)).convert('L')
+            img.thumbnail((_QR_AULA_NIVELES[-1], _QR_AULA_NIVELES[-1]))
+            textos = list(dict.fromkeys(_zbar_todos(img)))
+        except Exception:
+            textos = []
+
+    with _qr_cache_lock:
+        _qr_aula_cache[clave] = textos
+        while len(_qr_aula_cache) > _QR_CACHE_MAX:
+            _qr_aula_cache.pop(next(iter(_qr_aula_cache)))
+    return list(textos)
+
+
+# ================================================================
+# HOJA DE RESPUESTAS + ESCÁNER OMR PROFESIONAL
+# Sistema basado en posición con marcadores de alineación
+# ================================================================
+
+# Constantes de la hoja VERTICAL (compartidas entre generador y escáner)
+HOJA_W = 2480       # Ancho A4 PORTRAIT 300dpi
+HOJA_H = 3508       # Alto A4 PORTRAIT 300dpi
+HOJA_MARKER_SIZE = 100   # Tamaño marcadores esquina
+HOJA_MARKER_PAD = 40     # Padding de marcadores desde borde
+HOJA_BUBBLE_R = 34       # Radio de burbuja
+HOJA_Y_START = 950       # Y donde empiezan las burbujas
+HOJA_X_START = 340       # X donde empieza la primera opción
+HOJA_SP_Y = 108          # Espacio vertical entre preguntas
+HOJA_SP_X = 155          # Espacio horizontal entre opciones A,B,C,D
+HOJA_COL_SP = 750        # Espacio entre columnas de preguntas
+HOJA_PPC = 20            # Preguntas por columna
+
+
+def _posicion_burbuja(pregunta_idx, opcion_idx):
+    """Calcula posición exacta (cx, cy) de una burbuja en la hoja"""
+    col = pregunta_idx // HOJA_PPC
+    fila = pregunta_idx % HOJA_PPC
+    cx = HOJA_X_START + col * HOJA_COL_SP + opcion_idx * HOJA_SP_X
+    cy = HOJA_Y_START + fila * HOJA_SP_Y
+    return cx, cy
+
+
+def generar_hoja_respuestas(np_, titulo):
+    """Genera hoja de respuestas VERTICAL para escaneo OMR"""
+    img = Image.new('RGB', (HOJA_W, HOJA_H), 'white')
+    draw = ImageDraw.Draw(img)
+    try:
+        ft = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 70)
+        fs = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 45)
+        fn = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 42)
+        fl = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 32)
+        fb = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 30)
+        fi = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 22)
+    except Exception:
+        ft = fs = fn = fl = fb = fi = ImageFont.load_default()
+
+    # ===== 4 MARCADORES DE ESQUINA =====
+    ms = HOJA_MARKER_SIZE
+    mp = HOJA_MARKER_PAD
+    draw.rectangle([(mp, mp), (mp + ms, mp + ms)], fill="black")
+    draw.rectangle([(HOJA_W - mp - ms, mp), (HOJA_W - mp, mp + ms)], fill="black")
+    draw.rectangle([(mp, HOJA_H - mp - ms), (mp + ms, HOJA_H - mp)], fill="black")
+    draw.rectangle([(HOJA_W - mp - ms, HOJA_H - mp - ms),
+                    (HOJA_W - mp, HOJA_H - mp)], fill="black")
+    draw.rectangle([(mp, mp + ms + 10), (mp + ms, mp + ms + 30)], fill="black")
+
+    # ===== ENCABEZADO =====
+    draw.text((HOJA_W // 2, 200), "I.E.P. ALTERNATIVO YACHAY",
+              font=ft, fill="black", anchor="mm")
+    draw.text((HOJA_W // 2, 290), f"HOJA DE RESPUESTAS — {titulo.upper()}",
+              font=fs, fill="black", anchor="mm")
+
+    # ===== DATOS DEL ALUMNO =====
+    draw.text((220, 400), "Nombre: _____________________________________________",
+              font=fs, fill="black")
+    draw.text((220, 480), "DNI: __________________  Grado: __________________",
+              font=fs, fill="black")
+    draw.text((220, 560), f"Fecha: __________________  Total: {np_} preguntas",
+              font=fs, fill="black")
+
+    # ===== INSTRUCCIONES =====
+    draw.text((220, 660), "RELLENE COMPLETAMENTE el círculo de su respuesta",
+              font=fb, fill="red")
+    ex_y = 720
+    draw.text((220, ex_y), "Correcto:", font=fl, fill="gray")
+    draw.ellipse([(430, ex_y - 5), (490, ex_y + 55)], fill="black")
+    draw.text((530, ex_y), "Incorrecto:", font=fl, fill="gray")
+    draw.ellipse([(770, ex_y - 5), (830, ex_y + 55)], outline="black", width=3)
+    draw.text((870, ex_y), "Use lápiz 2B o bolígrafo negro", font=fl, fill="gray")
+
+    # Línea separadora
+    draw.line([(100, 820), (HOJA_W - 100, 820)], fill="black", width=4)
+
+    # ===== BURBUJAS =====
+    for i in range(np_):
+        col = i // HOJA_PPC
+        fila = i % HOJA_PPC
+
+        # Número de pregunta
+        num_x = HOJA_X_START + col * HOJA_COL_SP - 120
+        num_y = HOJA_Y_START + fila * HOJA_SP_Y
+        draw.text((num_x, num_y), f"{i + 1}.",
+                  font=fn, fill="black", anchor="rm")
+
+        # 4 opciones: A, B, C, D
+        for j, letra in enumerate(['A', 'B', 'C', 'D']):
+            cx, cy = _posicion_burbuja(i, j)
+            r = HOJA_BUBBLE_R
+            # Círculo bien definido con borde grueso
+            draw.ellipse([(cx - r, cy - r), (cx + r, cy + r)],
+                         outline="black", width=5)
+            # Letra pequeña dentro
+            draw.text((cx, cy), letra, font=fl, fill=(100, 100, 100), anchor="mm")
+
+    # ===== PIE DE PÁGINA =====
+    draw.line([(100, HOJA_H - 250), (HOJA_W - 100, HOJA_H - 250)],
+              fill="black", width=2)
+
+    frases_seguridad = [
+        "DOCUMENTO OFICIAL — CUALQUIER ALTERACIÓN INVALIDA ESTE EXAMEN",
+        "I.E.P. ALTERNATIVO YACHAY — LECTURA ÓPTICA AUTOMATIZADA",
+        "Use SOLO lápiz 2B o bolígrafo negro — Rellene completamente cada círculo",
+    ]
+    y_pie = HOJA_H - 230
+    for frase in frases_seguridad:
+        draw.text((HOJA_W // 2, y_pie), frase,
+                  font=fb, fill="gray", anchor="mm")
+        y_pie += 30
+
+    codigo_seg = hashlib.md5(f"{titulo}{datetime.now().isoformat()}".encode()).hexdigest()[:12].upper()
+    draw.text((HOJA_W // 2, HOJA_H - 60),
+              f"Código: {codigo_seg} | YACHAY PRO {datetime.now().year}",
+              font=fb, fill="black", anchor="mm")
+
+    # Marca de agua diagonal
+    try:
+        marca_font = ImageFont.truetype(
+            "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 60)
+    except Exception:
+        marca_font = fb
+    marca_img = Image.new('RGBA', img.size, (255, 255, 255, 0))
+    marca_draw = ImageDraw.Draw(marca_img)
+    for yy in range(200, HOJA_H - 200, 400):
+        for xx in range(-200, HOJA_W, 600):
+            marca_draw.text((xx, yy), "YACHAY PRO",
+                           font=marca_font, fill=(200, 200, 200, 35))
+    img = Image.alpha_composite(img.convert('RGBA'), marca_img).convert('RGB')
+
+    out = io.BytesIO()
+    img.save(out, format='PNG', quality=95)
+    out.seek(0)
+    return out
+
+
+# ================================================================
+# ESCÁNER OMR — DETECCIÓN POR POSICIÓN
+# ================================================================
+
+_OMR_LADO_GRUESO = 800    # Lado mayor del nivel reducido de la pirámide
+_OMR_ESTRATEGIAS = ['gris', 'sin_perspectiva', 'clahe', 'umbral']
+# Lo que funcionó en la última hoja leída (en este proceso): se prueba
+# primero en la siguiente. Las fotos de un mismo salón suelen tener la
+# misma luz, así que casi siempre acierta al primer intento.
+_omr_preferido = {'estrategia': None, 'metodo': None}
+
+
+def _primero(opciones, preferido):
+    """Misma lista con `preferido` al inicio (si está en ella)."""
+    if preferido not in opciones:
+        return list(opciones)
+    return [preferido] + [o for o in opciones if o != preferido]
+
+
+def _umbral_marcadores(gray, metodo, cache=None):
+    """Imagen binaria para el método de umbral `metodo` (0, 1 o 2).
+    Con `cache` (dict propio de esa imagen) cada blur/umbral se calcula
+    una sola vez aunque la imagen se vuelva a buscar en otro intento."""
+    if cache is not None and metodo in cache:
+        return cache[metodo]
+    if metodo == 0:
+        blur = cv2.GaussianBlur(gray, (5, 5), 0)
+        _, thresh = cv2.threshold(blur, 0, 255,
+                                   cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    elif metodo == 1:
+        blur = cv2.GaussianBlur(gray, (7, 7), 0)
+        thresh = cv2.adaptiveThreshold(blur, 255,
+                                        cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                        cv2.THRESH_BINARY_INV, 21, 5)
+    else:
+        blur = cv2.medianBlur(gray, 5)
+        _, thresh = cv2.threshold(blur, 80, 255, cv2.THRESH_BINARY_INV)
+    if cache is not None:
+        cache[metodo] = thresh
+    return thresh
+
+
+def _encontrar_marcadores(gray, cache=None):
+    """
+    Encuentra los 4 marcadores de esquina (cuadrados negros grandes).
+    Retorna las coordenadas ordenadas: [TL, TR, BL, BR] o None.
+    """
+    alto, ancho = gray.shape[:2]
+    resultados = []
+
+    # Probar múltiples umbrales para robustez (el último que funcionó, primero)
+    for metodo in _primero(range(3), _omr_preferido['metodo']):
+        thresh = _umbral_marcadores(gray, metodo, cache)
+
+        # Probar ambos modos de contorno para mayor robustez
+        for retr_mode in [cv2.RETR_EXTERNAL, cv2.RETR_LIST]:
+            contours, _ = cv2.findContours(thresh, retr_mode,
+                                            cv2.CHAIN_APPROX_SIMPLE)
+
+            # Buscar contornos grandes y cuadrados (los marcadores)
+            candidatos = []
+            min_size = min(ancho, alto) * 0.02  # Al menos 2% del tamaño
+            max_size = min(ancho, alto) * 0.12  # Máximo 12%
+
+            for ct in contours:
+                x, y, w, h = cv2.boundingRect(ct)
+                if w < min_size or h < min_size:
+                    continue
+                if w > max_size or h > max_size:
+                    continue
+
+                aspect = w / float(h) if h > 0 else 0
+                if not (0.6 <= aspect <= 1.6):
+                    continue
+
+                area = cv2.contourArea(ct)
+                rect_area = w * h
+                solidez = area / rect_area if rect_area > 0 else 0
+                if solidez < 0.6:
+                    continue
+
+                # Centro del contorno
+                cx = x + w // 2
+                cy = y + h // 2
+                candidatos.append((cx, cy, w * h, x, y, w, h))
+
+            if len(candidatos) < 4:
+                continue
+
+            # Ordenar por tamaño y tomar los más grandes
+            candidatos = sorted(candidatos, key=lambda c: c[2], reverse=True)
+
+            if len(candidatos) >= 4:
+                top = candidatos[:min(12, len(candidatos))]
+                mejor = _seleccionar_esquinas(top, ancho, alto)
+                if mejor is not None:
+                    resultados.append(mejor)
+                    break  # Encontrado, no seguir probando modos
+
+        if resultados:
+            _omr_preferido['metodo'] = metodo
+            break
+
+    if not resultados:
+        return None
+
+    # Retornar el primer resultado exitoso
+    return resultados[0]
+
+
+def _seleccionar_esquinas(candidatos, ancho, alto):
+    """
+    De una lista de candidatos, selecciona 4 que forman las esquinas
+    de la hoja. Retorna [TL, TR, BL, BR] como arrays de coordenadas.
+    """
+    puntos = [(c[0], c[1]) for c in candidatos]
+
+    # Clasificar por cuadrante
+    cx_medio = ancho / 2
+    cy_medio = alto / 2
+
+    tl_cands = [(x, y) for x, y in puntos if x < cx_medio and y < cy_medio]
+    tr_cands = [(x, y) for x, y in puntos if x > cx_medio and y < cy_medio]
+    bl_cands = [(x, y) for x, y in puntos if x < cx_medio and y > cy_medio]
+    br_cands = [(x, y) for x, y in puntos if x > cx_medio and y > cy_medio]
+
+    if not (tl_cands and tr_cands and bl_cands and br_cands):
+        return None
+
+    # Tomar el más cercano a cada esquina
+    tl = min(tl_cands, key=lambda p: p[0]**2 + p[1]**2)
+    tr = min(tr_cands, key=lambda p: (ancho - p[0])**2 + p[1]**2)
+    bl = min(bl_cands, key=lambda p: p[0]**2 + (alto - p[1])**2)
+    br = min(br_cands, key=lambda p: (ancho - p[0])**2 + (alto - p[1])**2)
+
+    return [list(tl), list(tr), list(bl), list(br)]
+
+
+def _reducir_omr(gray):
+    """Nivel reducido de la pirámide (lado mayor ~800px) y su escala."""
+    alto, ancho = gray.shape[:2]
+    lado = max(alto, ancho)
+    if lado <= _OMR_LADO_GRUESO:
+        return gray, 1.0
+    escala = _OMR_LADO_GRUESO / lado
+    pequena = cv2.resize(gray, (int(ancho * escala), int(alto * escala)),
+                         interpolation=cv2.INTER_AREA)
+    return pequena, escala
+
+
+def _refinar_esquinas(gray, esquinas, escala):
+    """
+    Lleva las esquinas halladas en la imagen reducida a resolución completa
+    y ajusta cada una al centro del marcador real, buscándolo solo en una
+    ventana local alrededor de la posición estimada.
+    """
+    if escala >= 1.0:
+        return esquinas
+    alto, ancho = gray.shape[:2]
+    r = max(24, int(min(alto, ancho) * 0.06))
+    min_lado = min(alto, ancho) * 0.01
+    finas = []
+    for x, y in esquinas:
+        fx, fy = int(round(x / escala)), int(round(y / escala))
+        x0, y0 = max(0, fx - r), max(0, fy - r)
+        roi = gray[y0:min(alto, fy + r), x0:min(ancho, fx + r)]
+        punto = [fx, fy]
+        if roi.size:
+            blur = cv2.GaussianBlur(roi, (5, 5), 0)
+            _, th = cv2.threshold(blur, 0, 255,
+                                  cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+            contours, _ = cv2.findContours(th, cv2.RETR_EXTERNAL,
+                                           cv2.CHAIN_APPROX_SIMPLE)
+            mejor_d = None
+            for ct in contours:
+                bx, by, bw, bh = cv2.boundingRect(ct)
+                if bw < min_lado or bh < min_lado:
+                    continue
+                if not (0.6 <= bw / float(bh) <= 1.6):
+                    continue
+                if cv2.contourArea(ct) / float(bw * bh) < 0.6:
+                    continue
+                cx, cy = x0 + bx + bw // 2, y0 + by + bh // 2
+                d = (cx - fx) ** 2 + (cy - fy) ** 2
+                if mejor_d is None or d < mejor_d:
+                    mejor_d, punto = d, [cx, cy]
+        finas.append(punto)
+    return finas
+
+
+def _corregir_perspectiva(gray, esquinas):
+    """
+    Aplica transformación de perspectiva para alinear la hoja.
+    esquinas = [TL, TR, BL, BR]
+    Retorna imagen corregida de tamaño HOJA_W x HOJA_H
+    """
+    tl, tr, bl, br = esquinas
+
+    # Puntos origen (de la foto)
+    src = np.array([tl, tr, bl, br], dtype="float32")
+
+    # Puntos destino (hoja perfecta) — ajustados a los centros de marcadores
+    mp = HOJA_MARKER_PAD + HOJA_MARKER_SIZE // 2
+    dst = np.array([
+        [mp, mp],
+        [HOJA_W - mp, mp],
+        [mp, HOJA_H - mp],
+        [HOJA_W - mp, HOJA_H - mp]
+    ], dtype="float32")
+
+    # Calcular y aplicar transformación
+    M = cv2.getPerspectiveTransform(src, dst)
+    warped = cv2.warpPerspective(gray, M, (HOJA_W, HOJA_H))
+    return warped
+
+
+_RADIO_MUESTRA = int(HOJA_BUBBLE_R * 0.60)
+_BANCO_BURBUJAS = {}   # num_preguntas → (ys, xs, lineal, validas, total)
+_BANCO_PARCHES = {}    # num_preguntas → (indice, disco, columnas)
+# Margen del parche alrededor del disco de muestra: 2 px del desenfoque
+# 5x5 + 1 px de la erosión 2x2, así el disco binarizado dentro del parche
+# es idéntico al de la hoja completa
+_MARGEN_PARCHE = _RADIO_MUESTRA + 3
+_PASO_OTSU = 32        # grilla de puntos para estimar el umbral OTSU
+_INDICE_OTSU = None
+
+
+def _indice_grilla(cy, cx, margen):
+    """Índice plano (en una hoja HOJA_W de ancho) de una imagen hecha de
+    parches cuadrados de lado 2*margen+1 centrados en (cy, cx), puestos
+    en una grilla casi cuadrada (los filtros de OpenCV van mucho más
+    rápido sobre una imagen ancha que sobre una tira de parches)."""
+    lado = 2 * margen + 1
+    n = len(cy)
+    columnas = int(np.ceil(np.sqrt(n)))
+    filas = -(-n // columnas)
+    relleno = filas * columnas - n
+    cy = np.concatenate([cy, np.full(relleno, cy[0])])
+    cx = np.concatenate([cx, np.full(relleno, cx[0])])
+    d = np.arange(-margen, margen + 1)
+    py = np.clip(cy[:, None, None] + d[None, :, None], 0, HOJA_H - 1)
+    px = np.clip(cx[:, None, None] + d[None, None, :], 0, HOJA_W - 1)
+    indice = (py.astype(np.intp) * HOJA_W + px).reshape(filas, columnas, lado, lado)
+    return indice.transpose(0, 2, 1, 3).reshape(filas * lado, columnas * lado), columnas
+
+
+def _banco_burbujas(num_preguntas):
+    """
+    Banco de muestreo precalculado para la plantilla fija HOJA_W x HOJA_H.
+    Para cada burbuja (pregunta x opción) guarda las coordenadas de TODOS
+    los píxeles de su disco de muestra, de modo que la lectura de una hoja
+    completa es un solo gather de NumPy en vez de 4 x N máscaras OpenCV.
+    Retorna (ys, xs, lineal, validas, total):
+      ys, xs   → int32 (num_preguntas*4, K) coordenadas a muestrear
+      lineal   → las mismas como índice plano de una hoja HOJA_W de ancho
+      validas  → bool (num_preguntas*4,) burbujas dentro de la hoja
+      total    → píxeles del disco (K)
+    """
+    banco = _BANCO_BURBUJAS.get(num_preguntas)
+    if banco is not None:
+        return banco
+
+    r = _RADIO_MUESTRA
+    # El disco se dibuja con cv2.circle, igual que la máscara original,
+    # para que la rasterización (y por lo tanto el ratio) sea idéntica.
+    disco = np.zeros((2 * r + 1, 2 * r + 1), dtype="uint8")
+    cv2.circle(disco, (r, r), r, 255, -1)
+    dy, dx = np.nonzero(disco)
+    dy = dy.astype(np.int32) - r
+    dx = dx.astype(np.int32) - r
+
+    centros = np.array([_posicion_burbuja(i, j)
+                        for i in range(num_preguntas) for j in range(4)],
+                       dtype=np.int32).reshape(-1, 2)
+    cx, cy = centros[:, 0], centros[:, 1]
+    validas = ((cy - r >= 0) & (cy + r < HOJA_H) &
+               (cx - r >= 0) & (cx + r < HOJA_W))
+    # Las burbujas fuera de la hoja muestrean el píxel (0, 0); su ratio
+    # se fuerza a 0 al leer.
+    ys = np.where(validas[:, None], cy[:, None] + dy[None, :], 0)
+    xs = np.where(validas[:, None], cx[:, None] + dx[None, :], 0)
+
+    lineal = ys.astype(np.intp) * HOJA_W + xs
+    banco = (ys, xs, lineal, validas, len(dy))
+    _BANCO_BURBUJAS[num_preguntas] = banco
+    return banco
+
+
+def _banco_parches(num_preguntas):
+    """Índice de los parches (uno por burbuja) que se binarizan en vez de
+    la hoja entera, y el disco de muestra dentro de cada parche."""
+    banco = _BANCO_PARCHES.get(num_preguntas)
+    if banco is not None:
+        return banco
+    centros = np.array([_posicion_burbuja(i, j)
+                        for i in range(num_preguntas) for j in range(4)],
+                       dtype=np.int32).reshape(-1, 2)
+    indice, columnas = _indice_grilla(centros[:, 1], centros[:, 0], _MARGEN_PARCHE)
+    lado = 2 * _MARGEN_PARCHE + 1
+    disco = np.zeros((lado, lado), dtype="uint8")
+    cv2.circle(disco, (_MARGEN_PARCHE, _MARGEN_PARCHE), _RADIO_MUESTRA, 1, -1)
+    banco = _BANCO_PARCHES[num_preguntas] = (indice, disco, columnas)
+    return banco
+
+
+def _umbral_otsu_hoja(plano):
+    """Umbral OTSU de la hoja desenfocada, estimado sobre una grilla de
+    puntos cada _PASO_OTSU px: cada punto se desenfoca con su propia
+    vecindad 5x5 (mismo valor que en la hoja completa), sin desenfocar ni
+    recorrer los 8.7 Mpx de la hoja."""
+    global _INDICE_OTSU
+    if _INDICE_OTSU is None:
+        gy, gx = np.mgrid[_PASO_OTSU // 2:HOJA_H:_PASO_OTSU,
+                          _PASO_OTSU // 2:HOJA_W:_PASO_OTSU]
+        _INDICE_OTSU = _indice_grilla(gy.ravel(), gx.ravel(), 2)[0]
+    puntos = cv2.GaussianBlur(plano.take(_INDICE_OTSU), (5, 5), 0)[2::5, 2::5]
+    umbral, _ = cv2.threshold(np.ascontiguousarray(puntos), 0, 255,
+                              cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    return umbral
+
+
+def _llenos_por_parches(warped_gray, num_preguntas):
+    """Píxeles marcados de cada disco de muestra binarizando SOLO los
+    parches de las burbujas (~6% de la hoja) con el umbral OTSU de la
+    hoja: mismo desenfoque, umbral y erosión que _binarizar_hoja."""
+    indice, disco, columnas = _banco_parches(num_preguntas)
+    parches = cv2.GaussianBlur(warped_gray.ravel().take(indice), (5, 5), 0)
+    umbral = _umbral_otsu_hoja(warped_gray.ravel())
+    _, thresh = cv2.threshold(parches, umbral, 255, cv2.THRESH_BINARY_INV)
+    thresh = cv2.erode(thresh, np.ones((2, 2), np.uint8), iterations=1)
+    lado = disco.shape[0]
+    thresh = thresh.reshape(-1, lado, columnas, lado).transpose(0, 2, 1, 3)
+    thresh = thresh.reshape(-1, lado, lado)[:num_preguntas * 4]
+    return np.einsum('nij,ij->n', thresh, disco, dtype=np.uint32) // 255
+
+
+def _binarizar_hoja(warped_gray):
+    """GaussianBlur + OTSU (invertido) + erosión para eliminar ruido,
+    trazos débiles y sombras. Las burbujas marcadas quedan en 255."""
+    blur = cv2.GaussianBlur(warped_gray, (5, 5), 0)
+    _, thresh = cv2.threshold(blur, 0, 255,
+                               cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    kernel = np.ones((2, 2), np.uint8)
+    return cv2.erode(thresh, kernel, iterations=1)
+
+
+def _leer_burbujas(warped_gray, num_preguntas):
+    """
+    Lee las respuestas de la imagen ya corregida/alineada.
+    MEJORADO: Lógica estricta anti-falsos positivos.
+    - Pre-procesamiento con GaussianBlur + OTSU
+    - Erosión para eliminar ruido/sombras
+    - Umbral de relleno mínimo 45%
+    - Comparación relativa: la más marcada debe ser >1.4x la segunda
+    - Si no cumple condiciones → '?' (indeterminado)
+    """
+    if num_preguntas <= 0:
+        return []
+    if warped_gray.shape == (HOJA_H, HOJA_W) and warped_gray.flags.c_contiguous:
+        # Solo se binarizan los parches de las burbujas, no la hoja entera
+        return _decidir_llenos(_llenos_por_parches(warped_gray, num_preguntas),
+                               num_preguntas)
+    return _decidir_burbujas(_binarizar_hoja(warped_gray), num_preguntas)
+
+
+def _decidir_burbujas(thresh, num_preguntas):
+    """Respuestas A/B/C/D/?/- a partir de la hoja ya binarizada. Todas
+    las burbujas se evalúan de una vez con el banco de muestreo
+    precalculado (_banco_burbujas)."""
+    ys, xs, lineal, validas, total = _banco_burbujas(num_preguntas)
+    if thresh.shape == (HOJA_H, HOJA_W) and thresh.flags.c_contiguous:
+        muestras = thresh.ravel().take(lineal)
+    else:
+        muestras = thresh[ys, xs]
+    # La hoja binarizada solo tiene 0 y 255: sumar es contar, y más rápido
+    return _decidir_llenos(muestras.sum(axis=1, dtype=np.uint32) // 255,
+                           num_preguntas)
+
+
+def _decidir_llenos(llenos, num_preguntas):
+    """Respuestas A/B/C/D/?/- a partir de los píxeles marcados de cada
+    disco de muestra (num_preguntas*4, en orden pregunta x opción)."""
+    UMBRAL_RELLENO_MINIMO = 0.45   # Mínimo 45% del círculo relleno
+    RATIO_DIFERENCIA = 1.4          # La más marcada debe ser 1.4x la segunda
+
+    _, _, _, validas, total = _banco_burbujas(num_preguntas)
+    intensidades = np.where(validas, llenos / total, 0.0).reshape(-1, 4)
+
+    max_idx = np.argmax(intensidades, axis=1)   # A, B, C, D
+    ordenadas = np.sort(intensidades, axis=1)
+    max_val = ordenadas[:, -1]
+    segunda = ordenadas[:, -2]
+    cociente = np.divide(max_val, segunda,
+                         out=np.full_like(max_val, np.inf),
+                         where=segunda > 0)
+
+    letras = np.array(['A', 'B', 'C', 'D'])[max_idx]
+    # Condición 2: diferencia significativa con la segunda opción,
+    # si no → ambiguo ('?', corregir manualmente)
+    letras = np.where(cociente < RATIO_DIFERENCIA, '?', letras)
+    # Condición 1: relleno mínimo, si no → en blanco ('-', 0 puntos)
+    letras = np.where(max_val < UMBRAL_RELLENO_MINIMO, '-', letras)
+    return letras.tolist()
+
+
+def _leer_sin_perspectiva(gray, num_preguntas):
+    """
+    Método alternativo cuando no se detectan marcadores.
+    Intenta detectar la región de burbujas directamente.
+    Busca patrones de filas de 4 elementos oscuros.
+    """
+    alto, ancho = gray.shape[:2]
+
+    # Redimensionar a tamaño estándar para posiciones conocidas
+    resized = cv2.resize(gray, (HOJA_W, HOJA_H), interpolation=cv2.INTER_LINEAR)
+
+    # Intentar leer directamente asumiendo que la imagen ya está alineada
+    respuestas = _leer_burbujas(resized, num_preguntas)
+
+    # Verificar calidad: si más del 70% son '?', falló
+    preguntas_detectadas = sum(1 for r in respuestas if r != '?')
+    if preguntas_detectadas < num_preguntas * 0.3:
+        return None
+
+    return respuestas
+
+
+def procesar_examen(image_bytes, num_preguntas):
+    """
+    ESCÁNER OMR PROFESIONAL - Basado en posición.
+    
+    Método principal:
+    1. Detecta 4 marcadores de esquina
+    2. Corrige perspectiva (la foto se vuelve una hoja plana)
+    3. Lee cada burbuja en su posición exacta
+    
+    Método alternativo (sin marcadores):
+    - Redimensiona la imagen al tamaño de la hoja
+    - Intenta leer las posiciones directamente
+    
+    Retorna lista de respuestas ['A','B','C','D','?'] o None si falla
+    """
+    if not HAS_CV2:
+        return None
+
+    try:
+        # Decodificar imagen
+        nparr = np.frombuffer(image_bytes, np.uint8)
+        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        if img is None:
+            return None
+
+        # Escalar si es muy grande (>4000px)
+        h_orig, w_orig = img.shape[:2]
+        escala = 1.0
+        if max(h_orig, w_orig) > 4000:
+            escala = 4000 / max(h_orig, w_orig)
+            img = cv2.resize(img, (int(w_orig * escala), int(h_orig * escala)),
+                             interpolation=cv2.INTER_AREA)
+
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+        # Pirámide: los marcadores se buscan en ~800px y se refinan en la
+        # imagen completa. Cada imagen tiene su caché de blur/umbral.
+        pequena, escala_p = _reducir_omr(gray)
+        cache_peq, cache_full = {}, {}
+        clahe_imgs = {}
+
+        def _clahe():
+            if not clahe_imgs:
+                clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
+                enh = clahe.apply(gray)
+                clahe_imgs['full'] = enh
+                clahe_imgs['peq'] = _reducir_omr(enh)[0]
+            return clahe_imgs
+
+        def _leer_con_marcadores(busq_peq, busq_full, img_warp,
+                                 cache_p=None, cache_f=None):
+            esquinas = _encontrar_marcadores(busq_peq, cache_p)
+            if esquinas is not None:
+                esquinas = _refinar_esquinas(img_warp, esquinas, escala_p)
+            elif escala_p < 1.0:
+                # La reducción pudo borrar marcadores pequeños: buscar en
+                # resolución completa (comportamiento anterior)
+                esquinas = _encontrar_marcadores(busq_full(), cache_f)
+            if esquinas is None:
+                return None
+            warped = _corregir_perspectiva(img_warp, esquinas)
+            respuestas = _leer_burbujas(warped, num_preguntas)
+            detectadas = sum(1 for r in respuestas if r != '?')
+            if detectadas >= num_preguntas * 0.3:
+                return respuestas
+            return None
+
+        def _estrategia(nombre):
+            # === MÉTODO 1: Con marcadores (el más preciso) ===
+            if nombre == 'gris':
+                return _leer_con_marcadores(pequena, lambda: gray, gray,
+                                            cache_peq, cache_full)
+            # === MÉTODO 2: Redimensionar directo (sin marcadores) ===
+            if nombre == 'sin_perspectiva':
+                return _leer_sin_perspectiva(gray, num_preguntas)
+            # === MÉTODO 3: Mejorar contraste y reintentar ===
+            if nombre == 'clahe':
+                enh = _clahe()
+                return _leer_con_marcadores(enh['peq'], lambda: enh['full'],
+                                            enh['full'], {}, {})
+            # === MÉTODO 4: Umbral manual y reintentar ===
+            for umbral in [100, 120, 140, 160]:
+                _, peq_th = cv2.threshold(pequena, umbral, 255, cv2.THRESH_BINARY)
+                respuestas = _leer_con_marcadores(
+                    peq_th,
+                    lambda u=umbral: cv2.threshold(gray, u, 255,
+                                                   cv2.THRESH_BINARY)[1],
+                    gray)
+                if respuestas:
+                    return respuestas
+            return None
+
+        for nombre in _primero(_OMR_ESTRATEGIAS, _omr_preferido['estrategia']):
+            respuestas = _estrategia(nombre)
+            if respuestas:
+                # La lectura sin marcadores casi nunca "falla": recordarla
+                # haría saltar la detección de marcadores en las siguientes
+                if nombre != 'sin_perspectiva':
+                    _omr_preferido['estrategia'] = nombre
+                return respuestas
+
+        return None
+
+    except Exception:
+        return None
+
+
+# ================================================================
+# CALIFICACIÓN POR LOTE (ZIP / varias fotos)
+# ================================================================
+
+_EXT_IMAGEN_OMR = ('.jpg', '.jpeg', '.png')
+
+
+def _extraer_hojas_lote(archivos):
+    """[(nombre, bytes)] de las imágenes subidas; los ZIP se expanden."""
+    hojas = []
+    for f in archivos:
+        nombre = f.name
+        datos = f.getvalue()
+        if nombre.lower().endswith('.zip'):
+            try:
+                with zipfile.ZipFile(io.BytesIO(datos)) as zf:
+                    for info in zf.infolist():
+                        n = info.filename
+                        if (info.is_dir() or '__MACOSX' in n
+                                or Path(n).name.startswith('.')
+                                or not n.lower().endswith(_EXT_IMAGEN_OMR)):
+                            continue
+                        hojas.append((n, zf.read(info)))
+            except Exception:
+                continue
+        elif nombre.lower().endswith(_EXT_IMAGEN_OMR):
+            hojas.append((nombre, datos))
+    return hojas
+
+
+def _dni_de_nombre_archivo(nombre):
+    """'fotos/70123456_juan.jpg' → '70123456' (primer número de 8 dígitos)."""
+    m = re.search(r'(?<!\d)(\d{8})(?!\d)', Path(nombre).stem)
+    return m.group(1) if m else ''
+
+
+def _omr_lote_trabajo(args):
+    """Trabajo de UNA hoja en el pool: lectura OMR + identificación."""
+    nombre, image_bytes, num_preguntas = args
+    respuestas = procesar_examen(image_bytes, num_preguntas)
+    # DNI: QR del carnet/sticker en la foto; si no, el nombre del archivo
+    dni, origen = '', ''
+    try:
+        qr = decodificar_qr_imagen(image_bytes)
+    except Exception:
+        qr = None
+    if qr:
+        m = re.search(r'\d{8}', str(qr))
+        if m:
+            dni, origen = m.group(0), 'QR'
+    if not dni:
+        dni = _dni_de_nombre_archivo(nombre)
+        origen = 'archivo' if dni else ''
+    return {'archivo': nombre, 'respuestas': respuestas,
+            'dni': dni, 'origen_dni': origen}
+
+
+def _contexto_lote():
+    # forkserver/spawn: los procesos hijos no heredan los hilos ni los
+    # locks (gspread, logging, la bandeja SQLite) del servidor Streamlit
+    import multiprocessing
+    try:
+        return multiprocessing.get_context('forkserver')
+    except ValueError:
+        return multiprocessing.get_context('spawn')
+
+
+def procesar_lote_omr(hojas, num_preguntas, progreso=None):
+    """
+    Ejecuta procesar_examen sobre todas las hojas usando todos los núcleos
+    (la búsqueda de marcadores es Python puro y no libera el GIL).
+    Usa procesos forkserver/spawn; si no están disponibles, hilos.
+    progreso(hechas, total) se llama a medida que terminan.
+    Retorna la lista de resultados en el mismo orden de `hojas`.
+    """
+    from concurrent.futures import (ProcessPoolExecutor, ThreadPoolExecutor,
+                                    as_completed)
+    tareas = [(n, b, num_preguntas) for n, b in hojas]
+    total = len(tareas)
+    resultados = [None] * total
+    workers = max(1, min(os.cpu_count() or 1, total))
+
+    def _ejecutar(executor):
+        futuros = {executor.submit(_omr_lote_trabajo, t): i
+                   for i, t in enumerate(tareas)}
+        hechas = 0
+        for fut in as_completed(futuros):
+            resultados[futuros[fut]] = fut.result()
+            hechas += 1
+            if progreso:
+                progreso(hechas, total)
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=_contexto_lote()) as ex:
+            _ejecutar(ex)
+    except Exception:
+        pendientes = [i for i, r in enumerate(resultados) if r is None]
+        if pendientes:
+            with ThreadPoolExecutor(max_workers=workers) as ex:
+                futuros = {ex.submit(_omr_lote_trabajo, tareas[i]): i
+                           for i in pendientes}
+                hechas = total - len(pendientes)
+                for fut in as_completed(futuros):
+                    resultados[futuros[fut]] = fut.result()
+                    hechas += 1
+                    if progreso:
+                        progreso(hechas, total)
+    return resultados
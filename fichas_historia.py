@@ -28,6 +28,8 @@ from datetime import datetime
 
 import streamlit as st
 
+import cache_recursos
+
 ENCABEZADO_L1 = "I.E.P. YACHAY  ·  ACADEMIA YACHAY"
 ENCABEZADO_L2 = "PIONEROS EN LA EDUCACIÓN DE CALIDAD"
 def pie_legal(area, profesor="Prof. Alexander Córdova"):
@@ -260,7 +262,8 @@ def _banda_titulo(story, tema, subtitulo, est, ancho, con_claves=False, area="")
               Paragraph(_lema_espaciado, est["lema"])]
     if os.path.exists(LOGO_PATH):
         try:
-            _logo = RLImage(LOGO_PATH, width=1.55 * cm, height=1.55 * cm)
+            _logo = RLImage(io.BytesIO(cache_recursos.bytes_archivo(LOGO_PATH)),
+                            width=1.55 * cm, height=1.55 * cm)
             _cab = Table([[_logo, _marca]], colWidths=[1.75 * cm, ancho - 1.75 * cm])
             _cab.setStyle(TableStyle([
                 ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
@@ -301,25 +304,12 @@ def _banda_titulo(story, tema, subtitulo, est, ancho, con_claves=False, area="")
     story.append(Spacer(1, 6))
 
 
-_LOGO_MARCA_AGUA_CACHE = None
-
-
 def _logo_marca_agua_reader():
-    """Carga el logo de marca de agua UNA sola vez y lo reutiliza en
-    todas las paginas del PDF, en vez de incrustarlo de nuevo por cada
-    pagina (eso multiplicaba el peso del PDF por el numero de paginas)."""
-    global _LOGO_MARCA_AGUA_CACHE
-    if _LOGO_MARCA_AGUA_CACHE is None:
-        import os
-        from reportlab.lib.utils import ImageReader
-        if os.path.exists(LOGO_MARCA_AGUA):
-            try:
-                _LOGO_MARCA_AGUA_CACHE = ImageReader(LOGO_MARCA_AGUA)
-            except Exception:
-                _LOGO_MARCA_AGUA_CACHE = False
-        else:
-            _LOGO_MARCA_AGUA_CACHE = False
-    return _LOGO_MARCA_AGUA_CACHE
+    """Logo de marca de agua cargado UNA sola vez (caché de recursos del
+    proceso) y reutilizado en todas las paginas del PDF, en vez de
+    incrustarlo de nuevo por cada pagina (eso multiplicaba el peso del PDF
+    por el numero de paginas). False si no hay logo."""
+    return cache_recursos.image_reader(LOGO_MARCA_AGUA) or False
 
 
 def _pie(canvas, doc):
@@ -8,10 +8,23 @@ from google.oauth2.service_account import Credentials
 import streamlit as st
 import json
 import base64
+import heapq
 import io
+import itertools
+import numbers
+import os
+import random
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
+from pathlib import Path
 import pandas as pd
 
+from almacen_blobs import AlmacenBlobs, BackendDrive
+
 # ================================================================
 # CONFIGURACIÓN DE HOJAS
 # ================================================================
@@ -63,13 +76,1065 @@ COLUMNAS = {
 }
 
 
+# ================================================================
+# PLANIFICADOR DE LLAMADAS A LA API (cuota de Google Sheets)
+# ================================================================
+# La cuota de Sheets (60 lecturas y 60 escrituras por minuto y por
+# usuario) la comparten TODAS las sesiones del proceso, porque todas usan
+# la misma cuenta de servicio. Cada request HTTP de gspread pasa por aquí.
+PRIORIDAD_ASISTENCIA = 0   # escaneos en la puerta: salen primero
+PRIORIDAD_NORMAL = 1
+PRIORIDAD_FONDO = 2        # respaldos y sincronizaciones en segundo plano
+
+_prioridad_local = threading.local()
+
+# Módulos que NO cuentan como "quien llama" en las estadísticas
+_MODULOS_INTERNOS = ('google_sync', 'gspread', 'requests', 'urllib3',
+                     'google.', 'threading', 'contextlib', 'functools',
+                     'sheets_simulado')
+
+
+@contextmanager
+def prioridad_api(nivel):
+    """Las llamadas a la API hechas dentro del bloque (en este hilo) usan
+    la prioridad `nivel`."""
+    previa = getattr(_prioridad_local, 'nivel', None)
+    _prioridad_local.nivel = nivel
+    try:
+        yield
+    finally:
+        _prioridad_local.nivel = previa
+
+
+def _codigo_http(error):
+    respuesta = getattr(error, 'response', None)
+    return getattr(respuesta, 'status_code', None)
+
+
+class _Cubeta:
+    """Token bucket: `capacidad` llamadas seguidas como máximo y
+    `por_segundo` fichas nuevas por segundo."""
+
+    def __init__(self, capacidad, por_segundo):
+        self.capacidad = capacidad
+        self.por_segundo = por_segundo
+        self.fichas = float(capacidad)
+        self.ts = time.monotonic()
+        self.bloqueada_hasta = 0.0
+
+    def espera(self, ahora):
+        """Segundos hasta que haya una ficha (0 si ya hay)."""
+        if ahora < self.bloqueada_hasta:
+            return self.bloqueada_hasta - ahora
+        self.fichas = min(self.capacidad,
+                          self.fichas + (ahora - self.ts) * self.por_segundo)
+        self.ts = ahora
+        if self.fichas >= 1:
+            return 0.0
+        return (1 - self.fichas) / self.por_segundo
+
+    def bloquear(self, segundos):
+        """Tras un 429: nadie sale hasta que pase la pausa."""
+        self.fichas = 0.0
+        self.ts = time.monotonic() + segundos
+        self.bloqueada_hasta = self.ts
+
+
+class _Vuelo:
+    def __init__(self):
+        self.listo = threading.Event()
+        self.resultado = None
+        self.error = None
+
+
+class PlanificadorAPI:
+    """Cola única de requests hacia Google Sheets.
+
+    - Token bucket separado para lecturas (GET) y escrituras.
+    - Cuando no hay fichas, sale primero la llamada de menor prioridad
+      (asistencia antes que pantallas, pantallas antes que hilos de fondo).
+    - Lecturas idénticas simultáneas se hacen una sola vez y todas las
+      sesiones reciben la misma respuesta (single-flight).
+    - Un 429 (cuota agotada) o un 5xx se reintenta con espera exponencial
+      (1, 2, 4, 8, 16 s + azar); un 429 además frena a todos los demás.
+    - Cuenta llamadas por función de origen para saber quién gasta cuota."""
+
+    def __init__(self, lecturas_por_min=60, escrituras_por_min=60,
+                 rafaga=10, reintentos=5):
+        self.reintentos = reintentos
+        self._cond = threading.Condition()
+        self._cubetas = {
+            'lectura': _Cubeta(rafaga, lecturas_por_min / 60.0),
+            'escritura': _Cubeta(rafaga, escrituras_por_min / 60.0),
+        }
+        self._colas = {'lectura': [], 'escritura': []}
+        self._turnos = itertools.count()
+        self._en_vuelo = {}
+        self.por_llamador = {}
+        self.stats = {'lecturas': 0, 'escrituras': 0, 'compartidas': 0,
+                      'reintentos': 0, 'errores_429': 0, 'espera_total_s': 0.0}
+
+    def instalar(self, client):
+        """Hace que todos los requests de un gspread.Client pasen por el
+        planificador."""
+        http = getattr(client, 'http_client', client)
+        original = http.request
+
+        def request(method, endpoint, *args, **kwargs):
+            return self.ejecutar(original, method, endpoint, *args, **kwargs)
+        http.request = request
+
+    # ── Estadísticas ─────────────────────────────────────────────
+    @staticmethod
+    def _llamador():
+        """'modulo.funcion' del primer marco de pila fuera de gspread y de
+        este módulo."""
+        marco = sys._getframe(2)
+        while marco is not None:
+            modulo = marco.f_globals.get('__name__', '')
+            if not modulo.startswith(_MODULOS_INTERNOS):
+                return f"{modulo}.{marco.f_code.co_name}"
+            marco = marco.f_back
+        return 'desconocido'
+
+    def _contar(self, llamador, campo, espera=0.0):
+        with self._cond:
+            fila = self.por_llamador.setdefault(
+                llamador, {'lecturas': 0, 'escrituras': 0, 'compartidas': 0,
+                           'reintentos': 0, 'errores_429': 0, 'espera_s': 0.0})
+            fila[campo] += 1
+            fila['espera_s'] += espera
+            if campo in self.stats:
+                self.stats[campo] += 1
+            self.stats['espera_total_s'] += espera
+
+    def resumen(self):
+        """Estadísticas globales y por llamador (copias)."""
+        with self._cond:
+            return dict(self.stats), {k: dict(v) for k, v in self.por_llamador.items()}
+
+    # ── Turnos ───────────────────────────────────────────────────
+    def _turno(self, tipo, prioridad):
+        """Bloquea hasta que le toca a esta llamada. Devuelve los segundos
+        que esperó."""
+        cola = self._colas[tipo]
+        cubeta = self._cubetas[tipo]
+        entrada = (prioridad, next(self._turnos))
+        t0 = time.monotonic()
+        with self._cond:
+            heapq.heappush(cola, entrada)
+            try:
+                while True:
+                    if cola[0] == entrada:
+                        espera = cubeta.espera(time.monotonic())
+                        if espera <= 0:
+                            cubeta.fichas -= 1
+                            heapq.heappop(cola)
+                            self._cond.notify_all()
+                            return time.monotonic() - t0
+                        self._cond.wait(espera)
+                    else:
+                        self._cond.wait(1.0)
+            except BaseException:
+                if entrada in cola:
+                    cola.remove(entrada)
+                    heapq.heapify(cola)
+                    self._cond.notify_all()
+                raise
+
+    def _con_reintentos(self, original, tipo, llamador, method, endpoint,
+                        args, kwargs):
+        prioridad = getattr(_prioridad_local, 'nivel', None)
+        if prioridad is None:
+            prioridad = PRIORIDAD_NORMAL
+        campo = 'lecturas' if tipo == 'lectura' else 'escrituras'
+        intento = 0
+        while True:
+            self._contar(llamador, campo, self._turno(tipo, prioridad))
+            try:
+                return original(method, endpoint, *args, **kwargs)
+            except Exception as e:
+                codigo = _codigo_http(e)
+                if codigo not in (429, 500, 502, 503) or intento >= self.reintentos:
+                    raise
+                pausa = 2 ** intento + random.uniform(0, 1)
+                intento += 1
+                self._contar(llamador, 'reintentos' if codigo != 429 else 'errores_429')
+                if codigo == 429:
+                    with self._cond:
+                        self._cubetas[tipo].bloquear(pausa)
+                        self._cond.notify_all()
+                else:
+                    time.sleep(pausa)
+
+    def ejecutar(self, original, method, endpoint, *args, **kwargs):
+        tipo = 'lectura' if str(method).upper() == 'GET' else 'escritura'
+        llamador = self._llamador()
+        if tipo == 'escritura':
+            return self._con_reintentos(original, tipo, llamador, method,
+                                        endpoint, args, kwargs)
+        clave = (endpoint, repr(args), repr(sorted(kwargs.items())))
+        with self._cond:
+            vuelo = self._en_vuelo.get(clave)
+            propio = vuelo is None
+            if propio:
+                vuelo = self._en_vuelo[clave] = _Vuelo()
+        if not propio:
+            # Misma lectura ya en camino: esperar su respuesta
+            vuelo.listo.wait()
+            self._contar(llamador, 'compartidas')
+            if vuelo.error is not None:
+                raise vuelo.error
+            return vuelo.resultado
+        try:
+            vuelo.resultado = self._con_reintentos(
+                original, tipo, llamador, method, endpoint, args, kwargs)
+            return vuelo.resultado
+        except Exception as e:
+            vuelo.error = e
+            raise
+        finally:
+            with self._cond:
+                self._en_vuelo.pop(clave, None)
+            vuelo.listo.set()
+
+
+# ================================================================
+# SINCRONIZACIÓN INCREMENTAL DE ASISTENCIAS (por lotes)
+# ================================================================
+ARCHIVO_COLA_ASISTENCIAS = "asistencias_pendientes_gs.jsonl"
+
+# Columnas que se actualizan cuando la fila (fecha, dni) ya existe
+CAMPOS_ASISTENCIA_ACTUALIZABLES = ('hora_entrada', 'hora_salida', 'tardanza',
+                                   'hora_entrada_tarde', 'hora_salida_tarde')
+
+
+def _letra_columna(key, campo):
+    """Letra de columna (A, B, ...) de un campo de COLUMNAS[key]."""
+    return chr(ord('A') + COLUMNAS[key].index(campo))
+
+
+class SincronizadorAsistencias:
+    """Cola de asistencias hacia la hoja 'Asistencias'.
+
+    Cada escaneo solo se encola (memoria + una línea en disco). Un hilo
+    vacía la cola cada `intervalo` segundos con UNA llamada batch_update
+    (filas que ya existen) y UNA append_rows (filas nuevas). El número de
+    fila de cada (fecha, dni) se guarda en memoria, así que nunca se vuelve
+    a leer la hoja completa para buscar el registro del día: solo se leen
+    las columnas fecha/dni una vez al arrancar (y cada `ttl_mapa` segundos
+    por si alguien editó la hoja a mano)."""
+
+    def __init__(self, gs, intervalo=10, archivo_cola=ARCHIVO_COLA_ASISTENCIAS,
+                 ttl_mapa=1800):
+        self.gs = gs
+        self.intervalo = intervalo
+        self.ttl_mapa = ttl_mapa
+        self.archivo_cola = Path(archivo_cola)
+        self._lock = threading.Lock()
+        self._pendientes = {}   # (fecha, dni) → fila (dict por columna)
+        self._filas = {}        # (fecha, dni) → número de fila en la hoja
+        self._mapa_ts = 0
+        self._hilo = None
+        self._despertar = threading.Event()
+        self.stats = {'encolados': 0, 'lotes': 0, 'llamadas_api': 0,
+                      'errores': 0, 'ultimo_error': ''}
+        self._cargar_cola()
+        if self._pendientes:
+            # Escaneos que dejó en disco un proceso anterior (reinicio o
+            # caída): se envían sin esperar al próximo escaneo
+            self._asegurar_hilo()
+
+    # ── Cola persistente ─────────────────────────────────────────
+    def _fusionar(self, datos):
+        """Combina un evento con lo pendiente de su (fecha, dni): los
+        valores no vacíos nuevos pisan a los anteriores."""
+        clave = (str(datos.get('fecha', '')), str(datos.get('dni', '')))
+        previo = self._pendientes.get(clave, {})
+        fila = dict(previo)
+        for c in COLUMNAS['asistencias']:
+            v = datos.get(c, '')
+            if v not in ('', None) or c not in fila:
+                fila[c] = v
+        self._pendientes[clave] = fila
+
+    def _cargar_cola(self):
+        if not self.archivo_cola.exists():
+            return
+        try:
+            with open(self.archivo_cola, 'r', encoding='utf-8') as f:
+                for linea in f:
+                    try:
+                        self._fusionar(json.loads(linea))
+                    except Exception:
+                        continue
+        except Exception:
+            pass
+
+    def _reescribir_cola(self):
+        """Deja en disco solo lo que sigue pendiente (escritura atómica)."""
+        tmp = self.archivo_cola.with_suffix('.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            for fila in self._pendientes.values():
+                f.write(json.dumps(fila, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.archivo_cola)
+
+    def encolar(self, datos):
+        """Encola el estado actual de una asistencia. No hace ninguna
+        llamada a Google: vuelve de inmediato."""
+        with self._lock:
+            self._fusionar(datos)
+            self.stats['encolados'] += 1
+            try:
+                with open(self.archivo_cola, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(datos, ensure_ascii=False) + '\n')
+            except Exception:
+                pass
+        self._asegurar_hilo()
+
+    def pendientes(self):
+        with self._lock:
+            return len(self._pendientes)
+
+    # ── Hilo de vaciado ──────────────────────────────────────────
+    def _asegurar_hilo(self):
+        if self._hilo is not None and self._hilo.is_alive():
+            return
+        self._hilo = threading.Thread(target=self._bucle, daemon=True,
+                                      name='yachay-sync-asistencias')
+        self._hilo.start()
+
+    def _bucle(self):
+        espera = self.intervalo
+        while True:
+            self._despertar.wait(espera)
+            self._despertar.clear()
+            try:
+                with prioridad_api(PRIORIDAD_ASISTENCIA):
+                    self.vaciar()
+                espera = self.intervalo
+            except Exception as e:
+                self.stats['errores'] += 1
+                self.stats['ultimo_error'] = str(e)[:200]
+                # Sin internet o cuota agotada: reintentar cada vez más lento
+                espera = min(espera * 2, 300)
+
+    def vaciar_ahora(self):
+        """Pide al hilo que vacíe la cola sin esperar al intervalo."""
+        self._asegurar_hilo()
+        self._despertar.set()
+
+    def _cargar_mapa_filas(self, ws):
+        valores = ws.get('A:B')
+        self.stats['llamadas_api'] += 1
+        filas = {}
+        for i, fila in enumerate(valores[1:], start=2):
+            if len(fila) >= 2 and fila[0] and fila[1]:
+                filas[(str(fila[0]).strip(), str(fila[1]).strip())] = i
+        self._filas = filas
+        self._mapa_ts = time.time()
+
+    def vaciar(self):
+        """Envía todo lo pendiente en un solo lote. Devuelve cuántas
+        asistencias se sincronizaron."""
+        with self._lock:
+            lote = dict(self._pendientes)
+        if not lote:
+            return 0
+        if not self.gs.conectado and not self.gs.reconectar():
+            return 0
+        ws = self.gs._get_hoja('asistencias')
+        if ws is None:
+            return 0
+        if not self._filas or time.time() - self._mapa_ts > self.ttl_mapa:
+            self._cargar_mapa_filas(ws)
+
+        actualizaciones, nuevas, claves_nuevas = [], [], []
+        for clave, fila in lote.items():
+            nro = self._filas.get(clave)
+            if nro:
+                for campo in CAMPOS_ASISTENCIA_ACTUALIZABLES:
+                    valor = fila.get(campo, '')
+                    if valor:
+                        actualizaciones.append({
+                            'range': f"{_letra_columna('asistencias', campo)}{nro}",
+                            'values': [[valor]],
+                        })
+            else:
+                nuevas.append([fila.get(c, '') for c in COLUMNAS['asistencias']])
+                claves_nuevas.append(clave)
+
+        if actualizaciones:
+            ws.batch_update(actualizaciones)
+            self.stats['llamadas_api'] += 1
+        if nuevas:
+            resp = ws.append_rows(nuevas)
+            self.stats['llamadas_api'] += 1
+            rango = ((resp or {}).get('updates') or {}).get('updatedRange', '')
+            m = re.search(r'![A-Z]+(\d+)', rango)
+            if m:
+                inicio = int(m.group(1))
+                for i, clave in enumerate(claves_nuevas):
+                    self._filas[clave] = inicio + i
+            else:
+                self._mapa_ts = 0  # no se supo dónde quedaron: releer mapa
+
+        with self._lock:
+            for clave, fila in lote.items():
+                # Si llegó otro escaneo mientras se enviaba, queda pendiente
+                if self._pendientes.get(clave) is fila:
+                    del self._pendientes[clave]
+            self._reescribir_cola()
+        self.stats['lotes'] += 1
+        return len(lote)
+
+
+# ================================================================
+# BANDEJA DE SALIDA (escrituras diferidas, persistente)
+# ================================================================
+ARCHIVO_BANDEJA = "gs_bandeja_salida.sqlite3"
+
+# Métodos de GoogleSync que se pueden diferir. Todos devuelven True/False.
+OPERACIONES_DIFERIDAS = ('sync_matricula_completa', 'sync_docentes_completo',
+                         'sync_usuarios_completo', 'guardar_resultados_examen',
+                         'guardar_incidencia', 'guardar_config')
+
+
+def _a_json(valor):
+    """Los DataFrame se guardan como {'__df__': {columnas, filas}}."""
+    if isinstance(valor, pd.DataFrame):
+        return {'__df__': {'columnas': [str(c) for c in valor.columns],
+                           'filas': valor.astype(object)
+                                         .where(valor.notna(), None)
+                                         .values.tolist()}}
+    raise TypeError(f"No serializable: {type(valor).__name__}")
+
+
+def _de_json(valor):
+    if isinstance(valor, dict) and '__df__' in valor:
+        d = valor['__df__']
+        return pd.DataFrame(d['filas'], columns=d['columnas'])
+    return valor
+
+
+class BandejaSalida:
+    """Cola persistente (SQLite) de escrituras hacia Google Sheets.
+
+    La pantalla guarda local, encola la operación y vuelve de inmediato; un
+    hilo la envía en orden, por lotes. Si no hay internet (o la API falla)
+    la operación queda en disco y se reintenta con espera exponencial,
+    también después de reiniciar la app.
+
+    Cada operación tiene una clave de idempotencia:
+      - reemplazar=True ('sync_matricula'): solo importa el último estado;
+        encolar otra vez la misma clave reemplaza a la pendiente y la pasa
+        al final de la cola.
+      - reemplazar=False (un examen, una incidencia): si la clave ya está
+        pendiente o ya se envió, se ignora: nunca se agrega dos veces.
+
+    Una operación que falla `max_intentos` veces deja de frenar a las que
+    vienen detrás: se salta y se sigue reintentando aparte. Si vuelve a
+    fallar mientras otra SÍ se envía (la conexión funciona, el problema es
+    ella), pasa a la tabla 'descartadas' para que el admin la revise. Un
+    corte de internet no descarta nada: ahí fallan todas."""
+
+    def __init__(self, gs, archivo=ARCHIVO_BANDEJA, intervalo=15, lote=20,
+                 espera_max=600, max_intentos=10):
+        self.gs = gs
+        self.archivo = str(archivo)
+        self.intervalo = intervalo
+        self.lote = lote
+        self.espera_max = espera_max
+        self.max_intentos = max_intentos
+        self._lock = threading.Lock()
+        self._hilo = None
+        self._despertar = threading.Event()
+        self.stats = {'encoladas': 0, 'enviadas': 0, 'fallos': 0,
+                      'descartadas': 0, 'ultimo_error': ''}
+        with self._conexion() as cx:
+            cx.execute("""CREATE TABLE IF NOT EXISTS pendientes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                clave TEXT UNIQUE NOT NULL,
+                op TEXT NOT NULL,
+                datos TEXT NOT NULL,
+                creado REAL NOT NULL,
+                intentos INTEGER NOT NULL DEFAULT 0,
+                proximo REAL NOT NULL DEFAULT 0,
+                ultimo_error TEXT NOT NULL DEFAULT '')""")
+            cx.execute("""CREATE TABLE IF NOT EXISTS enviadas (
+                clave TEXT PRIMARY KEY, enviado REAL NOT NULL)""")
+            cx.execute("""CREATE TABLE IF NOT EXISTS descartadas (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                clave TEXT NOT NULL,
+                op TEXT NOT NULL,
+                datos TEXT NOT NULL,
+                creado REAL NOT NULL,
+                intentos INTEGER NOT NULL,
+                descartado REAL NOT NULL,
+                ultimo_error TEXT NOT NULL DEFAULT '')""")
+
+    @contextmanager
+    def _conexion(self):
+        """Conexión corta: confirma al salir del bloque y se cierra."""
+        import sqlite3
+        cx = sqlite3.connect(self.archivo, timeout=30)
+        try:
+            cx.execute("PRAGMA journal_mode=WAL")
+            with cx:
+                yield cx
+        finally:
+            cx.close()
+
+    # ── Encolar ──────────────────────────────────────────────────
+    def encolar(self, op, args=(), kwargs=None, clave=None, reemplazar=False):
+        """Guarda la operación en disco y despierta al hilo. Devuelve la
+        clave, o None si ya estaba (operación idempotente repetida)."""
+        if op not in OPERACIONES_DIFERIDAS:
+            raise ValueError(f"Operación no diferible: {op}")
+        import uuid
+        clave = clave or f"{op}:{uuid.uuid4().hex}"
+        datos = json.dumps({'args': list(args), 'kwargs': kwargs or {}},
+                           ensure_ascii=False, default=_a_json)
+        with self._lock, self._conexion() as cx:
+            if reemplazar:
+                cx.execute("DELETE FROM pendientes WHERE clave = ?", (clave,))
+            elif cx.execute("""SELECT 1 FROM pendientes WHERE clave = ?
+                               UNION SELECT 1 FROM enviadas WHERE clave = ?""",
+                            (clave, clave)).fetchone():
+                return None
+            cx.execute("""INSERT INTO pendientes (clave, op, datos, creado)
+                          VALUES (?, ?, ?, ?)""", (clave, op, datos, time.time()))
+            self.stats['encoladas'] += 1
+        self._asegurar_hilo()
+        self._despertar.set()
+        return clave
+
+    def pendiente(self, prefijo):
+        """True si hay alguna operación pendiente cuya clave empieza con
+        `prefijo` (p. ej. 'sync_matricula')."""
+        with self._conexion() as cx:
+            return cx.execute("SELECT 1 FROM pendientes WHERE clave LIKE ? LIMIT 1",
+                              (prefijo.replace('%', '') + '%',)).fetchone() is not None
+
+    def estado(self):
+        """{'pendientes', 'antiguedad_s', 'ultimo_error', 'descartadas'}
+        para el panel del admin."""
+        with self._conexion() as cx:
+            n, mas_viejo = cx.execute(
+                "SELECT COUNT(*), MIN(creado) FROM pendientes").fetchone()
+            fila = cx.execute("""SELECT ultimo_error FROM pendientes
+                                 WHERE ultimo_error != '' ORDER BY id LIMIT 1""").fetchone()
+            descartadas = cx.execute("SELECT COUNT(*) FROM descartadas").fetchone()[0]
+        return {'pendientes': n,
+                'antiguedad_s': time.time() - mas_viejo if mas_viejo else 0,
+                'ultimo_error': fila[0] if fila else '',
+                'descartadas': descartadas}
+
+    def descartadas(self, limite=50):
+        """Las últimas operaciones descartadas: [{'clave', 'op', 'intentos',
+        'descartado', 'ultimo_error'}]."""
+        with self._conexion() as cx:
+            filas = cx.execute("""SELECT clave, op, intentos, descartado, ultimo_error
+                                  FROM descartadas ORDER BY id DESC LIMIT ?""",
+                               (limite,)).fetchall()
+        return [dict(zip(('clave', 'op', 'intentos', 'descartado', 'ultimo_error'), f))
+                for f in filas]
+
+    def reintentar_descartadas(self):
+        """Devuelve las descartadas a la cola (al final, con los intentos
+        en cero), p. ej. después de corregir la hoja. Devuelve cuántas."""
+        with self._lock, self._conexion() as cx:
+            filas = cx.execute("""SELECT id, clave, op, datos, creado
+                                  FROM descartadas ORDER BY id""").fetchall()
+            for _, clave, op, datos, creado in filas:
+                cx.execute("""INSERT OR IGNORE INTO pendientes (clave, op, datos, creado)
+                              VALUES (?, ?, ?, ?)""", (clave, op, datos, creado))
+            cx.execute("DELETE FROM descartadas")
+        if filas:
+            self._asegurar_hilo()
+            self._despertar.set()
+        return len(filas)
+
+    # ── Envío ────────────────────────────────────────────────────
+    def _asegurar_hilo(self):
+        if self._hilo is not None and self._hilo.is_alive():
+            return
+        self._hilo = threading.Thread(target=self._bucle, daemon=True,
+                                      name='yachay-bandeja-salida')
+        self._hilo.start()
+
+    def _bucle(self):
+        while True:
+            self._despertar.wait(self.intervalo)
+            self._despertar.clear()
+            try:
+                with prioridad_api(PRIORIDAD_FONDO):
+                    while self.vaciar() == self.lote:
+                        pass
+            except Exception as e:
+                self.stats['ultimo_error'] = str(e)[:200]
+
+    def vaciar(self):
+        """Envía hasta `lote` operaciones en orden. Se detiene en la
+        primera que falla (para no adelantar a las siguientes) y la
+        reprograma con espera exponencial; las que ya fallaron
+        `max_intentos` veces se saltan. Devuelve cuántas se enviaron."""
+        if not self.gs.conectado and not self.gs.reconectar():
+            return 0
+        with self._conexion() as cx:
+            filas = cx.execute("""SELECT id, clave, op, datos, intentos, proximo
+                                  FROM pendientes ORDER BY id LIMIT ?""",
+                               (self.lote,)).fetchall()
+        enviadas = 0
+        sospechosas = []   # agotadas que volvieron a fallar en esta vuelta
+        for id_, clave, op, datos, intentos, proximo in filas:
+            if proximo > time.time():
+                if intentos >= self.max_intentos:
+                    continue
+                break
+            error = ''
+            try:
+                carga = json.loads(datos)
+                args = [_de_json(a) for a in carga.get('args', [])]
+                kwargs = {k: _de_json(v) for k, v in carga.get('kwargs', {}).items()}
+                if not getattr(self.gs, op)(*args, **kwargs):
+                    error = f"{op} devolvió False"
+            except Exception as e:
+                error = f"{op}: {e}"[:300]
+            with self._lock, self._conexion() as cx:
+                if error:
+                    espera = min(self.espera_max, 5 * 2 ** intentos)
+                    cx.execute("""UPDATE pendientes SET intentos = intentos + 1,
+                                  proximo = ?, ultimo_error = ? WHERE id = ?""",
+                               (time.time() + espera, error, id_))
+                    self.stats['fallos'] += 1
+                    self.stats['ultimo_error'] = error
+                    if intentos + 1 < self.max_intentos:
+                        break
+                    sospechosas.append(id_)
+                    continue
+                cx.execute("DELETE FROM pendientes WHERE id = ?", (id_,))
+                cx.execute("INSERT OR REPLACE INTO enviadas VALUES (?, ?)",
+                           (clave, time.time()))
+                if sospechosas:
+                    # Esta sí salió: las agotadas fallan por sí mismas
+                    self._descartar(cx, sospechosas)
+                    sospechosas = []
+                # Las claves enviadas se recuerdan 30 días
+                cx.execute("DELETE FROM enviadas WHERE enviado < ?",
+                           (time.time() - 30 * 86400,))
+            enviadas += 1
+            self.stats['enviadas'] += 1
+        return enviadas
+
+    def _descartar(self, cx, ids):
+        marcas = ','.join('?' * len(ids))
+        cx.execute(f"""INSERT INTO descartadas (clave, op, datos, creado, intentos,
+                                                descartado, ultimo_error)
+                        SELECT clave, op, datos, creado, intentos, ?, ultimo_error
+                        FROM pendientes WHERE id IN ({marcas})""",
+                   (time.time(), *ids))
+        cx.execute(f"DELETE FROM pendientes WHERE id IN ({marcas})", ids)
+        self.stats['descartadas'] += len(ids)
+
+
+# ================================================================
+# SINCRONIZACIÓN POR DIFERENCIAS (Matricula / Docentes / Usuarios)
+# ================================================================
+_DECIMAL = re.compile(r'^-?\d+\.\d*$')
+
+
+def _celda(valor):
+    """Texto de una celda tal como se compara con la hoja. Los números se
+    normalizan (5.0 → '5', '2.50' → '2.5') para que un 5 del DataFrame y
+    el '5' que devuelve Sheets no cuenten como fila modificada. Los ceros
+    a la izquierda (DNI, códigos) se respetan."""
+    if valor is None:
+        return ''
+    try:
+        if pd.isna(valor):
+            return ''
+    except (TypeError, ValueError):
+        pass
+    if isinstance(valor, bool):
+        return str(valor)
+    if isinstance(valor, numbers.Integral):
+        return str(int(valor))
+    if isinstance(valor, numbers.Real):
+        valor = float(valor)
+        return str(int(valor)) if valor.is_integer() else repr(valor)
+    texto = str(valor)
+    if _DECIMAL.match(texto):
+        texto = texto.rstrip('0').rstrip('.')
+        if texto in ('', '-', '-0'):
+            texto = '0'
+    return texto
+
+
+class EspejoHoja:
+    """Copia en memoria de una hoja tabular con una columna clave (DNI,
+    usuario) y su número de fila.
+
+    sincronizar() compara la tabla nueva con la copia y envía solo las
+    filas insertadas / modificadas / eliminadas: un batch_update con los
+    valores (las filas nuevas ocupan primero los huecos de las eliminadas),
+    un append_rows si sobran filas nuevas y un batch_update de
+    deleteDimension si sobran eliminadas. Registrar un alumno cuesta O(1)
+    celdas enviadas, no toda la matrícula.
+
+    Si la hoja no tiene el encabezado esperado, hay claves repetidas o
+    vacías, o cambió más de la mitad de las filas, se reescribe completa
+    como antes."""
+
+    def __init__(self, gs, key, columna_clave, ttl=1800,
+                 solo_al_insertar=()):
+        self.gs = gs
+        self.key = key
+        self.columnas = COLUMNAS[key]
+        self.i_clave = self.columnas.index(columna_clave)
+        # Columnas que no se comparan en filas existentes (fecha de
+        # matrícula que se completa con "hoy" al guardar)
+        self.i_fijas = [self.columnas.index(c) for c in solo_al_insertar]
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._filas = None      # [[celda, ...], ...] desde la fila 2
+        self._indice = {}
+        self._ts = 0
+        self.stats = {'incrementales': 0, 'completas': 0,
+                      'insertadas': 0, 'modificadas': 0, 'eliminadas': 0}
+
+    def _ultima_columna(self):
+        return chr(ord('A') + len(self.columnas) - 1)
+
+    def _reindexar(self):
+        self._indice = {}
+        for nro, fila in enumerate(self._filas, start=2):
+            self._indice[fila[self.i_clave]] = nro
+        return len(self._indice) == len(self._filas)
+
+    def _cargar(self, ws):
+        """Lee la hoja. False si no se puede sincronizar por diferencias."""
+        valores = ws.get_all_values()
+        if not valores or [c.strip() for c in valores[0][:len(self.columnas)]] != self.columnas:
+            return False
+        ancho = len(self.columnas)
+        self._filas = [[_celda(c) for c in (fila + [''] * ancho)[:ancho]]
+                       for fila in valores[1:] if any(fila)]
+        if len(self._filas) != len(valores) - 1:
+            return False   # filas en blanco intercaladas: no se puede indexar
+        self._ts = time.time()
+        return self._reindexar()
+
+    def invalidar(self):
+        with self._lock:
+            self._filas = None
+
+    def _reescribir(self, ws, filas):
+        ws.clear()
+        ws.update([self.columnas] + filas, 'A1', value_input_option='RAW')
+        self._filas = [list(f) for f in filas]
+        self._ts = time.time()
+        if not self._reindexar():
+            self._filas = None
+        self.stats['completas'] += 1
+
+    def sincronizar(self, filas):
+        """Deja la hoja igual a `filas` (listas en el orden de COLUMNAS)."""
+        filas = [[_celda(v) for v in fila] for fila in filas]
+        ws = self.gs._get_hoja(self.key)
+        if ws is None:
+            return False
+        with self._lock:
+            try:
+                return self._sincronizar(ws, filas)
+            except Exception:
+                self._filas = None   # no se sabe cómo quedó: releer
+                raise
+
+    def _sincronizar(self, ws, filas):
+        nuevas = {}
+        for fila in filas:
+            nuevas[fila[self.i_clave]] = fila
+        if len(nuevas) != len(filas) or '' in nuevas:
+            self._reescribir(ws, filas)
+            return True
+        if (self._filas is None or time.time() - self._ts > self.ttl) \
+                and not self._cargar(ws):
+            self._reescribir(ws, filas)
+            return True
+
+        modificadas, insertadas = [], []
+        for clave, fila in nuevas.items():
+            nro = self._indice.get(clave)
+            if nro is None:
+                insertadas.append(fila)
+                continue
+            actual = self._filas[nro - 2]
+            for i in self.i_fijas:
+                fila[i] = actual[i]
+            if fila != actual:
+                modificadas.append((nro, fila))
+        eliminadas = sorted(nro for clave, nro in self._indice.items()
+                            if clave not in nuevas)
+
+        cambios = len(modificadas) + len(insertadas) + len(eliminadas)
+        if cambios == 0:
+            return True
+        if cambios > max(len(self._filas), len(filas)) // 2 + 10:
+            self._reescribir(ws, filas)
+            return True
+
+        self.stats['insertadas'] += len(insertadas)
+        self.stats['modificadas'] += len(modificadas)
+        self.stats['eliminadas'] += len(eliminadas)
+        # Las filas nuevas ocupan primero los huecos de las eliminadas
+        while insertadas and eliminadas:
+            modificadas.append((eliminadas.pop(0), insertadas.pop(0)))
+
+        ultima = self._ultima_columna()
+        if modificadas:
+            ws.batch_update([{'range': f"A{nro}:{ultima}{nro}", 'values': [fila]}
+                             for nro, fila in modificadas],
+                            value_input_option='RAW')
+            for nro, fila in modificadas:
+                self._filas[nro - 2] = fila
+        if insertadas:
+            ws.append_rows(insertadas, value_input_option='RAW')
+            self._filas.extend(insertadas)
+        if eliminadas:
+            pedidos = [{'deleteDimension': {'range': {
+                'sheetId': ws.id, 'dimension': 'ROWS',
+                'startIndex': nro - 1, 'endIndex': nro}}}
+                for nro in sorted(eliminadas, reverse=True)]
+            self.gs.spreadsheet.batch_update({'requests': pedidos})
+            quitar = set(eliminadas)
+            self._filas = [f for nro, f in enumerate(self._filas, start=2)
+                           if nro not in quitar]
+        self._reindexar()
+        self.stats['incrementales'] += 1
+        return True
+
+
+# ================================================================
+# HOJA CONFIG (clave → valor) CON ÍNDICE EN MEMORIA
+# ================================================================
+class ConfigStore:
+    """Acceso a la hoja 'Config' sin releerla en cada llamada.
+
+    La hoja se lee UNA vez (get_all_values) y se guarda una foto en
+    memoria con el índice clave → número de fila. Las lecturas salen de
+    la foto; las escrituras actualizan la celda exacta (batch_update) o
+    agregan filas (append_rows) y corrigen la foto sin volver a leer.
+    Así el arranque en frío, que antes hacía una lectura completa de la
+    hoja por cada archivo a restaurar, hace una sola.
+
+    Como en el código anterior, si una clave aparece repetida manda la
+    PRIMERA fila para get()/set(); items() devuelve todas, en orden."""
+
+    def __init__(self, gs, ttl=300):
+        self.gs = gs
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._filas = None      # [[clave, valor], ...] desde la fila 2
+        self._indice = {}       # clave → número de fila (primera aparición)
+        self._ts = 0
+        self._ws = None
+        self.stats = {'lecturas': 0, 'escrituras': 0, 'aciertos': 0}
+
+    def _hoja(self):
+        if self._ws is None:
+            self._ws = self.gs._get_hoja('config')
+        return self._ws
+
+    # ── Foto de la hoja ──────────────────────────────────────────
+    def _reindexar(self):
+        self._indice = {}
+        for i, (clave, _) in enumerate(self._filas, start=2):
+            if clave and clave not in self._indice:
+                self._indice[clave] = i
+
+    def _cargar(self, forzar=False):
+        """Lee la hoja completa si no hay foto o si venció el TTL.
+        Devuelve False si no hay conexión."""
+        if (self._filas is not None and not forzar
+                and time.time() - self._ts < self.ttl):
+            self.stats['aciertos'] += 1
+            return True
+        ws = self._hoja()
+        if ws is None:
+            return False
+        valores = ws.get_all_values()
+        self.stats['lecturas'] += 1
+        filas = []
+        for fila in valores[1:]:
+            clave = str(fila[0]).strip() if fila else ''
+            valor = fila[1] if len(fila) > 1 else ''
+            filas.append([clave, valor])
+        self._filas = filas
+        self._reindexar()
+        self._ts = time.time()
+        return True
+
+    def recargar(self):
+        """Descarta la foto: la próxima operación vuelve a leer la hoja."""
+        with self._lock:
+            self._filas = None
+
+    # ── Lectura ──────────────────────────────────────────────────
+    def get(self, clave, default=None):
+        """Valor (texto) de la clave, o `default` si no existe."""
+        with self._lock:
+            if not self._cargar():
+                return default
+            nro = self._indice.get(clave)
+            if nro is None:
+                return default
+            return self._filas[nro - 2][1]
+
+    def get_json(self, clave, default=None):
+        """Valor de la clave decodificado como JSON (default si no existe
+        o no es JSON válido)."""
+        valor = self.get(clave)
+        if not valor:
+            return default
+        try:
+            return json.loads(valor)
+        except Exception:
+            return default
+
+    def items(self, prefijo=''):
+        """Lista de (clave, valor) cuyas claves empiezan con `prefijo`, en
+        el orden de la hoja (incluye claves repetidas)."""
+        with self._lock:
+            if not self._cargar():
+                return []
+            return [(c, v) for c, v in self._filas if c and c.startswith(prefijo)]
+
+    # ── Escritura ────────────────────────────────────────────────
+    @staticmethod
+    def _texto(valor):
+        if isinstance(valor, (dict, list)):
+            return json.dumps(valor, ensure_ascii=False, default=str)
+        return '' if valor is None else str(valor)
+
+    def set(self, clave, valor):
+        """Crea o actualiza una clave (dict/list se guardan como JSON)."""
+        return self.set_many({clave: valor})
+
+    def _indice_vigente(self, ws, claves):
+        """Confirma contra la columna A que las filas de la foto siguen
+        teniendo las claves que se van a actualizar: si alguien insertó o
+        borró filas en la hoja desde la última lectura, 'B{nro}' caería en
+        la celda de otra clave. Si no coinciden, relee la hoja entera."""
+        nros = [self._indice[c] for c in claves if c in self._indice]
+        if not nros:
+            return True
+        columna = ws.col_values(1)
+        self.stats['lecturas'] += 1
+        for clave in claves:
+            nro = self._indice.get(clave)
+            if nro and (nro > len(columna)
+                        or str(columna[nro - 1]).strip() != clave):
+                return self._cargar(forzar=True)
+        return True
+
+    def set_many(self, valores):
+        """Crea o actualiza varias claves: una lectura de la columna A para
+        confirmar las filas, un batch_update para las existentes y un
+        append_rows para las nuevas."""
+        with self._lock:
+            if not self._cargar():
+                return False
+            ws = self._hoja()
+            if not self._indice_vigente(ws, list(valores)):
+                return False
+            actualizaciones, nuevas = [], []
+            for clave, valor in valores.items():
+                texto = self._texto(valor)
+                nro = self._indice.get(clave)
+                if nro:
+                    actualizaciones.append({'range': f"B{nro}",
+                                            'values': [[texto]]})
+                    self._filas[nro - 2][1] = texto
+                else:
+                    nuevas.append([clave, texto])
+            if actualizaciones:
+                ws.batch_update(actualizaciones, value_input_option='RAW')
+                self.stats['escrituras'] += 1
+            if nuevas:
+                resp = ws.append_rows(nuevas, value_input_option='RAW')
+                self.stats['escrituras'] += 1
+                rango = ((resp or {}).get('updates') or {}).get('updatedRange', '')
+                m = re.search(r'![A-Z]+(\d+)', rango)
+                if m and int(m.group(1)) == len(self._filas) + 2:
+                    self._filas.extend(nuevas)
+                    self._reindexar()
+                else:
+                    # La hoja cambió por fuera (fila en otra posición):
+                    # releer en la próxima operación.
+                    self._filas = None
+            return True
+
+    def agregar(self, clave, valor):
+        """Agrega SIEMPRE una fila nueva, aunque la clave exista (registros
+        tipo bitácora: eval_*, reclamo_*, histeval_*)."""
+        with self._lock:
+            if not self._cargar():
+                return False
+            ws = self._hoja()
+            fila = [clave, self._texto(valor)]
+            resp = ws.append_rows([fila], value_input_option='RAW')
+            self.stats['escrituras'] += 1
+            rango = ((resp or {}).get('updates') or {}).get('updatedRange', '')
+            m = re.search(r'![A-Z]+(\d+)', rango)
+            if m and int(m.group(1)) == len(self._filas) + 2:
+                self._filas.append(fila)
+                self._indice.setdefault(clave, len(self._filas) + 1)
+            else:
+                self._filas = None
+            return True
+
+    def eliminar(self, prefijos=(), claves=()):
+        """Elimina todas las filas cuya clave esté en `claves` o empiece
+        con alguno de `prefijos`, en UNA llamada batch_update. Devuelve
+        cuántas filas se eliminaron."""
+        prefijos = tuple(prefijos)
+        claves = set(claves)
+        with self._lock:
+            if not self._cargar(forzar=True):
+                return 0
+            ws = self._hoja()
+            borrar = [i for i, (c, _) in enumerate(self._filas, start=2)
+                      if c and (c in claves or (prefijos and c.startswith(prefijos)))]
+            if not borrar:
+                return 0
+            # De abajo hacia arriba para que los índices sigan valiendo
+            pedidos = [{'deleteDimension': {'range': {
+                'sheetId': ws.id, 'dimension': 'ROWS',
+                'startIndex': nro - 1, 'endIndex': nro}}}
+                for nro in sorted(borrar, reverse=True)]
+            self.gs.spreadsheet.batch_update({'requests': pedidos})
+            self.stats['escrituras'] += 1
+            quitar = set(borrar)
+            self._filas = [f for i, f in enumerate(self._filas, start=2)
+                           if i not in quitar]
+            self._reindexar()
+            return len(borrar)
+
+
 # ================================================================
 # CLASE PRINCIPAL DE SINCRONIZACIÓN
 # ================================================================
 class GoogleSync:
-    """Maneja toda la comunicación con Google Sheets"""
+    """Maneja toda la comunicación con Google Sheets.
 
-    def __init__(self):
+    Con `simulado` (un sheets_simulado.GoogleSimulado) no se usan
+    credenciales ni red: Sheets y Drive son locales, con latencia, cuota y
+    fallos simulados."""
+
+    def __init__(self, simulado=None):
         self.client = None
         self.spreadsheet = None
         self.conectado = False
@@ -78,15 +1143,35 @@ class GoogleSync:
         self._cache = {}
         self._cache_ts = {}
         self._CACHE_TTL = 120  # 2 minutos
+        self._sync_asistencias = None
+        self._config = None
+        self._blobs = None
+        self._hojas = {}
+        self._espejos = {}
+        self._bandeja = None
+        self.configurado = False
+        self._ultimo_intento_conexion = 0
+        self.planificador = PlanificadorAPI()
+        self.simulado = simulado
         self._inicializar()
 
     def _inicializar(self):
         """Conectar a Google Sheets usando Streamlit Secrets"""
         try:
+            if self.simulado is not None:
+                self.configurado = True
+                self.client = self.simulado.cliente
+                self.planificador.instalar(self.client)
+                self._drive = self.simulado.drive
+                self.spreadsheet = self.client.open("YACHAY PRO — Base de Datos")
+                self.conectado = True
+                self._asegurar_hojas()
+                return
             if 'gcp_service_account' not in st.secrets:
                 st.warning("⚠️ Google Sheets no configurado. "
                           "Los datos se guardan solo localmente.")
                 return
+            self.configurado = True
 
             creds_dict = dict(st.secrets['gcp_service_account'])
             scope = [
@@ -96,6 +1181,7 @@ class GoogleSync:
             ]
             creds = Credentials.from_service_account_info(creds_dict, scopes=scope)
             self.client = gspread.authorize(creds)
+            self.planificador.instalar(self.client)
             self._creds = creds
             try:
                 from googleapiclient.discovery import build
@@ -143,21 +1229,28 @@ class GoogleSync:
         fallar silenciosamente y pedirle al usuario que la cree a mano."""
         if not self.conectado:
             return None
+        # spreadsheet.worksheet() es una lectura de metadatos: se hace una
+        # sola vez por pestaña y proceso.
+        ws = self._hojas.get(key)
+        if ws is not None:
+            return ws
         nombre_hoja = HOJAS[key]
         try:
-            return self.spreadsheet.worksheet(nombre_hoja)
-        except Exception:
-            pass
-        try:
-            columnas = COLUMNAS.get(key, [])
-            ws_nueva = self.spreadsheet.add_worksheet(
-                title=nombre_hoja, rows=1000,
-                cols=max(len(columnas), 1))
-            if columnas:
-                ws_nueva.append_row(columnas)
-            return ws_nueva
+            ws = self.spreadsheet.worksheet(nombre_hoja)
         except Exception:
-            return None
+            ws = None
+        if ws is None:
+            try:
+                columnas = COLUMNAS.get(key, [])
+                ws = self.spreadsheet.add_worksheet(
+                    title=nombre_hoja, rows=1000,
+                    cols=max(len(columnas), 1))
+                if columnas:
+                    ws.append_row(columnas)
+            except Exception:
+                return None
+        self._hojas[key] = ws
+        return ws
 
     def _leer_con_cache(self, key, ttl=None):
         """Lee datos con caché en memoria (evita requests repetidos a GS)"""
@@ -179,6 +1272,15 @@ class GoogleSync:
         except Exception:
             return self._cache.get(key, [])
 
+    def prioridad(self, nivel):
+        """Context manager: llamadas a la API del bloque con prioridad
+        `nivel` (PRIORIDAD_ASISTENCIA / PRIORIDAD_NORMAL / PRIORIDAD_FONDO)."""
+        return prioridad_api(nivel)
+
+    def estadisticas_api(self):
+        """(totales, {llamador: contadores}) del planificador."""
+        return self.planificador.resumen()
+
     def invalidar_cache(self, key=None):
         """Invalida caché para forzar re-lectura"""
         if key:
@@ -207,12 +1309,10 @@ class GoogleSync:
         return pd.DataFrame(data)
 
     def leer_usuarios(self):
-        """Lee todos los usuarios → dict {username: {...}}"""
-        ws = self._get_hoja('usuarios')
-        if ws is None:
-            return {}
+        """Lee todos los usuarios → dict {username: {...}} (con caché 2 min;
+        se invalida al guardar/eliminar usuarios)"""
         try:
-            data = ws.get_all_records()
+            data = self._leer_con_cache('usuarios')
             usuarios = {}
             for row in data:
                 uname = str(row.get('username', '')).strip()
@@ -547,7 +1647,13 @@ class GoogleSync:
             data = ws.get_all_records()
             for row in data:
                 if str(row.get('dni')) == str(dni):
-                    return row.get('foto_base64', '')
+                    valor = str(row.get('foto_base64', ''))
+                    if valor.startswith('sha256:'):
+                        # La celda solo apunta al archivo en el almacén
+                        datos = self.blobs().leer_bytes(valor[7:])
+                        return (base64.b64encode(datos).decode('utf-8')
+                                if datos else None)
+                    return valor
             return None
         except Exception:
             return None
@@ -558,6 +1664,7 @@ class GoogleSync:
 
     def guardar_estudiante(self, datos):
         """Agrega o actualiza un estudiante"""
+        self._espejo('matricula').invalidar()   # cambia filas por fuera del espejo
         ws = self._get_hoja('matricula')
         if ws is None:
             return False
@@ -576,6 +1683,7 @@ class GoogleSync:
 
     def eliminar_estudiante(self, dni):
         """Elimina un estudiante por DNI"""
+        self._espejo('matricula').invalidar()
         ws = self._get_hoja('matricula')
         if ws is None:
             return False
@@ -590,6 +1698,7 @@ class GoogleSync:
 
     def guardar_docente(self, datos):
         """Agrega o actualiza un docente"""
+        self._espejo('docentes').invalidar()
         ws = self._get_hoja('docentes')
         if ws is None:
             return False
@@ -606,6 +1715,8 @@ class GoogleSync:
 
     def guardar_usuario(self, username, datos):
         """Guarda un usuario en la hoja"""
+        self._espejo('usuarios').invalidar()
+        self.invalidar_cache('usuarios')
         ws = self._get_hoja('usuarios')
         if ws is None:
             return False
@@ -628,6 +1739,8 @@ class GoogleSync:
 
     def eliminar_usuario(self, username):
         """Elimina un usuario"""
+        self._espejo('usuarios').invalidar()
+        self.invalidar_cache('usuarios')
         ws = self._get_hoja('usuarios')
         if ws is None:
             return False
@@ -642,6 +1755,10 @@ class GoogleSync:
 
     def guardar_asistencia(self, datos):
         """Registra una asistencia"""
+        with prioridad_api(PRIORIDAD_ASISTENCIA):
+            return self._guardar_asistencia(datos)
+
+    def _guardar_asistencia(self, datos):
         ws = self._get_hoja('asistencias')
         if ws is None:
             return False
@@ -677,6 +1794,68 @@ class GoogleSync:
             st.error(f"Error registrando asistencia: {e}")
             return False
 
+    def sincronizador_asistencias(self):
+        """Cola por lotes de la hoja Asistencias (una por proceso)."""
+        if self._sync_asistencias is None:
+            self._sync_asistencias = SincronizadorAsistencias(self)
+        return self._sync_asistencias
+
+    def config(self):
+        """Hoja Config con índice en memoria (una por proceso)."""
+        if self._config is None:
+            self._config = ConfigStore(self)
+        return self._config
+
+    def guardar_config(self, valores):
+        """set_many sobre la hoja Config (operación diferible de la
+        bandeja de salida)."""
+        return self.config().set_many(valores)
+
+    def blobs(self):
+        """Almacén de archivos por SHA-256 (uno por proceso). El backend
+        de Drive usa la carpeta compartida configurada en la hoja Config
+        ('drive_folder_raiz') o, si no hay, la de música. Sin Drive el
+        almacén queda solo local (durable=False)."""
+        if self._blobs is None or not self._blobs.durable:
+            backend = None
+            if self.conectado and self._drive is not None:
+                carpeta = (self.config().get('drive_folder_raiz', '').strip()
+                           or self._carpeta_musica_id())
+                if carpeta:
+                    backend = BackendDrive(self._drive, carpeta)
+            self._blobs = AlmacenBlobs(backend=backend)
+        return self._blobs
+
+    def reconectar(self, cada=60):
+        """Reintenta la conexión (como mucho una vez por `cada` segundos)
+        cuando la app arrancó sin internet."""
+        if self.conectado:
+            return True
+        if not self.configurado or time.time() - self._ultimo_intento_conexion < cada:
+            return False
+        self._ultimo_intento_conexion = time.time()
+        self._inicializar()
+        return self.conectado
+
+    def bandeja(self):
+        """Bandeja de salida persistente (una por proceso)."""
+        if self._bandeja is None:
+            self._bandeja = BandejaSalida(self)
+            if self._bandeja.estado()['pendientes']:
+                # Quedaron escrituras de una ejecución anterior
+                self._bandeja._asegurar_hilo()
+        return self._bandeja
+
+    def encolar_asistencia(self, datos):
+        """Versión por lotes de guardar_asistencia: encola y vuelve de
+        inmediato; el hilo de sincronización la envía en el próximo lote.
+        Sin conexión también se encola: el hilo reconecta, como la bandeja
+        de salida. False solo si Google Sheets no está configurado."""
+        if not self.configurado:
+            return False
+        self.sincronizador_asistencias().encolar(datos)
+        return True
+
     def guardar_resultados_examen(self, eval_id, titulo, fecha, docente,
                                    grado, areas_info, resultados_lista):
         """Guarda todos los resultados de una evaluación"""
@@ -738,12 +1917,18 @@ class GoogleSync:
             return False
 
     def guardar_foto(self, dni, nombre, tipo, foto_bytes):
-        """Guarda foto como base64 en Google Sheets"""
+        """Guarda la foto en el almacén de archivos y deja en la hoja Fotos
+        solo 'sha256:<hash>'. Sin Drive se guarda como base64, como antes."""
         ws = self._get_hoja('fotos')
         if ws is None:
             return False
         try:
-            b64 = base64.b64encode(foto_bytes).decode('utf-8')
+            almacen = self.blobs()
+            if almacen.durable:
+                h, _ = almacen.guardar_bytes(foto_bytes, 'image/jpeg')
+                b64 = f"sha256:{h}"
+            else:
+                b64 = base64.b64encode(foto_bytes).decode('utf-8')
             # Verificar si ya existe
             cell = ws.find(str(dni))
             if cell:
@@ -764,47 +1949,42 @@ class GoogleSync:
     # SINCRONIZACIÓN MASIVA
     # ================================================================
 
+    def _espejo(self, key):
+        """EspejoHoja de Matricula / Docentes / Usuarios (uno por proceso)."""
+        if key not in self._espejos:
+            clave, fijas = {
+                'matricula': ('dni', ('fecha_matricula',)),
+                'docentes': ('dni', ('fecha_registro',)),
+                'usuarios': ('username', ()),
+            }[key]
+            self._espejos[key] = EspejoHoja(self, key, clave,
+                                            solo_al_insertar=fijas)
+        return self._espejos[key]
+
     def sync_matricula_completa(self, df):
-        """Reemplaza TODA la hoja de matrícula con el DataFrame"""
+        """Deja la hoja de matrícula igual al DataFrame (solo envía las
+        filas que cambiaron)"""
         self.invalidar_cache('matricula')
-        ws = self._get_hoja('matricula')
-        if ws is None:
-            return False
         try:
-            ws.clear()
-            ws.append_row(COLUMNAS['matricula'])
-            if len(df) > 0:
-                rows = df[COLUMNAS['matricula']].fillna('').values.tolist()
-                ws.append_rows(rows)
-            return True
+            filas = df.reindex(columns=COLUMNAS['matricula']).values.tolist()
+            return self._espejo('matricula').sincronizar(filas)
         except Exception:
             return False
 
     def sync_docentes_completo(self, df):
-        """Reemplaza TODA la hoja de docentes"""
+        """Deja la hoja de docentes igual al DataFrame (solo diferencias)"""
         self.invalidar_cache('docentes')
-        ws = self._get_hoja('docentes')
-        if ws is None:
-            return False
         try:
-            ws.clear()
-            ws.append_row(COLUMNAS['docentes'])
-            if len(df) > 0:
-                cols = [c for c in COLUMNAS['docentes'] if c in df.columns]
-                rows = df[cols].fillna('').values.tolist()
-                ws.append_rows(rows)
-            return True
+            filas = df.reindex(columns=COLUMNAS['docentes']).values.tolist()
+            return self._espejo('docentes').sincronizar(filas)
         except Exception:
             return False
 
     def sync_usuarios_completo(self, usuarios_dict):
-        """Reemplaza TODA la hoja de usuarios"""
-        ws = self._get_hoja('usuarios')
-        if ws is None:
-            return False
+        """Deja la hoja de usuarios igual al dict (solo diferencias)"""
+        self.invalidar_cache('usuarios')
         try:
-            ws.clear()
-            ws.append_row(COLUMNAS['usuarios'])
+            filas = []
             for username, datos in usuarios_dict.items():
                 di = datos.get('docente_info') or {}
                 grado = di.get('grado', '') if isinstance(di, dict) else ''
@@ -814,10 +1994,9 @@ class GoogleSync:
                 di_s = datos.get('docente_info') or {}
                 dni_s = (datos.get('dni','') or
                          (di_s.get('dni','') if isinstance(di_s,dict) else ''))
-                row = [username, password, nombre,
-                       datos.get('rol', 'docente'), grado, nivel, str(dni_s)]
-                ws.append_row(row, value_input_option='RAW')
-            return True
+                filas.append([username, password, nombre,
+                              datos.get('rol', 'docente'), grado, nivel, str(dni_s)])
+            return self._espejo('usuarios').sincronizar(filas)
         except Exception:
             return False
 
@@ -902,5 +2081,17 @@ class GoogleSync:
 # ================================================================
 @st.cache_resource
 def get_google_sync():
-    """Retorna instancia singleton de GoogleSync"""
+    """Retorna instancia singleton de GoogleSync. Con la variable de
+    entorno YACHAY_GS_SIMULADO usa Sheets/Drive simulados (ver
+    sheets_simulado.py) para medir la app sin red."""
+    simulado = os.environ.get('YACHAY_GS_SIMULADO', '')
+    if simulado:
+        import atexit
+        from sheets_simulado import GoogleSimulado, Simulador
+        backend = GoogleSimulado(
+            Simulador.desde_entorno(),
+            archivo=simulado if simulado.endswith(('.sqlite3', '.db')) else None)
+        if backend.archivo:
+            atexit.register(backend.guardar)
+        return GoogleSync(simulado=backend)
     return GoogleSync()
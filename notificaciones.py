@@ -0,0 +1,291 @@
+"""
+YACHAY PRO — Despachador de notificaciones (Telegram / WhatsApp CallMeBot)
+Antes cada escaneo abría un hilo nuevo con una conexión HTTPS nueva, y el
+aviso de faltas de las 9:00 mandaba cientos de mensajes seguidos desde un
+solo hilo, sin freno, chocando con el límite de Telegram (~30 msg/s en
+total y 1 msg/s por chat).
+
+Aquí hay UN despachador por proceso:
+    - cola acotada (si se llena, el mensaje se descarta y se cuenta)
+    - pocos hilos, cada uno con conexiones HTTPS keep-alive por host
+    - límite global por canal (token bucket) y por destinatario
+    - reintentos con espera exponencial ante 429 (respetando retry_after
+      de Telegram), 5xx y errores de red; 400/401/403/404 no se reintentan
+    - métricas de entrega por canal para el panel del admin
+
+CacheConfig guarda la config del bot y los suscriptores para que cada
+escaneo no relea los JSON ni la hoja Config.
+
+Este módulo no depende de Streamlit: sistema_web.py mantiene las instancias
+del proceso (st.cache_resource).
+"""
+import heapq
+import http.client
+import itertools
+import json
+import threading
+import time
+import urllib.parse
+
+# Límites por canal: mensajes por segundo en total y por destinatario
+LIMITES = {
+    'telegram': {'global': 25.0, 'destino': 1.0},
+    # CallMeBot es un servicio gratuito y compartido: ir despacio
+    'callmebot': {'global': 2.0, 'destino': 0.2},
+}
+HOSTS = {'telegram': 'api.telegram.org', 'callmebot': 'api.callmebot.com'}
+
+
+class _Trabajo:
+    """Un mensaje en la cola. `listo` se activa al entregarlo o al
+    abandonarlo; `ok` dice cómo terminó."""
+    __slots__ = ('canal', 'destino', 'mensaje', 'credencial', 'intentos',
+                 'encolado', 'ok', 'error', 'listo')
+
+    def __init__(self, canal, destino, mensaje, credencial):
+        self.canal = canal
+        self.destino = str(destino)
+        self.mensaje = mensaje
+        self.credencial = credencial
+        self.intentos = 0
+        self.encolado = time.monotonic()
+        self.ok = None
+        self.error = ''
+        self.listo = threading.Event()
+
+    def esperar(self, timeout=None):
+        self.listo.wait(timeout)
+        return bool(self.ok)
+
+
+class _Reintentar(Exception):
+    def __init__(self, mensaje, espera=None):
+        super().__init__(mensaje)
+        self.espera = espera
+
+
+class DespachadorMensajes:
+
+    def __init__(self, hilos=4, max_cola=5000, reintentos=4, timeout=10,
+                 limites=None):
+        self.hilos = hilos
+        self.max_cola = max_cola
+        self.reintentos = reintentos
+        self.timeout = timeout
+        self.limites = limites or LIMITES
+        self._cond = threading.Condition()
+        self._cola = []                    # heap (listo_en, seq, trabajo)
+        self._seq = itertools.count()
+        self._fichas = {c: (l['global'], time.monotonic())
+                        for c, l in self.limites.items()}
+        self._proximo_destino = {}         # (canal, destino) → monotonic
+        self._hilos = []
+        self._local = threading.local()    # conexiones keep-alive por hilo
+        self.stats = {c: {'encolados': 0, 'enviados': 0, 'fallidos': 0,
+                          'reintentos': 0, 'descartados': 0,
+                          'demora_total_s': 0.0}
+                      for c in self.limites}
+
+    # ── Encolar ──────────────────────────────────────────────────
+    def encolar(self, canal, destino, mensaje, credencial):
+        """Pone un mensaje en la cola y vuelve de inmediato. Devuelve el
+        _Trabajo (para esperar su resultado si hace falta) o None si la
+        cola está llena."""
+        trabajo = _Trabajo(canal, destino, mensaje, credencial)
+        with self._cond:
+            if len(self._cola) >= self.max_cola:
+                self.stats[canal]['descartados'] += 1
+                return None
+            heapq.heappush(self._cola, (trabajo.encolado, next(self._seq), trabajo))
+            self.stats[canal]['encolados'] += 1
+            self._cond.notify()
+        self._asegurar_hilos()
+        return trabajo
+
+    def telegram(self, chat_id, mensaje, token):
+        return self.encolar('telegram', chat_id, mensaje, token)
+
+    def callmebot(self, celular, mensaje, apikey):
+        return self.encolar('callmebot', celular, mensaje, apikey)
+
+    def estadisticas(self):
+        with self._cond:
+            return {'en_cola': len(self._cola),
+                    'canales': {c: dict(s) for c, s in self.stats.items()}}
+
+    # ── Hilos ────────────────────────────────────────────────────
+    def _asegurar_hilos(self):
+        with self._cond:
+            self._hilos = [h for h in self._hilos if h.is_alive()]
+            while len(self._hilos) < self.hilos:
+                h = threading.Thread(target=self._bucle, daemon=True,
+                                     name=f'yachay-notif-{len(self._hilos)}')
+                h.start()
+                self._hilos.append(h)
+
+    def _reservar(self, trabajo, ahora):
+        """0 si el mensaje puede salir ya (y descuenta el cupo); si no, los
+        segundos que faltan. Se llama con self._cond tomado."""
+        limite = self.limites[trabajo.canal]
+        clave = (trabajo.canal, trabajo.destino)
+        falta = self._proximo_destino.get(clave, 0) - ahora
+        if falta > 0:
+            return falta
+        fichas, ts = self._fichas[trabajo.canal]
+        fichas = min(limite['global'], fichas + (ahora - ts) * limite['global'])
+        if fichas < 1:
+            self._fichas[trabajo.canal] = (fichas, ahora)
+            return (1 - fichas) / limite['global']
+        self._fichas[trabajo.canal] = (fichas - 1, ahora)
+        self._proximo_destino[clave] = ahora + 1 / limite['destino']
+        if len(self._proximo_destino) > 10000:
+            self._proximo_destino = {k: v for k, v in self._proximo_destino.items()
+                                     if v > ahora}
+        return 0
+
+    def _siguiente(self):
+        with self._cond:
+            while True:
+                if not self._cola:
+                    self._cond.wait()
+                    continue
+                ahora = time.monotonic()
+                listo_en, _, trabajo = self._cola[0]
+                if listo_en > ahora:
+                    self._cond.wait(listo_en - ahora)
+                    continue
+                heapq.heappop(self._cola)
+                espera = self._reservar(trabajo, ahora)
+                if espera <= 0:
+                    return trabajo
+                heapq.heappush(self._cola, (ahora + espera, next(self._seq), trabajo))
+                self._cond.notify()
+
+    def _bucle(self):
+        while True:
+            trabajo = self._siguiente()
+            try:
+                self._procesar(trabajo)
+            except Exception as e:
+                self._terminar(trabajo, False, str(e)[:200])
+
+    def _procesar(self, trabajo):
+        trabajo.intentos += 1
+        try:
+            if trabajo.canal == 'telegram':
+                self._enviar_telegram(trabajo)
+            else:
+                self._enviar_callmebot(trabajo)
+        except _Reintentar as e:
+            if trabajo.intentos > self.reintentos:
+                self._terminar(trabajo, False, str(e))
+                return
+            espera = e.espera if e.espera is not None else 2 ** trabajo.intentos
+            with self._cond:
+                self.stats[trabajo.canal]['reintentos'] += 1
+                heapq.heappush(self._cola, (time.monotonic() + espera,
+                                            next(self._seq), trabajo))
+                self._cond.notify()
+            return
+        self._terminar(trabajo, True)
+
+    def _terminar(self, trabajo, ok, error=''):
+        trabajo.ok, trabajo.error = ok, error
+        with self._cond:
+            s = self.stats[trabajo.canal]
+            if ok:
+                s['enviados'] += 1
+                s['demora_total_s'] += time.monotonic() - trabajo.encolado
+            else:
+                s['fallidos'] += 1
+        trabajo.listo.set()
+
+    # ── HTTP keep-alive ──────────────────────────────────────────
+    def _http(self, canal, metodo, ruta, cuerpo=None, cabeceras=None):
+        """(status, bytes) usando la conexión persistente de este hilo
+        para el host del canal. Una conexión keep-alive que el servidor ya
+        cerró se reabre una vez; cualquier otro error de red se reintenta
+        con espera."""
+        host = HOSTS[canal]
+        conexiones = getattr(self._local, 'conexiones', None)
+        if conexiones is None:
+            conexiones = self._local.conexiones = {}
+        for intento in range(2):
+            conn = conexiones.get(host)
+            nueva = conn is None
+            if nueva:
+                conn = conexiones[host] = http.client.HTTPSConnection(
+                    host, timeout=self.timeout)
+            try:
+                conn.request(metodo, ruta, body=cuerpo, headers=cabeceras or {})
+                resp = conn.getresponse()
+                return resp.status, resp.read()
+            except (http.client.HTTPException, OSError) as e:
+                conn.close()
+                conexiones.pop(host, None)
+                if nueva or intento:
+                    raise _Reintentar(f"red: {e}")
+
+    def _enviar_telegram(self, trabajo):
+        cuerpo = urllib.parse.urlencode({'chat_id': trabajo.destino,
+                                         'text': trabajo.mensaje,
+                                         'parse_mode': 'HTML'})
+        status, datos = self._http(
+            'telegram', 'POST', f"/bot{trabajo.credencial}/sendMessage", cuerpo,
+            {'Content-Type': 'application/x-www-form-urlencoded'})
+        try:
+            respuesta = json.loads(datos.decode('utf-8', 'ignore'))
+        except ValueError:
+            respuesta = {}
+        if status == 200 and respuesta.get('ok'):
+            return
+        descripcion = f"{status} {respuesta.get('description', '')}".strip()
+        if status == 429:
+            espera = (respuesta.get('parameters') or {}).get('retry_after')
+            raise _Reintentar(descripcion, espera)
+        if status >= 500:
+            raise _Reintentar(descripcion)
+        # 400 chat inexistente, 401 token, 403 bot bloqueado: no reintentar
+        raise RuntimeError(descripcion)
+
+    def _enviar_callmebot(self, trabajo):
+        tel = trabajo.destino.replace(' ', '').replace('+', '').replace('-', '')
+        if not tel.startswith('51'):
+            tel = '51' + tel
+        consulta = urllib.parse.urlencode({'phone': tel, 'text': trabajo.mensaje,
+                                           'apikey': trabajo.credencial},
+                                          quote_via=urllib.parse.quote)
+        status, _ = self._http('callmebot', 'GET', f"/whatsapp.php?{consulta}")
+        if status == 200:
+            return
+        if status == 429 or status >= 500:
+            raise _Reintentar(f"{status}")
+        raise RuntimeError(f"{status}")
+
+
+class CacheConfig:
+    """Config del bot y suscriptores en memoria, compartidos por todas las
+    sesiones del proceso. Cada nombre se recarga a los `ttl` segundos o al
+    invalidarlo (al guardar). Los valores vacíos no se guardan."""
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._datos = {}
+        self._lock = threading.Lock()
+
+    def obtener(self, nombre, cargar):
+        """Valor compartido (NO modificarlo) de `nombre`; si venció, lo
+        relee con cargar()."""
+        with self._lock:
+            hit = self._datos.get(nombre)
+            if hit is not None and time.monotonic() - hit[1] < self.ttl:
+                return hit[0]
+        valor = cargar() or {}
+        if valor:
+            with self._lock:
+                self._datos[nombre] = (valor, time.monotonic())
+        return valor
+
+    def invalidar(self, nombre):
+        with self._lock:
+            self._datos.pop(nombre, None)
@@ -0,0 +1,214 @@
+"""
+YACHAY PRO — Paquetes ZIP de la Academia CEPRU en paralelo
+El Centro de Descargas generaba cada ficha, cada examen de 20/40
+preguntas (alumno y docente) y el banco completo de TODOS los temas uno
+tras otro, en el hilo de la página, dentro de un ZIP en memoria: un
+curso de 16 balotas con todo marcado son ~100 documentos ReportLab y
+la página quedaba congelada varios minutos.
+
+Aquí:
+    - cada documento es una tarea (generador, args, kwargs) que se
+      genera en un ProcessPoolExecutor (ReportLab y pypdf son CPU puro,
+      los hilos no ayudan por el GIL)
+    - lo que ya está en la caché de PDFs (cache_pdfs.py) no se vuelve a
+      generar, y lo nuevo se guarda ahí para la próxima vez
+    - cada PDF terminado se escribe al ZIP en disco apenas llega: en
+      memoria solo están los documentos en vuelo
+    - el progreso es por documento terminado, no por tema empezado
+Si no se puede abrir el pool (entorno sin procesos hijos), se genera en
+el mismo proceso, igual que antes.
+
+Este módulo no depende de Streamlit: academia_cepru.py arma la lista de
+documentos y le pasa la caché del proceso (st.cache_resource).
+"""
+import multiprocessing
+import os
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+CARPETA_DEFECTO = "paquetes_cepru"
+HORAS_CONSERVAR = 12
+
+
+def _renderizar(generador, args, kwargs):
+    """Se ejecuta en el proceso hijo. Devuelve (datos, segundos)."""
+    t0 = time.monotonic()
+    return generador(*args, **kwargs), time.monotonic() - t0
+
+
+def _contexto():
+    # forkserver: los hijos no heredan los hilos del servidor Streamlit
+    try:
+        return multiprocessing.get_context("forkserver")
+    except ValueError:
+        return multiprocessing.get_context("spawn")
+
+
+def procesos_defecto():
+    return max(1, min((os.cpu_count() or 2) - 1, 6))
+
+
+def _en_paralelo(pendientes, procesos, entregar, hechos):
+    """Genera pendientes[i] en el pool con a lo sumo 2×procesos
+    documentos en vuelo. Anota en `hechos` los índices ya entregados."""
+    cola = [i for i in reversed(range(len(pendientes))) if i not in hechos]
+    with ProcessPoolExecutor(max_workers=procesos, mp_context=_contexto()) as pool:
+        en_curso = {}
+        while cola or en_curso:
+            while cola and len(en_curso) < 2 * procesos:
+                i = cola.pop()
+                _, generador, args, kwargs, _ = pendientes[i]
+                en_curso[pool.submit(_renderizar, generador, args, kwargs)] = i
+            listos, _ = wait(en_curso, return_when=FIRST_COMPLETED)
+            for fut in listos:
+                i = en_curso.pop(fut)
+                try:
+                    datos, segundos = fut.result()
+                except BrokenProcessPool:
+                    raise
+                except Exception:
+                    datos, segundos = None, 0.0
+                hechos.add(i)
+                entregar(pendientes[i], datos, segundos)
+
+
+def renderizar(tareas, cache=None, procesos=None, al_terminar=None):
+    """Genera [(id, generador, args, kwargs), ...] y llama a
+    al_terminar(id, datos, desde_cache) en este hilo a medida que cada
+    documento está listo (datos=None si falló). El orden de llegada no
+    es el de `tareas`.
+
+    Con caché, cada documento a generar se reserva con el lock por clave
+    de CachePDF: si otro paquete (otro admin) ya lo está generando, se
+    espera al final y se lee de la caché en vez de generarlo dos veces."""
+    procesos = procesos or procesos_defecto()
+    pendientes, en_espera = [], []
+    reservas = {}           # clave → lock tomado con cache.reservar()
+
+    def _desde_cache(id_, clave):
+        datos = cache.leer(clave)
+        if datos is not None and al_terminar:
+            al_terminar(id_, datos, True)
+        return datos is not None
+
+    def _entregar(pendiente, datos, segundos):
+        id_, _, _, _, clave = pendiente
+        if cache:
+            cache.registrar_generado(clave, datos, segundos)
+            lock_clave = reservas.pop(clave, None)
+            if lock_clave is not None:
+                cache.liberar(clave, lock_clave)
+        if al_terminar:
+            al_terminar(id_, datos, False)
+
+    def _generar_aqui(pendiente):
+        _, generador, args, kwargs, _ = pendiente
+        t0 = time.monotonic()
+        try:
+            datos = generador(*args, **kwargs)
+        except Exception:
+            datos = None
+        _entregar(pendiente, datos, time.monotonic() - t0)
+
+    try:
+        for id_, generador, args, kwargs in tareas:
+            if not cache:
+                pendientes.append((id_, generador, args, kwargs, None))
+                continue
+            clave = cache.clave(generador, *args, **kwargs)
+            if clave in reservas:
+                # Repetido dentro del mismo paquete
+                en_espera.append((id_, generador, args, kwargs, clave))
+            elif _desde_cache(id_, clave):
+                continue
+            else:
+                lock_clave = cache.reservar(clave, esperar=False)
+                if lock_clave is None:
+                    en_espera.append((id_, generador, args, kwargs, clave))
+                elif _desde_cache(id_, clave):
+                    # Otro lo terminó entre la lectura y la reserva
+                    cache.liberar(clave, lock_clave)
+                else:
+                    reservas[clave] = lock_clave
+                    pendientes.append((id_, generador, args, kwargs, clave))
+
+        hechos = set()
+        if pendientes and procesos > 1:
+            try:
+                _en_paralelo(pendientes, procesos, _entregar, hechos)
+            except (OSError, NotImplementedError, BrokenProcessPool):
+                pass
+        for i, pendiente in enumerate(pendientes):
+            if i not in hechos:
+                _generar_aqui(pendiente)
+
+        # Los que estaba generando otro: esperar su lock y leerlos
+        for pendiente in en_espera:
+            id_, _, _, _, clave = pendiente
+            lock_clave = cache.reservar(clave)
+            if _desde_cache(id_, clave):
+                cache.liberar(clave, lock_clave)
+            else:
+                reservas[clave] = lock_clave
+                _generar_aqui(pendiente)
+    finally:
+        for clave, lock_clave in reservas.items():
+            cache.liberar(clave, lock_clave)
+
+
+def limpiar_viejos(carpeta=CARPETA_DEFECTO, horas=HORAS_CONSERVAR):
+    """Borra los paquetes (y restos .tmp) de hace más de `horas`."""
+    limite = time.time() - horas * 3600
+    try:
+        for e in os.scandir(carpeta):
+            if e.is_file() and e.stat().st_mtime < limite:
+                try:
+                    os.remove(e.path)
+                except OSError:
+                    pass
+    except OSError:
+        pass
+
+
+def construir_paquete(documentos, destino, cache=None, procesos=None,
+                      reportar_progreso=None):
+    """Genera [(nombre_en_zip, generador, args, kwargs), ...] y los
+    escribe en el ZIP `destino` a medida que terminan. El ZIP aparece
+    completo de una vez (archivo temporal + os.replace).
+    'reportar_progreso' es un callback(fraccion, texto) opcional.
+    Devuelve {'archivos', 'errores', 'desde_cache', 'segundos'}."""
+    destino = Path(destino)
+    destino.parent.mkdir(parents=True, exist_ok=True)
+    tmp = destino.with_name(f"{destino.name}.{os.getpid()}.tmp")
+    total = len(documentos)
+    res = {'archivos': 0, 'errores': 0, 'desde_cache': 0, 'segundos': 0.0}
+    t0 = time.monotonic()
+
+    try:
+        with zipfile.ZipFile(tmp, "w", zipfile.ZIP_DEFLATED) as zf:
+            def _escribir(nombre, datos, desde_cache):
+                if isinstance(datos, (bytes, bytearray)) and datos:
+                    zf.writestr(nombre, bytes(datos))
+                    res['archivos'] += 1
+                    res['desde_cache'] += desde_cache
+                else:
+                    res['errores'] += 1
+                if reportar_progreso:
+                    hechos = res['archivos'] + res['errores']
+                    reportar_progreso(hechos / max(total, 1),
+                                      f"{nombre} ({hechos}/{total})")
+
+            renderizar(documentos, cache=cache, procesos=procesos,
+                       al_terminar=_escribir)
+        os.replace(tmp, destino)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    res['segundos'] = round(time.monotonic() - t0, 1)
+    return res
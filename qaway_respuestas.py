@@ -0,0 +1,277 @@
+"""
+YACHAY PRO — Respuestas de YACHAY QAWAY en memoria (una vez por proceso)
+Antes cada respuesta releía y reescribía todo resp_<sesion>.json (con
+indent=2), la vista del proyector lo volvía a leer en cada recarga y, con
+dos celulares escaneando a la vez, una escritura pisaba a la otra.
+
+AgregadorQaway guarda, por sesión:
+    - las respuestas por alumno (mismo formato que resp_<sesion>.json)
+    - contadores vivos por pregunta: cuántos A/B/C/D, cuántas correctas
+    - las correctas acumuladas por alumno (para el podio)
+Cada respuesta nueva es una línea en resp_<sesion>.jsonl (solo-agregar,
+un write() O_APPEND por lote: seguro entre hilos y procesos) y un ajuste
+O(1) de los contadores bajo un lock.
+
+La subida a Google Sheets se agrupa: una sesión con respuestas nuevas se
+sube cuando pasan `espera` segundos sin respuestas (o `espera_max` desde
+la primera pendiente), todas las sesiones listas en una sola llamada.
+
+Este módulo no depende de Streamlit: sistema_web.py mantiene la instancia
+del proceso (st.cache_resource) y le pasa la función que sube a Sheets.
+"""
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+OPCIONES = ('A', 'B', 'C', 'D')
+
+
+class SesionQaway:
+    """Respuestas y contadores de una sesión. resp_<id>.json es la base
+    (sesiones antiguas o restauradas desde Sheets) y resp_<id>.jsonl el
+    diario de respuestas nuevas, que se aplica encima."""
+
+    def __init__(self, sesion_id, carpeta):
+        self.sesion_id = sesion_id
+        carpeta = Path(carpeta)
+        self._ruta_base = carpeta / f"resp_{sesion_id}.json"
+        self._ruta_log = carpeta / f"resp_{sesion_id}.jsonl"
+        self._lock = threading.RLock()
+        self._firma_base = None
+        self._offset = 0
+        self.version = 0
+        self._reiniciar()
+
+    def _reiniciar(self):
+        self._alumnos = {}       # dni → {'nombre', 'respuestas': {p: item}}
+        self._preguntas = {}     # p → {'conteo', 'correctas', 'alumnos'}
+        self._correctas = {}     # dni → correctas acumuladas
+        self._offset = 0
+        self.version += 1
+
+    # ------------------------------------------------------------
+    # Aplicar respuestas
+    # ------------------------------------------------------------
+    def _aplicar(self, dni, nombre, pregunta, resp, correcta):
+        dni, p = str(dni), str(pregunta)
+        alumno = self._alumnos.get(dni)
+        if alumno is None:
+            alumno = self._alumnos[dni] = {'nombre': nombre or dni, 'respuestas': {}}
+        elif nombre:
+            alumno['nombre'] = nombre
+        q = self._preguntas.get(p)
+        if q is None:
+            q = self._preguntas[p] = {'conteo': dict.fromkeys(OPCIONES, 0),
+                                      'correctas': 0, 'alumnos': {}}
+        previo = alumno['respuestas'].get(p)
+        if previo is not None:
+            if previo['resp'] in q['conteo']:
+                q['conteo'][previo['resp']] -= 1
+            q['correctas'] -= bool(previo['ok'])
+            self._correctas[dni] -= bool(previo['ok'])
+        item = {'resp': resp, 'correcta': correcta, 'ok': resp == correcta}
+        alumno['respuestas'][p] = item
+        q['alumnos'][dni] = item
+        if resp in q['conteo']:
+            q['conteo'][resp] += 1
+        q['correctas'] += item['ok']
+        self._correctas[dni] = self._correctas.get(dni, 0) + item['ok']
+        self.version += 1
+
+    def _refrescar(self):
+        """Aplica lo que otros procesos agregaron al diario; si la base
+        cambió (restauración desde Sheets) reconstruye todo."""
+        try:
+            firma = self._ruta_base.stat().st_mtime_ns
+        except OSError:
+            firma = None
+        try:
+            tam = self._ruta_log.stat().st_size
+        except OSError:
+            tam = 0
+        if firma != self._firma_base or tam < self._offset:
+            self._reiniciar()
+            self._firma_base = firma
+            if firma is not None:
+                try:
+                    with open(self._ruta_base, 'r', encoding='utf-8') as f:
+                        base = json.load(f)
+                except Exception:
+                    base = {}
+                for dni, datos in (base.items() if isinstance(base, dict) else []):
+                    for p, item in (datos.get('respuestas') or {}).items():
+                        self._aplicar(dni, datos.get('nombre', ''), p,
+                                      item.get('resp', ''), item.get('correcta', ''))
+        if tam > self._offset:
+            with open(self._ruta_log, 'rb') as f:
+                f.seek(self._offset)
+                nuevo = f.read()
+            fin = nuevo.rfind(b'\n') + 1
+            for linea in nuevo[:fin].splitlines():
+                try:
+                    ev = json.loads(linea)
+                    self._aplicar(ev['dni'], ev.get('nombre', ''), ev['p'],
+                                  ev['resp'], ev.get('correcta', ''))
+                except Exception:
+                    continue
+            self._offset += fin
+
+    def registrar(self, pregunta, correcta, lecturas):
+        """Agrega las respuestas [(dni, nombre, opción), ...] a una
+        pregunta con un solo write() al diario."""
+        lineas = b''.join(
+            (json.dumps({'dni': str(dni), 'nombre': nombre, 'p': str(pregunta),
+                         'resp': resp, 'correcta': correcta},
+                        ensure_ascii=False) + '\n').encode('utf-8')
+            for dni, nombre, resp in lecturas)
+        if not lineas:
+            return
+        with self._lock:
+            self._ruta_log.parent.mkdir(parents=True, exist_ok=True)
+            fd = os.open(self._ruta_log, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, lineas)
+            finally:
+                os.close(fd)
+            # Lee desde el último offset: aplica lo propio y lo ajeno en orden
+            self._refrescar()
+
+    # ------------------------------------------------------------
+    # Consultas
+    # ------------------------------------------------------------
+    def pregunta(self, pregunta):
+        """Contadores vivos de una pregunta: {'conteo': {A,B,C,D},
+        'respondieron', 'correctas', 'pct_correctas', 'alumnos': [{dni,
+        nombre, resp, ok}] en orden de llegada}."""
+        with self._lock:
+            self._refrescar()
+            q = self._preguntas.get(str(pregunta))
+            if q is None:
+                return {'conteo': dict.fromkeys(OPCIONES, 0), 'respondieron': 0,
+                        'correctas': 0, 'pct_correctas': 0.0, 'alumnos': []}
+            n = len(q['alumnos'])
+            return {'conteo': dict(q['conteo']), 'respondieron': n,
+                    'correctas': q['correctas'],
+                    'pct_correctas': round(q['correctas'] / n * 100, 1) if n else 0.0,
+                    'alumnos': [{'dni': d, 'nombre': self._alumnos[d]['nombre'],
+                                 'resp': it['resp'], 'ok': it['ok']}
+                                for d, it in q['alumnos'].items()]}
+
+    def puntajes(self):
+        """{dni: (nombre, correctas)} de todos los que respondieron."""
+        with self._lock:
+            self._refrescar()
+            return {d: (a['nombre'], self._correctas.get(d, 0))
+                    for d, a in self._alumnos.items()}
+
+    def respuestas(self):
+        """Copia en el formato de resp_<sesion>.json:
+        {dni: {'nombre', 'respuestas': {p: {'resp', 'correcta', 'ok'}}}}."""
+        with self._lock:
+            self._refrescar()
+            return {d: {'nombre': a['nombre'],
+                        'respuestas': {p: dict(it) for p, it in a['respuestas'].items()}}
+                    for d, a in self._alumnos.items()}
+
+
+class AgregadorQaway:
+    """Sesiones QAWAY del proceso + subida agrupada a Google Sheets.
+    `sincronizar({sesion_id: respuestas})` la pone quien crea el agregador;
+    si lanza una excepción, esas sesiones se reintentan en la próxima
+    ronda."""
+
+    def __init__(self, carpeta, sincronizar=None, espera=8.0, espera_max=30.0):
+        self.carpeta = Path(carpeta)
+        self._sincronizar = sincronizar
+        self.espera = espera
+        self.espera_max = espera_max
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._sesiones = {}
+        self._sucias = {}           # sesion_id → (primera, última) marca
+        self._hilo = None
+        self.stats = {'respuestas': 0, 'subidas': 0, 'sesiones_subidas': 0,
+                      'ultimo_error': ''}
+
+    def sesion(self, sesion_id):
+        sesion_id = str(sesion_id)
+        with self._lock:
+            s = self._sesiones.get(sesion_id)
+            if s is None:
+                s = self._sesiones[sesion_id] = SesionQaway(sesion_id, self.carpeta)
+            return s
+
+    def registrar(self, sesion_id, pregunta, correcta, lecturas):
+        """Guarda respuestas [(dni, nombre, opción), ...] y programa la
+        subida a Sheets."""
+        lecturas = list(lecturas)
+        self.sesion(sesion_id).registrar(pregunta, correcta, lecturas)
+        self._marcar(str(sesion_id), len(lecturas))
+
+    def _marcar(self, sesion_id, n=0):
+        if self._sincronizar is None:
+            return
+        ahora = time.monotonic()
+        with self._cond:
+            self.stats['respuestas'] += n
+            primera, _ = self._sucias.get(sesion_id, (ahora, ahora))
+            self._sucias[sesion_id] = (primera, ahora)
+            self._asegurar_hilo()
+            self._cond.notify()
+
+    def forzar(self, sesion_id):
+        """Sube la sesión en la próxima ronda, sin esperar."""
+        if self._sincronizar is None:
+            return
+        with self._cond:
+            self._sucias[str(sesion_id)] = (-1e9, -1e9)
+            self._asegurar_hilo()
+            self._cond.notify()
+
+    def pendientes(self):
+        with self._lock:
+            return sorted(self._sucias)
+
+    # ── Hilo de subida ───────────────────────────────────────────
+    def _asegurar_hilo(self):
+        if self._hilo is not None and self._hilo.is_alive():
+            return
+        self._hilo = threading.Thread(target=self._bucle, daemon=True,
+                                      name='yachay-qaway-sync')
+        self._hilo.start()
+
+    def _listas(self, ahora):
+        """(sesiones listas para subir, segundos hasta la próxima)."""
+        listas, proxima = [], None
+        for sid, (primera, ultima) in self._sucias.items():
+            vence = min(ultima + self.espera, primera + self.espera_max)
+            if vence <= ahora:
+                listas.append(sid)
+            elif proxima is None or vence - ahora < proxima:
+                proxima = vence - ahora
+        return listas, proxima
+
+    def _bucle(self):
+        while True:
+            with self._cond:
+                while True:
+                    listas, proxima = self._listas(time.monotonic())
+                    if listas:
+                        break
+                    self._cond.wait(proxima)
+                for sid in listas:
+                    del self._sucias[sid]
+            lote = {sid: self.sesion(sid).respuestas() for sid in listas}
+            try:
+                self._sincronizar(lote)
+                self.stats['subidas'] += 1
+                self.stats['sesiones_subidas'] += len(lote)
+            except Exception as e:
+                self.stats['ultimo_error'] = str(e)[:200]
+                ahora = time.monotonic()
+                with self._cond:
+                    for sid in lote:
+                        self._sucias.setdefault(sid, (ahora, ahora))
+                time.sleep(self.espera)
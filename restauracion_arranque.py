@@ -0,0 +1,193 @@
+"""
+YACHAY PRO — Restauración de datos al arrancar (una vez por proceso)
+En Streamlit Cloud el disco se borra en cada reinicio: al arrancar hay que
+traer de Google Sheets / Drive los JSON, escudos, fondo y MP3. Antes se
+hacía en el hilo de la interfaz, en serie y en CADA sesión nueva.
+
+OrquestadorArranque ejecuta los pasos una sola vez por proceso, en segundo
+plano, con un pool de hilos: los pasos independientes (un archivo binario,
+un backup de Drive) van en paralelo y cada uno espera solo a los pasos de
+los que depende. Guarda el tiempo de cada paso para el panel del admin.
+
+ManifiestoRestauracion recuerda qué versión (sha256, modifiedTime de
+Drive, hash del valor en Config) se restauró en cada archivo local, para
+no volver a bajar lo que ya está al día.
+
+Este módulo no depende de Streamlit: sistema_web.py registra los pasos.
+"""
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+
+ARCHIVO_MANIFIESTO = "restauracion_manifiesto.json"
+
+
+# ================================================================
+# MANIFIESTO DE VERSIONES RESTAURADAS
+# ================================================================
+def _firma(ruta):
+    try:
+        st_r = os.stat(ruta)
+    except OSError:
+        return None
+    return [st_r.st_mtime_ns, st_r.st_size]
+
+
+class ManifiestoRestauracion:
+    """{ruta local: {'version', 'firma'}} persistido en un JSON."""
+
+    def __init__(self, archivo=ARCHIVO_MANIFIESTO):
+        self.archivo = Path(archivo)
+        self._lock = threading.Lock()
+        try:
+            with open(self.archivo, 'r', encoding='utf-8') as f:
+                self._entradas = json.load(f)
+        except Exception:
+            self._entradas = {}
+
+    def debe_restaurar(self, ruta, version):
+        """True si hay que traer `version` a `ruta`:
+            - el archivo local no existe, o
+            - lo restauramos nosotros, no se tocó desde entonces y la
+              versión remota es otra.
+        Un archivo local que no figura en el manifiesto, o que cambió
+        después de restaurarlo, se respeta (lo local es más nuevo)."""
+        firma = _firma(ruta)
+        if firma is None:
+            return True
+        if version is None:
+            return False
+        with self._lock:
+            entrada = self._entradas.get(str(ruta))
+        if entrada is None or entrada.get('firma') != firma:
+            return False
+        return entrada.get('version') != version
+
+    def version(self, ruta):
+        """Versión con la que restauramos `ruta`, o None si no la
+        restauramos nosotros o si se modificó después."""
+        firma = _firma(ruta)
+        with self._lock:
+            entrada = self._entradas.get(str(ruta))
+        if firma is None or entrada is None or entrada.get('firma') != firma:
+            return None
+        return entrada.get('version')
+
+    def registrar(self, ruta, version):
+        """Anota que `ruta` quedó con `version` (llamar después de escribirla)."""
+        with self._lock:
+            self._entradas[str(ruta)] = {'version': version,
+                                         'firma': _firma(ruta)}
+            datos = json.dumps(self._entradas, ensure_ascii=False)
+            tmp = self.archivo.with_name(self.archivo.name + '.tmp')
+            try:
+                with open(tmp, 'w', encoding='utf-8') as f:
+                    f.write(datos)
+                os.replace(tmp, self.archivo)
+            except Exception:
+                pass
+
+
+# ================================================================
+# ORQUESTADOR
+# ================================================================
+class OrquestadorArranque:
+    """Grafo de pasos con dependencias, ejecutado una vez en un pool.
+
+    paso(nombre, funcion, depende=()) registra un paso; iniciar() los
+    ejecuta en segundo plano. Un paso que falla queda con su error y NO
+    bloquea a los que dependen de él (restaurar es siempre "lo que se
+    pueda"). `envolver(funcion)` permite a quien llama ajustar cada paso
+    (prioridad de la API, contexto del hilo)."""
+
+    def __init__(self, hilos=8, envolver=None):
+        self.hilos = hilos
+        self._envolver = envolver or (lambda funcion: funcion)
+        self._pasos = {}
+        self._orden = []
+        self._lock = threading.Lock()
+        self._listo = threading.Event()
+        self.inicio = None
+        self.fin = None
+
+    def paso(self, nombre, funcion, depende=()):
+        self._pasos[nombre] = {'funcion': funcion, 'depende': tuple(depende),
+                               'estado': 'pendiente', 'inicio': None,
+                               'duracion_s': None, 'resultado': None,
+                               'error': ''}
+        self._orden.append(nombre)
+
+    def iniciar(self, lanzar=None):
+        """Arranca la ejecución en un hilo. `lanzar(target)` permite usar
+        el lanzador de hilos de la app (por defecto, un Thread daemon)."""
+        if lanzar is None:
+            def lanzar(target):
+                t = threading.Thread(target=target, daemon=True,
+                                     name='yachay-restauracion')
+                t.start()
+                return t
+        lanzar(self._ejecutar)
+
+    def _correr(self, nombre):
+        paso = self._pasos[nombre]
+        t0 = time.monotonic()
+        with self._lock:
+            paso['estado'] = 'corriendo'
+            paso['inicio'] = t0 - self.inicio
+        try:
+            resultado = self._envolver(paso['funcion'])()
+            estado, error = 'ok', ''
+        except Exception as e:
+            resultado, estado, error = None, 'error', str(e)[:200]
+        with self._lock:
+            paso.update(estado=estado, resultado=resultado, error=error,
+                        duracion_s=time.monotonic() - t0)
+
+    def _ejecutar(self):
+        self.inicio = time.monotonic()
+        pendientes = list(self._orden)
+        hechos = set()
+        en_curso = {}
+        try:
+            with ThreadPoolExecutor(max_workers=self.hilos,
+                                    thread_name_prefix='yachay-restaurar') as pool:
+                while pendientes or en_curso:
+                    for nombre in [n for n in pendientes
+                                   if all(d in hechos or d not in self._pasos
+                                          for d in self._pasos[n]['depende'])]:
+                        pendientes.remove(nombre)
+                        en_curso[pool.submit(self._correr, nombre)] = nombre
+                    if not en_curso:
+                        # Dependencias circulares: no debería pasar
+                        for nombre in pendientes:
+                            self._pasos[nombre]['estado'] = 'omitido'
+                        break
+                    terminados, _ = wait(list(en_curso), return_when=FIRST_COMPLETED)
+                    for futuro in terminados:
+                        hechos.add(en_curso.pop(futuro))
+        finally:
+            self.fin = time.monotonic()
+            self._listo.set()
+
+    # ── Consulta ─────────────────────────────────────────────────
+    @property
+    def terminado(self):
+        return self._listo.is_set()
+
+    def esperar(self, timeout=None):
+        return self._listo.wait(timeout)
+
+    def estado(self):
+        """{'terminado', 'total_s', 'pasos': [{nombre, estado, inicio,
+        duracion_s, resultado, error}, ...]} en el orden de registro."""
+        with self._lock:
+            pasos = [dict(nombre=n, **{k: v for k, v in self._pasos[n].items()
+                                       if k not in ('funcion', 'depende')})
+                     for n in self._orden]
+        total = None
+        if self.inicio is not None:
+            total = (self.fin or time.monotonic()) - self.inicio
+        return {'terminado': self.terminado, 'total_s': total, 'pasos': pasos}
@@ -0,0 +1,887 @@
+"""
+YACHAY PRO — Google Sheets y Drive simulados (en el mismo proceso)
+Reemplazo local de gspread y de la API de Drive para medir y probar la app
+sin credenciales ni red: GoogleSync(simulado=GoogleSimulado(...)) usa estas
+hojas en memoria en lugar de las reales, con la misma superficie que usa
+google_sync (get_all_values, get_all_records, append_rows, update,
+update_cell, batch_update, find, delete_rows, deleteDimension...) y la de
+Drive (files().list/create/update/get_media, y la de _DriveLite de
+sistema_web: list_files/upload/update/descargar).
+
+Cada llamada pasa por un Simulador que agrega:
+    - latencia por llamada (por defecto 300–800 ms, como Sheets real)
+    - cuota por minuto de lecturas y de escrituras → error 429
+    - fallos inyectados (al azar o los próximos N) → 500 / 503
+
+Las llamadas de Sheets pasan por cliente.http_client.request(), igual que
+en gspread, así que PlanificadorAPI.instalar() las ordena, reintenta y
+cuenta exactamente como en producción.
+
+Activación sin tocar código (ver google_sync.get_google_sync):
+    YACHAY_GS_SIMULADO=1                  hojas vacías en memoria
+    YACHAY_GS_SIMULADO=datos_sim.sqlite3  estado persistido en SQLite
+    YACHAY_GS_LATENCIA_MS=300,800         YACHAY_GS_FALLOS=0.02
+    YACHAY_GS_CUOTA=60,60                 (lecturas, escrituras por minuto)
+
+Este módulo no depende de Streamlit ni de gspread.
+"""
+import itertools
+import json
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+
+# ================================================================
+# ERRORES (mismo aspecto que gspread.exceptions.APIError)
+# ================================================================
+class _Respuesta:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class ErrorAPISimulado(Exception):
+    """Error de la API con error.response.status_code, que es lo que
+    mira PlanificadorAPI para decidir si reintenta."""
+
+    def __init__(self, codigo, mensaje=''):
+        super().__init__(f"APIError [{codigo}]: {mensaje or 'error simulado'}")
+        self.codigo = codigo
+        self.response = _Respuesta(codigo)
+
+
+class HojaNoEncontrada(Exception):
+    pass
+
+
+# ================================================================
+# SIMULADOR DE LATENCIA / CUOTA / FALLOS
+# ================================================================
+class Simulador:
+    """Decide cuánto tarda y cómo termina cada llamada.
+
+    latencia: (mín, máx) en segundos, uniforme. Las descargas y subidas
+    de Drive suman `seg_por_mb` por cada MB transferido.
+    lecturas_por_min / escrituras_por_min: ventana deslizante de 60 s,
+    None = sin límite. Drive no tiene cuota simulada.
+    prob_fallo: probabilidad de que una llamada termine en 500/503."""
+
+    def __init__(self, latencia=(0.3, 0.8), lecturas_por_min=60,
+                 escrituras_por_min=60, prob_fallo=0.0,
+                 codigos_fallo=(500, 503), seg_por_mb=0.1, semilla=None,
+                 dormir=time.sleep):
+        self.latencia = tuple(latencia)
+        self.limites = {'lectura': lecturas_por_min,
+                        'escritura': escrituras_por_min, 'drive': None}
+        self.prob_fallo = prob_fallo
+        self.codigos_fallo = tuple(codigos_fallo)
+        self.seg_por_mb = seg_por_mb
+        self._dormir = dormir
+        self._rnd = random.Random(semilla)
+        self._lock = threading.Lock()
+        self._ventanas = {tipo: deque() for tipo in self.limites}
+        self._forzados = deque()
+        self.stats = {'lecturas': 0, 'escrituras': 0, 'drive': 0,
+                      'errores_429': 0, 'fallos': 0, 'latencia_total_s': 0.0}
+
+    @classmethod
+    def desde_entorno(cls):
+        """Simulador configurado con las variables YACHAY_GS_* (ver el
+        docstring del módulo)."""
+        kwargs = {}
+        try:
+            lat = os.environ.get('YACHAY_GS_LATENCIA_MS')
+            if lat:
+                partes = [float(x) / 1000 for x in lat.split(',')]
+                kwargs['latencia'] = (partes[0], partes[-1])
+            cuota = os.environ.get('YACHAY_GS_CUOTA')
+            if cuota:
+                partes = [int(x) or None for x in cuota.split(',')]
+                kwargs['lecturas_por_min'] = partes[0]
+                kwargs['escrituras_por_min'] = partes[-1]
+            fallos = os.environ.get('YACHAY_GS_FALLOS')
+            if fallos:
+                kwargs['prob_fallo'] = float(fallos)
+        except ValueError:
+            pass
+        return cls(**kwargs)
+
+    def fallar_proximas(self, n=1, codigo=503):
+        """Las próximas `n` llamadas (de cualquier tipo) fallan con `codigo`."""
+        with self._lock:
+            self._forzados.extend([codigo] * n)
+
+    def llamada(self, tipo, tam=0):
+        """Simula una llamada de `tipo` ('lectura', 'escritura', 'drive')
+        que transfiere `tam` bytes. Duerme la latencia y lanza
+        ErrorAPISimulado si le toca fallar."""
+        ahora = time.monotonic()
+        with self._lock:
+            limite = self.limites.get(tipo)
+            ventana = self._ventanas[tipo]
+            while ventana and ahora - ventana[0] >= 60:
+                ventana.popleft()
+            if limite is not None and len(ventana) >= limite:
+                # Sheets responde el 429 de inmediato
+                self.stats['errores_429'] += 1
+                raise ErrorAPISimulado(429, 'Quota exceeded (simulado)')
+            ventana.append(ahora)
+            self.stats['lecturas' if tipo == 'lectura' else
+                       'escrituras' if tipo == 'escritura' else 'drive'] += 1
+            if self._forzados:
+                codigo = self._forzados.popleft()
+            elif self.prob_fallo and self._rnd.random() < self.prob_fallo:
+                codigo = self._rnd.choice(self.codigos_fallo)
+            else:
+                codigo = None
+            espera = (self._rnd.uniform(*self.latencia)
+                      + self.seg_por_mb * tam / (1024 * 1024))
+            self.stats['latencia_total_s'] += espera
+        if espera > 0:
+            self._dormir(espera)
+        if codigo is not None:
+            with self._lock:
+                self.stats['fallos'] += 1
+            raise ErrorAPISimulado(codigo, 'Backend error (simulado)')
+
+    def resumen(self):
+        with self._lock:
+            return dict(self.stats)
+
+
+# ================================================================
+# NOTACIÓN A1
+# ================================================================
+_RE_CELDA = re.compile(r'^([A-Z]*)(\d*)$')
+
+
+def _col_a_num(letras):
+    n = 0
+    for c in letras:
+        n = n * 26 + ord(c) - 64
+    return n
+
+
+def _num_a_col(n):
+    letras = ''
+    while n:
+        n, r = divmod(n - 1, 26)
+        letras = chr(65 + r) + letras
+    return letras
+
+
+def _rango(a1):
+    """"'Hoja'!A2:C5", 'A:B', 'B3' → (fila1, col1, fila2, col2), 1-based.
+    fila2/col2 = None: sin límite (o, en una sola celda, según los datos)."""
+    a1 = a1.split('!')[-1].replace('$', '').upper()
+    partes = a1.split(':')
+    celdas = []
+    for p in (partes[0], partes[-1]):
+        m = _RE_CELDA.match(p.strip())
+        if m is None:
+            raise ErrorAPISimulado(400, f"Rango inválido: {a1}")
+        letras, num = m.groups()
+        celdas.append((int(num) if num else None,
+                       _col_a_num(letras) if letras else None))
+    (f1, c1), (f2, c2) = celdas
+    if len(partes) == 1:
+        f2 = c2 = None
+    return f1 or 1, c1 or 1, f2, c2
+
+
+def _texto(valor):
+    """Valor tal como lo devuelve Sheets al leer (FORMATTED_VALUE, RAW)."""
+    if valor is None:
+        return ''
+    if isinstance(valor, bool):
+        return 'TRUE' if valor else 'FALSE'
+    if isinstance(valor, float) and valor.is_integer():
+        return str(int(valor))
+    return str(valor)
+
+
+def _numerico(valor):
+    """Conversión de get_all_records (numericise de gspread)."""
+    if valor == '':
+        return valor
+    try:
+        return int(valor)
+    except ValueError:
+        pass
+    try:
+        return float(valor)
+    except ValueError:
+        return valor
+
+
+def _sin_vacios_al_final(fila):
+    fin = len(fila)
+    while fin and fila[fin - 1] == '':
+        fin -= 1
+    return fila[:fin]
+
+
+# ================================================================
+# TRANSPORTE (equivalente a gspread.http_client.HTTPClient)
+# ================================================================
+class _Operacion:
+    """Lo que hace una llamada. Su repr es estable (método + hoja +
+    rango) para que PlanificadorAPI pueda unir lecturas idénticas."""
+    __slots__ = ('funcion', 'descripcion')
+
+    def __init__(self, funcion, descripcion):
+        self.funcion = funcion
+        self.descripcion = descripcion
+
+    def __call__(self):
+        return self.funcion()
+
+    def __repr__(self):
+        return self.descripcion
+
+
+class _HttpSimulado:
+    def __init__(self, simulador):
+        self.simulador = simulador
+
+    def request(self, method, endpoint, operacion=None):
+        self.simulador.llamada('lectura' if method == 'GET' else 'escritura')
+        return operacion()
+
+
+# ================================================================
+# SHEETS
+# ================================================================
+class Celda:
+    def __init__(self, row, col, value):
+        self.row = row
+        self.col = col
+        self.value = value
+
+
+class HojaSimulada:
+    """Pestaña de una hoja de cálculo (equivalente a gspread.Worksheet)."""
+
+    def __init__(self, libro, titulo, id_hoja, filas=None):
+        self.spreadsheet = libro
+        self.title = titulo
+        self.id = id_hoja
+        self._filas = [list(f) for f in (filas or [])]
+
+    def __repr__(self):
+        return f"<HojaSimulada {self.title!r} id:{self.id}>"
+
+    @property
+    def row_count(self):
+        return max(len(self._filas), 1000)
+
+    @property
+    def col_count(self):
+        return max([len(f) for f in self._filas] + [26])
+
+    def _llamar(self, metodo, accion, funcion, rango=''):
+        return self.spreadsheet._llamar(
+            metodo, f"{accion} '{self.title}'!{rango}", funcion)
+
+    # ── Acceso a la grilla (sin simulación: ya dentro de la llamada) ──
+    def _ultima_fila(self):
+        n = len(self._filas)
+        while n and not any(v != '' for v in self._filas[n - 1]):
+            n -= 1
+        return n
+
+    def _leer(self, f1, c1, f2, c2):
+        filas = self._filas[f1 - 1:f2 if f2 else None]
+        valores = [_sin_vacios_al_final(f[c1 - 1:c2 if c2 else None])
+                   for f in filas]
+        while valores and not valores[-1]:
+            valores.pop()
+        return valores
+
+    def _escribir(self, f1, c1, valores):
+        for i, fila in enumerate(valores):
+            r = f1 - 1 + i
+            while len(self._filas) <= r:
+                self._filas.append([])
+            destino = self._filas[r]
+            for j, v in enumerate(fila):
+                c = c1 - 1 + j
+                if len(destino) <= c:
+                    destino.extend([''] * (c + 1 - len(destino)))
+                destino[c] = _texto(v)
+        fin_f = f1 + max(len(valores), 1) - 1
+        fin_c = c1 + max([len(f) for f in valores] + [1]) - 1
+        return (f"'{self.title}'!{_num_a_col(c1)}{f1}:"
+                f"{_num_a_col(fin_c)}{fin_f}")
+
+    def _agregar(self, valores):
+        inicio = self._ultima_fila() + 1
+        rango = self._escribir(inicio, 1, valores)
+        return {'spreadsheetId': self.spreadsheet.id,
+                'tableRange': f"'{self.title}'!A1",
+                'updates': {'spreadsheetId': self.spreadsheet.id,
+                            'updatedRange': rango,
+                            'updatedRows': len(valores)}}
+
+    # ── Lectura ──────────────────────────────────────────────────
+    def get_all_values(self, **kwargs):
+        valores = self._llamar('GET', 'values', lambda: self._leer(1, 1, None, None))
+        ancho = max([len(f) for f in valores] + [0])
+        return [list(f) + [''] * (ancho - len(f)) for f in valores]
+
+    get_values = get_all_values
+
+    def get_all_records(self, head=1, default_blank='', numericise_ignore=(),
+                        **kwargs):
+        valores = self.get_all_values()
+        if len(valores) < head:
+            return []
+        encabezado = valores[head - 1]
+        ignorar = set(numericise_ignore)
+        registros = []
+        for fila in valores[head:]:
+            reg = {}
+            for i, col in enumerate(encabezado):
+                v = fila[i] if i < len(fila) else ''
+                if v == '':
+                    reg[col] = default_blank
+                elif 'all' in ignorar or (i + 1) in ignorar:
+                    reg[col] = v
+                else:
+                    reg[col] = _numerico(v)
+            registros.append(reg)
+        return registros
+
+    def get(self, rango, **kwargs):
+        limites = _rango(rango)
+        return self._llamar('GET', 'values', lambda: self._leer(*limites), rango)
+
+    def row_values(self, fila, **kwargs):
+        valores = self._llamar('GET', 'values',
+                               lambda: self._leer(fila, 1, fila, None), str(fila))
+        return list(valores[0]) if valores else []
+
+    def col_values(self, col, **kwargs):
+        letra = _num_a_col(col)
+        valores = self._llamar('GET', 'values',
+                               lambda: self._leer(1, col, None, col), letra)
+        return [f[0] if f else '' for f in valores]
+
+    def find(self, query, in_row=None, in_column=None, case_sensitive=True):
+        """Primera celda igual a `query` (None si no está), como gspread 6."""
+        def buscar():
+            q = query if case_sensitive else str(query).lower()
+            for r, fila in enumerate(self._filas, start=1):
+                if in_row and r != in_row:
+                    continue
+                for c, v in enumerate(fila, start=1):
+                    if in_column and c != in_column:
+                        continue
+                    if (v if case_sensitive else v.lower()) == q:
+                        return Celda(r, c, v)
+            return None
+        return self._llamar('GET', 'values', buscar, f"find:{query}")
+
+    # ── Escritura ────────────────────────────────────────────────
+    def append_row(self, values, value_input_option='RAW', **kwargs):
+        return self.append_rows([values], value_input_option)
+
+    def append_rows(self, values, value_input_option='RAW', **kwargs):
+        filas = [list(f) for f in values]
+        return self._llamar('POST', 'append', lambda: self._agregar(filas))
+
+    def update(self, values=None, range_name=None, value_input_option='RAW',
+               **kwargs):
+        # Acepta también el orden antiguo update('A1:C1', [[...]])
+        if isinstance(values, str) and not isinstance(range_name, str):
+            values, range_name = range_name, values
+        f1, c1, _, _ = _rango(range_name or 'A1')
+        filas = [list(f) for f in values]
+
+        def escribir():
+            return {'updatedRange': self._escribir(f1, c1, filas)}
+        return self._llamar('PUT', 'values', escribir, range_name or 'A1')
+
+    def update_cell(self, row, col, value):
+        return self._llamar('PUT', 'values',
+                            lambda: self._escribir(row, col, [[value]]),
+                            f"{_num_a_col(col)}{row}")
+
+    def batch_update(self, data, value_input_option='RAW', **kwargs):
+        pedidos = [(_rango(d['range']), [list(f) for f in d['values']])
+                   for d in data]
+
+        def escribir():
+            return {'totalUpdatedCells': sum(
+                len(f) for _, vals in pedidos for f in vals),
+                'responses': [{'updatedRange': self._escribir(f1, c1, vals)}
+                              for (f1, c1, _, _), vals in pedidos]}
+        return self._llamar('POST', 'values:batchUpdate', escribir)
+
+    def clear(self):
+        def limpiar():
+            self._filas = []
+        return self._llamar('POST', 'values:clear', limpiar)
+
+    def delete_rows(self, start_index, end_index=None):
+        fin = end_index or start_index
+
+        def borrar():
+            del self._filas[start_index - 1:fin]
+        return self._llamar('POST', 'batchUpdate', borrar,
+                            f"{start_index}:{fin}")
+
+
+class LibroSimulado:
+    """Hoja de cálculo (equivalente a gspread.Spreadsheet)."""
+
+    def __init__(self, cliente, titulo, id_libro):
+        self.client = cliente
+        self.title = titulo
+        self.id = id_libro
+        self._hojas = {}
+        self._ids = itertools.count(1)
+
+    def _llamar(self, metodo, descripcion, funcion):
+        # Un lock por libro: Sheets aplica cada request de forma atómica
+        def atomica():
+            with self.client._lock:
+                return funcion()
+        return self.client.http_client.request(
+            metodo, f"spreadsheets/{self.id}",
+            operacion=_Operacion(atomica, f"{metodo} {descripcion}"))
+
+    def _crear_hoja(self, titulo, filas=None):
+        hoja = HojaSimulada(self, titulo, next(self._ids), filas)
+        self._hojas[titulo] = hoja
+        return hoja
+
+    def worksheets(self):
+        return self._llamar('GET', 'metadata', lambda: list(self._hojas.values()))
+
+    def worksheet(self, titulo):
+        hoja = self._llamar('GET', f"metadata {titulo}",
+                            lambda: self._hojas.get(titulo))
+        if hoja is None:
+            raise HojaNoEncontrada(titulo)
+        return hoja
+
+    def add_worksheet(self, title, rows=1000, cols=26, **kwargs):
+        def crear():
+            if title in self._hojas:
+                raise ErrorAPISimulado(400, f"Ya existe la hoja {title!r}")
+            return self._crear_hoja(title)
+        return self._llamar('POST', 'addSheet', crear)
+
+    def batch_update(self, body):
+        """Solo deleteDimension (lo único que usa la app), aplicado en
+        orden como lo hace Sheets."""
+        def aplicar():
+            por_id = {h.id: h for h in self._hojas.values()}
+            for pedido in body.get('requests', []):
+                borrar = pedido.get('deleteDimension')
+                if borrar is None:
+                    raise ErrorAPISimulado(400, f"Pedido no simulado: {list(pedido)}")
+                r = borrar['range']
+                hoja = por_id.get(r.get('sheetId'))
+                if hoja is None or r.get('dimension') != 'ROWS':
+                    raise ErrorAPISimulado(400, 'deleteDimension inválido')
+                del hoja._filas[r['startIndex']:r['endIndex']]
+            return {'spreadsheetId': self.id,
+                    'replies': [{} for _ in body.get('requests', [])]}
+        return self._llamar('POST', 'batchUpdate', aplicar)
+
+
+class ClienteSimulado:
+    """Equivalente a gspread.Client. `http_client.request` es el punto que
+    envuelve PlanificadorAPI.instalar()."""
+
+    def __init__(self, simulador):
+        self.http_client = _HttpSimulado(simulador)
+        self._lock = threading.RLock()
+        self._libros = {}
+
+    def _libro(self, clave, titulo):
+        libro = self._libros.get(clave)
+        if libro is None:
+            libro = self._libros[clave] = LibroSimulado(
+                self, titulo, f"sim-{len(self._libros) + 1}")
+        return libro
+
+    def open(self, title):
+        return self._libro(title, title)
+
+    def open_by_key(self, key):
+        return self._libro(key, key)
+
+
+# ================================================================
+# DRIVE
+# ================================================================
+_RE_FILTRO = re.compile(
+    r"^\s*(?:(name|mimeType)\s*(=|contains)\s*'(.*)'|"
+    r"trashed\s*=\s*(true|false)|'(.*)'\s+in\s+parents)\s*$")
+
+
+def _filtro_drive(q):
+    """Función archivo → bool para el subconjunto de la sintaxis `q` de
+    Drive que usa la app (cláusulas unidas por ' and ')."""
+    condiciones = []
+    for clausula in (q or '').split(' and '):
+        if not clausula.strip():
+            continue
+        m = _RE_FILTRO.match(clausula)
+        if m is None:
+            raise ErrorAPISimulado(400, f"Consulta no simulada: {clausula}")
+        campo, op, valor, trashed, padre = m.groups()
+        if campo:
+            if op == '=':
+                condiciones.append(lambda a, c=campo, v=valor: a[c] == v)
+            else:
+                condiciones.append(lambda a, c=campo, v=valor: v in a[c])
+        elif trashed:
+            condiciones.append(lambda a, t=(trashed == 'true'): a['trashed'] == t)
+        else:
+            condiciones.append(lambda a, p=padre: p in a['parents'])
+    return lambda archivo: all(c(archivo) for c in condiciones)
+
+
+def _ahora_iso():
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+
+class _Ejecutable:
+    def __init__(self, funcion):
+        self._funcion = funcion
+
+    def execute(self, **kwargs):
+        return self._funcion()
+
+
+class _SubidaSimulada(_Ejecutable):
+    """files().create/update con media_body: execute() de una vez, o
+    next_chunk() por partes (una llamada simulada por parte)."""
+
+    def __init__(self, drive, media, terminar):
+        super().__init__(self._todo)
+        self._drive = drive
+        self._media = media
+        self._terminar = terminar
+        self._buf = bytearray()
+        self._total = media.size() if media is not None else 0
+
+    def _todo(self):
+        resultado = None
+        while resultado is None:
+            _, resultado = self.next_chunk()
+        return resultado
+
+    def next_chunk(self, **kwargs):
+        if self._media is None:
+            self._drive._llamada()
+            return None, self._terminar(b'')
+        paso = self._media.chunksize() if self._media.resumable() else self._total
+        paso = max(paso, 1)
+        parte = self._media.getbytes(len(self._buf), paso)
+        self._drive._llamada(len(parte))
+        self._buf.extend(parte)
+        if len(self._buf) >= self._total:
+            return None, self._terminar(bytes(self._buf))
+        return len(self._buf) / max(self._total, 1), None
+
+
+class _Descarga:
+    """files().get_media(): execute() devuelve los bytes, y además expone
+    uri/headers/http para que MediaIoBaseDownload la baje por partes."""
+
+    def __init__(self, drive, file_id):
+        self._drive = drive
+        self.file_id = file_id
+        self.uri = f"sim://drive/{file_id}?alt=media"
+        self.headers = {}
+        self.http = self
+
+    def execute(self, **kwargs):
+        contenido = self._drive._contenido(self.file_id)
+        self._drive._llamada(len(contenido))
+        return contenido
+
+    def request(self, uri, method='GET', headers=None, **kwargs):
+        """Interfaz httplib2 que usa MediaIoBaseDownload.next_chunk()."""
+        contenido = self._drive._contenido(self.file_id)
+        total = len(contenido)
+        ini, fin = 0, total - 1
+        m = re.match(r'bytes=(\d+)-(\d+)', (headers or {}).get('range', ''))
+        if m:
+            ini, fin = int(m.group(1)), min(int(m.group(2)), total - 1)
+        parte = contenido[ini:fin + 1]
+        self._drive._llamada(len(parte))
+
+        class _Resp(dict):
+            status = 206
+        resp = _Resp({'content-range': f"bytes {ini}-{fin}/{total}",
+                      'status': '206'})
+        return resp, parte
+
+
+class _ArchivosSimulados:
+    def __init__(self, drive):
+        self._d = drive
+
+    def list(self, q='', fields=None, pageSize=100, **kwargs):
+        def listar():
+            self._d._llamada()
+            filtro = _filtro_drive(q)
+            with self._d._lock:
+                encontrados = [self._d._publico(a) for a in self._d._archivos.values()
+                               if filtro(a)]
+            return {'files': encontrados[:pageSize]}
+        return _Ejecutable(listar)
+
+    def create(self, body=None, media_body=None, fields=None, **kwargs):
+        body = dict(body or {})
+
+        def terminar(contenido):
+            return self._d._crear(body, contenido if media_body is not None else None)
+        return _SubidaSimulada(self._d, media_body, terminar)
+
+    def update(self, fileId, body=None, media_body=None, **kwargs):
+        body = dict(body or {})
+
+        def terminar(contenido):
+            return self._d._actualizar(
+                fileId, body, contenido if media_body is not None else None)
+        return _SubidaSimulada(self._d, media_body, terminar)
+
+    def get(self, fileId, fields=None, **kwargs):
+        def leer():
+            self._d._llamada()
+            with self._d._lock:
+                archivo = self._d._archivos.get(fileId)
+                if archivo is None:
+                    raise ErrorAPISimulado(404, f"File not found: {fileId}")
+                return self._d._publico(archivo)
+        return _Ejecutable(leer)
+
+    def get_media(self, fileId, **kwargs):
+        return _Descarga(self._d, fileId)
+
+    def delete(self, fileId, **kwargs):
+        def borrar():
+            self._d._llamada()
+            with self._d._lock:
+                if self._d._archivos.pop(fileId, None) is None:
+                    raise ErrorAPISimulado(404, f"File not found: {fileId}")
+            return ''
+        return _Ejecutable(borrar)
+
+
+class _PermisosSimulados:
+    def __init__(self, drive):
+        self._d = drive
+
+    def create(self, fileId=None, body=None, **kwargs):
+        def crear():
+            self._d._llamada()
+            return {'id': 'anyoneWithLink', 'role': (body or {}).get('role')}
+        return _Ejecutable(crear)
+
+
+class DriveSimulado:
+    """Equivalente al servicio build('drive', 'v3') de googleapiclient."""
+
+    def __init__(self, simulador):
+        self.simulador = simulador
+        self._lock = threading.Lock()
+        self._archivos = {}
+        self._ids = itertools.count(1)
+
+    def files(self):
+        return _ArchivosSimulados(self)
+
+    def permissions(self):
+        return _PermisosSimulados(self)
+
+    def _llamada(self, tam=0):
+        self.simulador.llamada('drive', tam)
+
+    @staticmethod
+    def _publico(archivo):
+        return {k: v for k, v in archivo.items() if k != 'contenido'}
+
+    def _contenido(self, file_id):
+        with self._lock:
+            archivo = self._archivos.get(file_id)
+        if archivo is None or archivo['contenido'] is None:
+            raise ErrorAPISimulado(404, f"File not found: {file_id}")
+        return archivo['contenido']
+
+    def _crear(self, body, contenido):
+        with self._lock:
+            file_id = f"simfile{next(self._ids):06d}"
+            self._archivos[file_id] = {
+                'id': file_id, 'name': body.get('name', ''),
+                'mimeType': body.get('mimeType', 'application/octet-stream'),
+                'parents': list(body.get('parents', [])),
+                'trashed': bool(body.get('trashed', False)),
+                'modifiedTime': _ahora_iso(), 'contenido': contenido,
+            }
+            return {'id': file_id}
+
+    def _actualizar(self, file_id, body, contenido):
+        with self._lock:
+            archivo = self._archivos.get(file_id)
+            if archivo is None:
+                raise ErrorAPISimulado(404, f"File not found: {file_id}")
+            for campo in ('name', 'mimeType', 'trashed'):
+                if campo in body:
+                    archivo[campo] = body[campo]
+            if contenido is not None:
+                archivo['contenido'] = contenido
+            archivo['modifiedTime'] = _ahora_iso()
+            return {'id': file_id}
+
+
+class DriveLiteSimulado:
+    """Misma interfaz que _DriveLite de sistema_web (llamadas REST
+    directas con el token de la cuenta de servicio)."""
+
+    def __init__(self, drive):
+        self._drive = drive
+
+    class _Media:
+        def __init__(self, datos):
+            self._datos = datos
+
+        def size(self):
+            return len(self._datos)
+
+        def resumable(self):
+            return False
+
+        def chunksize(self):
+            return len(self._datos)
+
+        def getbytes(self, inicio, largo):
+            return self._datos[inicio:inicio + largo]
+
+    def list_files(self, q, fields="files(id,name)", page_size=5):
+        return self._drive.files().list(q=q, pageSize=page_size).execute()['files']
+
+    def create_folder(self, name, parent_id=None):
+        meta = {'name': name, 'mimeType': 'application/vnd.google-apps.folder'}
+        if parent_id:
+            meta['parents'] = [parent_id]
+        return self._drive.files().create(body=meta).execute()['id']
+
+    def upload(self, fname, data_bytes, mime, parent_id=None):
+        meta = {'name': fname, 'mimeType': mime}
+        if parent_id:
+            meta['parents'] = [parent_id]
+        return self._drive.files().create(
+            body=meta, media_body=self._Media(data_bytes)).execute()['id']
+
+    def update(self, file_id, data_bytes, mime):
+        return self._drive.files().update(
+            fileId=file_id, media_body=self._Media(data_bytes)).execute()['id']
+
+    def set_public(self, file_id):
+        return self._drive.permissions().create(
+            fileId=file_id, body={'role': 'reader', 'type': 'anyone'}).execute()
+
+    def delete(self, file_id):
+        try:
+            self._drive.files().delete(fileId=file_id).execute()
+        except Exception:
+            pass
+
+    def descargar(self, file_id):
+        return self._drive.files().get_media(fileId=file_id).execute()
+
+
+# ================================================================
+# CONJUNTO (lo que recibe GoogleSync)
+# ================================================================
+class GoogleSimulado:
+    """Sheets + Drive simulados que comparten un Simulador.
+
+    Con `archivo` el estado se carga de (y se guarda con guardar() en) una
+    base SQLite: sirve para sembrar una vez un colegio de 800 alumnos y
+    repetir arranques en frío sobre los mismos datos."""
+
+    def __init__(self, simulador=None, archivo=None):
+        self.simulador = simulador or Simulador()
+        self.cliente = ClienteSimulado(self.simulador)
+        self.drive = DriveSimulado(self.simulador)
+        self.archivo = archivo
+        if archivo and os.path.exists(archivo):
+            self.cargar(archivo)
+
+    def drive_lite(self):
+        return DriveLiteSimulado(self.drive)
+
+    def sembrar(self, titulo_hoja, filas, libro="YACHAY PRO — Base de Datos"):
+        """Carga filas (encabezado incluido) en una pestaña sin pasar por
+        el simulador: para preparar datos de un benchmark."""
+        lib = self.cliente.open(libro)
+        with self.cliente._lock:
+            hoja = lib._hojas.get(titulo_hoja) or lib._crear_hoja(titulo_hoja)
+            hoja._filas = [[_texto(v) for v in f] for f in filas]
+        return hoja
+
+    # ── Persistencia ─────────────────────────────────────────────
+    def guardar(self, archivo=None):
+        archivo = archivo or self.archivo
+        if not archivo:
+            return False
+        tmp = archivo + '.tmp'
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        cx = sqlite3.connect(tmp)
+        try:
+            cx.execute("CREATE TABLE hojas (libro TEXT, titulo TEXT, filas TEXT)")
+            cx.execute("""CREATE TABLE archivos (id TEXT PRIMARY KEY, meta TEXT,
+                          contenido BLOB)""")
+            with self.cliente._lock:
+                for clave, lib in self.cliente._libros.items():
+                    for titulo, hoja in lib._hojas.items():
+                        cx.execute("INSERT INTO hojas VALUES (?, ?, ?)",
+                                   (clave, titulo, json.dumps(hoja._filas,
+                                                              ensure_ascii=False)))
+            with self.drive._lock:
+                for file_id, a in self.drive._archivos.items():
+                    cx.execute("INSERT INTO archivos VALUES (?, ?, ?)",
+                               (file_id, json.dumps(DriveSimulado._publico(a)),
+                                a['contenido']))
+            cx.commit()
+        finally:
+            cx.close()
+        os.replace(tmp, archivo)
+        return True
+
+    def cargar(self, archivo):
+        cx = sqlite3.connect(archivo)
+        try:
+            for clave, titulo, filas in cx.execute(
+                    "SELECT libro, titulo, filas FROM hojas ORDER BY rowid"):
+                lib = self.cliente._libro(clave, clave)
+                lib._crear_hoja(titulo, json.loads(filas))
+            ultimo = 0
+            for file_id, meta, contenido in cx.execute(
+                    "SELECT id, meta, contenido FROM archivos"):
+                a = json.loads(meta)
+                a['contenido'] = contenido
+                self.drive._archivos[file_id] = a
+                m = re.search(r'(\d+)$', file_id)
+                ultimo = max(ultimo, int(m.group(1)) if m else 0)
+            self.drive._ids = itertools.count(ultimo + 1)
+        finally:
+            cx.close()
+
+    def resumen(self):
+        return self.simulador.resumen()
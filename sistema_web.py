@@ -28,7 +28,6 @@ from reportlab.platypus import Paragraph, Table, TableStyle
 from reportlab.lib.enums import TA_JUSTIFY, TA_CENTER
 from reportlab.lib import colors
 from reportlab.lib.units import mm, cm
-import qrcode
 import os
 import io
 import textwrap
@@ -36,16 +35,24 @@ import zipfile
 import time
 import json
 import urllib.parse
-import numpy as np
 import calendar
+import copy
 import hashlib
 from datetime import datetime, timedelta, timezone, date
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw
 from pathlib import Path
+from contextlib import contextmanager
+
+# Candados de archivo entre workers (no existe en Windows)
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 # Google Sheets sync
 try:
-    from google_sync import GoogleSync, get_google_sync
+    from google_sync import (GoogleSync, get_google_sync, prioridad_api,
+                             PRIORIDAD_FONDO)
     GOOGLE_SYNC_DISPONIBLE = True
 except ImportError:
     GOOGLE_SYNC_DISPONIBLE = False
@@ -100,6 +107,21 @@ try:
 except ImportError:
     SIMULADOR_NOMB_OK = False
 
+# Diario de asistencias (append-only, un archivo por día)
+from asistencia_diario import DiarioAsistencias
+from asistencia_resumen import ResumenAsistencias
+from almacen_notas import AlmacenNotas
+from almacen_tablas import leer_tabla, guardar_tabla, exportar_xlsx_bytes
+from almacen_blobs import meta_blob
+from restauracion_arranque import ManifiestoRestauracion, OrquestadorArranque
+from notificaciones import CacheConfig, DespachadorMensajes
+from qaway_respuestas import AgregadorQaway
+from escaner_omr import (generar_hoja_respuestas, procesar_examen,
+                         procesar_lote_omr, _extraer_hojas_lote,
+                         decodificar_qr_imagen, decodificar_qrs_imagen)
+# Escudos, logos, fuentes y QR decodificados una sola vez por proceso
+import cache_recursos
+
 import base64  # Para Aula Virtual
 
 # python-docx para leer archivos Word
@@ -131,13 +153,22 @@ except ImportError:
         def _add_script_run_ctx(thread):  # último recurso: no-op
             return thread
 
-def _iniciar_hilo(target, args=(), kwargs=None, daemon=True):
-    """Crea, adjunta el ScriptRunContext y arranca un hilo de forma segura."""
-    _t = _threading_base.Thread(target=target, args=args, kwargs=kwargs or {}, daemon=daemon)
-    try:
-        _add_script_run_ctx(_t)
-    except Exception:
-        pass
+def _iniciar_hilo(target, args=(), kwargs=None, daemon=True, contexto=True):
+    """Crea, adjunta el ScriptRunContext y arranca un hilo de forma segura.
+    Las llamadas a Google Sheets del hilo van con prioridad de fondo: ceden
+    la cuota a las asistencias y a las pantallas. contexto=False para los
+    hilos de todo el proceso, que no deben quedar atados a una sesión."""
+    def _con_prioridad(*a, **kw):
+        with prioridad_api(PRIORIDAD_FONDO):
+            return target(*a, **kw)
+
+    _destino = _con_prioridad if GOOGLE_SYNC_DISPONIBLE else target
+    _t = _threading_base.Thread(target=_destino, args=args, kwargs=kwargs or {}, daemon=daemon)
+    if contexto:
+        try:
+            _add_script_run_ctx(_t)
+        except Exception:
+            pass
     _t.start()
     return _t
 
@@ -433,6 +464,33 @@ def _gs():
     except Exception:
         return None
 
+def _encolar_gs(op, *args, clave=None, reemplazar=False, **kwargs):
+    """Encola una escritura a Google Sheets en la bandeja de salida
+    persistente y vuelve de inmediato (el envío, los reintentos y la
+    reconexión los hace un hilo). False si Google Sheets no está
+    configurado en este despliegue, o si la bandeja descartó la operación
+    porque su `clave` ya estaba pendiente o enviada (duplicada)."""
+    if not GOOGLE_SYNC_DISPONIBLE:
+        return False
+    try:
+        gs = get_google_sync()
+        if not gs.configurado:
+            return False
+        return gs.bandeja().encolar(op, args, kwargs, clave=clave,
+                                    reemplazar=reemplazar) is not None
+    except Exception:
+        return False
+
+def _gs_pendiente(prefijo):
+    """True si hay escrituras de `prefijo` que todavía no llegaron a
+    Google Sheets: en ese caso lo local es más nuevo que la nube."""
+    if not GOOGLE_SYNC_DISPONIBLE:
+        return False
+    try:
+        return get_google_sync().bandeja().pendiente(prefijo)
+    except Exception:
+        return False
+
 # ================================================================
 # ZONA HORARIA PERÚ (UTC-5)
 # ================================================================
@@ -635,9 +693,8 @@ def guardar_usuarios(usuarios):
     with open(ARCHIVO_USUARIOS, 'w', encoding='utf-8') as f:
         json.dump(usuarios, f, indent=2, ensure_ascii=False)
     # Sincronizar con Google Sheets
-    gs = _gs()
-    if gs:
-        gs.sync_usuarios_completo(usuarios)
+    _encolar_gs('sync_usuarios_completo', usuarios,
+                clave='sync_usuarios', reemplazar=True)
 
 
 # ================================================================
@@ -707,9 +764,11 @@ BIMESTRES = {
 ARCHIVO_BD = "base_datos.xlsx"
 ARCHIVO_MATRICULA = "matricula.xlsx"
 ARCHIVO_DOCENTES = "docentes.xlsx"
-ARCHIVO_ASISTENCIAS = "asistencias.json"
+ARCHIVO_ASISTENCIAS = "asistencias.json"  # Histórico consolidado (ver asistencia_diario.py)
+CARPETA_DIARIO_ASISTENCIAS = "asistencias_diario"
 ARCHIVO_INDICE_CACHE = "indice_dni_cache.json"  # Caché local del índice — sobrevive reinicios
 ARCHIVO_RESULTADOS = "resultados_examenes.json"
+ARCHIVO_NOTAS_DB = "notas.sqlite3"  # Almacén indexado de notas (ver almacen_notas.py)
 
 
 
@@ -1342,18 +1401,6 @@ try:
 except ImportError:
     HAS_BARCODE = False
 
-try:
-    import cv2
-    HAS_CV2 = True
-except ImportError:
-    HAS_CV2 = False
-
-try:
-    from pyzbar.pyzbar import decode as pyzbar_decode
-    HAS_PYZBAR = True
-except ImportError:
-    HAS_PYZBAR = False
-
 
 # ================================================================
 # FUENTES
@@ -1363,25 +1410,205 @@ class RecursoManager:
     @staticmethod
     def obtener_fuente(nombre, tamanio, bold=False):
         tam = int(tamanio)
-        rutas = [
+        rutas = (
             "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf" if bold else "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
             "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
             "/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf" if bold else "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
             "/usr/share/fonts/truetype/freefont/FreeSansBold.ttf" if bold else "/usr/share/fonts/truetype/freefont/FreeSans.ttf",
             "/usr/share/fonts/truetype/ubuntu/Ubuntu-Bold.ttf" if bold else "/usr/share/fonts/truetype/ubuntu/Ubuntu-R.ttf",
             "/usr/share/fonts/truetype/noto/NotoSans-Bold.ttf" if bold else "/usr/share/fonts/truetype/noto/NotoSans-Regular.ttf",
-        ]
-        for ruta in rutas:
-            try:
-                if Path(ruta).exists():
-                    return ImageFont.truetype(ruta, tam)
-            except Exception:
-                continue
-        # Fallback con tamanio (Pillow 10+)
+        )
+        # Primera ruta existente (o la fuente por defecto de Pillow),
+        # cargada una sola vez por proceso y tamaño
+        return cache_recursos.fuente(rutas, tam)
+
+
+# ================================================================
+# ASISTENCIAS — LECTOR ÚNICO (diario por día + histórico)
+# ================================================================
+
+@st.cache_resource
+def _diario_asistencias():
+    """Instancia ÚNICA por proceso del diario de asistencias, compartida
+    por todas las sesiones (tablet de la puerta, dirección, docentes).
+    Todo lo que lee o escribe asistencias pasa por aquí."""
+    return DiarioAsistencias(CARPETA_DIARIO_ASISTENCIAS, ARCHIVO_ASISTENCIAS,
+                             reloj=fecha_peru_str)
+
+
+def leer_asistencias_todas():
+    """Historial completo {fecha ISO: {dni: registro}} — mismo formato
+    que tenía asistencias.json."""
+    try:
+        return _diario_asistencias().leer_todo()
+    except Exception:
+        return {}
+
+
+@st.cache_resource
+def _resumen_asistencias():
+    """Tablas precalculadas de asistencia (rankings, Top del Mes, reporte
+    mensual, portal de padres), UNA por proceso y suscrita al diario: cada
+    escaneo actualiza solo su celda."""
+    diario = _diario_asistencias()
+    resumen = ResumenAsistencias(diario)
+    diario.suscribir(resumen.aviso)
+    return resumen
+
+
+_COMPLEMENTO_ASIS_INTERVALO = 600  # seg entre lecturas de la hoja / Drive
+
+
+def _complemento_asis_vencido():
+    # La hora de la última lectura vive en el resumen (cache_resource): un
+    # global del módulo se reiniciaría en cada rerun.
+    return _resumen_asistencias().complemento_vencido(_COMPLEMENTO_ASIS_INTERVALO)
+
+
+def _complementar_resumen_remoto(forzar=False):
+    """Suma al resumen los registros que solo están en la hoja Asistencias
+    o en el backup de Drive (p. ej. escaneos de otra instancia), como
+    máximo una vez cada _COMPLEMENTO_ASIS_INTERVALO segundos por proceso.
+    Antes cada sesión leía la hoja completa en cada recarga."""
+    resumen = _resumen_asistencias()
+    if not resumen.reservar_complemento(_COMPLEMENTO_ASIS_INTERVALO, forzar):
+        return
+    try:
+        respaldo = _drive_restaurar_json("asistencias.json")
+        if not respaldo:
+            gs = _gs()
+            respaldo = gs.config().get_json('asistencias_json') if gs else None
+        if isinstance(respaldo, dict):
+            resumen.complementar(respaldo)
+    except Exception:
+        pass
+    try:
+        gs = _gs()
+        ws_a = gs._get_hoja('asistencias') if gs else None
+        if ws_a:
+            dias = {}
+            for _row in ws_a.get_all_records():
+                _f = str(_row.get('fecha', '')).strip()
+                _d = str(_row.get('dni', '')).strip()
+                if not _f or not _d:
+                    continue
+                dias.setdefault(_f, {}).setdefault(_d, {
+                    'nombre': str(_row.get('nombre', '')).strip(),
+                    'entrada': str(_row.get('hora_entrada', '')).strip(),
+                    'salida': str(_row.get('hora_salida', '')).strip(),
+                    'es_docente': 'doc' in str(_row.get('tipo_persona', '')).lower(),
+                })
+            resumen.complementar(dias)
+    except Exception:
+        pass
+
+
+_RESPALDO_ASIS_INTERVALO = 600  # seg entre respaldos completos (Drive + Config)
+
+
+@st.cache_resource
+def _estado_respaldo_asis():
+    """Hora del último respaldo completo, UNA por proceso. No puede ser un
+    global del módulo: Streamlit vuelve a ejecutar el script en cada rerun
+    (cada escaneo) y lo reiniciaría."""
+    return {'ts': 0.0, 'lock': _threading_base.Lock()}
+
+
+def _respaldar_asistencias_periodico(forzar=False):
+    """Respaldo COMPLETO del historial (Drive YACHAY_BACKUP/asistencias.json
+    + celda 'asistencias_json' de Config) como máximo una vez cada
+    _RESPALDO_ASIS_INTERVALO segundos por proceso, en segundo plano. Antes
+    se subía en cada escaneo."""
+    estado = _estado_respaldo_asis()
+    with estado['lock']:
+        ahora = time.time()
+        if not forzar and ahora - estado['ts'] < _RESPALDO_ASIS_INTERVALO:
+            return
+        estado['ts'] = ahora
+
+    def _respaldo_bg():
+        _snap_asis = leer_asistencias_todas()
+        try: _drive_backup_json("asistencias.json", _snap_asis)
+        except Exception: pass
         try:
-            return ImageFont.load_default(size=tam)
-        except TypeError:
-            return ImageFont.load_default()
+            gs = _gs()
+            if gs:
+                gs.config().set('asistencias_json',
+                                json.dumps(_snap_asis, ensure_ascii=False))
+        except Exception: pass
+    _iniciar_hilo(_respaldo_bg)
+
+
+# ================================================================
+# ALMACÉN DE NOTAS (SQLite indexado, una instancia por proceso)
+# ================================================================
+@st.cache_resource
+def _almacen_notas_proceso():
+    return AlmacenNotas(ARCHIVO_NOTAS_DB)
+
+
+def _almacen_notas():
+    """Almacén de notas del proceso (historial de evaluaciones, resultados
+    de exámenes y de reportes). Antes de devolverlo importa los JSON que
+    cambiaron por fuera — la primera vez, o tras restaurarlos desde Drive,
+    Sheets o un ZIP — como mucho una revisión cada pocos segundos."""
+    almacen = _almacen_notas_proceso()
+    try:
+        almacen.sincronizar_archivos()
+    except Exception:
+        pass
+    return almacen
+
+
+_RESPALDO_NOTAS_ESPERA = 15  # seg sin cambios antes de exportar y respaldar
+
+
+@st.cache_resource
+def _estado_respaldo_notas():
+    """Hora del último cambio y si ya hay un hilo esperando para
+    respaldar, UNO por proceso: como global del módulo se reiniciaría en
+    cada rerun y cada guardado lanzaría su propio hilo."""
+    return {'ts': 0.0, 'hilo': False, 'lock': _threading_base.Lock()}
+
+
+def _programar_respaldo_notas():
+    """Reescribe los JSON de notas desde el almacén y los respalda (Drive
+    YACHAY_BACKUP + celdas 'historial_evaluaciones' / 'resultados_json' de
+    Config) _RESPALDO_NOTAS_ESPERA segundos después del último cambio, en
+    segundo plano: varias evaluaciones guardadas seguidas salen en un solo
+    respaldo. Antes cada guardado reescribía y subía el historial completo
+    desde la interfaz."""
+    almacen = _almacen_notas_proceso()
+    estado = _estado_respaldo_notas()
+    with estado['lock']:
+        estado['ts'] = time.time()
+        if estado['hilo']:
+            return
+        estado['hilo'] = True
+
+    def _respaldo_bg():
+        while True:
+            with estado['lock']:
+                falta = estado['ts'] + _RESPALDO_NOTAS_ESPERA - time.time()
+                if falta <= 0:
+                    estado['hilo'] = False
+                    break
+            time.sleep(falta)
+        try:
+            exportados = almacen.exportar_archivos()
+        except Exception:
+            return
+        for _fuente, _clave_cfg in (('historial', 'historial_evaluaciones'),
+                                    ('reporte', 'resultados_json')):
+            if _fuente not in exportados:
+                continue
+            try: _drive_backup_json(almacen.archivos[_fuente], exportados[_fuente])
+            except Exception: pass
+            _encolar_gs('guardar_config',
+                        {_clave_cfg: json.dumps(exportados[_fuente],
+                                                ensure_ascii=False, default=str)},
+                        clave=f"notas_respaldo:{_clave_cfg}", reemplazar=True)
+    _iniciar_hilo(_respaldo_bg)
 
 
 # ================================================================
@@ -1409,17 +1636,33 @@ class BaseDatos:
         if _cached is not None and not st.session_state.get('_forzar_local', False) and (_now - _ts) < 90:
             return _cached
 
-        # Después de escribir, forzar lectura local para evitar datos viejos de GS
         forzar_local = st.session_state.get('_forzar_local', False)
         if forzar_local:
             st.session_state['_forzar_local'] = False
+        df, cachear = BaseDatos.leer_matricula_fuentes(forzar_local)
+        if cachear:
+            st.session_state['_cache_mat_df'] = df
+            st.session_state['_cache_mat_ts'] = _now
+        return df
+
+    @staticmethod
+    def leer_matricula_fuentes(forzar_local=False):
+        """Matrícula desde Google Sheets (completada con lo que solo está
+        en disco) o desde el disco, SIN tocar session_state: la pueden usar
+        los hilos de fondo. Devuelve (df, cachear); cachear es False si
+        salió de la lectura local forzada o es la tabla vacía."""
+        def _normalizar_dni(df):
+            if 'DNI' in df.columns:
+                df['DNI'] = df['DNI'].astype(str).str.strip().str.replace('.0', '', regex=False)
+            return df
+
+        # Después de escribir (o mientras la escritura siga en la bandeja de
+        # salida), leer local para evitar datos viejos de GS
+        if forzar_local or _gs_pendiente('sync_matricula'):
             try:
-                if Path(ARCHIVO_MATRICULA).exists():
-                    df = pd.read_excel(ARCHIVO_MATRICULA, dtype=str, engine='openpyxl')
-                    df.columns = df.columns.str.strip()
-                    if 'DNI' in df.columns:
-                        df['DNI'] = df['DNI'].astype(str).str.strip().str.replace('.0', '', regex=False)
-                    return df
+                df = leer_tabla(ARCHIVO_MATRICULA)
+                if df is not None:
+                    return _normalizar_dni(df), False
             except Exception:
                 pass
         # Intentar Google Sheets primero
@@ -1435,15 +1678,12 @@ class BaseDatos:
                     df_gs = df_gs.rename(columns=col_map)
                     for col in df_gs.columns:
                         df_gs[col] = df_gs[col].astype(str).replace('nan', '').replace('None', '')
-                    if 'DNI' in df_gs.columns:
-                        df_gs['DNI'] = df_gs['DNI'].astype(str).str.strip().str.replace('.0', '', regex=False)
+                    _normalizar_dni(df_gs)
                     # ── PROTECCIÓN: combinar con local para no perder datos ──────
                     try:
-                        if Path(ARCHIVO_MATRICULA).exists():
-                            df_local = pd.read_excel(ARCHIVO_MATRICULA, dtype=str, engine='openpyxl')
-                            df_local.columns = df_local.columns.str.strip()
-                            if 'DNI' in df_local.columns:
-                                df_local['DNI'] = df_local['DNI'].astype(str).str.strip().str.replace('.0', '', regex=False)
+                        df_local = leer_tabla(ARCHIVO_MATRICULA)
+                        if df_local is not None:
+                            _normalizar_dni(df_local)
                             if not df_local.empty and 'DNI' in df_local.columns and 'DNI' in df_gs.columns:
                                 # Agregar al GS los que están en local pero no en GS
                                 dnis_gs = set(df_gs['DNI'].astype(str).str.strip())
@@ -1452,61 +1692,45 @@ class BaseDatos:
                                     df_gs = pd.concat([df_gs, df_solo_local], ignore_index=True)
                     except Exception:
                         pass
-                    st.session_state['_cache_mat_df'] = df_gs
-                    st.session_state['_cache_mat_ts'] = _now
-                    return df_gs
+                    return df_gs, True
             except Exception:
                 pass
         # Fallback: leer local
         try:
-            if Path(ARCHIVO_MATRICULA).exists():
-                df = pd.read_excel(ARCHIVO_MATRICULA, dtype=str, engine='openpyxl')
-                df.columns = df.columns.str.strip()
-                if 'DNI' in df.columns:
-                    df['DNI'] = df['DNI'].astype(str).str.strip().str.replace('.0', '', regex=False)
-                st.session_state['_cache_mat_df'] = df
-                st.session_state['_cache_mat_ts'] = _now
-                return df
+            df = leer_tabla(ARCHIVO_MATRICULA)
+            if df is not None:
+                return _normalizar_dni(df), True
         except Exception:
             pass
         return pd.DataFrame(columns=[
             'Nombre', 'DNI', 'Nivel', 'Grado', 'Seccion',
             'Apoderado', 'DNI_Apoderado', 'Celular_Apoderado'
-        ])
+        ]), False
 
     @staticmethod
     def guardar_matricula(df):
-        try:
-            df.to_excel(ARCHIVO_MATRICULA, index=False, engine='openpyxl')
-        except Exception:
-            # Fallback: guardar como CSV si openpyxl falla
-            df.to_csv(ARCHIVO_MATRICULA.replace('.xlsx', '.csv'), index=False)
+        # Copia canónica en Parquet (XLSX/CSV solo si pyarrow no está)
+        guardar_tabla(df, ARCHIVO_MATRICULA)
         # Forzar lectura local en el próximo cargar (GS puede tener datos viejos)
         st.session_state['_forzar_local'] = True
         st.session_state.pop('_cache_mat_df', None)  # invalidar caché
-        # Invalidar índice DNI para que se reconstruya con datos nuevos
-        st.session_state.pop('_indice_dni', None)
-        st.session_state.pop('_indice_dni_ts', None)
-        # Borrar caché local también para que se regenere con el nuevo alumno
+        # Invalidar índice DNI (de TODO el proceso, incluida su caché en
+        # disco) para que se reconstruya con el nuevo alumno
+        _indice_dni().invalidar()
+        # Sincronizar con Google Sheets (bandeja de salida: solo cuenta el
+        # último estado de la matrícula)
         try:
-            if Path(ARCHIVO_INDICE_CACHE).exists():
-                Path(ARCHIVO_INDICE_CACHE).unlink()
+            col_map = {'Nombre': 'nombre', 'DNI': 'dni', 'Nivel': 'nivel',
+                       'Grado': 'grado', 'Seccion': 'seccion',
+                       'Apoderado': 'apoderado', 'DNI_Apoderado': 'dni_apoderado',
+                       'Celular_Apoderado': 'celular_apoderado'}
+            df_gs = df.rename(columns=col_map).copy()
+            if 'fecha_matricula' not in df_gs.columns:
+                df_gs['fecha_matricula'] = fecha_peru_str()
+            _encolar_gs('sync_matricula_completa', df_gs,
+                        clave='sync_matricula', reemplazar=True)
         except Exception:
             pass
-        # Sincronizar con Google Sheets
-        gs = _gs()
-        if gs:
-            try:
-                col_map = {'Nombre': 'nombre', 'DNI': 'dni', 'Nivel': 'nivel',
-                           'Grado': 'grado', 'Seccion': 'seccion',
-                           'Apoderado': 'apoderado', 'DNI_Apoderado': 'dni_apoderado',
-                           'Celular_Apoderado': 'celular_apoderado'}
-                df_gs = df.rename(columns=col_map).copy()
-                if 'fecha_matricula' not in df_gs.columns:
-                    df_gs['fecha_matricula'] = fecha_peru_str()
-                gs.sync_matricula_completa(df_gs)
-            except Exception:
-                pass
 
     @staticmethod
     def registrar_estudiante(datos):
@@ -1552,43 +1776,31 @@ class BaseDatos:
                     return r
             return None
 
-        # 1. ÍNDICE EN MEMORIA — instantáneo (<1ms)
-        indice = st.session_state.get('_indice_dni')
-        if indice and dni_str in indice:
-            return indice[dni_str].copy()
-
-        # 2. Reconstruir índice si no existe o es viejo (>3 min)
-        ultima = st.session_state.get('_indice_dni_ts', 0)
-        if not indice or (time.time() - ultima > 180):
-            _construir_indice_dni()
-            indice = st.session_state.get('_indice_dni', {})
-            if dni_str in indice:
-                return indice[dni_str].copy()
+        # 1-2. ÍNDICE COMPARTIDO EN MEMORIA — instantáneo (<1ms); se
+        # reconstruye solo si fue invalidado o venció su TTL
+        indice = _indice_dni()
+        found = indice.buscar(dni_str)
+        if found:
+            return found
 
         # 3. Archivo local directo (sin GS, ~50ms)
         try:
-            if Path(ARCHIVO_MATRICULA).exists():
-                df_local = pd.read_excel(ARCHIVO_MATRICULA, dtype=str, engine='openpyxl')
-                df_local.columns = df_local.columns.str.strip()
+            df_local = leer_tabla(ARCHIVO_MATRICULA)
+            if df_local is not None:
                 found = _buscar_en_df(df_local, 'alumno')
                 if found:
-                    if '_indice_dni' not in st.session_state:
-                        st.session_state['_indice_dni'] = {}
-                    st.session_state['_indice_dni'][dni_str] = found
+                    indice.agregar(dni_str, found)
                     return found
         except Exception:
             pass
 
         # 4. Docentes local
         try:
-            if Path(ARCHIVO_DOCENTES).exists():
-                df_d = pd.read_excel(ARCHIVO_DOCENTES, dtype=str, engine='openpyxl')
-                df_d.columns = df_d.columns.str.strip()
+            df_d = leer_tabla(ARCHIVO_DOCENTES)
+            if df_d is not None:
                 found = _buscar_en_df(df_d, 'docente')
                 if found:
-                    if '_indice_dni' not in st.session_state:
-                        st.session_state['_indice_dni'] = {}
-                    st.session_state['_indice_dni'][dni_str] = found
+                    indice.agregar(dni_str, found)
                     return found
         except Exception:
             pass
@@ -1639,63 +1851,19 @@ class BaseDatos:
         df['DNI'] = df['DNI'].astype(str).str.strip()
         df = df[df['DNI'] != dni_str]
         BaseDatos.guardar_matricula(df)
-        # 2. Borrar notas en historial_evaluaciones.json
-        try:
-            if Path('historial_evaluaciones.json').exists():
-                with open('historial_evaluaciones.json', 'r', encoding='utf-8') as f:
-                    hist = json.load(f)
-                # Eliminar todas las claves que contengan este DNI
-                hist = {k: v for k, v in hist.items() if dni_str not in k}
-                with open('historial_evaluaciones.json', 'w', encoding='utf-8') as f:
-                    json.dump(hist, f, indent=2, ensure_ascii=False)
-        except Exception:
-            pass
-        # 3. Borrar de resultados.json
-        try:
-            if Path('resultados.json').exists():
-                with open('resultados.json', 'r', encoding='utf-8') as f:
-                    res = json.load(f)
-                res = {k: v for k, v in res.items() if dni_str not in k}
-                with open('resultados.json', 'w', encoding='utf-8') as f:
-                    json.dump(res, f, indent=2, ensure_ascii=False)
-        except Exception:
-            pass
-        # 4. Borrar de resultados_examenes.json
-        try:
-            if Path('resultados_examenes.json').exists():
-                with open('resultados_examenes.json', 'r', encoding='utf-8') as f:
-                    rex = json.load(f)
-                rex = {k: v for k, v in rex.items() if dni_str not in k}
-                with open('resultados_examenes.json', 'w', encoding='utf-8') as f:
-                    json.dump(rex, f, indent=2, ensure_ascii=False)
-        except Exception:
-            pass
-        # Limpiar notas del estudiante al eliminar
+        # 2. Borrar sus notas (historial, resultados de exámenes y de reportes)
         BaseDatos.eliminar_notas_por_dni(dni)
 
     @staticmethod
     def eliminar_notas_por_dni(dni):
-        """Borra todas las notas y evaluaciones de un DNI específico"""
-        dni_str = str(dni).strip()
-        # historial_evaluaciones.json
+        """Borra todas las notas y evaluaciones de un DNI específico: sus
+        resultados y su fila en cada ranking del historial (coincidencia
+        exacta del DNI en el almacén indexado)."""
         try:
-            if Path('historial_evaluaciones.json').exists():
-                with open('historial_evaluaciones.json', 'r', encoding='utf-8') as f:
-                    hist = json.load(f)
-                hist.pop(dni_str, None)
-                with open('historial_evaluaciones.json', 'w', encoding='utf-8') as f:
-                    json.dump(hist, f, indent=2, ensure_ascii=False)
-        except Exception: pass
-        # resultados.json y ARCHIVO_RESULTADOS
-        for archivo in ['resultados.json', ARCHIVO_RESULTADOS]:
-            try:
-                if Path(archivo).exists():
-                    with open(archivo, 'r', encoding='utf-8') as f:
-                        res = json.load(f)
-                    res = [r for r in res if str(r.get('dni', '')) != dni_str]
-                    with open(archivo, 'w', encoding='utf-8') as f:
-                        json.dump(res, f, indent=2, ensure_ascii=False)
-            except Exception: pass
+            if _almacen_notas().eliminar_dni(dni):
+                _programar_respaldo_notas()
+        except Exception:
+            pass
 
     @staticmethod
     def obtener_estudiantes_grado(grado, seccion=None):
@@ -1731,13 +1899,13 @@ class BaseDatos:
             return _cached
 
         # Después de escribir, forzar lectura local
-        forzar_local = st.session_state.get('_forzar_local_doc', False)
+        forzar_local = (st.session_state.get('_forzar_local_doc', False)
+                        or _gs_pendiente('sync_docentes'))
         if forzar_local:
             st.session_state['_forzar_local_doc'] = False
             try:
-                if Path(ARCHIVO_DOCENTES).exists():
-                    df = pd.read_excel(ARCHIVO_DOCENTES, dtype=str, engine='openpyxl')
-                    df.columns = df.columns.str.strip()
+                df = leer_tabla(ARCHIVO_DOCENTES)
+                if df is not None:
                     if 'DNI' in df.columns:
                         df['DNI'] = df['DNI'].astype(str).str.strip().str.replace('.0', '', regex=False)
                     return df
@@ -1763,9 +1931,8 @@ class BaseDatos:
             except Exception:
                 pass
         try:
-            if Path(ARCHIVO_DOCENTES).exists():
-                df = pd.read_excel(ARCHIVO_DOCENTES, dtype=str, engine='openpyxl')
-                df.columns = df.columns.str.strip()
+            df = leer_tabla(ARCHIVO_DOCENTES)
+            if df is not None:
                 if 'DNI' in df.columns:
                     df['DNI'] = df['DNI'].astype(str).str.strip().str.replace('.0', '', regex=False)
                 st.session_state['_cache_doc_df'] = df
@@ -1810,28 +1977,23 @@ class BaseDatos:
 
     @staticmethod
     def guardar_docentes(df):
-        try:
-            df.to_excel(ARCHIVO_DOCENTES, index=False, engine='openpyxl')
-        except Exception:
-            df.to_csv(ARCHIVO_DOCENTES.replace('.xlsx', '.csv'), index=False)
+        guardar_tabla(df, ARCHIVO_DOCENTES)
         # Forzar lectura local en el próximo cargar
         st.session_state['_forzar_local_doc'] = True
         st.session_state.pop('_cache_doc_df', None)
-        # Invalidar índice DNI
-        st.session_state.pop('_indice_dni', None)
-        st.session_state.pop('_indice_dni_ts', None)
-        gs = _gs()
-        if gs:
-            try:
-                col_map = {'Nombre': 'nombre', 'DNI': 'dni', 'Cargo': 'cargo',
-                           'Especialidad': 'especialidad', 'Celular': 'celular',
-                           'Grado_Asignado': 'grado_asignado'}
-                df_gs = df.rename(columns=col_map).copy()
-                if 'fecha_registro' not in df_gs.columns:
-                    df_gs['fecha_registro'] = fecha_peru_str()
-                gs.sync_docentes_completo(df_gs)
-            except Exception:
-                pass
+        # Invalidar índice DNI (compartido por todas las sesiones)
+        _indice_dni().invalidar()
+        try:
+            col_map = {'Nombre': 'nombre', 'DNI': 'dni', 'Cargo': 'cargo',
+                       'Especialidad': 'especialidad', 'Celular': 'celular',
+                       'Grado_Asignado': 'grado_asignado'}
+            df_gs = df.rename(columns=col_map).copy()
+            if 'fecha_registro' not in df_gs.columns:
+                df_gs['fecha_registro'] = fecha_peru_str()
+            _encolar_gs('sync_docentes_completo', df_gs,
+                        clave='sync_docentes', reemplazar=True)
+        except Exception:
+            pass
 
     @staticmethod
     def registrar_docente(datos):
@@ -1854,71 +2016,40 @@ class BaseDatos:
     @staticmethod
     def guardar_asistencia(dni, nombre, tipo, hora, es_docente=False):
         fecha_hoy = fecha_peru_str()
-        asistencias = {}
-        if Path(ARCHIVO_ASISTENCIAS).exists():
-            with open(ARCHIVO_ASISTENCIAS, 'r', encoding='utf-8') as f:
-                asistencias = json.load(f)
-        if fecha_hoy not in asistencias:
-            asistencias[fecha_hoy] = {}
-        if dni not in asistencias[fecha_hoy]:
-            asistencias[fecha_hoy][dni] = {
-                'nombre': nombre, 'entrada': '', 'salida': '',
-                'tardanza': '', 'entrada_tarde': '', 'salida_tarde': '',
-                'es_docente': es_docente
-            }
         # Mapear tipos a campos
         campo = tipo.lower().replace(' ', '_')
-        if campo in ('entrada', 'salida', 'tardanza', 'entrada_tarde', 'salida_tarde'):
-            asistencias[fecha_hoy][dni][campo] = hora
-        asistencias[fecha_hoy][dni]['nombre'] = nombre
-        with open(ARCHIVO_ASISTENCIAS, 'w', encoding='utf-8') as f:
-            json.dump(asistencias, f, indent=2, ensure_ascii=False)
+        # Una línea al diario del día (append + fsync): costo constante en
+        # todo el año y sin pisar los registros de otras sesiones.
+        reg = _diario_asistencias().registrar(fecha_hoy, str(dni), nombre,
+                                              campo, hora, es_docente)
         # Invalidar caché inmediatamente para que el render muestre el registro
         st.session_state['_asis_invalidar'] = True
         st.session_state.pop('_cache_asis_hoy', None)
-        # Sync GSheets y Drive en hilo separado — NO bloquea la UI
-        _snap_asis = dict(asistencias)
-        _snap_dni = str(dni)
-        _snap_nom = str(nombre)
-        _snap_doc = bool(es_docente)
-        _snap_fecha = str(fecha_hoy)
-        def _sync_bg():
-            try: _drive_backup_json("asistencias.json", _snap_asis)
-            except Exception: pass
+        # Sync GSheets — solo se ENCOLA; el sincronizador de google_sync
+        # envía los escaneos por lotes (una llamada cada pocos segundos).
+        # También sin conexión: la cola queda en disco y el sincronizador
+        # reconecta solo (no usar _gs(), que es None mientras no haya red).
+        try:
+            gs = get_google_sync() if GOOGLE_SYNC_DISPONIBLE else None
+        except Exception:
+            gs = None
+        if gs is not None and gs.configurado:
             try:
-                gs = _gs()
-                if gs:
-                    indice = st.session_state.get('_indice_dni', {})
-                    grado = str(indice.get(_snap_dni, {}).get('Grado', ''))
-                    nivel = str(indice.get(_snap_dni, {}).get('Nivel', ''))
-                    reg = _snap_asis.get(_snap_fecha, {}).get(_snap_dni, {})
-                    gs.guardar_asistencia({
-                        'fecha': _snap_fecha, 'dni': _snap_dni, 'nombre': _snap_nom,
-                        'tipo_persona': 'docente' if _snap_doc else 'alumno',
-                        'hora_entrada': reg.get('entrada', ''),
-                        'hora_salida': reg.get('salida', ''),
-                        'tardanza': reg.get('tardanza', ''),
-                        'hora_entrada_tarde': reg.get('entrada_tarde', ''),
-                        'hora_salida_tarde': reg.get('salida_tarde', ''),
-                        'grado': grado, 'nivel': nivel,
-                    })
-                    # Guardar el JSON completo en hoja config — para restaurar Top del Mes
-                    try:
-                        ws_cfg = gs._get_hoja('config')
-                        if ws_cfg:
-                            import json as _jsg
-                            _asis_str = _jsg.dumps(_snap_asis, ensure_ascii=False)
-                            _rows_cfg = ws_cfg.get_all_values()
-                            _found = False
-                            for _ri, _rw in enumerate(_rows_cfg):
-                                if _rw and _rw[0] == 'asistencias_json':
-                                    ws_cfg.update_cell(_ri+1, 2, _asis_str)
-                                    _found = True; break
-                            if not _found:
-                                ws_cfg.append_row(['asistencias_json', _asis_str])
-                    except Exception: pass
-            except Exception: pass
-        _iniciar_hilo(_sync_bg)
+                _info = _indice_dni().buscar(dni) or {}
+                gs.encolar_asistencia({
+                    'fecha': fecha_hoy, 'dni': str(dni), 'nombre': str(nombre),
+                    'tipo_persona': 'docente' if es_docente else 'alumno',
+                    'hora_entrada': reg.get('entrada', ''),
+                    'hora_salida': reg.get('salida', ''),
+                    'tardanza': reg.get('tardanza', ''),
+                    'hora_entrada_tarde': reg.get('entrada_tarde', ''),
+                    'hora_salida_tarde': reg.get('salida_tarde', ''),
+                    'grado': str(_info.get('Grado', '')),
+                    'nivel': str(_info.get('Nivel', '')),
+                })
+            except Exception:
+                pass
+        _respaldar_asistencias_periodico()
 
     @staticmethod
     def obtener_asistencias_hoy():
@@ -1934,25 +2065,19 @@ class BaseDatos:
             return st.session_state[_key_df]
         st.session_state[_key_inv] = False
 
-        fecha_hoy = fecha_peru_str()
-        resultado = {}
-        if Path(ARCHIVO_ASISTENCIAS).exists():
-            with open(ARCHIVO_ASISTENCIAS, 'r', encoding='utf-8') as f:
-                resultado = json.load(f).get(fecha_hoy, {})
+        try:
+            resultado = _diario_asistencias().leer_dia(fecha_peru_str())
+        except Exception:
+            resultado = {}
         st.session_state[_key_df] = resultado
         st.session_state[_key_ts] = _now
         return resultado
 
     @staticmethod
     def borrar_asistencias_hoy():
-        fecha_hoy = fecha_peru_str()
-        if Path(ARCHIVO_ASISTENCIAS).exists():
-            with open(ARCHIVO_ASISTENCIAS, 'r', encoding='utf-8') as f:
-                a = json.load(f)
-            if fecha_hoy in a:
-                del a[fecha_hoy]
-            with open(ARCHIVO_ASISTENCIAS, 'w', encoding='utf-8') as f:
-                json.dump(a, f, indent=2, ensure_ascii=False)
+        _diario_asistencias().borrar_dia(fecha_peru_str())
+        st.session_state['_asis_invalidar'] = True
+        st.session_state.pop('_cache_asis_hoy', None)
 
     @staticmethod
     def obtener_estadisticas():
@@ -1979,98 +2104,95 @@ class BaseDatos:
     @staticmethod
     def guardar_resultados_examen(resultado, usuario_docente):
         """Guarda resultado asociado al usuario docente"""
-        datos = {}
-        if Path(ARCHIVO_RESULTADOS).exists():
-            try:
-                with open(ARCHIVO_RESULTADOS, 'r', encoding='utf-8') as f:
-                    raw = json.load(f)
-                if isinstance(raw, list):
-                    datos = {"migrado": raw}
-                elif isinstance(raw, dict):
-                    datos = raw
-                else:
-                    datos = {}
-            except Exception:
-                datos = {}
-        if usuario_docente not in datos:
-            datos[usuario_docente] = []
-        datos[usuario_docente].append(resultado)
-        with open(ARCHIVO_RESULTADOS, 'w', encoding='utf-8') as f:
-            json.dump(datos, f, indent=2, ensure_ascii=False)
+        try:
+            _almacen_notas().agregar_resultados('examen', usuario_docente, [resultado])
+            _programar_respaldo_notas()
+        except Exception:
+            pass
         # Sincronizar con Google Sheets
-        gs = _gs()
-        if gs:
-            try:
-                import uuid
-                eval_id = str(uuid.uuid4())[:8]
-                titulo = resultado.get('titulo', 'Evaluación')
-                fecha = resultado.get('fecha', fecha_peru_str())
-                grado = resultado.get('grado', '')
-                areas_info = resultado.get('areas', [])
-                alumnos = resultado.get('alumnos', [])
-                gs.guardar_resultados_examen(
-                    eval_id, titulo, fecha, usuario_docente,
-                    grado, areas_info, alumnos
-                )
-            except Exception:
-                pass
+        try:
+            import uuid
+            eval_id = str(uuid.uuid4())[:8]
+            titulo = resultado.get('titulo', 'Evaluación')
+            fecha = resultado.get('fecha', fecha_peru_str())
+            grado = resultado.get('grado', '')
+            areas_info = resultado.get('areas', [])
+            alumnos = resultado.get('alumnos', [])
+            _encolar_gs('guardar_resultados_examen',
+                        eval_id, titulo, fecha, usuario_docente,
+                        grado, areas_info, alumnos,
+                        clave=f"resultados_examen:{eval_id}")
+        except Exception:
+            pass
+
+    @staticmethod
+    def guardar_resultados_examen_lote(resultados, usuario_docente):
+        """Guarda varios resultados (calificación por lote) con UNA sola
+        transacción en el almacén de notas y UNA sola escritura a Google
+        Sheets."""
+        if not resultados:
+            return
+        try:
+            _almacen_notas().agregar_resultados('examen', usuario_docente, resultados)
+            _programar_respaldo_notas()
+        except Exception:
+            pass
+        try:
+            import uuid
+            eval_id = str(uuid.uuid4())[:8]
+            primero = resultados[0]
+            grados = [r.get('grado', '') for r in resultados if r.get('grado')]
+            # Formato de filas que espera GoogleSync.guardar_resultados_examen
+            alumnos = []
+            for r in resultados:
+                alumnos.append({
+                    'nombre': r.get('nombre', ''),
+                    'dni': r.get('dni', ''),
+                    'promedio': r.get('promedio_general', 0),
+                    'notas': [{
+                        'area': a.get('nombre', ''),
+                        'total': a.get('total', 0),
+                        'claves': ''.join(d['c'] for d in a.get('detalle', [])),
+                        'respuestas': ''.join(d['r'] for d in a.get('detalle', [])),
+                        'correctas': a.get('correctas', 0),
+                        'nota': a.get('nota', 0),
+                    } for a in r.get('areas', [])],
+                })
+            areas_info = [{'nombre': a.get('nombre', ''), 'num': a.get('total', 0)}
+                          for a in primero.get('areas', [])]
+            _encolar_gs('guardar_resultados_examen',
+                        eval_id, primero.get('titulo', 'Evaluación'),
+                        primero.get('fecha', fecha_peru_str()), usuario_docente,
+                        max(set(grados), key=grados.count) if grados else '',
+                        areas_info, alumnos,
+                        clave=f"resultados_examen:{eval_id}")
+        except Exception:
+            pass
 
     @staticmethod
     def cargar_resultados_examen(usuario_docente):
         """Carga solo los resultados del docente específico"""
-        if Path(ARCHIVO_RESULTADOS).exists():
-            try:
-                with open(ARCHIVO_RESULTADOS, 'r', encoding='utf-8') as f:
-                    datos = json.load(f)
-                # Si es formato viejo (lista), retornar la lista completa
-                if isinstance(datos, list):
-                    return datos
-                elif isinstance(datos, dict):
-                    return datos.get(usuario_docente, [])
-            except Exception:
-                pass
-        return []
+        try:
+            return _almacen_notas().resultados('examen', docente=usuario_docente)
+        except Exception:
+            return []
 
     @staticmethod
     def limpiar_resultados_examen(usuario_docente):
         """Limpia solo los resultados del docente"""
-        if Path(ARCHIVO_RESULTADOS).exists():
-            try:
-                with open(ARCHIVO_RESULTADOS, 'r', encoding='utf-8') as f:
-                    datos = json.load(f)
-                if isinstance(datos, list):
-                    # Formato viejo, limpiar todo
-                    datos = {}
-                elif isinstance(datos, dict) and usuario_docente in datos:
-                    datos[usuario_docente] = []
-                with open(ARCHIVO_RESULTADOS, 'w', encoding='utf-8') as f:
-                    json.dump(datos, f, indent=2, ensure_ascii=False)
-            except Exception:
-                pass
+        try:
+            _almacen_notas().limpiar_resultados('examen', usuario_docente)
+            _programar_respaldo_notas()
+        except Exception:
+            pass
 
     @staticmethod
     def cargar_todos_resultados():
         """Carga todos los resultados (para admin)"""
-        if Path(ARCHIVO_RESULTADOS).exists():
-            try:
-                with open(ARCHIVO_RESULTADOS, 'r', encoding='utf-8') as f:
-                    datos = json.load(f)
-                todos = []
-                if isinstance(datos, list):
-                    # Formato viejo
-                    for r in datos:
-                        r['_docente'] = 'migrado'
-                        todos.append(r)
-                elif isinstance(datos, dict):
-                    for usr, lista in datos.items():
-                        if isinstance(lista, list):
-                            for r in lista:
-                                r['_docente'] = usr
-                                todos.append(r)
-                return todos
-            except Exception:
-                pass
-        return []
+        try:
+            return _almacen_notas().resultados('examen')
+        except Exception:
+            return []
 
     @staticmethod
     def promover_grados():
@@ -2215,189 +2337,251 @@ class BaseDatos:
         return cantidad
 
 
-def _construir_indice_dni():
-    """Construye indice DNI-persona. Docentes SIEMPRE sincrono, alumnos GSheets en background."""
-    indice = {}
+def _indice_desde_df(df, tipo):
+    """{dni: fila} a partir de un DataFrame con columna DNI — vectorizado
+    (sin iterrows). Descarta DNIs de menos de 7 caracteres."""
+    if df is None or df.empty or 'DNI' not in df.columns:
+        return {}
+    dnis = df['DNI'].astype(str).str.strip().str.replace('.0', '', regex=False)
+    validos = dnis.str.len() >= 7
+    filas = df[validos].assign(_tipo=tipo).to_dict('records')
+    return dict(zip(dnis[validos], filas))
+
+
+def _indice_docentes_gs(df_doc):
+    """Docentes de la hoja GS (columnas en minúscula) → {dni: persona}."""
+    if df_doc is None or df_doc.empty:
+        return {}
+    df_doc = df_doc.copy()
+    df_doc.columns = [c.strip().lower() for c in df_doc.columns]
+    if 'dni' not in df_doc.columns:
+        return {}
+    def _col(nombre, defecto=''):
+        if nombre in df_doc.columns:
+            return df_doc[nombre].astype(str).str.strip()
+        return pd.Series(defecto, index=df_doc.index)
+    dni = _col('dni').str.replace('.0', '', regex=False)
+    corto = dni.str.isdigit() & (dni.str.len() <= 8)
+    dni = dni.where(~corto, dni.str.zfill(8))
+    df_i = pd.DataFrame({
+        'DNI': dni, '_tipo': 'docente',
+        'Nombre': _col('nombre').str.upper(),
+        'Cargo': _col('cargo', 'DOCENTE'),
+        'Grado': _col('grado_asignado'),
+        'Celular': _col('celular'),
+    })
+    df_i = df_i[(dni != '') & (dni.str.len() >= 7)]
+    return dict(zip(df_i['DNI'], df_i.to_dict('records')))
+
+
+def _indice_docentes_usuarios(usuarios, indice):
+    """Agrega al índice los usuarios con rol docente/directivo/auxiliar que
+    aún no estén. Por convención la contraseña ES el DNI cuando no hay
+    docente_info['dni'] ni columna dni."""
+    for uname, ud in (usuarios or {}).items():
+        rol = str(ud.get('rol', '')).lower()
+        if not any(r in rol for r in ['docente', 'director', 'auxiliar', 'promotor']):
+            continue
+        _di = ud.get('docente_info') or {}
+        dni_u = (str(_di.get('dni', '') if isinstance(_di, dict) else '').strip() or
+                 str(ud.get('dni', '')).strip())
+        if not dni_u or len(dni_u) < 7:
+            _pwd = str(ud.get('password', '')).strip().replace('.0', '')
+            if _pwd.isdigit() and 7 <= len(_pwd) <= 8:
+                dni_u = _pwd.zfill(8)
+        if not dni_u or len(dni_u) < 7:
+            continue
+        dni_u = dni_u.replace('.0', '')
+        if dni_u.isdigit() and len(dni_u) < 8:
+            dni_u = dni_u.zfill(8)
+        if dni_u in indice:
+            continue
+        nombre_u = str(ud.get('nombre', '') or ud.get('label', uname)).strip().upper()
+        if not nombre_u or nombre_u in ('NAN', 'NONE'):
+            nombre_u = uname.replace('.', ' ').upper()
+        indice[dni_u] = {
+            'DNI': dni_u, '_tipo': 'docente', 'Nombre': nombre_u,
+            'Cargo': ('DIRECTORA' if 'directiv' in rol else
+                      'AUXILIAR' if 'auxiliar' in rol else 'DOCENTE'),
+            'Grado': str((_di.get('grado', '') if isinstance(_di, dict) else '') or
+                         ud.get('grado', '')).strip(),
+        }
 
-    # PASO 1: cache JSON local
-    try:
-        if Path(ARCHIVO_INDICE_CACHE).exists():
-            with open(ARCHIVO_INDICE_CACHE, 'r', encoding='utf-8') as f:
-                indice = json.load(f)
-            if indice:
-                st.session_state['_indice_desde_cache'] = True
-    except Exception:
-        pass
 
-    # PASO 2: Alumnos Excel local (solo si cache vacio)
-    if not indice:
+class IndiceDNI:
+    """Índice DNI → persona COMPARTIDO por todas las sesiones del proceso
+    (tablet de la puerta, dirección, cada docente). Se construye una sola
+    vez y se reconstruye solo cuando:
+      • BaseDatos.guardar_matricula / guardar_docentes suben la versión
+        (invalidar()), o
+      • pasaron TTL segundos (para ver altas hechas desde otra instancia).
+    Las lecturas son O(1) y nunca ven un dict a medio construir: cada
+    reconstrucción arma un dict nuevo y lo reemplaza de una vez."""
+
+    TTL = 600
+
+    def __init__(self):
+        self._lock = _threading_base.Lock()
+        self._datos = {}
+        self._stats = {'docentes': 0, 'alumnos': 0}
+        self._version = 0
+        self._version_construida = -1
+        self._ts = 0.0
+
+    def invalidar(self):
+        with self._lock:
+            self._version += 1
         try:
-            if Path(ARCHIVO_MATRICULA).exists():
-                df = pd.read_excel(ARCHIVO_MATRICULA, dtype=str, engine='openpyxl')
-                df.columns = df.columns.str.strip()
-                if not df.empty and 'DNI' in df.columns:
-                    for _, row in df.iterrows():
-                        dni = str(row.get('DNI', '')).strip()
-                        if dni and len(dni) >= 7:
-                            r = row.to_dict(); r['_tipo'] = 'alumno'
-                            indice[dni] = r
+            Path(ARCHIVO_INDICE_CACHE).unlink(missing_ok=True)
         except Exception:
             pass
 
-    # PASO 3a: Docentes Excel local
-    _docs_ok = False
-    try:
-        if Path(ARCHIVO_DOCENTES).exists():
-            df_d = pd.read_excel(ARCHIVO_DOCENTES, dtype=str, engine='openpyxl')
-            df_d.columns = df_d.columns.str.strip()
-            if not df_d.empty and 'DNI' in df_d.columns:
-                for _, row in df_d.iterrows():
-                    dni = str(row.get('DNI', '')).strip().replace('.0','')
-                    if dni and len(dni) >= 7:
-                        r = row.to_dict(); r['_tipo'] = 'docente'
-                        indice[dni] = r
-                _docs_ok = True
-    except Exception:
-        pass
+    def _vigente(self):
+        return (self._version_construida == self._version
+                and time.time() - self._ts < self.TTL)
 
-    # PASO 3b: Docentes GSheets (Streamlit Cloud — no hay Excel local)
-    if not _docs_ok:
+    def _asegurar(self):
+        if self._vigente():
+            return
+        with self._lock:
+            if self._vigente():
+                return  # otra sesión lo reconstruyó mientras esperábamos
+            self._construir(self._version)
+
+    def _publicar(self, indice, version):
+        n_doc = sum(1 for v in indice.values() if v.get('_tipo') == 'docente')
+        self._stats = {'docentes': n_doc, 'alumnos': len(indice) - n_doc}
+        self._datos = indice
+        self._version_construida = version
+        self._ts = time.time()
         try:
-            gs = _gs()
-            if gs and hasattr(gs, 'leer_docentes'):
-                df_doc = gs.leer_docentes()
-                if not df_doc.empty:
-                    df_doc.columns = [c.strip().lower() for c in df_doc.columns]
-                    for _, row in df_doc.iterrows():
-                        dni_r = str(row.get('dni', '')).strip().replace('.0','')
-                        if not dni_r: continue
-                        dni = dni_r.zfill(8) if dni_r.isdigit() and len(dni_r) <= 8 else dni_r
-                        if len(dni) < 7: continue
-                        indice[dni] = {
-                            'DNI': dni, '_tipo': 'docente',
-                            'Nombre': str(row.get('nombre','')).strip().upper(),
-                            'Cargo':  str(row.get('cargo','DOCENTE')).strip(),
-                            'Grado':  str(row.get('grado_asignado','')).strip(),
-                            'Celular':str(row.get('celular','')).strip(),
-                        }
+            with open(ARCHIVO_INDICE_CACHE, 'w', encoding='utf-8') as f:
+                json.dump(indice, f, ensure_ascii=False)
+        except Exception:
+            pass
+
+    def _construir(self, version):
+        """Docentes SIEMPRE síncrono, alumnos de GSheets en segundo plano."""
+        indice = {}
+
+        # PASO 1: caché JSON local (sobrevive reinicios)
+        try:
+            if Path(ARCHIVO_INDICE_CACHE).exists():
+                with open(ARCHIVO_INDICE_CACHE, 'r', encoding='utf-8') as f:
+                    indice = json.load(f)
+        except Exception:
+            indice = {}
+
+        # PASO 2: Alumnos Excel local (solo si la caché estaba vacía)
+        if not indice:
+            try:
+                df = leer_tabla(ARCHIVO_MATRICULA)
+                if df is not None:
+                    indice.update(_indice_desde_df(df, 'alumno'))
+            except Exception:
+                pass
+
+        # PASO 3a: Docentes Excel local
+        _docs_ok = False
+        try:
+            df_d = leer_tabla(ARCHIVO_DOCENTES)
+            if df_d is not None:
+                if not df_d.empty and 'DNI' in df_d.columns:
+                    indice.update(_indice_desde_df(df_d, 'docente'))
                     _docs_ok = True
         except Exception:
             pass
 
-    # PASO 3c: FALLBACK — usuarios con rol docente
-    # La hoja Usuarios tiene columnas: username, password_hash, nombre, rol, grado_asignado, nivel_asignado
-    # El DNI NO está como columna separada — pero por convención la contraseña ES el DNI
-    # Por eso usamos ud.get('password') como DNI cuando mide 8 dígitos
-    try:
         gs = _gs()
-        if gs:
-            usuarios = gs.leer_usuarios()
-            for uname, ud in usuarios.items():
-                rol = str(ud.get('rol', '')).lower()
-                if not any(r in rol for r in ['docente','director','auxiliar','promotor']):
-                    continue
-                # Intentar DNI desde docente_info primero, luego password (= DNI por defecto)
-                _di   = ud.get('docente_info') or {}
-                dni_u = (str(_di.get('dni','') if isinstance(_di,dict) else '').strip() or
-                         str(ud.get('dni','')).strip())
-                # Si no, usar password que por convención es el DNI
-                if not dni_u or len(dni_u) < 7:
-                    _pwd = str(ud.get('password','')).strip().replace('.0','')
-                    if _pwd.isdigit() and 7 <= len(_pwd) <= 8:
-                        dni_u = _pwd.zfill(8)
-                if not dni_u or len(dni_u) < 7:
-                    continue
-                dni_u = dni_u.replace('.0','')
-                if dni_u not in indice:
-                    nombre_u = str(ud.get('nombre', ud.get('label', uname))).strip().upper()
-                    if not nombre_u or nombre_u in ('NAN','NONE',''):
-                        nombre_u = uname.replace('.',' ').upper()
-                    cargo = ('DIRECTORA' if 'directiv' in rol else
-                             'AUXILIAR'  if 'auxiliar' in rol else 'DOCENTE')
-                    indice[dni_u] = {
-                        'DNI': dni_u, '_tipo': 'docente',
-                        'Nombre': nombre_u, 'Cargo': cargo,
-                        'Grado': str(ud.get('grado','')).strip(),
-                    }
-    except Exception:
-        pass
+        # PASO 3b: Docentes GSheets (Streamlit Cloud — no hay Excel local)
+        if not _docs_ok and gs:
+            try:
+                _idx_doc = _indice_docentes_gs(gs.leer_docentes())
+                if _idx_doc:
+                    indice.update(_idx_doc)
+            except Exception:
+                pass
 
-    # PASO 3c2: también desde usuarios.json local (si existe)
-    try:
-        import json as _jloc
-        _uloc = _jloc.loads(Path('usuarios.json').read_text(encoding='utf-8')) if Path('usuarios.json').exists() else {}
-        for _un, _ud in _uloc.items():
-            _rol = str(_ud.get('rol','')).lower()
-            if not any(r in _rol for r in ['docente','director','auxiliar','promotor']):
-                continue
-            _diloc = _ud.get('docente_info') or {}
-            _dniloc = (str(_diloc.get('dni','') if isinstance(_diloc,dict) else '').strip() or
-                       str(_ud.get('password','')).strip().replace('.0',''))
-            if not _dniloc or len(_dniloc) < 7:
-                continue
-            if _dniloc.isdigit() and len(_dniloc) < 8:
-                _dniloc = _dniloc.zfill(8)
-            if _dniloc not in indice:
-                _nomloc = str(_ud.get('label', _ud.get('nombre', _un))).strip().upper()
-                if not _nomloc or _nomloc in ('NAN','NONE',''):
-                    _nomloc = _un.replace('.',' ').upper()
-                indice[_dniloc] = {
-                    'DNI': _dniloc, '_tipo': 'docente',
-                    'Nombre': _nomloc,
-                    'Cargo': ('DIRECTORA' if 'directiv' in _rol else
-                              'AUXILIAR'  if 'auxiliar' in _rol else 'DOCENTE'),
-                    'Grado': str((_diloc.get('grado','') if isinstance(_diloc,dict) else '') or
-                                 _ud.get('grado','')).strip(),
-                }
-    except Exception:
-        pass
+        # PASO 3c: usuarios con rol docente — GSheets (leída con caché) y
+        # usuarios.json local
+        try:
+            if gs:
+                _indice_docentes_usuarios(gs.leer_usuarios(), indice)
+        except Exception:
+            pass
+        try:
+            if Path(ARCHIVO_USUARIOS).exists():
+                _indice_docentes_usuarios(
+                    json.loads(Path(ARCHIVO_USUARIOS).read_text(encoding='utf-8')),
+                    indice)
+        except Exception:
+            pass
 
-    # Guardar en RAM
-    st.session_state['_indice_dni']    = indice
-    st.session_state['_indice_dni_ts'] = time.time()
-    n_doc = sum(1 for v in indice.values() if isinstance(v,dict) and v.get('_tipo')=='docente')
-    n_alu = sum(1 for v in indice.values() if isinstance(v,dict) and v.get('_tipo')=='alumno')
-    st.session_state['_indice_stats'] = {'docentes': n_doc, 'alumnos': n_alu}
+        self._publicar(indice, version)
 
-    # Guardar cache disco
-    try:
-        with open(ARCHIVO_INDICE_CACHE, 'w', encoding='utf-8') as f:
-            json.dump(indice, f, ensure_ascii=False)
-    except Exception:
-        pass
+        # PASO 4: Alumnos GSheets en hilo de fondo — UNO por reconstrucción
+        # del proceso, no uno por sesión.
+        if gs:
+            _iniciar_hilo(self._completar_alumnos_gs, args=(version,))
 
-    # PASO 4: Alumnos GSheets en hilo de fondo
-    # NOTA: se captura una copia (_idx_base) del índice ANTES de lanzar el
-    # hilo para no leer st.session_state concurrentemente desde dos hilos.
-    _idx_base = dict(st.session_state.get('_indice_dni', {}))
-    def _gs_act(idx2):
+    def _completar_alumnos_gs(self, version):
         try:
             gs = _gs()
-            if not gs: return
+            if not gs:
+                return
             df_gs = gs.leer_matricula()
-            col_map = {'nombre':'Nombre','dni':'DNI','nivel':'Nivel','grado':'Grado',
-                       'seccion':'Seccion','apoderado':'Apoderado',
-                       'dni_apoderado':'DNI_Apoderado','celular_apoderado':'Celular_Apoderado'}
-            if not df_gs.empty:
-                df_gs = df_gs.rename(columns=col_map)
-                for _, row in df_gs.iterrows():
-                    dni = str(row.get('DNI','')).strip().replace('.0','')
-                    if dni and len(dni) >= 7:
-                        r = row.to_dict(); r['_tipo'] = 'alumno'
-                        idx2[dni] = r
-            # Mantener docentes existentes
-            for k, v in list(idx2.items()):
-                if isinstance(v, dict) and v.get('_tipo') == 'docente':
-                    idx2[k] = v
-            st.session_state['_indice_dni'] = idx2
-            try:
-                with open(ARCHIVO_INDICE_CACHE, 'w', encoding='utf-8') as f:
-                    json.dump(idx2, f, ensure_ascii=False)
-            except Exception:
-                pass
+            if df_gs.empty:
+                return
+            df_gs = df_gs.rename(columns={
+                'nombre': 'Nombre', 'dni': 'DNI', 'nivel': 'Nivel', 'grado': 'Grado',
+                'seccion': 'Seccion', 'apoderado': 'Apoderado',
+                'dni_apoderado': 'DNI_Apoderado', 'celular_apoderado': 'Celular_Apoderado'})
+            alumnos = _indice_desde_df(df_gs, 'alumno')
+            with self._lock:
+                if version != self._version:
+                    return  # llegó una invalidación: ese índice ya no sirve
+                nuevo = dict(self._datos)
+                # Los docentes existentes no se pisan con filas de matrícula
+                for dni, fila in alumnos.items():
+                    if nuevo.get(dni, {}).get('_tipo') != 'docente':
+                        nuevo[dni] = fila
+                self._publicar(nuevo, version)
         except Exception:
             pass
-    _iniciar_hilo(_gs_act, args=(_idx_base,))
+
+    # ── API de lectura ───────────────────────────────────────────
+    def datos(self):
+        """Dict {dni: persona}. Solo lectura: no modificarlo."""
+        self._asegurar()
+        return self._datos
+
+    def buscar(self, dni):
+        self._asegurar()
+        r = self._datos.get(str(dni).strip())
+        return dict(r) if r else None
+
+    def estadisticas(self):
+        self._asegurar()
+        return dict(self._stats)
+
+    def agregar(self, dni, persona):
+        """Agrega una persona encontrada por un camino lento (Excel/GS)
+        para que la próxima búsqueda sea O(1)."""
+        with self._lock:
+            nuevo = dict(self._datos)
+            nuevo[str(dni).strip()] = persona
+            self._datos = nuevo
+
+    def recargar(self):
+        """Fuerza la reconstrucción completa (botón 'Recargar índice')."""
+        self.invalidar()
+        self._asegurar()
+
+
+@st.cache_resource
+def _indice_dni():
+    """Instancia ÚNICA por proceso del índice DNI."""
+    return IndiceDNI()
 
 
 def _nombre_completo_docente():
@@ -2498,7 +2682,7 @@ class GeneradorPDF:
     def _fondo(self):
         if Path("fondo.png").exists():
             try:
-                self.canvas.drawImage("fondo.png", 0, 0,
+                self.canvas.drawImage(cache_recursos.image_reader("fondo.png"), 0, 0,
                                        width=self.width, height=self.height)
             except Exception:
                 pass
@@ -2508,7 +2692,7 @@ class GeneradorPDF:
             try:
                 self.canvas.saveState()
                 self.canvas.setFillAlpha(0.35)
-                self.canvas.drawImage("escudo_upload.png",
+                self.canvas.drawImage(cache_recursos.image_reader("escudo_upload.png"),
                                        self.width / 2 - 120, self.height / 2 - 120,
                                        240, 240, mask='auto')
                 self.canvas.restoreState()
@@ -2540,20 +2724,13 @@ class GeneradorPDF:
         data = (f"YACHAY|{tipo}|{datos.get('alumno', datos.get('Nombre', ''))}|"
                 f"{datos.get('dni', datos.get('DNI', ''))}|"
                 f"{hora_peru().strftime('%d/%m/%Y')}")
-        q = qrcode.QRCode(box_size=10, border=1)
-        q.add_data(data)
-        q.make(fit=True)
-        img = q.make_image(fill_color="black", back_color="white")
-        tmp = "tmp_qr.png"
-        img.save(tmp)
-        self.canvas.drawImage(tmp, self.config['qr_x'], self.config['qr_y'], 70, 70)
+        from reportlab.lib.utils import ImageReader
+        png = cache_recursos.qr_png(data, box_size=10, border=1)
+        self.canvas.drawImage(ImageReader(io.BytesIO(png)),
+                              self.config['qr_x'], self.config['qr_y'], 70, 70)
         self.canvas.setFont("Helvetica", 6)
         self.canvas.drawCentredString(self.config['qr_x'] + 35,
                                        self.config['qr_y'] - 5, "VERIFICACIÓN")
-        try:
-            os.remove(tmp)
-        except Exception:
-            pass
 
     def _solicitante(self, datos, y):
         """CORREGIDO: Se expide a solicitud del padre/madre/apoderado"""
@@ -3223,7 +3400,7 @@ def generar_registro_asistencia_pdf(grado, seccion, anio, estudiantes_df,
             try:
                 c.saveState()
                 c.setFillAlpha(0.35)
-                c.drawImage("escudo_upload.png", w / 2 - 100, h / 2 - 100,
+                c.drawImage(cache_recursos.image_reader("escudo_upload.png"), w / 2 - 100, h / 2 - 100,
                             200, 200, mask='auto')
                 c.restoreState()
             except Exception:
@@ -3354,13 +3531,12 @@ def generar_ranking_pdf(resultados, anio):
     # ── Marca de agua UNA SOLA — zona inferior vacía ─────────────────────
     if Path("escudo_upload.png").exists():
         try:
-            from PIL import Image as PILImage
-            img = PILImage.open("escudo_upload.png")
+            img = cache_recursos.imagen("escudo_upload.png")
             iw, ih = img.size
             mw = 220; mh = mw / (iw/ih)
             c.saveState()
             c.setFillAlpha(0.20)
-            c.drawImage("escudo_upload.png", w/2-mw/2, 30, mw, mh, mask='auto')
+            c.drawImage(cache_recursos.image_reader("escudo_upload.png"), w/2-mw/2, 30, mw, mh, mask='auto')
             c.restoreState()
         except Exception:
             pass
@@ -3374,17 +3550,16 @@ def generar_ranking_pdf(resultados, anio):
     esc_izq = "escudo_upload.png"
     esc_der = "escudo2_upload.png" if Path("escudo2_upload.png").exists() else "escudo_upload.png"
     try:
-        from PIL import Image as PILImage
         if Path(esc_izq).exists():
-            img = PILImage.open(esc_izq)
+            img = cache_recursos.imagen(esc_izq)
             iw, ih = img.size
             aw = ALTO_ESC * (iw/ih)
-            c.drawImage(esc_izq, 18, h-12-ALTO_ESC, aw, ALTO_ESC, mask='auto')
+            c.drawImage(cache_recursos.image_reader(esc_izq), 18, h-12-ALTO_ESC, aw, ALTO_ESC, mask='auto')
         if Path(esc_der).exists():
-            img2 = PILImage.open(esc_der)
+            img2 = cache_recursos.imagen(esc_der)
             iw2, ih2 = img2.size
             aw2 = ALTO_ESC * (iw2/ih2)
-            c.drawImage(esc_der, w-18-aw2, h-12-ALTO_ESC, aw2, ALTO_ESC, mask='auto')
+            c.drawImage(cache_recursos.image_reader(esc_der), w-18-aw2, h-12-ALTO_ESC, aw2, ALTO_ESC, mask='auto')
     except Exception:
         pass
 
@@ -3491,6 +3666,28 @@ def generar_ranking_pdf(resultados, anio):
 # GENERADOR DE CARNETS
 # ================================================================
 
+def _carnet_fondo_base(ancho, alto):
+    """
+    Fondo blanco del carnet con el escudo en marca de agua (alfa ≤ 28),
+    calculado UNA vez mientras escudo_upload.png no cambie. El recorte de
+    alfa se hace con Image.point (tabla de 256 valores) en vez de recorrer
+    los píxeles en Python. Retorna None si no hay escudo.
+    """
+    f = cache_recursos.firma("escudo_upload.png")
+    if f is None:
+        return None
+
+    def _crear():
+        esc = cache_recursos.imagen("escudo_upload.png", (280, 280), "RGBA")
+        capa = Image.new('RGBA', (ancho, alto), (255, 255, 255, 0))
+        capa.paste(esc, ((ancho - 280) // 2, (alto - 280) // 2))
+        capa.putalpha(capa.getchannel('A').point(lambda v: min(v, 28)))
+        return Image.alpha_composite(
+            Image.new('RGBA', (ancho, alto), (255, 255, 255, 255)), capa
+        ).convert('RGB')
+    return cache_recursos.cacheado(('carnet_fondo', ancho, alto) + f, _crear)
+
+
 class GeneradorCarnet:
     WIDTH = 1012
     HEIGHT = 638
@@ -3506,20 +3703,10 @@ class GeneradorCarnet:
         self.draw = ImageDraw.Draw(self.img)
 
     def _escudo_fondo(self):
-        if Path("escudo_upload.png").exists():
-            try:
-                esc = Image.open("escudo_upload.png").convert("RGBA")
-                esc = esc.resize((280, 280), Image.LANCZOS)
-                capa = Image.new('RGBA', (self.WIDTH, self.HEIGHT), (255, 255, 255, 0))
-                capa.paste(esc, ((self.WIDTH - 280) // 2, (self.HEIGHT - 280) // 2))
-                px = [(d[0], d[1], d[2], min(d[3], 28)) for d in capa.getdata()]
-                capa.putdata(px)
-                self.img = Image.alpha_composite(
-                    self.img.convert('RGBA'), capa
-                ).convert('RGB')
-                self.draw = ImageDraw.Draw(self.img)
-            except Exception:
-                pass
+        fondo = _carnet_fondo_base(self.WIDTH, self.HEIGHT)
+        if fondo is not None:
+            self.img = fondo.copy()
+            self.draw = ImageDraw.Draw(self.img)
 
     def _barras(self):
         self.draw.rectangle([(0, 0), (self.WIDTH, 210)], fill=self.AZUL)
@@ -3700,10 +3887,7 @@ class GeneradorCarnet:
     def _qr(self):
         try:
             dni = str(self.datos.get('DNI', self.datos.get('dni', '')))
-            q = qrcode.QRCode(box_size=16, border=1)
-            q.add_data(dni)
-            q.make(fit=True)
-            iq = q.make_image(fill_color="black", back_color="white")
+            iq = cache_recursos.qr_imagen(dni, box_size=16, border=1)
             iq = iq.resize((310, 310), Image.LANCZOS)
             self.img.paste(iq, (self.WIDTH - 345, 195))
             fs = RecursoManager.obtener_fuente("", 20, True)
@@ -3735,7 +3919,8 @@ class GeneradorCarnet:
         except Exception:
             pass
 
-    def generar(self):
+    def renderizar(self):
+        """Dibuja el carnet y retorna la imagen PIL (sin codificar)."""
         self._escudo_fondo()
         self._barras()
         self._textos()
@@ -3743,6 +3928,10 @@ class GeneradorCarnet:
         self._datos()
         self._qr()
         self._barcode()
+        return self.img
+
+    def generar(self):
+        self.renderizar()
         out = io.BytesIO()
         self.img.save(out, format='PNG', optimize=True, quality=95)
         out.seek(0)
@@ -3754,6 +3943,17 @@ class GeneradorCarnet:
 # ================================================================
 
 def generar_carnets_lote_pdf(lista_datos, anio, es_docente=False):
+    from concurrent.futures import ThreadPoolExecutor
+    from reportlab.lib.utils import ImageReader
+
+    def _render(datos):
+        # La imagen PIL va directo a ReportLab: sin PNG intermedio ni
+        # archivos temporales (que chocaban entre sesiones concurrentes)
+        try:
+            return GeneradorCarnet(datos, anio, es_docente=es_docente).renderizar()
+        except Exception:
+            return None
+
     buffer = io.BytesIO()
     c = canvas.Canvas(buffer, pagesize=A4)
     w, h = A4
@@ -3766,42 +3966,46 @@ def generar_carnets_lote_pdf(lista_datos, anio, es_docente=False):
     pp = 8                                     # 8 por pagina (2x4)
     total = len(lista_datos)
     np2 = (total + pp - 1) // pp
-    for pag in range(np2):
-        if pag > 0:
-            c.showPage()
-        ini = pag * pp
-        fin = min(ini + pp, total)
-        for idx in range(ini, fin):
-            pos = idx - ini
-            col = pos % 2
-            fila = pos // 2
-            x = mx + col * (cw2 + gx)
-            y = h - my - 8 - (fila + 1) * ch2 - fila * gy
-            gen = GeneradorCarnet(lista_datos[idx], anio, es_docente=es_docente)
-            ib = gen.generar()
-            tmp = f"tmp_c_{idx}.png"
-            with open(tmp, 'wb') as f:
-                f.write(ib.getvalue())
-            try:
-                c.drawImage(tmp, x, y, width=cw2, height=ch2,
-                            preserveAspectRatio=True)
-                c.setStrokeColor(colors.grey)
-                c.setDash(3, 3)
-                c.setLineWidth(0.3)
-                c.rect(x, y, cw2, ch2)
-                c.setDash()
-            except Exception:
-                pass
-            try:
-                os.remove(tmp)
-            except Exception:
-                pass
-        c.setFont("Helvetica", 6)
-        c.setFillColor(colors.grey)
-        c.drawCentredString(w / 2, 10,
-                            f"YACHAY — Carnets {anio} — Pág {pag + 1}/{np2} — "
-                            f"Cortar por líneas punteadas")
-        c.setFillColor(colors.black)
+    # Pool de hilos: el redimensionado y la composición de PIL liberan el
+    # GIL. Se renderiza página por página para no tener cientos de
+    # imágenes en memoria a la vez.
+    workers = max(1, min(os.cpu_count() or 1, pp))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        siguiente = pool.map(_render, lista_datos[0:min(pp, total)])
+        for pag in range(np2):
+            if pag > 0:
+                c.showPage()
+            ini = pag * pp
+            fin = min(ini + pp, total)
+            imagenes = list(siguiente)
+            # Mientras se dibuja esta página, ya se renderiza la siguiente
+            if fin < total:
+                siguiente = pool.map(_render, lista_datos[fin:min(fin + pp, total)])
+            for idx in range(ini, fin):
+                pos = idx - ini
+                col = pos % 2
+                fila = pos // 2
+                x = mx + col * (cw2 + gx)
+                y = h - my - 8 - (fila + 1) * ch2 - fila * gy
+                img = imagenes[pos]
+                if img is None:
+                    continue
+                try:
+                    c.drawImage(ImageReader(img), x, y, width=cw2, height=ch2,
+                                preserveAspectRatio=True)
+                    c.setStrokeColor(colors.grey)
+                    c.setDash(3, 3)
+                    c.setLineWidth(0.3)
+                    c.rect(x, y, cw2, ch2)
+                    c.setDash()
+                except Exception:
+                    pass
+            c.setFont("Helvetica", 6)
+            c.setFillColor(colors.grey)
+            c.drawCentredString(w / 2, 10,
+                                f"YACHAY — Carnets {anio} — Pág {pag + 1}/{np2} — "
+                                f"Cortar por líneas punteadas")
+            c.setFillColor(colors.black)
     c.save()
     buffer.seek(0)
     return buffer
@@ -3871,485 +4075,155 @@ def generar_mensaje_asistencia(nombre, tipo, hora):
             f"{frase}")
 
 
-def decodificar_qr_imagen(ib):
-    if not HAS_PYZBAR:
-        return None
-    try:
-        img = Image.open(io.BytesIO(ib))
-        cod = pyzbar_decode(img)
-        if cod:
-            return cod[0].data.decode('utf-8')
-    except Exception:
-        pass
-    if HAS_CV2:
-        try:
-            np2 = np.frombuffer(ib, np.uint8)
-            ic = cv2.imdecode(np2, cv2.IMREAD_COLOR)
-            gr = cv2.cvtColor(ic, cv2.COLOR_BGR2GRAY)
-            for m in [cv2.THRESH_BINARY, cv2.THRESH_BINARY_INV]:
-                _, th = cv2.threshold(gr, 127, 255, m)
-                cod = pyzbar_decode(Image.fromarray(th))
-                if cod:
-                    return cod[0].data.decode('utf-8')
-        except Exception:
-            pass
-    return None
-
+def qr_repetido(texto, clave_sesion, ventana=5.0):
+    """True si `texto` ya se procesó en esta sesión hace menos de
+    `ventana` segundos (el mismo carnet frente a la cámara en dos frames
+    seguidos, o el rerun de Streamlit con el mismo frame)."""
+    ahora = time.time()
+    ultimo = st.session_state.get(clave_sesion)
+    st.session_state[clave_sesion] = (texto, ahora)
+    return bool(ultimo and ultimo[0] == texto and ahora - ultimo[1] < ventana)
 
 
-
-# ================================================================
-# HOJA DE RESPUESTAS + ESCÁNER OMR PROFESIONAL
-# Sistema basado en posición con marcadores de alineación
-# ================================================================
-
-# Constantes de la hoja VERTICAL (compartidas entre generador y escáner)
-HOJA_W = 2480       # Ancho A4 PORTRAIT 300dpi
-HOJA_H = 3508       # Alto A4 PORTRAIT 300dpi
-HOJA_MARKER_SIZE = 100   # Tamaño marcadores esquina
-HOJA_MARKER_PAD = 40     # Padding de marcadores desde borde
-HOJA_BUBBLE_R = 34       # Radio de burbuja
-HOJA_Y_START = 950       # Y donde empiezan las burbujas
-HOJA_X_START = 340       # X donde empieza la primera opción
-HOJA_SP_Y = 108          # Espacio vertical entre preguntas
-HOJA_SP_X = 155          # Espacio horizontal entre opciones A,B,C,D
-HOJA_COL_SP = 750        # Espacio entre columnas de preguntas
-HOJA_PPC = 20            # Preguntas por columna
-
-
-def _posicion_burbuja(pregunta_idx, opcion_idx):
-    """Calcula posición exacta (cx, cy) de una burbuja en la hoja"""
-    col = pregunta_idx // HOJA_PPC
-    fila = pregunta_idx % HOJA_PPC
-    cx = HOJA_X_START + col * HOJA_COL_SP + opcion_idx * HOJA_SP_X
-    cy = HOJA_Y_START + fila * HOJA_SP_Y
-    return cx, cy
-
-
-def generar_hoja_respuestas(np_, titulo):
-    """Genera hoja de respuestas VERTICAL para escaneo OMR"""
-    img = Image.new('RGB', (HOJA_W, HOJA_H), 'white')
-    draw = ImageDraw.Draw(img)
-    try:
-        ft = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 70)
-        fs = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 45)
-        fn = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 42)
-        fl = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 32)
-        fb = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 30)
-        fi = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 22)
-    except Exception:
-        ft = fs = fn = fl = fb = fi = ImageFont.load_default()
-
-    # ===== 4 MARCADORES DE ESQUINA =====
-    ms = HOJA_MARKER_SIZE
-    mp = HOJA_MARKER_PAD
-    draw.rectangle([(mp, mp), (mp + ms, mp + ms)], fill="black")
-    draw.rectangle([(HOJA_W - mp - ms, mp), (HOJA_W - mp, mp + ms)], fill="black")
-    draw.rectangle([(mp, HOJA_H - mp - ms), (mp + ms, HOJA_H - mp)], fill="black")
-    draw.rectangle([(HOJA_W - mp - ms, HOJA_H - mp - ms),
-                    (HOJA_W - mp, HOJA_H - mp)], fill="black")
-    draw.rectangle([(mp, mp + ms + 10), (mp + ms, mp + ms + 30)], fill="black")
-
-    # ===== ENCABEZADO =====
-    draw.text((HOJA_W // 2, 200), "I.E.P. ALTERNATIVO YACHAY",
-              font=ft, fill="black", anchor="mm")
-    draw.text((HOJA_W // 2, 290), f"HOJA DE RESPUESTAS — {titulo.upper()}",
-              font=fs, fill="black", anchor="mm")
-
-    # ===== DATOS DEL ALUMNO =====
-    draw.text((220, 400), "Nombre: _____________________________________________",
-              font=fs, fill="black")
-    draw.text((220, 480), "DNI: __________________  Grado: __________________",
-              font=fs, fill="black")
-    draw.text((220, 560), f"Fecha: __________________  Total: {np_} preguntas",
-              font=fs, fill="black")
-
-    # ===== INSTRUCCIONES =====
-    draw.text((220, 660), "RELLENE COMPLETAMENTE el círculo de su respuesta",
-              font=fb, fill="red")
-    ex_y = 720
-    draw.text((220, ex_y), "Correcto:", font=fl, fill="gray")
-    draw.ellipse([(430, ex_y - 5), (490, ex_y + 55)], fill="black")
-    draw.text((530, ex_y), "Incorrecto:", font=fl, fill="gray")
-    draw.ellipse([(770, ex_y - 5), (830, ex_y + 55)], outline="black", width=3)
-    draw.text((870, ex_y), "Use lápiz 2B o bolígrafo negro", font=fl, fill="gray")
-
-    # Línea separadora
-    draw.line([(100, 820), (HOJA_W - 100, 820)], fill="black", width=4)
-
-    # ===== BURBUJAS =====
-    for i in range(np_):
-        col = i // HOJA_PPC
-        fila = i % HOJA_PPC
-
-        # Número de pregunta
-        num_x = HOJA_X_START + col * HOJA_COL_SP - 120
-        num_y = HOJA_Y_START + fila * HOJA_SP_Y
-        draw.text((num_x, num_y), f"{i + 1}.",
-                  font=fn, fill="black", anchor="rm")
-
-        # 4 opciones: A, B, C, D
-        for j, letra in enumerate(['A', 'B', 'C', 'D']):
-            cx, cy = _posicion_burbuja(i, j)
-            r = HOJA_BUBBLE_R
-            # Círculo bien definido con borde grueso
-            draw.ellipse([(cx - r, cy - r), (cx + r, cy + r)],
-                         outline="black", width=5)
-            # Letra pequeña dentro
-            draw.text((cx, cy), letra, font=fl, fill=(100, 100, 100), anchor="mm")
-
-    # ===== PIE DE PÁGINA =====
-    draw.line([(100, HOJA_H - 250), (HOJA_W - 100, HOJA_H - 250)],
-              fill="black", width=2)
-
-    frases_seguridad = [
-        "DOCUMENTO OFICIAL — CUALQUIER ALTERACIÓN INVALIDA ESTE EXAMEN",
-        "I.E.P. ALTERNATIVO YACHAY — LECTURA ÓPTICA AUTOMATIZADA",
-        "Use SOLO lápiz 2B o bolígrafo negro — Rellene completamente cada círculo",
-    ]
-    y_pie = HOJA_H - 230
-    for frase in frases_seguridad:
-        draw.text((HOJA_W // 2, y_pie), frase,
-                  font=fb, fill="gray", anchor="mm")
-        y_pie += 30
-
-    codigo_seg = hashlib.md5(f"{titulo}{datetime.now().isoformat()}".encode()).hexdigest()[:12].upper()
-    draw.text((HOJA_W // 2, HOJA_H - 60),
-              f"Código: {codigo_seg} | YACHAY PRO {datetime.now().year}",
-              font=fb, fill="black", anchor="mm")
-
-    # Marca de agua diagonal
-    try:
-        marca_font = ImageFont.truetype(
-            "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 60)
-    except Exception:
-        marca_font = fb
-    marca_img = Image.new('RGBA', img.size, (255, 255, 255, 0))
-    marca_draw = ImageDraw.Draw(marca_img)
-    for yy in range(200, HOJA_H - 200, 400):
-        for xx in range(-200, HOJA_W, 600):
-            marca_draw.text((xx, yy), "YACHAY PRO",
-                           font=marca_font, fill=(200, 200, 200, 35))
-    img = Image.alpha_composite(img.convert('RGBA'), marca_img).convert('RGB')
-
-    out = io.BytesIO()
-    img.save(out, format='PNG', quality=95)
-    out.seek(0)
-    return out
+def _calificar_hoja(ia, ra):
+    """
+    Compara las respuestas `ra` (lista de letras) con las claves de cada
+    área de `ia`. Retorna (areas, promedio) con el mismo formato que
+    guarda BaseDatos.guardar_resultados_examen en res['areas'].
+    """
+    areas = []
+    idx = 0
+    sn = 0
+    for a in ia:
+        n = a['num']
+        ck = a['claves'][:n]
+        rk = ra[idx:idx + n]
+        ok = sum(1 for j in range(min(len(ck), len(rk)))
+                 if ck[j] == rk[j])
+        nota = round((ok / n) * 20, 1) if n else 0
+        detalle = []
+        for j in range(n):
+            cj = ck[j] if j < len(ck) else '?'
+            rj = rk[j] if j < len(rk) else '?'
+            detalle.append({
+                'p': idx + j + 1, 'c': cj, 'r': rj,
+                'ok': (j < len(ck) and j < len(rk) and ck[j] == rk[j])
+            })
+        areas.append({
+            'nombre': a['nombre'], 'correctas': ok,
+            'total': n, 'nota': nota, 'letra': nota_a_letra(nota),
+            'detalle': detalle
+        })
+        sn += nota
+        idx += n
+    pm = round(sn / len(ia), 1) if ia else 0
+    return areas, pm
 
 
 # ================================================================
-# ESCÁNER OMR — DETECCIÓN POR POSICIÓN
+# CALIFICACIÓN POR LOTE (ZIP / varias fotos)
 # ================================================================
 
-def _encontrar_marcadores(gray):
-    """
-    Encuentra los 4 marcadores de esquina (cuadrados negros grandes).
-    Retorna las coordenadas ordenadas: [TL, TR, BL, BR] o None.
-    """
-    alto, ancho = gray.shape[:2]
-    resultados = []
-
-    # Probar múltiples umbrales para robustez
-    for metodo in range(3):
-        if metodo == 0:
-            blur = cv2.GaussianBlur(gray, (5, 5), 0)
-            _, thresh = cv2.threshold(blur, 0, 255,
-                                       cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
-        elif metodo == 1:
-            blur = cv2.GaussianBlur(gray, (7, 7), 0)
-            thresh = cv2.adaptiveThreshold(blur, 255,
-                                            cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-                                            cv2.THRESH_BINARY_INV, 21, 5)
+def _calificar_lote_ui(ia, tp, titulo, usuario_actual):
+    """Pantalla del modo lote dentro de ✅ Calificar."""
+    st.info("📦 Suba un ZIP o varias fotos de hojas de respuestas. Cada "
+            "alumno se identifica por el QR de su carnet en la foto o por "
+            "su DNI (8 dígitos) en el nombre del archivo.")
+    archivos = st.file_uploader("📁 ZIP o fotos:",
+                                type=['zip', 'jpg', 'jpeg', 'png'],
+                                accept_multiple_files=True, key="fu_lote_omr")
+    if archivos and st.button("🔍 PROCESAR LOTE", type="primary",
+                              use_container_width=True, key="btn_lote_omr"):
+        if not tp:
+            st.error("⚠️ Configure las claves primero")
         else:
-            blur = cv2.medianBlur(gray, 5)
-            _, thresh = cv2.threshold(blur, 80, 255, cv2.THRESH_BINARY_INV)
-
-        # Probar ambos modos de contorno para mayor robustez
-        for retr_mode in [cv2.RETR_EXTERNAL, cv2.RETR_LIST]:
-            contours, _ = cv2.findContours(thresh, retr_mode,
-                                            cv2.CHAIN_APPROX_SIMPLE)
-
-            # Buscar contornos grandes y cuadrados (los marcadores)
-            candidatos = []
-            min_size = min(ancho, alto) * 0.02  # Al menos 2% del tamaño
-            max_size = min(ancho, alto) * 0.12  # Máximo 12%
-
-            for ct in contours:
-                x, y, w, h = cv2.boundingRect(ct)
-                if w < min_size or h < min_size:
-                    continue
-                if w > max_size or h > max_size:
-                    continue
-
-                aspect = w / float(h) if h > 0 else 0
-                if not (0.6 <= aspect <= 1.6):
-                    continue
-
-                area = cv2.contourArea(ct)
-                rect_area = w * h
-                solidez = area / rect_area if rect_area > 0 else 0
-                if solidez < 0.6:
-                    continue
-
-                # Centro del contorno
-                cx = x + w // 2
-                cy = y + h // 2
-                candidatos.append((cx, cy, w * h, x, y, w, h))
-
-            if len(candidatos) < 4:
-                continue
-
-            # Ordenar por tamaño y tomar los más grandes
-            candidatos = sorted(candidatos, key=lambda c: c[2], reverse=True)
-
-            if len(candidatos) >= 4:
-                top = candidatos[:min(12, len(candidatos))]
-                mejor = _seleccionar_esquinas(top, ancho, alto)
-                if mejor is not None:
-                    resultados.append(mejor)
-                    break  # Encontrado, no seguir probando modos
-
-    if not resultados:
-        return None
-
-    # Retornar el primer resultado exitoso
-    return resultados[0]
-
-
-def _seleccionar_esquinas(candidatos, ancho, alto):
-    """
-    De una lista de candidatos, selecciona 4 que forman las esquinas
-    de la hoja. Retorna [TL, TR, BL, BR] como arrays de coordenadas.
-    """
-    puntos = [(c[0], c[1]) for c in candidatos]
-
-    # Clasificar por cuadrante
-    cx_medio = ancho / 2
-    cy_medio = alto / 2
-
-    tl_cands = [(x, y) for x, y in puntos if x < cx_medio and y < cy_medio]
-    tr_cands = [(x, y) for x, y in puntos if x > cx_medio and y < cy_medio]
-    bl_cands = [(x, y) for x, y in puntos if x < cx_medio and y > cy_medio]
-    br_cands = [(x, y) for x, y in puntos if x > cx_medio and y > cy_medio]
-
-    if not (tl_cands and tr_cands and bl_cands and br_cands):
-        return None
-
-    # Tomar el más cercano a cada esquina
-    tl = min(tl_cands, key=lambda p: p[0]**2 + p[1]**2)
-    tr = min(tr_cands, key=lambda p: (ancho - p[0])**2 + p[1]**2)
-    bl = min(bl_cands, key=lambda p: p[0]**2 + (alto - p[1])**2)
-    br = min(br_cands, key=lambda p: (ancho - p[0])**2 + (alto - p[1])**2)
-
-    return [list(tl), list(tr), list(bl), list(br)]
-
-
-def _corregir_perspectiva(gray, esquinas):
-    """
-    Aplica transformación de perspectiva para alinear la hoja.
-    esquinas = [TL, TR, BL, BR]
-    Retorna imagen corregida de tamaño HOJA_W x HOJA_H
-    """
-    tl, tr, bl, br = esquinas
-
-    # Puntos origen (de la foto)
-    src = np.array([tl, tr, bl, br], dtype="float32")
-
-    # Puntos destino (hoja perfecta) — ajustados a los centros de marcadores
-    mp = HOJA_MARKER_PAD + HOJA_MARKER_SIZE // 2
-    dst = np.array([
-        [mp, mp],
-        [HOJA_W - mp, mp],
-        [mp, HOJA_H - mp],
-        [HOJA_W - mp, HOJA_H - mp]
-    ], dtype="float32")
-
-    # Calcular y aplicar transformación
-    M = cv2.getPerspectiveTransform(src, dst)
-    warped = cv2.warpPerspective(gray, M, (HOJA_W, HOJA_H))
-    return warped
-
+            hojas = _extraer_hojas_lote(archivos)
+            if not hojas:
+                st.error("❌ No se encontraron imágenes (.jpg/.png)")
+            else:
+                barra = st.progress(0.0, text=f"0/{len(hojas)} hojas")
+
+                def _avance(hechas, total):
+                    barra.progress(hechas / total,
+                                   text=f"{hechas}/{total} hojas")
+
+                crudos = procesar_lote_omr(hojas, tp, progreso=_avance)
+                filas = []
+                for r in crudos:
+                    det = r['respuestas']
+                    nombre, grado = '', ''
+                    if r['dni']:
+                        ad = BaseDatos.buscar_por_dni(r['dni'])
+                        if ad:
+                            nombre = str(ad.get('Nombre', ''))
+                            grado = str(ad.get('Grado', ''))
+                    dudosas = sum(1 for x in det if x == '?') if det else tp
+                    if not det:
+                        estado = '❌ No leída'
+                    elif not nombre:
+                        estado = '⚠️ Sin identificar'
+                    elif dudosas:
+                        estado = f'⚠️ {dudosas} dudosas'
+                    else:
+                        estado = '✅ OK'
+                    filas.append({
+                        'Guardar': bool(det) and bool(nombre),
+                        'Archivo': r['archivo'],
+                        'DNI': r['dni'],
+                        'Nombre': nombre,
+                        'Grado': grado,
+                        'Respuestas': ''.join(det) if det else '',
+                        'Confianza': round(100 * (tp - dudosas) / tp) if tp else 0,
+                        'Estado': estado,
+                    })
+                st.session_state['_lote_omr'] = {'filas': filas, 'tp': tp}
+                barra.empty()
 
-def _leer_burbujas(warped_gray, num_preguntas):
-    """
-    Lee las respuestas de la imagen ya corregida/alineada.
-    MEJORADO: Lógica estricta anti-falsos positivos.
-    - Pre-procesamiento con GaussianBlur + OTSU
-    - Erosión para eliminar ruido/sombras
-    - Umbral de relleno mínimo 45%
-    - Comparación relativa: la más marcada debe ser >1.4x la segunda
-    - Si no cumple condiciones → '?' (indeterminado)
-    """
-    # Pre-procesamiento robusto
-    blur = cv2.GaussianBlur(warped_gray, (5, 5), 0)
-    _, thresh = cv2.threshold(blur, 0, 255,
-                               cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
-
-    # Erosión para eliminar ruido, trazos débiles y sombras
-    kernel = np.ones((2, 2), np.uint8)
-    thresh = cv2.erode(thresh, kernel, iterations=1)
-
-    respuestas = []
-    radio_muestra = int(HOJA_BUBBLE_R * 0.60)
-    UMBRAL_RELLENO_MINIMO = 0.45   # Mínimo 45% del círculo relleno
-    RATIO_DIFERENCIA = 1.4          # La más marcada debe ser 1.4x la segunda
-
-    for i in range(num_preguntas):
-        intensidades = []
-        for j in range(4):  # A, B, C, D
-            cx, cy = _posicion_burbuja(i, j)
-
-            # Verificar límites
-            if (cy - radio_muestra < 0 or cy + radio_muestra >= HOJA_H or
-                    cx - radio_muestra < 0 or cx + radio_muestra >= HOJA_W):
-                intensidades.append(0.0)
+    lote = st.session_state.get('_lote_omr')
+    if not lote:
+        return
+    filas = lote['filas']
+    ok = sum(1 for f in filas if f['Estado'] == '✅ OK')
+    st.markdown(f"**{len(filas)} hojas** — ✅ {ok} sin observaciones · "
+                f"⚠️ {len(filas) - ok} para revisar")
+    st.caption("Revise las filas marcadas: corrija DNI o las '?' de "
+               "Respuestas antes de guardar.")
+    editado = st.data_editor(
+        pd.DataFrame(filas), key="ed_lote_omr", hide_index=True,
+        use_container_width=True,
+        disabled=['Archivo', 'Nombre', 'Grado', 'Confianza', 'Estado'])
+
+    if st.button("💾 GUARDAR LOTE", type="primary",
+                 use_container_width=True, key="btn_guardar_lote_omr"):
+        if lote['tp'] != tp:
+            st.error("⚠️ Las claves cambiaron desde que se procesó el lote. "
+                     "Vuelva a procesarlo.")
+            return
+        fecha = hora_peru().strftime('%d/%m/%Y %H:%M')
+        resultados = []
+        for _, f in editado.iterrows():
+            if not f['Guardar'] or not str(f['Respuestas']).strip():
                 continue
-
-            # Crear máscara circular localizada (más eficiente)
-            y1 = max(0, cy - radio_muestra - 5)
-            y2 = min(HOJA_H, cy + radio_muestra + 5)
-            x1 = max(0, cx - radio_muestra - 5)
-            x2 = min(HOJA_W, cx + radio_muestra + 5)
-
-            roi = thresh[y1:y2, x1:x2]
-            mask_local = np.zeros_like(roi, dtype="uint8")
-            cv2.circle(mask_local,
-                       (cx - x1, cy - y1),
-                       radio_muestra, 255, -1)
-
-            masked = cv2.bitwise_and(roi, roi, mask=mask_local)
-            total = cv2.countNonZero(mask_local)
-            filled = cv2.countNonZero(masked)
-            ratio = filled / total if total > 0 else 0.0
-            intensidades.append(ratio)
-
-        if not intensidades:
-            respuestas.append('-')  # Sin datos = en blanco = 0 puntos
-            continue
-
-        max_val = max(intensidades)
-        max_idx = intensidades.index(max_val)
-
-        # Condición 1: Relleno mínimo
-        if max_val < UMBRAL_RELLENO_MINIMO:
-            respuestas.append('-')  # En blanco = 0 puntos (no marcó nada)
-            continue
-
-        # Condición 2: Diferencia significativa con la segunda opción
-        sorted_vals = sorted(intensidades, reverse=True)
-        segunda = sorted_vals[1] if len(sorted_vals) >= 2 else 0
-
-        if segunda > 0 and max_val / segunda < RATIO_DIFERENCIA:
-            respuestas.append('?')  # Ambiguo — corregir manualmente
-            continue
-
-        # Respuesta clara
-        respuestas.append(['A', 'B', 'C', 'D'][max_idx])
-
-    return respuestas
-
-
-def _leer_sin_perspectiva(gray, num_preguntas):
-    """
-    Método alternativo cuando no se detectan marcadores.
-    Intenta detectar la región de burbujas directamente.
-    Busca patrones de filas de 4 elementos oscuros.
-    """
-    alto, ancho = gray.shape[:2]
-
-    # Redimensionar a tamaño estándar para posiciones conocidas
-    resized = cv2.resize(gray, (HOJA_W, HOJA_H), interpolation=cv2.INTER_LINEAR)
-
-    _, thresh = cv2.threshold(resized, 0, 255,
-                               cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
-
-    # Intentar leer directamente asumiendo que la imagen ya está alineada
-    respuestas = _leer_burbujas(resized, num_preguntas)
-
-    # Verificar calidad: si más del 70% son '?', falló
-    preguntas_detectadas = sum(1 for r in respuestas if r != '?')
-    if preguntas_detectadas < num_preguntas * 0.3:
-        return None
-
-    return respuestas
-
-
-def procesar_examen(image_bytes, num_preguntas):
-    """
-    ESCÁNER OMR PROFESIONAL - Basado en posición.
-    
-    Método principal:
-    1. Detecta 4 marcadores de esquina
-    2. Corrige perspectiva (la foto se vuelve una hoja plana)
-    3. Lee cada burbuja en su posición exacta
-    
-    Método alternativo (sin marcadores):
-    - Redimensiona la imagen al tamaño de la hoja
-    - Intenta leer las posiciones directamente
-    
-    Retorna lista de respuestas ['A','B','C','D','?'] o None si falla
-    """
-    if not HAS_CV2:
-        return None
-
-    try:
-        # Decodificar imagen
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        if img is None:
-            return None
-
-        # Escalar si es muy grande (>4000px)
-        h_orig, w_orig = img.shape[:2]
-        escala = 1.0
-        if max(h_orig, w_orig) > 4000:
-            escala = 4000 / max(h_orig, w_orig)
-            img = cv2.resize(img, (int(w_orig * escala), int(h_orig * escala)),
-                             interpolation=cv2.INTER_AREA)
-
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-
-        # === MÉTODO 1: Con marcadores (el más preciso) ===
-        esquinas = _encontrar_marcadores(gray)
-        if esquinas is not None:
-            warped = _corregir_perspectiva(gray, esquinas)
-            respuestas = _leer_burbujas(warped, num_preguntas)
-            detectadas = sum(1 for r in respuestas if r != '?')
-            if detectadas >= num_preguntas * 0.3:
-                return respuestas
-
-        # === MÉTODO 2: Redimensionar directo (sin marcadores) ===
-        respuestas = _leer_sin_perspectiva(gray, num_preguntas)
-        if respuestas:
-            return respuestas
-
-        # === MÉTODO 3: Mejorar contraste y reintentar ===
-        clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
-        enhanced = clahe.apply(gray)
-        esquinas2 = _encontrar_marcadores(enhanced)
-        if esquinas2 is not None:
-            warped2 = _corregir_perspectiva(enhanced, esquinas2)
-            respuestas2 = _leer_burbujas(warped2, num_preguntas)
-            detectadas2 = sum(1 for r in respuestas2 if r != '?')
-            if detectadas2 >= num_preguntas * 0.3:
-                return respuestas2
-
-        # === MÉTODO 4: Umbral manual y reintentar ===
-        for umbral in [100, 120, 140, 160]:
-            _, manual_thresh = cv2.threshold(gray, umbral, 255, cv2.THRESH_BINARY)
-            esquinas3 = _encontrar_marcadores(manual_thresh)
-            if esquinas3 is not None:
-                warped3 = _corregir_perspectiva(gray, esquinas3)
-                respuestas3 = _leer_burbujas(warped3, num_preguntas)
-                detectadas3 = sum(1 for r in respuestas3 if r != '?')
-                if detectadas3 >= num_preguntas * 0.3:
-                    return respuestas3
-
-        return None
-
-    except Exception:
-        return None
+            dni = str(f['DNI']).strip()
+            nombre, grado = str(f['Nombre']), str(f['Grado'])
+            if dni and not nombre:
+                ad = BaseDatos.buscar_por_dni(dni)
+                if ad:
+                    nombre = str(ad.get('Nombre', ''))
+                    grado = str(ad.get('Grado', ''))
+            areas, pm = _calificar_hoja(ia, list(str(f['Respuestas']).upper()))
+            resultados.append({
+                'fecha': fecha, 'titulo': titulo,
+                'dni': dni, 'nombre': nombre or 'Sin nombre', 'grado': grado,
+                'areas': areas, 'promedio_general': pm,
+            })
+        if not resultados:
+            st.warning("No hay hojas marcadas para guardar.")
+            return
+        BaseDatos.guardar_resultados_examen_lote(resultados, usuario_actual)
+        st.session_state.pop('_lote_omr', None)
+        st.success(f"🎉 {len(resultados)} resultados guardados")
+        reproducir_beep_exitoso()
 
 # ================================================================
 # PANTALLA DE LOGIN (Usuario + Contraseña — SEGURO)
@@ -4556,7 +4430,7 @@ def tab_portal_estudiante():
     st.markdown("### 📚 Mis Fichas de Estudio")
 
     try:
-        from academia_cepru import AREAS_CEPRU
+        from academia_cepru import AREAS_CEPRU, pdf_cacheado
         from fichas_historia import (generar_ficha_texto, _PATRON,
                                      _color_area)
     except ImportError:
@@ -4632,8 +4506,8 @@ def tab_portal_estudiante():
     c_desc, c_ver, c_audio = st.columns(3)
     with c_desc:
         try:
-            pdf_bytes = generar_ficha_texto(tema, False, "Academia Virtual",
-                                            area=area_info["area_pie"])
+            pdf_bytes = pdf_cacheado(generar_ficha_texto, tema, False,
+                                     "Academia Virtual", area=area_info["area_pie"])
             st.download_button(
                 "📄 Descargar ficha para completar (PDF)",
                 data=pdf_bytes,
@@ -4984,8 +4858,6 @@ def tab_portal_estudiante():
 
 def _portal_padres_familia():
     """Portal público para padres: consulta asistencia y notas de su hijo/a."""
-    import json as _json
-    from pathlib import Path as _Path
     from datetime import datetime as _dt
 
     # ══════════════════════════════════════════════════════════════
@@ -5221,49 +5093,30 @@ def _portal_padres_familia():
     st.markdown("---")
     st.markdown("## 📅 Registro de Asistencia")
 
-    asis_hist = {}
-    if _Path(ARCHIVO_ASISTENCIAS).exists():
-        try:
-            with open(ARCHIVO_ASISTENCIAS, 'r', encoding='utf-8') as f:
-                asis_hist = _json.load(f)
-        except Exception:
-            asis_hist = {}
-
+    # Días con registro desde el resumen precalculado (días hábiles, del
+    # más reciente al más antiguo); el detalle de horas se lee solo para
+    # los días que se muestran. La tardanza es la del resumen, igual que
+    # en los rankings: marcada como tardanza O entrada después del límite.
     registros = []
-    for fecha_key, personas in asis_hist.items():
-        if not isinstance(personas, dict):
-            continue
-        if dni_estudiante not in personas:
-            continue
-        v = personas[dni_estudiante]
+    for d in _resumen_asistencias().historial(dni_estudiante):
+        registros.append({
+            'fecha_dt':  _dt.fromisoformat(d['fecha']),
+            'fecha':     f"{d['fecha'][8:10]}/{d['fecha'][5:7]}/{d['fecha'][:4]}",
+            'iso':       d['fecha'],
+            'entrada':   d['primera'] if d['estado'] != 'registrado' else '',
+            'tardanza':  d['estado'] == 'tardanza',
+            'sal_man':   '', 'ent_tar': '', 'sal_tar': '',
+        })
+    _diario_portal = _diario_asistencias()
+    for r in registros[:30]:
         try:
-            if '-' in fecha_key and len(fecha_key) == 10:
-                fecha_dt = _dt.strptime(fecha_key, '%Y-%m-%d')
-                fecha_display = fecha_dt.strftime('%d/%m/%Y')
-            elif '/' in fecha_key and len(fecha_key) == 10:
-                fecha_dt = _dt.strptime(fecha_key, '%d/%m/%Y')
-                fecha_display = fecha_key
-            else:
-                continue
+            v = _diario_portal.leer_dia(r['iso']).get(dni_estudiante, {})
         except Exception:
             continue
-
-        ent     = v.get('entrada', '')
-        tard    = v.get('tardanza', '')
-        sal_man = v.get('salida', '')
-        ent_tar = v.get('entrada_tarde', '')
-        sal_tar = v.get('salida_tarde', '')
-        registros.append({
-            'fecha_dt':  fecha_dt,
-            'fecha':     fecha_display,
-            'entrada':   ent or tard,
-            'tardanza':  bool(tard),
-            'sal_man':   sal_man,
-            'ent_tar':   ent_tar,
-            'sal_tar':   sal_tar,
-        })
-
-    registros = sorted(registros, key=lambda x: x['fecha_dt'], reverse=True)
+        r['entrada'] = v.get('entrada', '') or v.get('tardanza', '') or r['entrada']
+        r['sal_man'] = v.get('salida', '')
+        r['ent_tar'] = v.get('entrada_tarde', '')
+        r['sal_tar'] = v.get('salida_tarde', '')
 
     total   = len(registros)
     puntual = sum(1 for r in registros if r['entrada'] and not r['tardanza'])
@@ -5357,16 +5210,6 @@ def _portal_padres_familia():
 
     mis_notas = {}  # {area: [{periodo, titulo, nota, fecha}]}
 
-    def _leer_json_portal(archivo):
-        p = _Path(archivo)
-        if not p.exists():
-            return None
-        try:
-            with open(p, 'r', encoding='utf-8') as f:
-                return _json.load(f)
-        except Exception:
-            return None
-
     def _agregar_nota(area, periodo, titulo, nota, fecha=''):
         area  = str(area).strip() or 'General'
         nota_s = str(nota).strip()
@@ -5405,118 +5248,31 @@ def _portal_padres_familia():
                     "C":"#dc2626","I":"#dc2626","NE":"#6b7280"}
             return mapa.get(str(nota_str).strip().upper(), "#6b7280"), str(nota_str).strip()
 
-    # ── FUENTE 1: resultados.json ─────────────────────────────────
-    res_raw = _leer_json_portal('resultados.json')
-    if isinstance(res_raw, dict):
-        tmp = []
-        for v in res_raw.values():
-            if isinstance(v, list): tmp.extend(v)
-        res_raw = tmp
-    for reg in (res_raw or []):
-        if not isinstance(reg, dict): continue
-        if (str(reg.get('dni','')).strip() != dni_estudiante and
-                str(reg.get('nombre','')).strip().upper() != nombre.upper()):
-            continue
-        periodo = reg.get('periodo', reg.get('bimestre', reg.get('semana', '')))
-        titulo  = reg.get('titulo', '')
-        fecha_r = reg.get('fecha', '')
-        areas_r = reg.get('areas', [])
-        if isinstance(areas_r, list):
-            for a in areas_r:
-                if isinstance(a, dict):
-                    _agregar_nota(a.get('nombre', a.get('area', 'General')),
-                                  periodo, titulo, a.get('nota', a.get('calificacion','')), fecha_r)
-        elif isinstance(areas_r, dict):
-            for an, av in areas_r.items():
-                _agregar_nota(an, periodo, titulo, av, fecha_r)
-
-    # ── FUENTE 2: resultados_examenes.json ────────────────────────
-    res_exam = _leer_json_portal('resultados_examenes.json')
-    if isinstance(res_exam, dict):
-        tmp2 = []
-        for v in res_exam.values():
-            if isinstance(v, list): tmp2.extend(v)
-        res_exam = tmp2
-    for reg in (res_exam or []):
-        if not isinstance(reg, dict): continue
-        if (str(reg.get('dni','')).strip() != dni_estudiante and
-                str(reg.get('nombre','')).strip().upper() != nombre.upper()):
+    # ── Notas del alumno desde el almacén (índice por DNI / nombre) ──
+    # Fuentes, en este orden: resultados por alumno (Registrar Notas,
+    # diagnósticos, QAWAY), resultados de exámenes y rankings del historial
+    # de evaluaciones
+    try:
+        _notas_portal = _almacen_notas().notas_alumno(dni_estudiante, nombre)
+    except Exception:
+        _notas_portal = []
+    _orden_fuente = {'reporte': 0, 'examen': 1, 'historial': 2}
+    _notas_portal = sorted((n for n in _notas_portal if n['fuente'] in _orden_fuente),
+                           key=lambda n: _orden_fuente[n['fuente']])
+    for n in _notas_portal:
+        if n['fuente'] != 'historial':
+            _agregar_nota(n['area'], n['periodo'], n['titulo'], n['nota'], n['fecha'])
             continue
-        periodo = reg.get('periodo', reg.get('bimestre', ''))
-        titulo  = reg.get('titulo', '')
-        fecha_r = reg.get('fecha', '')
-        areas_r = reg.get('areas', [])
-        if isinstance(areas_r, list):
-            for a in areas_r:
-                if isinstance(a, dict):
-                    _agregar_nota(a.get('nombre', 'General'), periodo, titulo,
-                                  a.get('nota', a.get('calificacion','')), fecha_r)
-        elif isinstance(areas_r, dict):
-            for an, av in areas_r.items():
-                _agregar_nota(an, periodo, titulo, av, fecha_r)
-
-    # ── FUENTE 3: historial_evaluaciones.json ─────────────────────
-    # ⚠️ areas es lista de DICTS: [{'nombre':'Historia','id':...}]
-    # ranking es: [{'DNI':'...','Nombre':'...','Historia':16,'Promedio':13.0}]
-    hist_ev = _leer_json_portal('historial_evaluaciones.json') or {}
-    for clave_ev, ev in hist_ev.items():
-        if not isinstance(ev, dict): continue
-        periodo   = ev.get('periodo', ev.get('bimestre', ''))
-        titulo    = ev.get('titulo', '')
-        fecha_r   = ev.get('fecha', '')
-        areas_ev  = ev.get('areas', [])
-        # Extraer nombres de áreas (pueden ser dicts o strings)
-        areas_nombres_ev = []
-        for a in areas_ev:
-            if isinstance(a, dict):
-                areas_nombres_ev.append(str(a.get('nombre', '')).strip())
-            elif isinstance(a, str):
-                areas_nombres_ev.append(a.strip())
-        areas_nombres_ev = [x for x in areas_nombres_ev if x]
-
-        for fila_ev in ev.get('ranking', []):
-            if not isinstance(fila_ev, dict): continue
-            dni_fila    = str(fila_ev.get('DNI', fila_ev.get('dni', ''))).strip()
-            nombre_fila = str(fila_ev.get('Nombre', fila_ev.get('nombre', ''))).strip().upper()
-            if dni_fila != dni_estudiante and nombre_fila != nombre.upper():
-                continue
-            # Guardar puesto para esta sesión
-            puesto_ev = fila_ev.get('Puesto', fila_ev.get('puesto', ''))
-            total_ev  = len(ev.get('ranking', []))
-            medalla_ev = fila_ev.get('Medalla', fila_ev.get('medalla', ''))
-            # Leer nota por cada área
-            if areas_nombres_ev:
-                for an in areas_nombres_ev:
-                    av = fila_ev.get(an, '')
-                    if av != '':
-                        nota_entry = {
-                            'sem':    periodo,
-                            'titulo': titulo,
-                            'nota':   str(av),
-                            'fecha':  fecha_r,
-                            'puesto': puesto_ev,
-                            'total':  total_ev,
-                            'medalla': medalla_ev,
-                        }
-                        an_key = str(an).strip() or 'General'
-                        if an_key not in mis_notas:
-                            mis_notas[an_key] = []
-                        mis_notas[an_key].append(nota_entry)
-            else:
-                nota_g = fila_ev.get('promedio', fila_ev.get('Promedio', fila_ev.get('nota', '')))
-                nota_entry = {
-                    'sem':    periodo,
-                    'titulo': titulo,
-                    'nota':   str(nota_g),
-                    'fecha':  fecha_r,
-                    'puesto': puesto_ev,
-                    'total':  total_ev,
-                    'medalla': medalla_ev,
-                }
-                an_key = 'General / QAWAY'
-                if an_key not in mis_notas:
-                    mis_notas[an_key] = []
-                mis_notas[an_key].append(nota_entry)
+        an_key = n['area'] or 'General / QAWAY'
+        mis_notas.setdefault(an_key, []).append({
+            'sem':     n['periodo'],
+            'titulo':  n['titulo'],
+            'nota':    n['nota'],
+            'fecha':   n['fecha'],
+            'puesto':  n['puesto'],
+            'total':   n['n'],
+            'medalla': n['medalla'],
+        })
 
     # ── Mostrar notas POR SEMANA / FECHA ─────────────────────────
     if mis_notas:
@@ -6221,10 +5977,8 @@ def pantalla_login():
                             gs = _gs()
                             if gs:
                                 try:
-                                    ws = gs._get_hoja('config')
-                                    if ws:
-                                        codigo_rec = f"REC-{hora_peru().year}-{int(time.time()) % 10000:04d}"
-                                        ws.append_row([
+                                    codigo_rec = f"REC-{hora_peru().year}-{int(time.time()) % 10000:04d}"
+                                    if gs.config().agregar(
                                             f"reclamo_{codigo_rec}",
                                             json.dumps({
                                                 'codigo': codigo_rec, 'nombre': r_nombre,
@@ -6233,8 +5987,7 @@ def pantalla_login():
                                                 'detalle': r_detalle,
                                                 'fecha': fecha_peru_str(), 'hora': hora_peru_str(),
                                                 'estado': 'Pendiente'
-                                            }, ensure_ascii=False)
-                                        ])
+                                            }, ensure_ascii=False)):
                                         st.success(f"✅ Reclamo registrado. Código: **{codigo_rec}**")
                                         st.info(f"📧 Se enviará respuesta al correo: {r_email.strip()}")
                                 except Exception:
@@ -6285,13 +6038,38 @@ def crear_backup():
     buf = io.BytesIO()
     with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as zf:
         for archivo in ARCHIVOS_BACKUP:
+            if archivo in (ARCHIVO_ASISTENCIAS, ARCHIVO_RESULTADOS,
+                           "historial_evaluaciones.json"):
+                continue  # se exportan desde el diario / el almacén (abajo)
+            if archivo in (ARCHIVO_MATRICULA, ARCHIVO_DOCENTES):
+                # El XLSX se genera desde el almacén Parquet (puede no
+                # existir o estar desactualizado en disco)
+                _xlsx = exportar_xlsx_bytes(archivo)
+                if _xlsx is not None:
+                    zf.writestr(archivo, _xlsx)
+                continue
             if Path(archivo).exists():
                 zf.write(archivo, archivo)
+        # Las notas se exportan al día desde el almacén (los JSON en disco
+        # se reescriben con retraso)
+        try:
+            _alm_bk = _almacen_notas()
+            for _fuente in ('historial', 'examen'):
+                _nombre_bk = _alm_bk.archivos[_fuente]
+                zf.writestr(_nombre_bk, json.dumps(_alm_bk.exportar(_fuente), indent=2,
+                                                   ensure_ascii=False, default=str))
+        except Exception:
+            pass
+        _asis_todas = leer_asistencias_todas()
+        if _asis_todas or Path(ARCHIVO_ASISTENCIAS).exists():
+            zf.writestr(ARCHIVO_ASISTENCIAS,
+                        json.dumps(_asis_todas, indent=2, ensure_ascii=False))
         # Agregar un manifiesto con info del backup
         info = {
             "fecha": hora_peru().strftime('%d/%m/%Y %H:%M:%S'),
             "version": "YACHAY PRO v4.0",
-            "archivos": [a for a in ARCHIVOS_BACKUP if Path(a).exists()],
+            "archivos": [a for a in ARCHIVOS_BACKUP
+                         if Path(a).exists() or a in zf.namelist()],
             "total_alumnos": len(BaseDatos.cargar_matricula()),
             "total_docentes": len(BaseDatos.cargar_docentes()),
         }
@@ -6315,6 +6093,10 @@ def restaurar_backup(zip_bytes):
                     restaurados.append(archivo)
                 except Exception as e:
                     errores.append(f"{archivo}: {str(e)}")
+        # El asistencias.json del backup ya trae el historial completo:
+        # los diarios locales quedarían por encima y lo taparían.
+        if ARCHIVO_ASISTENCIAS in restaurados:
+            _diario_asistencias().descartar_diarios()
     except Exception as e:
         errores.append(f"Error ZIP: {str(e)}")
     return restaurados, errores
@@ -6505,27 +6287,84 @@ def configurar_sidebar():
                 _chk_all = st.checkbox("Confirmo que deseo borrar TODAS las notas", key="chk_reset_all")
                 if _chk_all and st.button("🗑️ BORRAR TODAS LAS NOTAS", type="primary",
                                            use_container_width=True, key="btn_reset_all"):
-                    for _archivo in ['historial_evaluaciones.json', 'resultados.json',
-                                     'resultados_examenes.json', ARCHIVO_RESULTADOS]:
-                        try:
-                            with open(_archivo, 'w', encoding='utf-8') as _f:
-                                json.dump({}, _f)
-                        except Exception: pass
+                    # El almacén se vacía y reescribe los JSON vacíos (que
+                    # además quedan marcados para no volver a importarse)
+                    try:
+                        _alm_reset = _almacen_notas()
+                        _alm_reset.vaciar()
+                        _alm_reset.exportar_archivos()
+                    except Exception: pass
+                    _programar_respaldo_notas()
                     # Limpiar también en Google Sheets
                     try:
                         _gs_inst = _gs()
                         if _gs_inst:
-                            ws_cfg = _gs_inst._get_hoja('config')
-                            if ws_cfg:
-                                registros = ws_cfg.get_all_records()
-                                # Borrar desde el final para no desplazar índices
-                                for i in range(len(registros), 0, -1):
-                                    clave = str(registros[i-1].get('clave', ''))
-                                    if clave.startswith('nota_') or clave.startswith('resultado_'):
-                                        ws_cfg.delete_rows(i + 1)
+                            _gs_inst.config().eliminar(prefijos=('nota_', 'resultado_'))
                     except Exception: pass
                     st.success("✅ Todas las notas eliminadas del sistema y GS")
                     st.rerun()
+            # Bandeja de salida: se muestra también sin conexión, que es
+            # justamente cuando crece
+            try:
+                _gs_cfg = get_google_sync() if GOOGLE_SYNC_DISPONIBLE else None
+            except Exception:
+                _gs_cfg = None
+            if _gs_cfg is not None and _gs_cfg.configurado:
+                try:
+                    _est_bandeja = _gs_cfg.bandeja().estado()
+                    _pend_asist = _gs_cfg.sincronizador_asistencias().pendientes()
+                except Exception:
+                    _est_bandeja, _pend_asist = None, 0
+                if _est_bandeja is not None:
+                    with st.expander("📤 Pendientes de subir a Google Sheets"):
+                        _c1, _c2, _c3 = st.columns(3)
+                        _c1.metric("Escrituras", _est_bandeja['pendientes'])
+                        _c2.metric("Asistencias", _pend_asist)
+                        _c3.metric("Más antigua", f"{int(_est_bandeja['antiguedad_s'] // 60)} min")
+                        if not _gs_cfg.conectado:
+                            st.warning("Sin conexión: se reintenta en segundo plano")
+                        if _est_bandeja['ultimo_error']:
+                            st.caption(f"Último error: {_est_bandeja['ultimo_error']}")
+                        if _est_bandeja['descartadas']:
+                            st.error(f"{_est_bandeja['descartadas']} escrituras descartadas: "
+                                     "fallaron una y otra vez mientras las demás sí se enviaban")
+                            st.dataframe(pd.DataFrame(_gs_cfg.bandeja().descartadas()),
+                                         use_container_width=True, hide_index=True)
+                            if st.button("🔁 Reintentar descartadas", key="bandeja_reintentar"):
+                                _gs_cfg.bandeja().reintentar_descartadas()
+                                st.rerun()
+            _est_rest = _restauracion_arranque().estado()
+            with st.expander("⏱️ Restauración al arrancar"):
+                if _est_rest['total_s'] is not None:
+                    st.caption(("✅ Terminada" if _est_rest['terminado'] else "⏳ En curso")
+                               + f" · {_est_rest['total_s']:.1f}s en total")
+                _df_rest = pd.DataFrame(_est_rest['pasos'])
+                if not _df_rest.empty:
+                    _df_rest['duracion_s'] = _df_rest['duracion_s'].astype(float).round(2)
+                    st.dataframe(_df_rest[['nombre', 'estado', 'duracion_s', 'resultado', 'error']],
+                                 use_container_width=True, hide_index=True)
+            _est_notif = _notificaciones().estadisticas()
+            with st.expander("📨 Notificaciones a padres"):
+                st.caption(f"En cola: {_est_notif['en_cola']}")
+                _df_notif = pd.DataFrame.from_dict(_est_notif['canales'], orient='index')
+                _df_notif['demora_prom_s'] = (_df_notif['demora_total_s']
+                                              / _df_notif['enviados'].clip(lower=1)).round(1)
+                st.dataframe(_df_notif.drop(columns=['demora_total_s']),
+                             use_container_width=True)
+            _gs_api = _gs()
+            if _gs_api:
+                with st.expander("📡 Uso de la API de Google Sheets"):
+                    _tot_api, _por_llamador = _gs_api.estadisticas_api()
+                    st.caption(f"Lecturas: {_tot_api['lecturas']} · "
+                               f"Escrituras: {_tot_api['escrituras']} · "
+                               f"Compartidas: {_tot_api['compartidas']} · "
+                               f"429: {_tot_api['errores_429']} · "
+                               f"Espera: {_tot_api['espera_total_s']:.1f}s")
+                    if _por_llamador:
+                        _df_api = pd.DataFrame.from_dict(_por_llamador, orient='index')
+                        _df_api['espera_s'] = _df_api['espera_s'].round(1)
+                        st.dataframe(_df_api.sort_values('lecturas', ascending=False),
+                                     use_container_width=True)
 
         st.markdown("---")
         anio = st.number_input("📅 Año:", 2024, 2040, 2026, key="ai")
@@ -12556,24 +12395,12 @@ def tab_asistencias():
     st.caption(f"🕒 **{hora_peru().strftime('%H:%M:%S')}** | "
                f"📅 {hora_peru().strftime('%d/%m/%Y')}")
 
-    import time as _t_asis
-
-    # ── CARGA AUTOMÁTICA SIEMPRE — sin botón, sin intervención ──────────
-    # SIEMPRE reconstruye el índice al entrar, garantizando docentes + alumnos
-    _idx = st.session_state.get('_indice_dni', {})
-    _idx_ts = st.session_state.get('_indice_dni_ts', 0)
-    _edad = _t_asis.time() - _idx_ts
-
-    # Contar antes de decidir
-    _n_doc = sum(1 for v in _idx.values() if isinstance(v, dict) and v.get('_tipo') == 'docente')
-    _n_alu = sum(1 for v in _idx.values() if isinstance(v, dict) and v.get('_tipo') == 'alumno')
-
-    # Reconstruir si: vacío, viejo (>3min), o faltan docentes
-    if (not _idx) or (_edad > 180) or (_n_doc == 0):
-        _construir_indice_dni()
-        _idx  = st.session_state.get('_indice_dni', {})
-        _n_doc = sum(1 for v in _idx.values() if isinstance(v, dict) and v.get('_tipo') == 'docente')
-        _n_alu = sum(1 for v in _idx.values() if isinstance(v, dict) and v.get('_tipo') == 'alumno')
+    # ── CARGA AUTOMÁTICA — índice COMPARTIDO por todas las sesiones ─────
+    # Una sesión nueva reutiliza el índice ya construido por el proceso; solo
+    # se reconstruye si alguien guardó matrícula/docentes o venció su TTL.
+    _stats_idx = _indice_dni().estadisticas()
+    _n_doc = _stats_idx['docentes']
+    _n_alu = _stats_idx['alumnos']
 
     # ── Estado visual ──────────────────────────────────────────────────
     _col_a, _col_b = st.columns(2)
@@ -12587,12 +12414,7 @@ def tab_asistencias():
     if _n_alu == 0 and _n_doc == 0:
         st.error("❌ No se cargaron datos. Verifica tu conexión a Google Sheets o que el Excel de matrícula esté subido.")
         if st.button("Intentar cargar de nuevo", type="primary", key="btn_force_reload"):
-            st.session_state.pop('_indice_dni', None)
-            st.session_state.pop('_indice_dni_ts', None)
-            try:
-                Path(ARCHIVO_INDICE_CACHE).unlink(missing_ok=True)
-            except Exception:
-                pass
+            _indice_dni().invalidar()
             st.rerun()
         return  # No mostrar el resto si no hay datos
 
@@ -12696,7 +12518,9 @@ def tab_asistencias():
             foto = st.camera_input("Apunta al QR:", key="ca")
             if foto:
                 d = decodificar_qr_imagen(foto.getvalue())
-                if d:
+                if d and qr_repetido(d, '_ultimo_qr_asistencia'):
+                    st.info(f"✔️ {d} ya se registró hace unos segundos.")
+                elif d:
                     _registrar_asistencia_rapida(d)
                 else:
                     st.warning("⚠️ QR no detectado.")
@@ -12743,16 +12567,13 @@ def tab_asistencias():
                    delta_color="normal" if _n_doc > 0 else "inverse")
         if _n_doc == 0:
             if st.button("🔄 Recargar índice", type="primary", key="btn_reload_indice"):
-                st.session_state.pop('_indice_dni', None)
-                st.session_state.pop('_indice_dni_ts', None)
                 try:
-                    Path(ARCHIVO_INDICE_CACHE).unlink(missing_ok=True)
                     _gs_i = _gs()
                     if _gs_i: _gs_i.invalidar_cache()
                 except Exception:
                     pass
                 with st.spinner("Recargando..."):
-                    _construir_indice_dni()
+                    _indice_dni().recargar()
                 st.rerun()
 
         # Sonido/vibración via JS después de registrar
@@ -12896,13 +12717,7 @@ def tab_asistencias():
     st.markdown("---")
     st.markdown("### 📅 Historial de Asistencia — Descargar por Fecha")
 
-    _hist_todas = {}
-    if Path(ARCHIVO_ASISTENCIAS).exists():
-        with open(ARCHIVO_ASISTENCIAS, 'r', encoding='utf-8') as _fh:
-            try:
-                _hist_todas = json.load(_fh)
-            except Exception:
-                _hist_todas = {}
+    _hist_todas = leer_asistencias_todas()
 
     # Complementar con Google Sheets — recupera datos de meses anteriores
     try:
@@ -13092,11 +12907,7 @@ def tab_asistencias():
                     st.warning("No hay estudiantes matriculados en este grado.")
                 else:
                     # Cargar asistencias locales + GSheets
-                    _asis_aus = {}
-                    if Path(ARCHIVO_ASISTENCIAS).exists():
-                        with open(ARCHIVO_ASISTENCIAS,"r",encoding="utf-8") as _fa2:
-                            try: _asis_aus = json.load(_fa2)
-                            except Exception: pass
+                    _asis_aus = leer_asistencias_todas()
                     try:
                         _gs2 = _gs()
                         if _gs2:
@@ -13408,8 +13219,8 @@ def tab_asistencias():
                                             "I.E.P. Alternativo Yachay - Chinchero\n"
                                             "\U0001f4de 084-750071"
                                         )
-                                        _tg_enviar(_cid2, _msg_tg, _tok_aus)
-                                _iniciar_hilo(_env_aus)
+                                        _tg_encolar(_cid2, _msg_tg, _tok_aus)
+                                _env_aus()
                                 st.success(f"✅ Enviando Telegram a {len(_con_tg)} apoderados...")
                             elif not _tok_aus:
                                 st.warning("Configura el bot de Telegram primero.")
@@ -13420,10 +13231,7 @@ def tab_asistencias():
         st.markdown("---")
         st.subheader("📊 Analytics de Asistencia")
 
-        _asis_hist = {}
-        if Path(ARCHIVO_ASISTENCIAS).exists():
-            with open(ARCHIVO_ASISTENCIAS, 'r', encoding='utf-8') as _f:
-                _asis_hist = json.load(_f)
+        _asis_hist = leer_asistencias_todas()
 
         _dias_anal = [(hora_peru().date() - timedelta(days=_d)).strftime('%Y-%m-%d') for _d in range(13, -1, -1)]
         _dias_anal_display = [(hora_peru().date() - timedelta(days=_d)).strftime('%d/%m') for _d in range(13, -1, -1)]
@@ -13629,69 +13437,20 @@ def tab_asistencias():
             if _dia <= _hoy:
                 _dias_semana.append((_dia.strftime("%Y-%m-%d"), _dia.strftime("%d/%m/%Y")))
 
-        _asis_sem = {}
-        # 1. Cargar desde archivo local
-        if Path(ARCHIVO_ASISTENCIAS).exists():
-            with open(ARCHIVO_ASISTENCIAS, "r", encoding="utf-8") as _fs:
-                _asis_sem = _jps.load(_fs)
+        # Ranking desde el resumen precalculado; si faltan días de la
+        # semana, complementar con la hoja / Drive (máx. cada 10 min)
+        _resumen = _resumen_asistencias()
+        _ini_sem_iso, _fin_sem_iso = _dias_semana[0][0], _dias_semana[-1][0]
+        _top_alu, _top_doc, _dias_con_data = _resumen.ranking(_ini_sem_iso, _fin_sem_iso)
+        if len(_dias_con_data) < len(_dias_semana) and _complemento_asis_vencido():
+            _complementar_resumen_remoto()
+            _top_alu, _top_doc, _dias_con_data = _resumen.ranking(_ini_sem_iso, _fin_sem_iso)
+        _dias_con_data = set(_dias_con_data)
 
-        # 2. Complementar con GSheets si faltan dias de la semana
-        _dias_faltantes = [iso for iso,_ in _dias_semana if not _asis_sem.get(iso)]
-        if _dias_faltantes:
-            try:
-                gs = _gs()
-                if gs:
-                    ws_a = gs._get_hoja('asistencias')
-                    if ws_a:
-                        _rows_gs = ws_a.get_all_records()
-                        for _row in _rows_gs:
-                            _f_gs  = str(_row.get('fecha','')).strip()
-                            _d_gs  = str(_row.get('dni','')).strip()
-                            _nom   = str(_row.get('nombre','')).strip()
-                            _tipo  = str(_row.get('tipo_persona','')).strip().lower()
-                            _ent_g = str(_row.get('hora_entrada','')).strip()
-                            _sal_g = str(_row.get('hora_salida','')).strip()
-                            if not _f_gs or not _d_gs: continue
-                            if _f_gs not in _asis_sem:
-                                _asis_sem[_f_gs] = {}
-                            if _d_gs not in _asis_sem[_f_gs]:
-                                _asis_sem[_f_gs][_d_gs] = {
-                                    'nombre': _nom,
-                                    'entrada': _ent_g,
-                                    'salida': _sal_g,
-                                    'es_docente': 'doc' in _tipo,
-                                }
-            except Exception:
-                pass
-
-        _n_dias_con_data = sum(1 for iso,_ in _dias_semana if _asis_sem.get(iso))
-
-        _conteo_alu = {}
-        _conteo_doc = {}
-        for _iso, _disp in _dias_semana:
-            _reg_dia = _asis_sem.get(_iso, _asis_sem.get(_disp, {}))
-            for _dk, _dv in _reg_dia.items():
-                _ent  = _dv.get("entrada","") or _dv.get("tardanza","")
-                _tard = bool(_dv.get("tardanza",""))
-                try:
-                    if _ent:
-                        _h,_m = int(_ent[:2]),int(_ent[3:5])
-                        _tard = _tard or (_h*60+_m > 8*60+5)
-                except Exception:
-                    pass
-                _dst = _conteo_doc if _dv.get("es_docente",False) else _conteo_alu
-                if _dk not in _dst:
-                    _dst[_dk] = {"nombre":_dv.get("nombre",""), "puntual":0, "tardanza":0, "total":0}
-                _dst[_dk]["total"] += 1
-                if _ent and not _tard: _dst[_dk]["puntual"] += 1
-                elif _tard: _dst[_dk]["tardanza"] += 1
-
-        _top_alu = sorted(_conteo_alu.values(), key=lambda x:(-x["puntual"],x["tardanza"]))[:10]
-        _top_doc = sorted(_conteo_doc.values(), key=lambda x:(-x["puntual"],x["tardanza"]))[:10]
         _fecha_ini_sem = _dias_semana[0][1]
         _fecha_fin_sem = _dias_semana[-1][1]
         _semana_key    = f"{_dias_semana[0][0]}_{_dias_semana[-1][0]}"
-        _n_dias_reg    = len([d for d,_ in _dias_semana if _asis_sem.get(d)])
+        _n_dias_reg    = len(_dias_con_data)
 
         # Guardar en historial automaticamente si hay datos
         if _top_alu or _top_doc:
@@ -13708,9 +13467,8 @@ def tab_asistencias():
         # Info de días encontrados
         _nombres_dias = ['Lun','Mar','Mié','Jue','Vie']
         _dias_info = []
-        for _iso, _disp in _dias_semana:
-            _wd = datetime.strptime(_iso, '%Y-%m-%d').weekday()
-            _tiene = bool(_asis_sem.get(_iso) or _asis_sem.get(_disp))
+        for _wd, (_iso, _disp) in enumerate(_dias_semana):
+            _tiene = _iso in _dias_con_data
             _dias_info.append(f"{'✅' if _tiene else '⬜'} {_nombres_dias[_wd]} {_disp[0:5]}")
         _dias_str = '  '.join(_dias_info)
 
@@ -13823,127 +13581,15 @@ def tab_asistencias():
                              "Julio","Agosto","Septiembre","Octubre","Noviembre","Diciembre"][_mes_actual]
             _nom_mes = _nom_mes_full[:3]
 
-            # Construir datos del mes completo
-            # Fuente 1: semana actual (ya cargada)
-            _asis_mes = dict(_asis_sem)
-
-            # Fuente 2: asistencias.json local (puede tener más días si no reinició)
-            try:
-                if Path(ARCHIVO_ASISTENCIAS).exists():
-                    with open(ARCHIVO_ASISTENCIAS,"r",encoding="utf-8") as _fam:
-                        _local_all = json.load(_fam)
-                    for _fk_l, _fd_l in _local_all.items():
-                        if _fk_l not in _asis_mes:
-                            _asis_mes[_fk_l] = _fd_l
-                        else:
-                            for _dk_l, _dv_l in _fd_l.items():
-                                if _dk_l not in _asis_mes[_fk_l]:
-                                    _asis_mes[_fk_l][_dk_l] = _dv_l
-            except Exception:
-                pass
-
-            # Fuente 3: Google Drive YACHAY_BACKUP/asistencias.json
-            # Tiene el historial COMPLETO (todo abril y meses anteriores)
-            _drive_cache_key = '_asis_drive_cache'
-            _drive_cache_ts  = '_asis_drive_ts'
-            import time as _tm_mes
-            _now_mes = _tm_mes.time()
-            # Solo consultar Drive una vez cada 5 minutos para no ralentizar
-            if (_now_mes - st.session_state.get(_drive_cache_ts, 0) > 300
-                    or _drive_cache_key not in st.session_state):
+            # Top del Mes desde los totales mensuales del resumen. El
+            # historial de Drive y la hoja Asistencias (por si esta
+            # instancia no vio todos los escaneos) se suman como máximo
+            # una vez cada 10 minutos por proceso.
+            if _complemento_asis_vencido():
                 with st.spinner("🔄 Cargando historial completo de asistencias..."):
-                    try:
-                        _drive_full = _drive_restaurar_json("asistencias.json")
-                        if _drive_full and isinstance(_drive_full, dict):
-                            st.session_state[_drive_cache_key] = _drive_full
-                            st.session_state[_drive_cache_ts]  = _now_mes
-                    except Exception:
-                        pass
-
-            _drive_data = st.session_state.get(_drive_cache_key, {})
-            for _fk_d, _fd_d in _drive_data.items():
-                if _fk_d not in _asis_mes:
-                    _asis_mes[_fk_d] = _fd_d
-                else:
-                    for _dk_d, _dv_d in _fd_d.items():
-                        if _dk_d not in _asis_mes[_fk_d]:
-                            _asis_mes[_fk_d][_dk_d] = _dv_d
-
-            # Fuente 4: GSheets config backup (asistencias_json) — fallback
-            try:
-                _gs_inst2 = _gs()
-                if _gs_inst2 and not _drive_data:
-                    _ws_cfg2 = _gs_inst2._get_hoja('config')
-                    if _ws_cfg2:
-                        for _row_cfg in _ws_cfg2.get_all_values():
-                            if _row_cfg and _row_cfg[0] == 'asistencias_json' and len(_row_cfg) > 1:
-                                _gs_full = json.loads(_row_cfg[1])
-                                for _fk_g2, _fd_g2 in _gs_full.items():
-                                    if _fk_g2 not in _asis_mes:
-                                        _asis_mes[_fk_g2] = _fd_g2
-                                break
-            except Exception:
-                pass
-            try:
-                gs = _gs()
-                if gs:
-                    ws_am = gs._get_hoja('asistencias')
-                    if ws_am:
-                        for _row in ws_am.get_all_records():
-                            _f_gs  = str(_row.get('fecha','')).strip()
-                            _d_gs  = str(_row.get('dni','')).strip()
-                            _nom_g = str(_row.get('nombre','')).strip()
-                            _tipo_g= str(_row.get('tipo_persona','')).strip().lower()
-                            _ent_g = str(_row.get('hora_entrada','')).strip()
-                            if not _f_gs or not _d_gs: continue
-                            try:
-                                _fdt_g = (datetime.strptime(_f_gs, "%Y-%m-%d")
-                                          if "-" in _f_gs else datetime.strptime(_f_gs, "%d/%m/%Y"))
-                                if _fdt_g.month != _mes_actual or _fdt_g.year != _anio_actual: continue
-                                if _fdt_g.weekday() >= 5: continue
-                                _fkey_g = _fdt_g.strftime("%Y-%m-%d")
-                            except Exception:
-                                continue
-                            if _fkey_g not in _asis_mes:
-                                _asis_mes[_fkey_g] = {}
-                            if _d_gs not in _asis_mes[_fkey_g]:
-                                _asis_mes[_fkey_g][_d_gs] = {
-                                    'nombre': _nom_g, 'entrada': _ent_g,
-                                    'es_docente': 'doc' in _tipo_g,
-                                }
-            except Exception:
-                pass
-
-            _conteo_mes_alu = {}
-            _conteo_mes_doc = {}
-            _dias_mes_con_data = 0
-            for _fkey, _fdata in _asis_mes.items():
-                try:
-                    _fdt = (datetime.strptime(_fkey, "%Y-%m-%d")
-                            if "-" in _fkey else datetime.strptime(_fkey, "%d/%m/%Y"))
-                    if _fdt.month != _mes_actual or _fdt.year != _anio_actual: continue
-                    if _fdt.weekday() >= 5: continue
-                except Exception:
-                    continue
-                _dias_mes_con_data += 1
-                for _dk, _dv in _fdata.items():
-                    _ent  = _dv.get("entrada","") or _dv.get("tardanza","")
-                    _tard = bool(_dv.get("tardanza",""))
-                    try:
-                        if _ent:
-                            _h,_m = int(_ent[:2]),int(_ent[3:5])
-                            _tard = _tard or (_h*60+_m > 8*60+5)
-                    except Exception:
-                        pass
-                    _dst = _conteo_mes_doc if _dv.get("es_docente",False) else _conteo_mes_alu
-                    if _dk not in _dst:
-                        _dst[_dk] = {"nombre":_dv.get("nombre",""),"puntual":0,"tardanza":0,"total":0}
-                    _dst[_dk]["total"] += 1
-                    if _ent and not _tard: _dst[_dk]["puntual"] += 1
-                    elif _tard: _dst[_dk]["tardanza"] += 1
-
-            _top_mes_alu = sorted(_conteo_mes_alu.values(),key=lambda x:(-x["puntual"],x["tardanza"]))[:10]
-            _top_mes_doc = sorted(_conteo_mes_doc.values(),key=lambda x:(-x["puntual"],x["tardanza"]))[:10]
+                    _complementar_resumen_remoto()
+            _top_mes_alu, _top_mes_doc, _dias_mes_con_data = _resumen.ranking_mes(
+                _anio_actual, _mes_actual)
 
             st.markdown(f"""
             <div style='background:linear-gradient(135deg,#fffbeb,#fef3c7);border-radius:14px;
@@ -14081,9 +13727,9 @@ def tab_asistencias():
 
         # ── Historial de dias ─────────────────────────────────────
         with st.expander("📅 Historial — Descargar PDF de otro dia", expanded=False):
-            if Path(ARCHIVO_ASISTENCIAS).exists():
-                with open(ARCHIVO_ASISTENCIAS,"r",encoding="utf-8") as _fh:
-                    _hist_all = _jps.load(_fh)
+            _hist_all = {datetime.strptime(_k, "%Y-%m-%d").strftime("%d/%m/%Y"): _v
+                         for _k, _v in leer_asistencias_todas().items()}
+            if _hist_all:
                 _fechas_disp = sorted(
                     [d for d in _hist_all.keys() if len(d.split("/")) == 3],
                     key=lambda d:(d.split("/")[2],d.split("/")[1],d.split("/")[0]),
@@ -14292,6 +13938,33 @@ def tab_asistencias():
 
 
 
+# ─────────────────────────────────────────────────────────────
+# DESPACHADOR DE NOTIFICACIONES + CACHÉ DE CONFIG/SUSCRIPTORES
+# ─────────────────────────────────────────────────────────────
+@st.cache_resource
+def _notificaciones():
+    """Despachador ÚNICO por proceso de Telegram / CallMeBot (cola,
+    conexiones keep-alive y límites de envío compartidos)."""
+    return DespachadorMensajes()
+
+_CACHE_NOTIF_TTL = 300
+
+
+@st.cache_resource
+def _cache_notif_proceso():
+    """Config del bot y suscriptores en memoria, UNA caché por proceso:
+    antes cada escaneo releía los JSON (y la hoja Config). Se invalidan al
+    guardar."""
+    return CacheConfig(_CACHE_NOTIF_TTL)
+
+def _notif_cache(nombre, cargar):
+    """Valor compartido (NO modificarlo) de `nombre`, recargado con
+    cargar() cada _CACHE_NOTIF_TTL segundos. Los vacíos no se guardan."""
+    return _cache_notif_proceso().obtener(nombre, cargar)
+
+def _notif_invalidar(nombre):
+    _cache_notif_proceso().invalidar(nombre)
+
 # ─────────────────────────────────────────────────────────────
 # WHATSAPP AUTOMÁTICO — CallMeBot (100% gratis)
 # Setup único por padre: enviar "I allow callmebot to send me messages"
@@ -14301,7 +13974,10 @@ _CMB_CONFIG_PATH = "callmebot_config.json"
 _CMB_SUBS_PATH   = "callmebot_suscriptores.json"
 
 def _cmb_cargar_subs():
-    """Carga mapa DNI → {celular, apikey}."""
+    """Carga mapa DNI → {celular, apikey} (copia: se puede modificar)."""
+    return copy.deepcopy(_notif_cache('cmb_subs', _cmb_leer_subs))
+
+def _cmb_leer_subs():
     try:
         if Path(_CMB_SUBS_PATH).exists():
             with open(_CMB_SUBS_PATH,"r",encoding="utf-8") as f:
@@ -14322,28 +13998,11 @@ def _cmb_guardar_subs(data):
     except Exception: pass
     try: _tg_gs_set('callmebot_suscriptores', data)
     except Exception: pass
-
-def _cmb_enviar(celular, mensaje, apikey):
-    """Envía WhatsApp via CallMeBot. Retorna True si OK."""
-    import urllib.request as _ur2
-    import urllib.parse as _up2
-    try:
-        # Limpiar número
-        tel = str(celular).replace(' ','').replace('+','').replace('-','')
-        if not tel.startswith('51'): tel = '51' + tel
-        # Solo texto ASCII/URL-safe
-        msg_enc = _up2.quote(str(mensaje))
-        url = f"https://api.callmebot.com/whatsapp.php?phone={tel}&text={msg_enc}&apikey={apikey}"
-        req = _ur2.Request(url)
-        with _ur2.urlopen(req, timeout=6) as resp:
-            body = resp.read().decode('utf-8','ignore').lower()
-            return 'message queued' in body or resp.status == 200
-    except Exception:
-        return False
+    _notif_invalidar('cmb_subs')
 
 def _cmb_notificar_asistencia(dni_alumno, nombre_alumno, grado, tipo, hora):
     """Envía WhatsApp automático al padre via CallMeBot."""
-    subs = _cmb_cargar_subs()
+    subs = _notif_cache('cmb_subs', _cmb_leer_subs)   # solo lectura
     _cod_norm_cmb = normalizar_codigo_estudiante(dni_alumno)
     entry = subs.get(_cod_norm_cmb) or subs.get(str(dni_alumno).strip())
     if not entry: return
@@ -14364,7 +14023,7 @@ def _cmb_notificar_asistencia(dni_alumno, nombre_alumno, grado, tipo, hora):
         f"Hora: {hora}\n"
         "IEP Yachay Chinchero Tel:084-750071"
     )
-    _iniciar_hilo(_cmb_enviar, args=(celular, msg, apikey))
+    _notificaciones().callmebot(celular, msg, apikey)
 
 # ═══════════════════════════════════════════════════════
 # SISTEMA DE NOTIFICACIONES TELEGRAM PARA PADRES
@@ -14415,15 +14074,7 @@ def _tg_gs_set(clave, valor_dict):
     try:
         gs = _gs()
         if not gs: return
-        ws = gs._get_hoja('config')
-        if not ws: return
-        val_str = json.dumps(valor_dict, ensure_ascii=False)
-        all_vals = ws.get_all_values()
-        for idx, row in enumerate(all_vals):
-            if row and row[0] == clave:
-                ws.update_cell(idx + 1, 2, val_str)
-                return
-        ws.append_row([clave, val_str])
+        gs.config().set(clave, json.dumps(valor_dict, ensure_ascii=False))
     except Exception: pass
 
 def _tg_gs_get(clave):
@@ -14431,16 +14082,16 @@ def _tg_gs_get(clave):
     try:
         gs = _gs()
         if not gs: return None
-        ws = gs._get_hoja('config')
-        if not ws: return None
-        for row in ws.get_all_values():
-            if row and row[0] == clave and len(row) > 1 and row[1]:
-                return json.loads(row[1])
+        return gs.config().get_json(clave)
     except Exception: pass
     return None
 
 def _tg_cargar_config():
-    """Carga config del bot: primero GSheets (permanente), fallback local."""
+    """Carga config del bot (copia: se puede modificar)."""
+    return copy.deepcopy(_notif_cache('tg_config', _tg_leer_config))
+
+def _tg_leer_config():
+    """Config del bot: primero GSheets (permanente), fallback local."""
     # 1. GSheets — persistente entre reinicios de Streamlit Cloud
     cfg_gs = _tg_gs_get('telegram_config')
     if cfg_gs:
@@ -14465,6 +14116,7 @@ def _tg_guardar_config(data):
             json.dump(data, f, ensure_ascii=False, indent=2)
     except Exception: pass
     _tg_gs_set('telegram_config', data)
+    _notif_invalidar('tg_config')
 
 def _tg_normalizar_claves_subs(subs_dict):
     """Normaliza las claves (DNI/código) del dict de suscriptores a mayúsculas,
@@ -14480,7 +14132,11 @@ def _tg_normalizar_claves_subs(subs_dict):
     return normalizado
 
 def _tg_cargar_subs():
-    """Carga suscriptores: primero GSheets, fallback local."""
+    """Carga suscriptores (copia: se puede modificar)."""
+    return copy.deepcopy(_notif_cache('tg_subs', _tg_leer_subs))
+
+def _tg_leer_subs():
+    """Suscriptores: primero GSheets, fallback local."""
     subs_gs = _tg_gs_get('telegram_suscriptores')
     if subs_gs:
         subs_gs = _tg_normalizar_claves_subs(subs_gs)
@@ -14503,6 +14159,7 @@ def _tg_guardar_subs(data):
             json.dump(data, f, ensure_ascii=False, indent=2)
     except Exception: pass
     _tg_gs_set('telegram_suscriptores', data)
+    _notif_invalidar('tg_subs')
 
 def _tg_llamar_api(endpoint, token, params=None, timeout=8):
     """Llamada genérica a la API de Telegram. Retorna dict con ok/result/error."""
@@ -14537,12 +14194,17 @@ def _tg_enviar(chat_id, mensaje, token):
     except Exception:
         return False
 
+def _tg_encolar(chat_id, mensaje, token):
+    """Encola un mensaje de Telegram en el despachador del proceso (no
+    bloquea). Devuelve el trabajo, o None si la cola está llena."""
+    return _notificaciones().telegram(chat_id, mensaje, _tg_limpiar_token(token))
+
 def _tg_notificar_asistencia(dni_alumno, nombre_alumno, grado, tipo, hora):
-    """Envía notificación de asistencia al padre si está suscrito. Hilo separado."""
-    cfg = _tg_cargar_config()
+    """Envía notificación de asistencia al padre si está suscrito (en cola)."""
+    cfg = _notif_cache('tg_config', _tg_leer_config)   # solo lectura
     token = _tg_limpiar_token(cfg.get("bot_token",""))
     if not token: return
-    subs = _tg_cargar_subs()
+    subs = _notif_cache('tg_subs', _tg_leer_subs)
     _cod_norm = normalizar_codigo_estudiante(dni_alumno)
     entry = subs.get(_cod_norm) or subs.get(str(dni_alumno).strip())
     if not entry: return
@@ -14568,7 +14230,7 @@ def _tg_notificar_asistencia(dni_alumno, nombre_alumno, grado, tipo, hora):
         f"\U0001f4de 084-750071\n\n"
         f"{pie_institucional(turno=tipo)}"
     )
-    _iniciar_hilo(_tg_enviar, args=(chat_id, msg, token))
+    _tg_encolar(chat_id, msg, token)
 
 def _tg_obtener_chat_id(token):
     """Obtiene los últimos updates del bot en hilo con resultado en session_state."""
@@ -14576,10 +14238,10 @@ def _tg_obtener_chat_id(token):
 
 def _registrar_asistencia_rapida(dni):
     """Registra asistencia — INSTANTÁNEO: solo usa índice en RAM, nunca GSheets."""
-    # 1. Buscar SOLO en índice local (< 1ms, nunca bloquea)
-    _idx = st.session_state.get('_indice_dni', {})
+    # 1. Buscar SOLO en índice compartido en RAM (< 1ms, nunca bloquea)
+    _idx = _indice_dni()
     dni_str = str(dni).strip()
-    _d = _idx.get(dni_str)
+    _d = _idx.buscar(dni_str)
     if _d:
         persona = {
             'DNI': dni_str,
@@ -14604,8 +14266,7 @@ def _registrar_asistencia_rapida(dni):
                                'Nivel': _d2.get('Nivel', _d2.get('nivel', '')),
                                '_tipo': _d2.get('_tipo', 'alumno')}
                     # Agregar al índice RAM para próximas búsquedas
-                    if _idx is not None:
-                        _idx[dni_str] = _d2
+                    _idx.agregar(dni_str, _d2)
         except Exception:
             pass
 
@@ -14623,8 +14284,7 @@ def _registrar_asistencia_rapida(dni):
                     if not fila.empty:
                         r = fila.iloc[0].to_dict()
                         r['_tipo'] = 'docente'
-                        if _idx is not None:
-                            _idx[dni_str] = r
+                        _idx.agregar(dni_str, r)
                         nom_fb = str(r.get('Nombre', r.get('nombre', dni_str))).strip()
                         persona = {'DNI': dni_str, 'Nombre': nom_fb,
                                    'Grado': '', 'Nivel': '', '_tipo': 'docente'}
@@ -14645,8 +14305,7 @@ def _registrar_asistencia_rapida(dni):
                         if not fila.empty:
                             r = fila.iloc[0].to_dict()
                             r['_tipo'] = 'alumno'
-                            if _idx is not None:
-                                _idx[dni_str] = r
+                            _idx.agregar(dni_str, r)
                             nom_fb = str(r.get('Nombre', r.get('nombre', dni_str))).strip()
                             persona = {'DNI': dni_str, 'Nombre': nom_fb,
                                        'Grado': str(r.get('Grado','')),
@@ -14840,14 +14499,13 @@ def generar_reporte_estudiante_pdf(nombre, dni, grado, resultados_hist, config):
     # ── Marca de agua ────────────────────────────────────────────────────
     if Path("escudo_upload.png").exists():
         try:
-            from PIL import Image as PILImage
-            img = PILImage.open("escudo_upload.png")
+            img = cache_recursos.imagen("escudo_upload.png")
             iw, ih = img.size
             ratio = iw / ih
             mw = 420; mh = mw / ratio
             c.saveState()
             c.setFillAlpha(0.35)
-            c.drawImage("escudo_upload.png", w/2-mw/2, h/2-mh/2, mw, mh, mask='auto')
+            c.drawImage(cache_recursos.image_reader("escudo_upload.png"), w/2-mw/2, h/2-mh/2, mw, mh, mask='auto')
             c.restoreState()
         except Exception:
             pass
@@ -14861,19 +14519,18 @@ def generar_reporte_estudiante_pdf(nombre, dni, grado, resultados_hist, config):
     esc_izq = "escudo_upload.png"
     esc_der = "escudo2_upload.png" if Path("escudo2_upload.png").exists() else "escudo_upload.png"
     try:
-        from PIL import Image as PILImage
         if Path(esc_izq).exists():
-            img = PILImage.open(esc_izq)
+            img = cache_recursos.imagen(esc_izq)
             iw, ih = img.size
             aw = ALTO_ESC * (iw/ih)
-            c.drawImage(esc_izq, 18, h-12-ALTO_ESC, aw, ALTO_ESC, mask='auto')
+            c.drawImage(cache_recursos.image_reader(esc_izq), 18, h-12-ALTO_ESC, aw, ALTO_ESC, mask='auto')
         if Path(esc_der).exists():
-            img2 = PILImage.open(esc_der)
+            img2 = cache_recursos.imagen(esc_der)
             iw2, ih2 = img2.size
             aw2 = ALTO_ESC * (iw2/ih2)
             _alto_der2 = 80
             _aw_der2 = _alto_der2 * (iw2/ih2)
-            c.drawImage(esc_der, w-18-_aw_der2, h-12-_alto_der2, _aw_der2, _alto_der2, mask='auto')
+            c.drawImage(cache_recursos.image_reader(esc_der), w-18-_aw_der2, h-12-_alto_der2, _aw_der2, _alto_der2, mask='auto')
     except Exception:
         pass
 
@@ -15179,12 +14836,9 @@ def tab_calificacion_yachay(config):
                 gs = _gs()
                 if gs:
                     try:
-                        ws = gs._get_hoja('config')
-                        if ws:
-                            ws.append_row([
-                                f"eval_{eval_key}",
-                                json.dumps(eval_data, ensure_ascii=False, default=str)
-                            ])
+                        gs.config().agregar(
+                            f"eval_{eval_key}",
+                            json.dumps(eval_data, ensure_ascii=False, default=str))
                     except Exception:
                         pass
 
@@ -15292,16 +14946,11 @@ def tab_calificacion_yachay(config):
             gs = _gs()
             if gs:
                 try:
-                    ws = gs._get_hoja('config')
-                    if ws:
-                        data = ws.get_all_records()
-                        for d in data:
-                            clave = str(d.get('clave', ''))
-                            if clave.startswith('eval_'):
-                                try:
-                                    evals_disp[clave[5:]] = json.loads(d.get('valor', '{}'))
-                                except Exception:
-                                    pass
+                    for clave, valor in gs.config().items('eval_'):
+                        try:
+                            evals_disp[clave[5:]] = json.loads(valor or '{}')
+                        except Exception:
+                            pass
                 except Exception:
                     pass
 
@@ -15452,10 +15101,16 @@ def tab_calificacion_yachay(config):
 
         # Respuestas
         st.markdown("**📝 Respuestas:**")
-        met = st.radio("Método:", ["✏️ Manual", "📸 Cámara/Foto"],
+        met = st.radio("Método:", ["✏️ Manual", "📸 Cámara/Foto",
+                                   "📦 Lote (ZIP / varias fotos)"],
                        horizontal=True, key="met")
         ra = []
-        if met == "✏️ Manual":
+        if met == "📦 Lote (ZIP / varias fotos)":
+            _calificar_lote_ui(
+                ia, tp,
+                titulo_eval if modo_cal == "📂 Evaluación Guardada" else "Evaluación",
+                usuario_actual)
+        elif met == "✏️ Manual":
             for i, a in enumerate(ia):
                 r = st.text_input(f"{a['nombre']} ({a['num']}):",
                                   key=f"r{i}", max_chars=a['num'],
@@ -15509,36 +15164,12 @@ def tab_calificacion_yachay(config):
                     'dni': de, 'nombre': nm, 'grado': grado_est,
                     'areas': [], 'promedio_general': 0
                 }
-                idx = 0
-                sn = 0
                 mw = (f"📝 *RESULTADOS*\n🏫 YACHAY\n👤 {nm}\n"
                       f"📅 {hora_peru().strftime('%d/%m/%Y')}\n\n")
-                for a in ia:
-                    n = a['num']
-                    ck = a['claves'][:n]
-                    rk = ra[idx:idx + n]
-                    ok = sum(1 for j in range(min(len(ck), len(rk)))
-                             if ck[j] == rk[j])
-                    nota = round((ok / n) * 20, 1) if n else 0
-                    lt = nota_a_letra(nota)
-                    detalle = []
-                    for j in range(n):
-                        cj = ck[j] if j < len(ck) else '?'
-                        rj = rk[j] if j < len(rk) else '?'
-                        detalle.append({
-                            'p': idx + j + 1, 'c': cj, 'r': rj,
-                            'ok': (j < len(ck) and j < len(rk) and ck[j] == rk[j])
-                        })
-                    res['areas'].append({
-                        'nombre': a['nombre'], 'correctas': ok,
-                        'total': n, 'nota': nota, 'letra': lt,
-                        'detalle': detalle
-                    })
-                    sn += nota
-                    mw += f"📚 *{a['nombre']}:* {nota}/20 ({lt})\n"
-                    idx += n
+                res['areas'], pm = _calificar_hoja(ia, ra)
+                for ar in res['areas']:
+                    mw += f"📚 *{ar['nombre']}:* {ar['nota']}/20 ({ar['letra']})\n"
 
-                pm = round(sn / len(ia), 1) if ia else 0
                 lp = nota_a_letra(pm)
                 res['promedio_general'] = pm
                 mw += f"\n📊 *PROMEDIO: {pm}/20 ({lp})*"
@@ -15719,76 +15350,69 @@ def tab_calificacion_yachay(config):
         # NUEVO: Mostrar evaluaciones guardadas
         st.markdown("### 💾 Evaluaciones Guardadas")
         try:
-            historial_file = 'historial_evaluaciones.json'
-            if Path(historial_file).exists():
-                with open(historial_file, 'r', encoding='utf-8') as f:
-                    hist_data = json.load(f)
-                
-                if hist_data:
-                    for clave, eval_data in sorted(hist_data.items(), reverse=True):
-                        with st.expander(f"📝 {eval_data['grado']} - {eval_data['periodo']} ({eval_data['fecha']})"):
-                            st.write(f"**Hora:** {eval_data.get('hora', 'N/A')}")
-                            st.write(f"**Estudiantes evaluados:** {len(eval_data.get('ranking', []))}")
-                            st.write(f"**Áreas:** {', '.join([a['nombre'] for a in eval_data.get('areas', [])] if isinstance(eval_data.get('areas', []), list) else eval_data.get('areas', []))}")
-                            
-                            col_ver, col_del = st.columns([4, 1])
-                            with col_ver:
-                                if st.button("📊 Ver Ranking", key=f"ver_rank_{clave}", type="primary"):
-                                    df_hist = pd.DataFrame(eval_data.get('ranking', []))
-                                    st.dataframe(df_hist, use_container_width=True)
-                            with col_del:
-                                if st.button("🗑️ Eliminar", key=f"del_eval_{clave}", type="primary"):
-                                    del hist_data[clave]
-                                    with open(historial_file, 'w', encoding='utf-8') as f:
-                                        json.dump(hist_data, f, ensure_ascii=False, indent=2)
-                                    st.success("✅ Evaluación eliminada")
-                                    st.rerun()
-                            # WA — siempre visible, sin botón intermedio
-                            _areas_h = [a['nombre'] if isinstance(a,dict) else str(a) for a in eval_data.get('areas', [])]
-                            _wa_links = []
-                            for _fh in eval_data.get('ranking', []):
-                                _alum = BaseDatos.buscar_por_dni(_fh.get('DNI',''))
-                                _cel = str((_alum or {}).get('Celular_Apoderado','')).strip()
-                                if _cel and _cel not in ('nan','None',''):
-                                    _cc = _cel.replace(' ','').replace('+','').replace('-','')
-                                    if not _cc.startswith('51'): _cc = '51'+_cc
-                                    _msg = (f"I.E.P. YACHAY - NOTAS\n"
-                                            f"{_fh.get('Nombre','')}\n"
-                                            f"{eval_data.get('grado','')} | {eval_data.get('periodo','')}\n")
-                                    for _an in _areas_h:
-                                        _msg += f"{_an}: {_fh.get(_an,0)} ({nota_a_letra(_fh.get(_an,0))})\n"
-                                    _msg += f"PROMEDIO: {_fh.get('Promedio',0)}" 
+            hist_data = _cargar_historial_evaluaciones()
+            if hist_data:
+                for clave, eval_data in sorted(hist_data.items(), reverse=True):
+                    with st.expander(f"📝 {eval_data['grado']} - {eval_data['periodo']} ({eval_data['fecha']})"):
+                        st.write(f"**Hora:** {eval_data.get('hora', 'N/A')}")
+                        st.write(f"**Estudiantes evaluados:** {len(eval_data.get('ranking', []))}")
+                        st.write(f"**Áreas:** {', '.join([a['nombre'] for a in eval_data.get('areas', [])] if isinstance(eval_data.get('areas', []), list) else eval_data.get('areas', []))}")
+                        
+                        col_ver, col_del = st.columns([4, 1])
+                        with col_ver:
+                            if st.button("📊 Ver Ranking", key=f"ver_rank_{clave}", type="primary"):
+                                df_hist = pd.DataFrame(eval_data.get('ranking', []))
+                                st.dataframe(df_hist, use_container_width=True)
+                        with col_del:
+                            if st.button("🗑️ Eliminar", key=f"del_eval_{clave}", type="primary"):
+                                _almacen_notas().eliminar_evaluacion(clave)
+                                _programar_respaldo_notas()
+                                st.success("✅ Evaluación eliminada")
+                                st.rerun()
+                        # WA — siempre visible, sin botón intermedio
+                        _areas_h = [a['nombre'] if isinstance(a,dict) else str(a) for a in eval_data.get('areas', [])]
+                        _wa_links = []
+                        for _fh in eval_data.get('ranking', []):
+                            _alum = BaseDatos.buscar_por_dni(_fh.get('DNI',''))
+                            _cel = str((_alum or {}).get('Celular_Apoderado','')).strip()
+                            if _cel and _cel not in ('nan','None',''):
+                                _cc = _cel.replace(' ','').replace('+','').replace('-','')
+                                if not _cc.startswith('51'): _cc = '51'+_cc
+                                _msg = (f"I.E.P. YACHAY - NOTAS\n"
+                                        f"{_fh.get('Nombre','')}\n"
+                                        f"{eval_data.get('grado','')} | {eval_data.get('periodo','')}\n")
+                                for _an in _areas_h:
+                                    _msg += f"{_an}: {_fh.get(_an,0)} ({nota_a_letra(_fh.get(_an,0))})\n"
+                                _msg += f"PROMEDIO: {_fh.get('Promedio',0)}" 
+                                import urllib.parse as _up
+                                _url = f"https://wa.me/{_cc}?text={_up.quote(_msg)}"
+                                _wa_links.append(f'<a href="{_url}" target="_blank" style="background:#25D366;color:white;padding:3px 8px;border-radius:5px;text-decoration:none;font-size:0.75rem;margin:2px;display:inline-block;">📱 {_fh.get("Nombre","")[:16]}</a>')
+                        if _wa_links:
+                            st.markdown("**📱 WhatsApp:**")
+                            st.markdown(" ".join(_wa_links), unsafe_allow_html=True)
+                        if False and st.session_state.get(f'_wa_hist_{clave}'):
+                            areas_h = [a['nombre'] if isinstance(a,dict) else str(a)
+                                       for a in eval_data.get('areas', [])]
+                            for fila_h in eval_data.get('ranking', []):
+                                alum_wa = BaseDatos.buscar_por_dni(fila_h.get('DNI',''))
+                                cel_wa  = str((alum_wa or {}).get('Celular_Apoderado','')).strip()
+                                if cel_wa and cel_wa not in ('nan','None',''):
+                                    cel_c = cel_wa.replace(' ','').replace('+','').replace('-','')
+                                    if not cel_c.startswith('51'): cel_c = '51'+cel_c
+                                    msg = f"🏫 *I.E.P. YACHAY*\n📊 *REPORTE DE NOTAS*\n\n"
+                                    msg += f"👤 Alumno: {fila_h.get('Nombre','')}\n"
+                                    msg += f"📚 Grado: {eval_data.get('grado','')}\n"
+                                    msg += f"📅 Periodo: {eval_data.get('periodo','')}\n"
+                                    msg += f"📝 Evaluacion: {eval_data.get('titulo','')}\n━━━━━━━━━━━━━━━━━\n"
+                                    for an in areas_h:
+                                        nota_w = fila_h.get(an, 0)
+                                        msg += f"📖 {an}: *{nota_w}* ({nota_a_letra(nota_w)})\n"
+                                    msg += f"━━━━━━━━━━━━━━━━━\n📊 *PROMEDIO: {fila_h.get('Promedio',0)}*"
                                     import urllib.parse as _up
-                                    _url = f"https://wa.me/{_cc}?text={_up.quote(_msg)}"
-                                    _wa_links.append(f'<a href="{_url}" target="_blank" style="background:#25D366;color:white;padding:3px 8px;border-radius:5px;text-decoration:none;font-size:0.75rem;margin:2px;display:inline-block;">📱 {_fh.get("Nombre","")[:16]}</a>')
-                            if _wa_links:
-                                st.markdown("**📱 WhatsApp:**")
-                                st.markdown(" ".join(_wa_links), unsafe_allow_html=True)
-                            if False and st.session_state.get(f'_wa_hist_{clave}'):
-                                areas_h = [a['nombre'] if isinstance(a,dict) else str(a)
-                                           for a in eval_data.get('areas', [])]
-                                for fila_h in eval_data.get('ranking', []):
-                                    alum_wa = BaseDatos.buscar_por_dni(fila_h.get('DNI',''))
-                                    cel_wa  = str((alum_wa or {}).get('Celular_Apoderado','')).strip()
-                                    if cel_wa and cel_wa not in ('nan','None',''):
-                                        cel_c = cel_wa.replace(' ','').replace('+','').replace('-','')
-                                        if not cel_c.startswith('51'): cel_c = '51'+cel_c
-                                        msg = f"🏫 *I.E.P. YACHAY*\n📊 *REPORTE DE NOTAS*\n\n"
-                                        msg += f"👤 Alumno: {fila_h.get('Nombre','')}\n"
-                                        msg += f"📚 Grado: {eval_data.get('grado','')}\n"
-                                        msg += f"📅 Periodo: {eval_data.get('periodo','')}\n"
-                                        msg += f"📝 Evaluacion: {eval_data.get('titulo','')}\n━━━━━━━━━━━━━━━━━\n"
-                                        for an in areas_h:
-                                            nota_w = fila_h.get(an, 0)
-                                            msg += f"📖 {an}: *{nota_w}* ({nota_a_letra(nota_w)})\n"
-                                        msg += f"━━━━━━━━━━━━━━━━━\n📊 *PROMEDIO: {fila_h.get('Promedio',0)}*"
-                                        import urllib.parse as _up
-                                        url_wa = f"https://wa.me/{cel_c}?text={_up.quote(msg)}"
-                                        st.markdown(f'<a href="{url_wa}" target="_blank" style="background:#25D366;color:white;padding:4px 10px;border-radius:6px;text-decoration:none;font-size:0.8rem;">📱 WA {fila_h.get("Nombre","")[:20]}</a>', unsafe_allow_html=True)
-                else:
-                    st.info("No hay evaluaciones guardadas en historial")
+                                    url_wa = f"https://wa.me/{cel_c}?text={_up.quote(msg)}"
+                                    st.markdown(f'<a href="{url_wa}" target="_blank" style="background:#25D366;color:white;padding:4px 10px;border-radius:6px;text-decoration:none;font-size:0.8rem;">📱 WA {fila_h.get("Nombre","")[:20]}</a>', unsafe_allow_html=True)
             else:
-                st.info("No hay historial disponible aún")
+                st.info("No hay evaluaciones guardadas en historial")
         except Exception as e:
             st.error(f"Error al cargar historial: {str(e)}")
         
@@ -16453,17 +16077,10 @@ def _tab_registro_auxiliar_docente(grado, config):
             key="dc_cursos",
             help="El PDF se ajusta automáticamente al número de áreas elegidas")
     else:
-        notas = {}
-        if Path('notas.json').exists():
-            with open('notas.json', 'r', encoding='utf-8') as f:
-                notas = json.load(f)
-        cursos_con_notas = {}
-        for k, v in notas.items():
-            if isinstance(v, dict) and v.get('grado') == grado_sel:
-                area_n = v.get('area', '')
-                if area_n not in cursos_con_notas:
-                    cursos_con_notas[area_n] = 0
-                cursos_con_notas[area_n] += 1
+        try:
+            cursos_con_notas = _almacen_notas().areas_con_notas(grado_sel)
+        except Exception:
+            cursos_con_notas = {}
         if cursos_con_notas:
             st.success(f"📊 {len(cursos_con_notas)} cursos con notas registradas")
         else:
@@ -16841,10 +16458,16 @@ def tab_incidencias(config):
                     'registrado_por': st.session_state.get('usuario_actual', ''),
                 }
 
-                # Guardar en Google Sheets
-                if gs:
-                    gs.guardar_incidencia(datos_inc)
-                    st.success(f"✅ Incidencia {codigo} registrada y guardada en Google Sheets")
+                # Guardar en Google Sheets. El código no es único (sale
+                # de la hora o del conteo de filas): la clave de la bandeja
+                # lleva además un hash del contenido, así solo se descarta
+                # el reenvío de la MISMA incidencia (doble clic).
+                huella = hashlib.sha1(json.dumps(
+                    datos_inc, sort_keys=True, ensure_ascii=False,
+                    default=str).encode('utf-8')).hexdigest()[:16]
+                if _encolar_gs('guardar_incidencia', datos_inc,
+                               clave=f"incidencia:{codigo}:{huella}"):
+                    st.success(f"✅ Incidencia {codigo} registrada (se sincroniza con Google Sheets)")
                 else:
                     st.success(f"✅ Incidencia {codigo} registrada")
 
@@ -16922,13 +16545,13 @@ def generar_reporte_asistencia_mensual_pdf(datos_mes, grado, mes, anio, config):
     c.drawString(x_start + 15, y, "Nombre")
     c.drawString(x_start + 180, y, "DNI")
 
-    # Días como columnas
+    # Días como columnas (L-V)
+    dias_habiles = [d for d in range(1, dias_mes + 1)
+                    if cal_mod.weekday(anio, mes, d) < 5]
     x_dia = x_start + 225
-    for d in range(1, dias_mes + 1):
-        dia_semana = cal_mod.weekday(anio, mes, d)
-        if dia_semana < 5:  # L-V
-            c.drawCentredString(x_dia, y, str(d))
-            x_dia += 18
+    for d in dias_habiles:
+        c.drawCentredString(x_dia, y, str(d))
+        x_dia += 18
 
     c.drawString(x_dia + 5, y, "Total")
     c.drawString(x_dia + 35, y, "%")
@@ -16948,23 +16571,19 @@ def generar_reporte_asistencia_mensual_pdf(datos_mes, grado, mes, anio, config):
 
         x_dia = x_start + 225
         total_asist = 0
-        total_dias_hab = 0
-        for d in range(1, dias_mes + 1):
-            dia_semana = cal_mod.weekday(anio, mes, d)
-            if dia_semana < 5:
-                total_dias_hab += 1
-                fecha_str = f"{anio}-{mes:02d}-{d:02d}"
-                if fecha_str in info.get('fechas', {}):
-                    c.setFillColor(colors.HexColor("#16a34a"))
-                    c.drawCentredString(x_dia, y, "✓")
-                    c.setFillColor(colors.black)
-                    total_asist += 1
-                else:
-                    c.setFillColor(colors.HexColor("#dc2626"))
-                    c.drawCentredString(x_dia, y, "✗")
-                    c.setFillColor(colors.black)
-                x_dia += 18
+        fechas_alumno = info.get('fechas', {})
+        for d in dias_habiles:
+            if f"{anio}-{mes:02d}-{d:02d}" in fechas_alumno:
+                c.setFillColor(colors.HexColor("#16a34a"))
+                c.drawCentredString(x_dia, y, "✓")
+                total_asist += 1
+            else:
+                c.setFillColor(colors.HexColor("#dc2626"))
+                c.drawCentredString(x_dia, y, "✗")
+            c.setFillColor(colors.black)
+            x_dia += 18
 
+        total_dias_hab = len(dias_habiles)
         pct = (total_asist / total_dias_hab * 100) if total_dias_hab > 0 else 0
         c.drawString(x_dia + 5, y, str(total_asist))
         c.drawString(x_dia + 35, y, f"{pct:.0f}%")
@@ -19564,15 +19183,13 @@ def _tab_test_vocacional_ui(config):
                 fila_dig = df_g_dig[df_g_dig["Nombre"] == nombre_dig] if not df_g_dig.empty else pd.DataFrame()
                 dni_dig  = str(fila_dig.iloc[0].get("DNI","")) if not fila_dig.empty else ""
                 prom_areas_dig = {}
-                hist_dig = _cargar_historial_evaluaciones()
-                for _, ev_d in hist_dig.items():
-                    if ev_d.get("grado","") == grado_dig:
-                        for frd in ev_d.get("ranking",[]):
-                            if str(frd.get("DNI","")) == dni_dig or frd.get("Nombre","") == nombre_dig:
-                                for an in [a["nombre"] for a in ev_d.get("areas",[]) if isinstance(a, dict)]:
-                                    nv = frd.get(an, 0)
-                                    if nv and float(nv) > 0:
-                                        prom_areas_dig.setdefault(an, []).append(float(nv))
+                try:
+                    for _n in _almacen_notas().notas_alumno(dni_dig, nombre_dig,
+                                                            fuentes=('historial',)):
+                        if _n['grado'] == grado_dig and _n['area'] and (_n['valor'] or 0) > 0:
+                            prom_areas_dig.setdefault(_n['area'], []).append(_n['valor'])
+                except Exception:
+                    pass
                 prom_areas_dig = {k: round(sum(v)/len(v),1) for k,v in prom_areas_dig.items()}
                 prom_dig = round(sum(prom_areas_dig.values())/len(prom_areas_dig),1) if prom_areas_dig else 0
                 lit_dig  = nota_a_letra(prom_dig) if prom_dig > 0 else "C"
@@ -19705,22 +19322,10 @@ def _tab_test_vocacional_ui(config):
             st.markdown("<br>", unsafe_allow_html=True)
             if st.button("🎯 Generar Diagnóstico y Descargar PDF", type="primary", key="tv_generar_cl"):
                 # Cargar notas del estudiante
-                hist_eval = _cargar_historial_evaluaciones()
-                notas_est = []
-                for _, ev in hist_eval.items():
-                    for fila_h in ev.get("ranking",[]):
-                        if str(fila_h.get("DNI","")) == dni_tv:
-                            areas_h = ev.get("areas",[])
-                            names_h = [a["nombre"] for a in areas_h] if areas_h and isinstance(areas_h[0],dict) else list(areas_h)
-                            for an in names_h:
-                                nv = fila_h.get(an,0)
-                                if nv and float(nv)>0:
-                                    notas_est.append({"area":an,"nota":float(nv)})
-
-                promedios_area = {}
-                for n in notas_est:
-                    promedios_area.setdefault(n["area"],[]).append(n["nota"])
-                promedios_area = {k: round(sum(v)/len(v),1) for k,v in promedios_area.items()}
+                try:
+                    promedios_area = _almacen_notas().promedios_por_area([dni_tv]).get(str(dni_tv).strip(), {})
+                except Exception:
+                    promedios_area = {}
                 prom_gen  = round(sum(promedios_area.values())/len(promedios_area),1) if promedios_area else 0
                 lit_gen   = nota_a_letra(prom_gen) if prom_gen>0 else "C"
                 afinidad  = _calcular_afinidad_academica(promedios_area)
@@ -19774,7 +19379,11 @@ def _tab_test_vocacional_ui(config):
         st.info(f"📋 {len(df_lote)} estudiantes en **{grado_lote}** — Cada uno recibirá su PDF de diagnóstico vocacional UNSAAC.")
 
         if st.button("📦 Generar ZIP — Diagnósticos del grado completo", type="primary", key="tv_lote_btn"):
-            hist_eval = _cargar_historial_evaluaciones()
+            # Promedios por área de todo el grado en una sola consulta
+            try:
+                prom_lote = _almacen_notas().promedios_por_area(df_lote["DNI"].astype(str).tolist())
+            except Exception:
+                prom_lote = {}
             zip_buf   = io.BytesIO()
             generados = 0
             barra     = st.progress(0)
@@ -19786,20 +19395,7 @@ def _tab_test_vocacional_ui(config):
                     dni_l    = str(row_l.get("DNI",""))
                     if not nombre_l or not dni_l:
                         continue
-                    notas_l = []
-                    for _, ev in hist_eval.items():
-                        for fila_l in ev.get("ranking",[]):
-                            if str(fila_l.get("DNI","")) == dni_l:
-                                areas_l  = ev.get("areas",[])
-                                names_l  = [a["nombre"] for a in areas_l] if areas_l and isinstance(areas_l[0],dict) else list(areas_l)
-                                for an in names_l:
-                                    nv = fila_l.get(an,0)
-                                    if nv and float(nv)>0:
-                                        notas_l.append({"area":an,"nota":float(nv)})
-                    prom_area_l = {}
-                    for n in notas_l:
-                        prom_area_l.setdefault(n["area"],[]).append(n["nota"])
-                    prom_area_l = {k: round(sum(v)/len(v),1) for k,v in prom_area_l.items()}
+                    prom_area_l = prom_lote.get(dni_l.strip(), {})
                     prom_l      = round(sum(prom_area_l.values())/len(prom_area_l),1) if prom_area_l else 0
                     lit_l       = nota_a_letra(prom_l) if prom_l>0 else "C"
                     afinidad_l  = _calcular_afinidad_academica(prom_area_l)
@@ -19840,26 +19436,28 @@ def tab_reportes(config):
 
     if subtab == "🏆 Historial de Evaluaciones":
         st.markdown("### 🏆 Historial de Evaluaciones — Vista Director")
-        hist = _cargar_historial_evaluaciones()
-        if not hist:
+        try:
+            _alm_h = _almacen_notas()
+            grados_hist = _alm_h.valores('grado')
+            docentes_hist = _alm_h.valores('docente')
+        except Exception:
+            grados_hist, docentes_hist = [], []
+        if not grados_hist:
             st.info("📭 No hay evaluaciones guardadas en el historial.")
             return
 
-        # Filtros
+        # Filtros (consulta indexada por grado / docente)
         fc1, fc2 = st.columns(2)
         with fc1:
-            grados_hist = sorted(set(v.get('grado','') for v in hist.values()))
             filtro_grado = st.selectbox("Filtrar por grado:", ["Todos"] + grados_hist, key="rep_hist_grado")
         with fc2:
-            docentes_hist = sorted(set(v.get('docente','') for v in hist.values()))
             filtro_doc = st.selectbox("Filtrar por docente:", ["Todos"] + docentes_hist, key="rep_hist_doc")
+        hist = _cargar_historial_evaluaciones(
+            grado=None if filtro_grado == "Todos" else filtro_grado,
+            docente=None if filtro_doc == "Todos" else filtro_doc)
 
         total_mostradas = 0
         for clave, ev in sorted(hist.items(), reverse=True):
-            if filtro_grado != "Todos" and ev.get('grado') != filtro_grado:
-                continue
-            if filtro_doc != "Todos" and ev.get('docente') != filtro_doc:
-                continue
             total_mostradas += 1
             areas_ev = ev.get('areas', [])
             if areas_ev and isinstance(areas_ev[0], dict):
@@ -19897,14 +19495,8 @@ def tab_reportes(config):
         </div>""", unsafe_allow_html=True)
 
         # ── Cargar datos de asistencia ─────────────────────────────────
-        # Fuente 1: archivo local
-        asistencias = {}
-        if Path(ARCHIVO_ASISTENCIAS).exists():
-            try:
-                with open(ARCHIVO_ASISTENCIAS, 'r', encoding='utf-8') as f:
-                    asistencias = json.load(f)
-            except Exception:
-                pass
+        # Fuente 1: diario local
+        asistencias = leer_asistencias_todas()
 
         # Fuente 2: Drive backup (tiene el historial completo del año)
         _drv_cache_rep = st.session_state.get('_asis_drive_cache', {})
@@ -20255,51 +19847,42 @@ def tab_reportes(config):
                 if st.button("💾 GUARDAR CAMBIOS", type="primary", key="btn_edit_doc"):
                     if motivo:
                         try:
-                            asist_data = {}
-                            if Path(ARCHIVO_ASISTENCIAS).exists():
-                                with open(ARCHIVO_ASISTENCIAS, 'r', encoding='utf-8') as f:
-                                    asist_data = json.load(f)
+                            _diario = _diario_asistencias()
+                            asist_dia = _diario.leer_dia(fecha_str_e)
                             # Buscar DNI del docente
                             dni_edit = None
-                            if fecha_str_e in asist_data:
-                                for dk, dv in asist_data[fecha_str_e].items():
-                                    if dv.get('nombre', '').strip().upper() == docente_edit.strip().upper():
-                                        dni_edit = dk
-                                        break
-                            if dni_edit and fecha_str_e in asist_data and dni_edit in asist_data[fecha_str_e]:
+                            for dk, dv in asist_dia.items():
+                                if dv.get('nombre', '').strip().upper() == docente_edit.strip().upper():
+                                    dni_edit = dk
+                                    break
+                            if dni_edit:
+                                cambios = {}
                                 if nueva_entrada:
-                                    asist_data[fecha_str_e][dni_edit]['entrada'] = nueva_entrada
+                                    cambios['entrada'] = nueva_entrada
                                 if nueva_salida:
-                                    asist_data[fecha_str_e][dni_edit]['salida'] = nueva_salida
+                                    cambios['salida'] = nueva_salida
                                 if quitar_tard:
-                                    asist_data[fecha_str_e][dni_edit]['tardanza'] = ''
-                                    if not asist_data[fecha_str_e][dni_edit].get('entrada'):
-                                        asist_data[fecha_str_e][dni_edit]['entrada'] = nueva_entrada or '07:30'
-                                asist_data[fecha_str_e][dni_edit]['modificado'] = motivo
-                                asist_data[fecha_str_e][dni_edit]['modificado_por'] = st.session_state.get('usuario_actual', '')
-                                with open(ARCHIVO_ASISTENCIAS, 'w', encoding='utf-8') as f:
-                                    json.dump(asist_data, f, indent=2, ensure_ascii=False)
+                                    cambios['tardanza'] = ''
+                                    if not asist_dia[dni_edit].get('entrada'):
+                                        cambios['entrada'] = nueva_entrada or '07:30'
+                                cambios['modificado'] = motivo
+                                cambios['modificado_por'] = st.session_state.get('usuario_actual', '')
+                                _diario.actualizar(fecha_str_e, dni_edit, cambios)
                                 st.success(f"✅ Registro de {docente_edit} modificado — {fecha_str_e}")
                                 st.rerun()
                             else:
                                 st.warning("No se encontró registro para esa fecha. Puede crear uno nuevo.")
-                                # Crear registro
-                                if fecha_str_e not in asist_data:
-                                    asist_data[fecha_str_e] = {}
                                 # Buscar DNI en docentes
                                 df_doc_e = BaseDatos.cargar_docentes()
                                 if not df_doc_e.empty:
                                     fd = df_doc_e[df_doc_e['Nombre'].astype(str).str.upper() == docente_edit.upper()]
                                     if not fd.empty:
                                         dn = str(fd.iloc[0].get('DNI', f'edit_{docente_edit[:10]}'))
-                                        asist_data[fecha_str_e][dn] = {
-                                            'nombre': docente_edit, 'entrada': nueva_entrada or '07:30',
-                                            'salida': nueva_salida, 'tardanza': '' if quitar_tard else '',
-                                            'es_docente': True, 'modificado': motivo,
-                                            'entrada_tarde': '', 'salida_tarde': '',
-                                        }
-                                        with open(ARCHIVO_ASISTENCIAS, 'w', encoding='utf-8') as f:
-                                            json.dump(asist_data, f, indent=2, ensure_ascii=False)
+                                        _diario.actualizar(fecha_str_e, dn, {
+                                            'entrada': nueva_entrada or '07:30',
+                                            'salida': nueva_salida, 'tardanza': '',
+                                            'modificado': motivo,
+                                        }, nombre=docente_edit, es_docente=True)
                                         st.success(f"✅ Registro creado para {docente_edit} — {fecha_str_e}")
                                         st.rerun()
                         except Exception as e:
@@ -20519,36 +20102,48 @@ def tab_reportes(config):
 
     if subtab == "📋 Asistencia Mensual":
         st.markdown("### 📋 Reporte Mensual de Asistencia por Grado")
-        if gs:
-            c1, c2, c3 = st.columns(3)
-            with c1:
-                grado_rep = st.selectbox("Grado:", GRADOS_OPCIONES, key="rep_gr")
-            with c2:
-                mes_rep = st.selectbox("Mes:", list(range(1, 13)),
-                                        format_func=lambda x: ['', 'Enero', 'Febrero',
-                                        'Marzo', 'Abril', 'Mayo', 'Junio', 'Julio',
-                                        'Agosto', 'Septiembre', 'Octubre', 'Noviembre',
-                                        'Diciembre'][x], key="rep_mes")
-            with c3:
-                anio_rep = st.number_input("Año:", value=hora_peru().year,
-                                            key="rep_anio")
-
-            if st.button("📊 Generar Reporte", type="primary", key="btn_rep_asist"):
+        c1, c2, c3 = st.columns(3)
+        with c1:
+            grado_rep = st.selectbox("Grado:", GRADOS_OPCIONES, key="rep_gr")
+        with c2:
+            mes_rep = st.selectbox("Mes:", list(range(1, 13)),
+                                    format_func=lambda x: ['', 'Enero', 'Febrero',
+                                    'Marzo', 'Abril', 'Mayo', 'Junio', 'Julio',
+                                    'Agosto', 'Septiembre', 'Octubre', 'Noviembre',
+                                    'Diciembre'][x], key="rep_mes")
+        with c3:
+            anio_rep = st.number_input("Año:", value=hora_peru().year,
+                                        key="rep_anio")
+
+        if st.button("📊 Generar Reporte", type="primary", key="btn_rep_asist"):
+            # Desde el resumen precalculado, con todos los matriculados
+            # del grado (también los que no vinieron ningún día)
+            df_rep = BaseDatos.obtener_estudiantes_grado(grado_rep)
+            nombres_rep = {}
+            if not df_rep.empty and 'DNI' in df_rep.columns:
+                for _, row_r in df_rep.iterrows():
+                    dni_r = str(row_r.get('DNI', '')).strip()
+                    if dni_r and dni_r != 'nan':
+                        nombres_rep[dni_r] = str(row_r.get('Nombre', '')).strip()
+            datos = {}
+            for dni_r, info_r in _resumen_asistencias().asistencia_mes(
+                    int(anio_rep), mes_rep, list(nombres_rep)).items():
+                nom_r = nombres_rep.get(dni_r) or info_r['nombre'] or dni_r
+                datos[nom_r] = {'dni': dni_r, 'fechas': info_r['fechas']}
+            if not any(i['fechas'] for i in datos.values()) and gs:
                 datos = gs.reporte_asistencia_mensual(grado_rep, mes_rep, int(anio_rep))
-                if datos:
-                    st.success(f"✅ {len(datos)} estudiantes encontrados")
-                    for nombre, info_a in sorted(datos.items()):
-                        total = len(info_a.get('fechas', {}))
-                        st.write(f"**{nombre}** — {total} días asistidos")
-                    pdf = generar_reporte_asistencia_mensual_pdf(
-                        datos, grado_rep, mes_rep, int(anio_rep), config)
-                    st.download_button("📥 PDF Asistencia Mensual", pdf,
-                                       f"Asistencia_{grado_rep}_{mes_rep}.pdf",
-                                       "application/pdf", key="dl_rep_asist")
-                else:
-                    st.warning("No hay datos para este período")
-        else:
-            st.warning("⚠️ Conecta Google Sheets")
+            if datos:
+                st.success(f"✅ {len(datos)} estudiantes encontrados")
+                for nombre, info_a in sorted(datos.items()):
+                    total = len(info_a.get('fechas', {}))
+                    st.write(f"**{nombre}** — {total} días asistidos")
+                pdf = generar_reporte_asistencia_mensual_pdf(
+                    datos, grado_rep, mes_rep, int(anio_rep), config)
+                st.download_button("📥 PDF Asistencia Mensual", pdf,
+                                   f"Asistencia_{grado_rep}_{mes_rep}.pdf",
+                                   "application/pdf", key="dl_rep_asist")
+            else:
+                st.warning("No hay datos para este período")
 
     elif subtab == "📊 Reporte Integral":
         st.markdown("### 📊 Reporte Integral del Estudiante")
@@ -20582,18 +20177,13 @@ def tab_reportes(config):
                         notas_edit = []
                         if gs:
                             try:
-                                ws = gs._get_hoja('config')
-                                if ws:
-                                    data = ws.get_all_records()
-                                    for d in data:
-                                        clave = str(d.get('clave', ''))
-                                        if clave.startswith(f'nota_{dni_ri}'):
-                                            try:
-                                                nota_data = json.loads(d.get('valor', '{}'))
-                                                nota_data['_clave'] = clave
-                                                notas_edit.append(nota_data)
-                                            except Exception:
-                                                pass
+                                for clave, valor in gs.config().items(f'nota_{dni_ri}'):
+                                    try:
+                                        nota_data = json.loads(valor or '{}')
+                                        nota_data['_clave'] = clave
+                                        notas_edit.append(nota_data)
+                                    except Exception:
+                                        pass
                             except Exception:
                                 pass
                         
@@ -20612,16 +20202,10 @@ def tab_reportes(config):
                                             try:
                                                 nota['nota'] = nueva
                                                 nota['literal'] = nota_a_letra(nueva)
-                                                ws = gs._get_hoja('config')
-                                                if ws:
-                                                    all_data = ws.get_all_records()
-                                                    for row_idx, row in enumerate(all_data, start=2):
-                                                        if str(row.get('clave', '')) == nota['_clave']:
-                                                            nota_copy = nota.copy()
-                                                            nota_copy.pop('_clave', None)
-                                                            ws.update_cell(row_idx, 2, 
-                                                                         json.dumps(nota_copy, ensure_ascii=False))
-                                                            break
+                                                nota_copy = nota.copy()
+                                                nota_copy.pop('_clave', None)
+                                                gs.config().set(nota['_clave'],
+                                                                json.dumps(nota_copy, ensure_ascii=False))
                                                 st.success(f"✅ Actualizado: {nueva}/20")
                                                 time.sleep(1)
                                                 st.rerun()
@@ -20644,12 +20228,7 @@ def tab_reportes(config):
 
                     # Cargar asistencia LOCAL primero (fuente principal)
                     try:
-                        if Path(ARCHIVO_ASISTENCIAS).exists():
-                            with open(ARCHIVO_ASISTENCIAS, 'r', encoding='utf-8') as f:
-                                todas_asis = json.load(f)
-                            for fecha_a, registros in todas_asis.items():
-                                if str(dni_ri) in registros:
-                                    asist_est[fecha_a] = registros[str(dni_ri)]
+                        asist_est = _diario_asistencias().historial_dni(dni_ri)
                     except Exception:
                         pass
 
@@ -20672,59 +20251,41 @@ def tab_reportes(config):
 
                     if gs:
                         try:
-                            ws = gs._get_hoja('config')
-                            if ws:
-                                data = ws.get_all_records()
-                                for d in data:
-                                    clave = str(d.get('clave', ''))
-                                    if clave.startswith(f'nota_{dni_ri}'):
-                                        try:
-                                            notas_est.append(json.loads(d.get('valor', '{}')))
-                                        except Exception:
-                                            pass
+                            for _clave, valor in gs.config().items(f'nota_{dni_ri}'):
+                                try:
+                                    notas_est.append(json.loads(valor or '{}'))
+                                except Exception:
+                                    pass
                         except Exception:
                             pass
 
-                    # También cargar de resultados de examen
+                    # Exámenes y Registrar Notas del año (consulta por DNI)
                     _anio_rep = str(config.get('anio', 2026))
-                    all_res = BaseDatos.cargar_todos_resultados()
-                    for r in all_res:
-                        if str(r.get('dni', '')) == str(dni_ri):
-                            _fecha_r = str(r.get('fecha', ''))
-                            if not _fecha_r.startswith(_anio_rep):
-                                continue
-                            for area in r.get('areas', []):
-                                notas_est.append({
-                                    'area': area['nombre'],
-                                    'nota': area['nota'],
-                                    'literal': nota_a_letra(area['nota']),
-                                    'bimestre': r.get('titulo', 'Evaluación'),
-                                    'fecha': r.get('fecha', ''),
-                                    'tipo': 'examen'
-                                })
-
-                    # Cargar notas del historial de evaluaciones (Registrar Notas)
-                    hist_eval = _cargar_historial_evaluaciones()
-                    for clave_h, ev_h in hist_eval.items():
-                        _fecha_h = str(ev_h.get('fecha', ''))
-                        if not _fecha_h.startswith(_anio_rep):
-                            continue
-                        for fila_h in ev_h.get('ranking', []):
-                            if str(fila_h.get('DNI', '')) == str(dni_ri):
-                                areas_h = ev_h.get('areas', [])
-                                areas_nombres_h = [a['nombre'] for a in areas_h] if areas_h and isinstance(areas_h[0], dict) else list(areas_h)
-                                for a_n in areas_nombres_h:
-                                    nota_v = fila_h.get(a_n, 0)
-                                    if nota_v and float(nota_v) > 0:
-                                        notas_est.append({
-                                            'area': a_n,
-                                            'nota': float(nota_v),
-                                            'literal': nota_a_letra(float(nota_v)),
-                                            'bimestre': ev_h.get('periodo', ''),
-                                            'fecha': ev_h.get('fecha', ''),
-                                            'titulo': ev_h.get('titulo', ''),
-                                            'tipo': 'registro_notas'
-                                        })
+                    try:
+                        _notas_ri = _almacen_notas().notas_alumno(
+                            dni_ri, fuentes=('examen', 'historial'), anio=_anio_rep)
+                    except Exception:
+                        _notas_ri = []
+                    for _n in sorted(_notas_ri, key=lambda _x: _x['fuente'] != 'examen'):
+                        if _n['fuente'] == 'examen':
+                            notas_est.append({
+                                'area': _n['area'],
+                                'nota': _n['valor'] or 0,
+                                'literal': nota_a_letra(_n['valor'] or 0),
+                                'bimestre': _n['titulo'] or 'Evaluación',
+                                'fecha': _n['fecha'],
+                                'tipo': 'examen'
+                            })
+                        elif _n['area'] and (_n['valor'] or 0) > 0:
+                            notas_est.append({
+                                'area': _n['area'],
+                                'nota': _n['valor'],
+                                'literal': nota_a_letra(_n['valor']),
+                                'bimestre': _n['periodo'],
+                                'fecha': _n['fecha'],
+                                'titulo': _n['titulo'],
+                                'tipo': 'registro_notas'
+                            })
 
                     al = BaseDatos.buscar_por_dni(dni_ri)
                     grado_est = str(al.get('Grado', grado_ri)) if al else grado_ri
@@ -20765,6 +20326,15 @@ def tab_reportes(config):
                     c_pdf = canvas.Canvas(buf_all, pagesize=A4)
                     w_page, h_page = A4
 
+                    # Exámenes y Registrar Notas del año de TODO el grado en
+                    # una consulta (antes: todos los resultados × cada alumno)
+                    _anio_rep_g = str(config.get('anio', 2026))
+                    try:
+                        _notas_grado = _almacen_notas().notas_alumnos(
+                            dg['DNI'].astype(str).tolist(),
+                            fuentes=('examen', 'historial'), anio=_anio_rep_g)
+                    except Exception:
+                        _notas_grado = {}
                     for _, row in dg.iterrows():
                         n_est = str(row.get('Nombre', ''))
                         d_est = str(row.get('DNI', ''))
@@ -20773,50 +20343,23 @@ def tab_reportes(config):
                         notas_est = []
                         if gs:
                             try:
-                                ws = gs._get_hoja('config')
-                                if ws:
-                                    data = ws.get_all_records()
-                                    for d in data:
-                                        clave = str(d.get('clave', ''))
-                                        if clave.startswith(f'nota_{d_est}'):
-                                            try:
-                                                notas_est.append(json.loads(d.get('valor', '{}')))
-                                            except Exception:
-                                                pass
+                                for _clave, valor in gs.config().items(f'nota_{d_est}'):
+                                    try:
+                                        notas_est.append(json.loads(valor or '{}'))
+                                    except Exception:
+                                        pass
                             except Exception:
                                 pass
 
-                        # De exámenes también
-                        _anio_rep_g = str(config.get('anio', 2026))
-                        all_res = BaseDatos.cargar_todos_resultados()
-                        for r in all_res:
-                            if str(r.get('dni', '')) == d_est:
-                                if not str(r.get('fecha', '')).startswith(_anio_rep_g):
-                                    continue
-                                for area in r.get('areas', []):
-                                    notas_est.append({
-                                        'area': area['nombre'],
-                                        'nota': area['nota'],
-                                        'fecha': r.get('fecha', ''),
-                                    })
-
-                        # De historial de evaluaciones (Registrar Notas)
-                        hist_eval_g = _cargar_historial_evaluaciones()
-                        for clave_hg, ev_hg in hist_eval_g.items():
-                            if not str(ev_hg.get('fecha', '')).startswith(_anio_rep_g):
-                                continue
-                            for fila_hg in ev_hg.get('ranking', []):
-                                if str(fila_hg.get('DNI', '')) == str(d_est):
-                                    areas_hg = ev_hg.get('areas', [])
-                                    areas_noms_hg = [a['nombre'] for a in areas_hg] if areas_hg and isinstance(areas_hg[0], dict) else list(areas_hg)
-                                    for a_ng in areas_noms_hg:
-                                        nota_vg = fila_hg.get(a_ng, 0)
-                                        if nota_vg and float(nota_vg) > 0:
-                                            notas_est.append({
-                                                'area': a_ng,
-                                                'nota': float(nota_vg),
-                                                'fecha': ev_hg.get('fecha', ''),
-                                            })
+                        # De exámenes y del historial de evaluaciones
+                        for _n in sorted(_notas_grado.get(d_est.strip(), []),
+                                         key=lambda _x: _x['fuente'] != 'examen'):
+                            if _n['fuente'] == 'examen' or (_n['area'] and (_n['valor'] or 0) > 0):
+                                notas_est.append({
+                                    'area': _n['area'],
+                                    'nota': _n['valor'] or 0,
+                                    'fecha': _n['fecha'],
+                                })
 
                         # Página del estudiante
                         c_pdf.setFont("Helvetica-Bold", 14)
@@ -21388,30 +20931,6 @@ def generar_registro_bimestral_pdf(grado, seccion, anio, estudiantes_df,
 # TAB: REGISTRAR NOTAS (Manual — Para todos los docentes)
 # ================================================================
 
-def _sync_resultados_a_gs():
-    """Sincroniza resultados.json a Google Sheets"""
-    try:
-        gs = _gs()
-        if not gs:
-            return
-        if Path('resultados.json').exists():
-            with open('resultados.json', 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            ws = gs._get_hoja('config')
-            if ws:
-                data_str = json.dumps(data, ensure_ascii=False, default=str)
-                all_vals = ws.get_all_values()
-                found = False
-                for idx, row in enumerate(all_vals):
-                    if row and row[0] == 'resultados_json':
-                        ws.update_cell(idx + 1, 2, data_str)
-                        found = True
-                        break
-                if not found:
-                    ws.append_row(['resultados_json', data_str])
-    except Exception:
-        pass
-
 def _sync_horario_a_gs():
     """Sincroniza config_horario.json a Google Sheets"""
     try:
@@ -21421,68 +20940,69 @@ def _sync_horario_a_gs():
         if Path('config_horario.json').exists():
             with open('config_horario.json', 'r', encoding='utf-8') as f:
                 data = json.load(f)
-            ws = gs._get_hoja('config')
-            if ws:
-                data_str = json.dumps(data, ensure_ascii=False, default=str)
-                all_vals = ws.get_all_values()
-                found = False
-                for idx, row in enumerate(all_vals):
-                    if row and row[0] == 'config_horario':
-                        ws.update_cell(idx + 1, 2, data_str)
-                        found = True
-                        break
-                if not found:
-                    ws.append_row(['config_horario', data_str])
+            gs.config().set('config_horario', json.dumps(data, ensure_ascii=False, default=str))
     except Exception:
         pass
 
+def _clave_blob(nombre_clave):
+    """Fila de metadatos (hoja Config) del archivo: 'bin_fondo' → 'blob_fondo'."""
+    return "blob_" + (nombre_clave[4:] if nombre_clave.startswith("bin_") else nombre_clave)
+
 def _guardar_archivo_binario_gs(nombre_clave, filepath):
-    """Guarda un archivo binario (imagen, mp3) como base64 en Google Sheets hoja config"""
+    """Guarda un archivo binario (imagen, mp3) en el almacén por SHA-256
+    (Drive) y deja en la hoja config solo la fila de metadatos. Sin Drive
+    configurado se guarda como base64 en la hoja, como antes."""
     try:
         if not Path(filepath).exists():
             return False
-        import base64 as b64mod
-        with open(filepath, "rb") as fbin:
-            data_b64 = b64mod.b64encode(fbin.read()).decode('utf-8')
         gs = _gs()
         if not gs:
             return False
-        ws = gs._get_hoja('config')
-        if not ws:
-            return False
-        all_vals = ws.get_all_values()
-        found = False
-        for idx, row in enumerate(all_vals):
-            if row and row[0] == nombre_clave:
-                ws.update_cell(idx + 1, 2, data_b64)
-                found = True
-                break
-        if not found:
-            ws.append_row([nombre_clave, data_b64])
-        return True
+        cfg = gs.config()
+        almacen = gs.blobs()
+        if almacen.durable:
+            h, tam = almacen.guardar_archivo(filepath)
+            cambios = {_clave_blob(nombre_clave): meta_blob(h, tam, Path(filepath).name)}
+            if cfg.get(nombre_clave):
+                cambios[nombre_clave] = ""   # liberar el base64 antiguo
+            return cfg.set_many(cambios)
+        import base64 as b64mod
+        with open(filepath, "rb") as fbin:
+            data_b64 = b64mod.b64encode(fbin.read()).decode('utf-8')
+        return cfg.set(nombre_clave, data_b64)
     except Exception:
         return False
 
 def _restaurar_archivo_binario_gs(nombre_clave, filepath):
-    """Restaura un archivo binario desde base64 en Google Sheets si no existe localmente"""
+    """Restaura un archivo binario desde el almacén por SHA-256 (o desde
+    el base64 antiguo en Google Sheets) si no existe localmente, o si
+    otra instancia subió una versión nueva y la copia local no se tocó
+    desde que la restauramos"""
     try:
-        if Path(filepath).exists():
-            return True  # ya existe, no sobreescribir
-        import base64 as b64mod
         gs = _gs()
         if not gs:
+            return Path(filepath).exists()
+        # Sale de la foto en memoria de la hoja Config: restaurar todos
+        # los archivos al arrancar cuesta UNA lectura de la hoja.
+        cfg = gs.config()
+        meta = cfg.get_json(_clave_blob(nombre_clave))
+        h = meta.get("sha256", "") if meta else None
+        manifiesto = _manifiesto_restauracion()
+        if not manifiesto.debe_restaurar(filepath, h):
+            return True  # ya existe y está al día
+        if h and gs.blobs().restaurar(h, filepath):
+            manifiesto.registrar(filepath, h)
+            return True
+        if Path(filepath).exists():
+            return True
+        valor = cfg.get(nombre_clave)
+        if not valor:
             return False
-        ws = gs._get_hoja('config')
-        if not ws:
-            return False
-        all_vals = ws.get_all_values()
-        for row in all_vals:
-            if row and row[0] == nombre_clave and len(row) > 1 and row[1]:
-                data = b64mod.b64decode(row[1])
-                with open(filepath, "wb") as fbin:
-                    fbin.write(data)
-                return True
-        return False
+        import base64 as b64mod
+        data = b64mod.b64decode(valor)
+        with open(filepath, "wb") as fbin:
+            fbin.write(data)
+        return True
     except Exception:
         return False
 
@@ -21497,8 +21017,26 @@ def _restaurar_archivo_binario_gs(nombre_clave, filepath):
 # Usa directamente st.secrets["gcp_service_account"] que ya está configurado
 # ================================================================
 
+@st.cache_resource
+def _token_drive():
+    """El token dura 1 hora: se reutiliza entre llamadas, sesiones y
+    reruns (y entre los hilos de la restauración al arrancar) en vez de
+    firmar un JWT en cada una. UNO por proceso."""
+    return {'token': None, 'expira': 0, 'lock': _threading_base.Lock()}
+
 def _drive_get_token():
     """Obtiene un access token de Drive usando JWT firmado con la llave privada del service account."""
+    cache = _token_drive()
+    with cache['lock']:
+        if cache['token'] and time.time() < cache['expira'] - 300:
+            return cache['token']
+        token = _drive_pedir_token()
+        if token:
+            cache['token'] = token
+            cache['expira'] = time.time() + 3600
+        return token
+
+def _drive_pedir_token():
     try:
         import time, json as _j, base64 as _b64, hashlib, hmac
         from urllib import request as _urllib_req, parse as _urllib_parse
@@ -21553,6 +21091,9 @@ def _drive_get_token():
 
 def _drive_service():
     """Retorna un objeto liviano para llamadas a Drive API via requests."""
+    gs = _gs()
+    if gs is not None and gs.simulado is not None:
+        return gs.simulado.drive_lite()
     token = _drive_get_token()
     if not token:
         return None
@@ -21617,6 +21158,15 @@ def _drive_service():
             with _r.urlopen(req, timeout=60) as resp:
                 return _j.loads(resp.read()).get("id", file_id)
 
+        def descargar(self, file_id):
+            import urllib.request as _r
+            req = _r.Request(
+                f"https://www.googleapis.com/drive/v3/files/{file_id}"
+                f"?alt=media&supportsAllDrives=true",
+                headers=self._headers)
+            with _r.urlopen(req, timeout=30) as resp:
+                return resp.read()
+
         def set_public(self, file_id):
             import urllib.request as _r, json as _j
             body = _j.dumps({"role": "reader", "type": "anyone"}).encode()
@@ -21646,11 +21196,9 @@ def _drive_get_carpeta_raiz():
     try:
         gs = _gs()
         if gs:
-            ws = gs._get_hoja("config")
-            if ws:
-                for row in ws.get_all_values():
-                    if row and row[0] == "drive_folder_raiz" and len(row) > 1 and row[1]:
-                        return row[1].strip()
+            valor = gs.config().get("drive_folder_raiz")
+            if valor:
+                return valor.strip()
     except Exception:
         pass
     return None
@@ -21660,15 +21208,7 @@ def _drive_guardar_carpeta_raiz(folder_id):
     try:
         gs = _gs()
         if gs:
-            ws = gs._get_hoja("config")
-            if ws:
-                all_v = ws.get_all_values()
-                for idx, row in enumerate(all_v):
-                    if row and row[0] == "drive_folder_raiz":
-                        ws.update_cell(idx + 1, 2, folder_id)
-                        return True
-                ws.append_row(["drive_folder_raiz", folder_id])
-                return True
+            return gs.config().set("drive_folder_raiz", folder_id)
     except Exception:
         pass
     return False
@@ -21717,27 +21257,26 @@ def _drive_backup_json(nombre_archivo, datos_dict):
     except Exception as _e:
         return None
 
+def _drive_buscar_backup(nombre_archivo):
+    """{'id', 'name', 'modifiedTime'} del backup en Drive, o None."""
+    svc = _drive_service()
+    if not svc:
+        return None
+    folder_id = _drive_get_folder("YACHAY_BACKUP")
+    q = f"name='{nombre_archivo}' and trashed=false"
+    if folder_id:
+        q += f" and '{folder_id}' in parents"
+    files = svc.list_files(q=q, fields="files(id,name,modifiedTime)")
+    return files[0] if files else None
+
 def _drive_restaurar_json(nombre_archivo):
     """Descarga y retorna dict desde backup en Drive. None si no existe."""
     try:
         import json as _jb
-        import urllib.request as _ur
-        svc = _drive_service()
-        if not svc:
-            return None
-        folder_id = _drive_get_folder("YACHAY_BACKUP")
-        q = f"name='{nombre_archivo}' and trashed=false"
-        if folder_id:
-            q += f" and '{folder_id}' in parents"
-        files = svc.list_files(q=q, fields="files(id,name,modifiedTime)")
-        if not files:
+        archivo = _drive_buscar_backup(nombre_archivo)
+        if not archivo:
             return None
-        file_id = files[0]["id"]
-        req = _ur.Request(
-            f"https://www.googleapis.com/drive/v3/files/{file_id}?alt=media",
-            headers={"Authorization": f"Bearer {_drive_get_token()}"})
-        with _ur.urlopen(req, timeout=30) as resp:
-            return _jb.loads(resp.read())
+        return _jb.loads(_drive_service().descargar(archivo["id"]))
     except Exception:
         return None
 
@@ -21811,17 +21350,7 @@ def _pausa_guardar_mp3(modelo_id, audio_bytes, extension="mp3"):
         if drive_file_id:
             gs = _gs()
             if gs:
-                ws = gs._get_hoja('config')
-                if ws:
-                    clave = f"drive_pausa_mp3_{modelo_id}"
-                    all_vals = ws.get_all_values()
-                    found = False
-                    for idx, row in enumerate(all_vals):
-                        if row and row[0] == clave:
-                            ws.update_cell(idx + 1, 2, drive_file_id)
-                            found = True; break
-                    if not found:
-                        ws.append_row([clave, drive_file_id])
+                gs.config().set(f"drive_pausa_mp3_{modelo_id}", drive_file_id)
     except Exception as _e:
         st.session_state["_drive_error"] = str(_e)
 
@@ -21839,14 +21368,7 @@ def _pausa_cargar_drive_file_id(modelo_id):
         gs = _gs()
         if not gs:
             return None
-        ws = gs._get_hoja('config')
-        if not ws:
-            return None
-        all_vals = ws.get_all_values()
-        clave = f"drive_pausa_mp3_{modelo_id}"
-        for row in all_vals:
-            if row and row[0] == clave and len(row) > 1 and row[1]:
-                return row[1]
+        return gs.config().get(f"drive_pausa_mp3_{modelo_id}") or None
     except Exception:
         pass
     return None
@@ -21865,8 +21387,8 @@ def _pausa_cargar_mp3_b64(modelo_id):
                 return b64mod.b64encode(f.read()).decode("utf-8"), ext
     return None, None
 
-def _restaurar_todos_archivos_binarios():
-    """Restaura todos los archivos binarios (escudos, fondo, mp3 pausas, mp3 qaway) desde GSheets"""
+def _archivos_binarios_restaurables():
+    """[(clave en GSheets, archivo local)] de escudos, fondo, mp3 pausas y mp3 qaway"""
     archivos_binarios = [
         ("bin_escudo_izq",    "escudo_upload.png"),
         ("bin_escudo_der",    "escudo2_upload.png"),
@@ -21877,32 +21399,51 @@ def _restaurar_todos_archivos_binarios():
         archivos_binarios.append((f"bin_pausa_mp3_{i}", f"pausa_mp3_{i}.mp3"))
     # MP3 de YACHAY QAWAY
     archivos_binarios.append(("bin_qaway_mp3", str(_plk_dir() / "musica_fondo.mp3")))
-    for nombre_clave, filepath in archivos_binarios:
-        try:
-            _restaurar_archivo_binario_gs(nombre_clave, filepath)
-        except Exception:
-            pass
+    return archivos_binarios
+
+# Backups JSON en Drive: (nombre en Drive, archivo local)
+BACKUPS_DRIVE = [
+    ("historial_evaluaciones.json", "historial_evaluaciones.json"),
+    ("asistencias.json", "asistencias.json"),
+    ("diagnostico.json", "diagnostico.json"),
+    ("resultados.json", "resultados.json"),
+]
+
+def _restaurar_backup_drive(nombre_drive, nombre_local):
+    """Restaura UN backup JSON de Drive si no existe localmente, o si en
+    Drive hay uno más nuevo (modifiedTime) que el que restauramos antes.
+    Drive es la segunda capa: un archivo que vino de la hoja Config no se
+    pisa con el backup de Drive."""
+    manifiesto = _manifiesto_restauracion()
+    if Path(nombre_local).exists() and not manifiesto.debe_restaurar(nombre_local, ''):
+        # Archivo local propio (no restaurado por nosotros): no preguntar a Drive
+        return False
+    if str(manifiesto.version(nombre_local) or '').startswith('config:'):
+        return False
+    archivo = _drive_buscar_backup(nombre_drive)
+    if not archivo:
+        return False
+    version = f"drive:{archivo.get('modifiedTime') or archivo['id']}"
+    if not manifiesto.debe_restaurar(nombre_local, version):
+        return False
+    data = json.loads(_drive_service().descargar(archivo["id"]))
+    if not data:
+        return False
+    with open(nombre_local, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    manifiesto.registrar(nombre_local, version)
+    return True
 
-def _restaurar_desde_drive_backups():
-    """Restaura archivos JSON desde Drive si no existen localmente.
-    Se ejecuta al inicio — backup silencioso como segunda capa de seguridad."""
-    archivos = [
-        ("historial_evaluaciones.json", "historial_evaluaciones.json"),
-        ("asistencias.json", "asistencias.json"),
-        ("diagnostico.json", "diagnostico.json"),
-        ("resultados.json", "resultados.json"),
-    ]
-    for nombre_drive, nombre_local in archivos:
-        try:
-            if Path(nombre_local).exists():
-                continue  # ya existe localmente, no sobreescribir
-            data = _drive_restaurar_json(nombre_drive)
-            if data:
-                with open(nombre_local, 'w', encoding='utf-8') as f:
-                    json.dump(data, f, ensure_ascii=False, indent=2)
-        except Exception:
-            pass
 
+# Claves de la hoja Config que respaldan un JSON local
+RESPALDOS_CONFIG = {
+    'historial_evaluaciones': 'historial_evaluaciones.json',
+    'resultados_json': 'resultados.json',
+    'config_horario': 'config_horario.json',
+    'diagnostico_data': 'diagnostico_data.json',
+    # Historial completo de asistencias — fundamental para Top del Mes
+    'asistencias_json': 'asistencias.json',
+}
 
 def _restaurar_datos_desde_gs():
     """Restaura archivos JSON locales desde Google Sheets al iniciar"""
@@ -21910,95 +21451,102 @@ def _restaurar_datos_desde_gs():
         gs = _gs()
         if not gs:
             return
-        ws = gs._get_hoja('config')
-        if not ws:
-            return
-        data = ws.get_all_values()
+        manifiesto = _manifiesto_restauracion()
         restaurados = 0
-        for row in data:
-            if not row or len(row) < 2:
+        for key, val in gs.config().items():
+            archivo = RESPALDOS_CONFIG.get(key)
+            if not archivo or not val:
                 continue
-            key, val = row[0], row[1]
             try:
-                if key == 'historial_evaluaciones' and not Path('historial_evaluaciones.json').exists():
-                    with open('historial_evaluaciones.json', 'w', encoding='utf-8') as f:
-                        f.write(val)
-                    restaurados += 1
-                elif key == 'resultados_json' and not Path('resultados.json').exists():
-                    with open('resultados.json', 'w', encoding='utf-8') as f:
-                        f.write(val)
-                    restaurados += 1
-                elif key == 'config_horario' and not Path('config_horario.json').exists():
-                    with open('config_horario.json', 'w', encoding='utf-8') as f:
-                        f.write(val)
-                    restaurados += 1
-                elif key == 'diagnostico_data' and not Path('diagnostico_data.json').exists():
-                    with open('diagnostico_data.json', 'w', encoding='utf-8') as f:
-                        f.write(val)
-                    restaurados += 1
-                elif key == 'asistencias_json' and not Path('asistencias.json').exists():
-                    # Restaurar historial completo de asistencias — fundamental para Top del Mes
-                    with open('asistencias.json', 'w', encoding='utf-8') as f:
-                        f.write(val)
-                    restaurados += 1
+                version = f"config:{hashlib.sha256(val.encode('utf-8')).hexdigest()}"
+                if not manifiesto.debe_restaurar(archivo, version):
+                    continue
+                with open(archivo, 'w', encoding='utf-8') as f:
+                    f.write(val)
+                manifiesto.registrar(archivo, version)
+                restaurados += 1
             except Exception:
                 pass
         return restaurados
     except Exception:
         return 0
 
-def _cargar_historial_evaluaciones():
-    """Carga historial — CACHÉ en session_state (TTL 60 seg, archivo local)"""
-    import time as _time
-    _now = _time.time()
-    _cached = st.session_state.get('_cache_hist_eval')
-    _ts     = st.session_state.get('_cache_hist_ts', 0)
-    if (_cached is not None
-            and not st.session_state.get('_hist_invalidar', False)
-            and (_now - _ts) < 60):
-        return _cached
-    st.session_state['_hist_invalidar'] = False
+
+# ================================================================
+# RESTAURACIÓN AL ARRANCAR (una vez por proceso, en segundo plano)
+# ================================================================
+@st.cache_resource
+def _manifiesto_restauracion():
+    """Versiones restauradas de cada archivo local (una por proceso)."""
+    return ManifiestoRestauracion()
+
+def _paso_fondo(funcion):
+    """Los pasos de la restauración usan la cuota de la API con
+    prioridad de fondo: ceden el paso a las asistencias y al login."""
+    if not GOOGLE_SYNC_DISPONIBLE:
+        return funcion
+    def _envuelta():
+        with prioridad_api(PRIORIDAD_FONDO):
+            return funcion()
+    return _envuelta
+
+@st.cache_resource
+def _restauracion_arranque():
+    """Restaura datos desde Google Sheets + Drive UNA vez por proceso, en
+    segundo plano y en paralelo. La primera sesión la dispara; las demás
+    (y los reruns) reciben la misma instancia ya en marcha o terminada.
+
+    conexion → config → (datos de Config, 24 binarios en paralelo)
+             → backups de Drive (los 4 en paralelo, después de Config
+               porque Drive es la segunda capa: solo completan los
+               archivos que Config no trajo)"""
+    orq = OrquestadorArranque(hilos=8, envolver=_paso_fondo)
+    orq.paso("conexion", lambda: _gs() is not None)
+    orq.paso("config", lambda: len(_gs().config().items()) if _gs() else 0,
+             depende=("conexion",))
+    orq.paso("datos_config", _restaurar_datos_desde_gs, depende=("config",))
+    for nombre_clave, filepath in _archivos_binarios_restaurables():
+        orq.paso(f"binario:{nombre_clave}",
+                 lambda c=nombre_clave, f=filepath: _restaurar_archivo_binario_gs(c, f),
+                 depende=("config",))
+    for nombre_drive, nombre_local in BACKUPS_DRIVE:
+        orq.paso(f"drive:{nombre_drive}",
+                 lambda d=nombre_drive, l=nombre_local: _restaurar_backup_drive(d, l),
+                 depende=("datos_config",))
+    orq.iniciar(lanzar=_iniciar_hilo)
+    return orq
+
+def _cargar_historial_evaluaciones(grado=None, docente=None, periodo=None):
+    """{clave: evaluación} desde el almacén de notas, filtrado por los
+    índices (grado / docente / periodo). El almacén memoriza la consulta
+    hasta el próximo cambio."""
     try:
-        if Path('historial_evaluaciones.json').exists():
-            with open('historial_evaluaciones.json', 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            st.session_state['_cache_hist_eval'] = data
-            st.session_state['_cache_hist_ts']   = _now
-            return data
+        return _almacen_notas().evaluaciones(grado=grado, docente=docente,
+                                            periodo=periodo)
     except Exception:
-        pass
-    return {}
+        return {}
 
-def _guardar_historial_evaluaciones(hist_data):
-    """Guarda el historial de evaluaciones en archivo JSON + Google Sheets + Drive"""
-    st.session_state['_hist_invalidar'] = True   # invalidar caché
+def _guardar_evaluacion(clave, evaluacion):
+    """Guarda UNA evaluación del historial (UPSERT en el almacén) y
+    programa el respaldo JSON + Google Sheets + Drive en segundo plano."""
     try:
-        with open('historial_evaluaciones.json', 'w', encoding='utf-8') as f:
-            json.dump(hist_data, f, ensure_ascii=False, indent=2, default=str)
-        # Backup en Drive (en segundo plano, no bloquea)
-        try: _drive_backup_json("historial_evaluaciones.json", hist_data)
-        except Exception: pass
-        # Sync a Google Sheets
-        try:
-            gs = _gs()
-            if gs:
-                ws = gs._get_hoja('config')
-                if ws:
-                    data_str = json.dumps(hist_data, ensure_ascii=False, default=str)
-                    all_data = ws.get_all_values()
-                    found = False
-                    for idx, row in enumerate(all_data):
-                        if row and row[0] == 'historial_evaluaciones':
-                            ws.update_cell(idx + 1, 2, data_str)
-                            found = True
-                            break
-                    if not found:
-                        ws.append_row(['historial_evaluaciones', data_str])
-        except Exception:
-            pass
-        return True
+        _almacen_notas().guardar_evaluacion(clave, evaluacion)
     except Exception:
         return False
+    _programar_respaldo_notas()
+    return True
+
+def _guardar_resultados_reporte(registros):
+    """Agrega resultados por alumno (los de resultados.json: portal de
+    padres y Reporte Integral) en una sola transacción."""
+    if not registros:
+        return 0
+    try:
+        n = _almacen_notas().agregar_resultados('reporte', None, registros)
+    except Exception:
+        return 0
+    _programar_respaldo_notas()
+    return n
 
 def _cargar_diagnostico():
     """Carga diagnósticos guardados desde JSON local"""
@@ -22018,18 +21566,8 @@ def _guardar_diagnostico(data):
         try:
             gs = _gs()
             if gs:
-                ws = gs._get_hoja('config')
-                if ws:
-                    data_str = json.dumps(data, ensure_ascii=False, default=str)
-                    all_data = ws.get_all_values()
-                    found = False
-                    for idx, row in enumerate(all_data):
-                        if row and row[0] == 'diagnostico_data':
-                            ws.update_cell(idx + 1, 2, data_str)
-                            found = True
-                            break
-                    if not found:
-                        ws.append_row(['diagnostico_data', data_str])
+                gs.config().set('diagnostico_data',
+                                json.dumps(data, ensure_ascii=False, default=str))
         except Exception:
             pass
         # Backup en Drive
@@ -22047,16 +21585,10 @@ def _restaurar_diagnostico_desde_gs():
         gs = _gs()
         if not gs:
             return
-        ws = gs._get_hoja('config')
-        if not ws:
-            return
-        all_data = ws.get_all_values()
-        for row in all_data:
-            if row and row[0] == 'diagnostico_data' and len(row) > 1:
-                data = json.loads(row[1])
-                with open('diagnostico_data.json', 'w', encoding='utf-8') as f:
-                    json.dump(data, f, ensure_ascii=False, indent=2)
-                break
+        data = gs.config().get_json('diagnostico_data')
+        if data is not None:
+            with open('diagnostico_data.json', 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
     except Exception:
         pass
 
@@ -22787,10 +22319,10 @@ def tab_registrar_notas(config):
                     todos_diag[clave_sal if es_salida else clave_ent] = notas_ingresadas
                     if _guardar_diagnostico(todos_diag):
                         st.success(f"✅ Diagnóstico de {tipo_nombre} guardado.")
-                        # ── Guardar en resultados.json para portal de padres ──
+                        # ── Guardar en resultados (portal de padres) ──
                         try:
                             tipo_label = f"Diagnóstico {'Salida' if es_salida else 'Entrada'}"
-                            resultados_act = BaseDatos.cargar_todos_resultados()
+                            resultados_act = []
                             for _, row_d in df_diag.iterrows():
                                 nombre_d = str(row_d.get('Nombre', '')).strip()
                                 dni_d    = str(row_d.get('DNI', '')).strip()
@@ -22817,9 +22349,7 @@ def tab_registrar_notas(config):
                                     'tipo':             'diagnostico',
                                 }
                                 resultados_act.append(reg_d)
-                            with open('resultados.json', 'w', encoding='utf-8') as _fr:
-                                json.dump(resultados_act, _fr,
-                                          ensure_ascii=False, indent=2, default=str)
+                            _guardar_resultados_reporte(resultados_act)
                         except Exception:
                             pass
                     else:
@@ -22883,10 +22413,9 @@ def tab_registrar_notas(config):
 
     if vista == "📂 Historial de Evaluaciones":
         st.markdown("### 📂 Evaluaciones Guardadas")
-        hist = _cargar_historial_evaluaciones()
-        # Filtrar por rol
-        if st.session_state.rol not in ['admin', 'directivo']:
-            hist = {k: v for k, v in hist.items() if v.get('docente') == usuario}
+        # Filtrar por rol (consulta indexada por docente)
+        hist = _cargar_historial_evaluaciones(
+            docente=None if st.session_state.rol in ['admin', 'directivo'] else usuario)
         if not hist:
             st.info("📭 No hay evaluaciones guardadas aún.")
             return
@@ -22918,10 +22447,8 @@ def tab_registrar_notas(config):
                                                "application/pdf", key=f"dl_hist_{clave}")
                     with col_prog_h:
                         if st.button("📊 Gráfico Progreso", key=f"prog_hist_{clave}", type="primary"):
-                            _hist_all_hv = _cargar_historial_evaluaciones()
-                            _prev_hv = [v for k2,v in _hist_all_hv.items()
-                                        if isinstance(v,dict) and v.get('grado','')==ev.get('grado','')
-                                        and k2!=clave]
+                            _hist_all_hv = _cargar_historial_evaluaciones(grado=ev.get('grado',''))
+                            _prev_hv = [v for k2,v in _hist_all_hv.items() if k2!=clave]
                             _pdf_prog_hv = _generar_pdf_progreso_barras(
                                 ranking_h, areas_nombres, _prev_hv,
                                 ev.get('grado',''), ev.get('periodo',''), config)
@@ -23177,9 +22704,8 @@ def tab_registrar_notas(config):
                     # Guardar igual que evaluación normal
                     areas_obj = [{'nombre': c['nombre'], 'id': f"cl_{i}",
                                   'n_preguntas': c['n_preguntas']} for i,c in enumerate(cursos_config)]
-                    hist_cl = _cargar_historial_evaluaciones()
                     clave_cl = f"{grado_cl}_{bim_cl}_claves_{fecha_peru_str()}"
-                    hist_cl[clave_cl] = {
+                    ev_cl = {
                         'id': clave_cl, 'grado': grado_cl, 'periodo': bim_cl,
                         'titulo': titulo_cl or f"Claves {bim_cl}",
                         'fecha': fecha_peru_str(), 'hora': hora_peru_str(),
@@ -23189,42 +22715,29 @@ def tab_registrar_notas(config):
                     }
                     # ── Guardar todo en una sola operación al final ──────
                     with st.spinner("💾 Guardando evaluación..."):
-                        # 1. Historial evaluaciones (JSON + GSheets en una llamada)
-                        _guardar_historial_evaluaciones(hist_cl)
-
-                        # 2. resultados.json — construir lista completa de una vez
-                        try:
-                            _res_path = 'resultados.json'
-                            _res_act = []
-                            if Path(_res_path).exists():
-                                with open(_res_path,'r',encoding='utf-8') as _fr2:
-                                    _res_act = json.load(_fr2)
-                            # Construir todos los registros en memoria primero
-                            _nuevos = [
-                                {
-                                    'dni': _dnir,
-                                    'nombre': _datr['nombre'],
-                                    'grado': grado_cl,
-                                    'periodo': bim_cl,
-                                    'titulo': titulo_cl or f"Claves {bim_cl}",
-                                    'fecha': fecha_peru_str(),
-                                    'hora': hora_peru_str(),
-                                    'docente': usuario,
-                                    'docente_nombre': nombre_completo_doc,
-                                    'areas': [{'nombre': k, 'nota': v}
-                                              for k, v in _datr['areas'].items()],
-                                    'promedio_general': _datr['promedio'],
-                                    '_docente': usuario,
-                                }
-                                for _dnir, _datr in notas_cl.items()
-                                if _datr['promedio'] > 0
-                            ]
-                            # Escribir todo de una sola vez (no uno por uno)
-                            _res_act.extend(_nuevos)
-                            with open(_res_path,'w',encoding='utf-8') as _fw2:
-                                json.dump(_res_act, _fw2, ensure_ascii=False, indent=2)
-                        except Exception as _erc:
-                            st.warning(f"Historial guardado — aviso en resultados.json: {_erc}")
+                        # 1. Historial evaluaciones (el respaldo va en segundo plano)
+                        _guardar_evaluacion(clave_cl, ev_cl)
+
+                        # 2. Resultados por alumno — una sola transacción
+                        _guardar_resultados_reporte([
+                            {
+                                'dni': _dnir,
+                                'nombre': _datr['nombre'],
+                                'grado': grado_cl,
+                                'periodo': bim_cl,
+                                'titulo': titulo_cl or f"Claves {bim_cl}",
+                                'fecha': fecha_peru_str(),
+                                'hora': hora_peru_str(),
+                                'docente': usuario,
+                                'docente_nombre': nombre_completo_doc,
+                                'areas': [{'nombre': k, 'nota': v}
+                                          for k, v in _datr['areas'].items()],
+                                'promedio_general': _datr['promedio'],
+                                '_docente': usuario,
+                            }
+                            for _dnir, _datr in notas_cl.items()
+                            if _datr['promedio'] > 0
+                        ])
 
                     _n_cl = len([v for v in notas_cl.values() if v['promedio']>0])
                     st.success(f"✅ Evaluación guardada — {_n_cl} estudiantes registrados")
@@ -23245,8 +22758,8 @@ def tab_registrar_notas(config):
                                           f"Grado: {grado_cl} | {bim_cl}\nEvaluacion: {titulo_cl or 'Por Claves'}\n\n"
                                           f"{_at}\n\nPROMEDIO: {_dat['promedio']}\n"
                                           f"I.E.P. Alternativo Yachay - Chinchero\n\U0001f4de 084-750071")
-                                    _tg_enviar(_cid,_msg,_tok_cl)
-                            _iniciar_hilo(_env_cl)
+                                    _tg_encolar(_cid,_msg,_tok_cl)
+                            _env_cl()
                     except Exception: pass
                     st.balloons()
 
@@ -23260,10 +22773,9 @@ def tab_registrar_notas(config):
                                        "application/pdf", key="dl_pdf_cl")
                 if st.button("📊 PDF Gráfico Progreso", type="primary",
                              use_container_width=True, key="btn_pdf_prog_cl"):
-                    _hist_a_cl = _cargar_historial_evaluaciones()
-                    _prev_cl = [v for k,v in _hist_a_cl.items()
-                                if isinstance(v,dict) and v.get('grado','')==grado_cl
-                                and v.get('periodo','')!=bim_cl]
+                    _hist_a_cl = _cargar_historial_evaluaciones(grado=grado_cl)
+                    _prev_cl = [v for v in _hist_a_cl.values()
+                                if v.get('periodo','')!=bim_cl]
                     _pdf_pg_cl = _generar_pdf_progreso_barras(
                         ranking_cl, areas_cl_names, _prev_cl, grado_cl, bim_cl, config)
                     st.session_state['_pdf_prog_cl'] = _pdf_pg_cl
@@ -23697,9 +23209,8 @@ def tab_registrar_notas(config):
         with col_g1:
             if st.button("💾 GUARDAR EN HISTORIAL", type="primary",
                          use_container_width=True, key="btn_guardar_historial"):
-                hist = _cargar_historial_evaluaciones()
                 clave_hist = f"{grado_sel}_{bim_sel}_{ev['id']}_{fecha_peru_str()}"
-                hist[clave_hist] = {
+                ev_hist = {
                     'id': ev['id'],
                     'grado': grado_sel,
                     'periodo': bim_sel,
@@ -23713,15 +23224,14 @@ def tab_registrar_notas(config):
                 }
                 if gs:
                     try:
-                        ws = gs._get_hoja('config')
-                        if ws:
-                            ws.append_row([f"histeval_{clave_hist}",
-                                           json.dumps(hist[clave_hist], ensure_ascii=False, default=str)])
+                        gs.config().agregar(f"histeval_{clave_hist}",
+                                            json.dumps(ev_hist, ensure_ascii=False, default=str))
                     except Exception:
                         pass
-                if _guardar_historial_evaluaciones(hist):
+                if _guardar_evaluacion(clave_hist, ev_hist):
                     # También guardar notas individuales para Reporte Integral
                     try:
+                        regs_notas = []
                         for dni_nota, data_nota in notas_actuales.items():
                             if data_nota.get('nsp', False):
                                 continue  # No guardar NSP
@@ -23741,15 +23251,11 @@ def tab_registrar_notas(config):
                                 'promedio_general': data_nota['promedio'],
                                 '_docente': usuario
                             }
-                            # Guardar en resultados.json
-                            resultados_actuales = BaseDatos.cargar_todos_resultados()
-                            resultados_actuales.append(reg)
-                            with open('resultados.json', 'w', encoding='utf-8') as f:
-                                json.dump(resultados_actuales, f, ensure_ascii=False, indent=2)
+                            regs_notas.append(reg)
+                        # Todos los alumnos en una sola transacción
+                        _guardar_resultados_reporte(regs_notas)
                     except Exception:
                         pass
-                    
-                    _sync_resultados_a_gs()
 
                     # Vincular con el avance del temario (preuniversitario)
                     try:
@@ -23785,8 +23291,8 @@ def tab_registrar_notas(config):
                                              f"Grado: {_grado_ev} | {_bim_ev}\nEvaluacion: {_tit_ev}\n\n"
                                              f"{_at_ev}\n\nPROMEDIO: {_fila.get('Promedio',0)}\n"
                                              f"I.E.P. Alternativo Yachay - Chinchero\n\U0001f4de 084-750071")
-                                    _tg_enviar(_cid_ev,_msg_ev,_tok_ev)
-                            _iniciar_hilo(_env_notas_ev)
+                                    _tg_encolar(_cid_ev,_msg_ev,_tok_ev)
+                            _env_notas_ev()
                     except Exception: pass
                 else:
                     st.error("❌ Error al guardar")
@@ -24068,13 +23574,12 @@ def _generar_ranking_pdf(ranking_filas, areas, grado, periodo, config,
     # ── Marca de agua ────────────────────────────────────────────────────
     if Path("escudo_upload.png").exists():
         try:
-            from PIL import Image as PILImage
-            img = PILImage.open("escudo_upload.png")
+            img = cache_recursos.imagen("escudo_upload.png")
             iw, ih = img.size
             mw = 200; mh = mw / (iw / ih)
             c_pdf.saveState()
             c_pdf.setFillAlpha(0.12)
-            c_pdf.drawImage("escudo_upload.png", w/2-mw/2, h/2-mh/2, mw, mh, mask='auto')
+            c_pdf.drawImage(cache_recursos.image_reader("escudo_upload.png"), w/2-mw/2, h/2-mh/2, mw, mh, mask='auto')
             c_pdf.restoreState()
         except Exception:
             pass
@@ -24089,12 +23594,11 @@ def _generar_ranking_pdf(ranking_filas, areas, grado, periodo, config,
                           ("escudo2_upload.png" if Path("escudo2_upload.png").exists() else "escudo_upload.png", "der")]:
         try:
             if Path(path_e).exists():
-                from PIL import Image as PILImage
-                img = PILImage.open(path_e)
+                img = cache_recursos.imagen(path_e)
                 iw, ih = img.size
                 aw = ALTO_ESC * (iw / ih)
                 xp = 10 if lado == "izq" else w - 10 - aw
-                c_pdf.drawImage(path_e, xp, h - 52, aw, ALTO_ESC, mask='auto')
+                c_pdf.drawImage(cache_recursos.image_reader(path_e), xp, h - 52, aw, ALTO_ESC, mask='auto')
         except Exception:
             pass
 
@@ -24724,14 +24228,9 @@ def _cargar_fichas_registro():
     gs = _gs()
     if gs:
         try:
-            ws = gs._get_hoja('config')
-            if ws:
-                data = ws.get_all_records()
-                for row in data:
-                    if str(row.get('clave', '')) == 'fichas_registro':
-                        contenido = str(row.get('valor', ''))
-                        if contenido and contenido.strip() not in ('', '[]'):
-                            return json.loads(contenido)
+            contenido = gs.config().get('fichas_registro', '')
+            if contenido and contenido.strip() not in ('', '[]'):
+                return json.loads(contenido)
         except Exception:
             pass
     # Fallback: archivo local
@@ -24757,20 +24256,9 @@ def _guardar_ficha_registro(ficha):
     try:
         gs = _gs()
         if gs:
-            ws = gs._get_hoja('config')
-            if ws:
-                data = ws.get_all_records()
-                fila = None
-                for i, row in enumerate(data):
-                    if str(row.get('clave', '')) == 'fichas_registro':
-                        fila = i + 2
-                        break
-                contenido = json.dumps(fichas, ensure_ascii=False)
-                if len(contenido) < 45000:
-                    if fila:
-                        ws.update_cell(fila, 2, contenido)
-                    else:
-                        ws.append_row(['fichas_registro', contenido])
+            contenido = json.dumps(fichas, ensure_ascii=False)
+            if len(contenido) < 45000:
+                gs.config().set('fichas_registro', contenido)
     except Exception:
         pass
     return ficha
@@ -25159,12 +24647,11 @@ def _dibujar_escudo(c, x, y, alto_deseado):
     if not Path("escudo_upload.png").exists():
         return
     try:
-        from PIL import Image as PILImage
-        img = PILImage.open("escudo_upload.png")
+        img = cache_recursos.imagen("escudo_upload.png")
         iw, ih = img.size
         ratio = iw / ih
         ancho = alto_deseado * ratio
-        c.drawImage("escudo_upload.png", x, y, ancho, alto_deseado, mask='auto')
+        c.drawImage(cache_recursos.image_reader("escudo_upload.png"), x, y, ancho, alto_deseado, mask='auto')
     except Exception:
         pass
 
@@ -25181,23 +24668,21 @@ def _pdf_encabezado_material(c, w, h, config, semana, area, titulo, grado, docen
     esc_der = "escudo2_upload.png" if Path("escudo2_upload.png").exists() else "escudo_upload.png"
     if Path(esc_izq).exists():
         try:
-            from PIL import Image as PILImage
-            img = PILImage.open(esc_izq)
+            img = cache_recursos.imagen(esc_izq)
             iw, ih = img.size
             ratio = iw / ih
             ancho_esc = ALTO_ESC * ratio
-            c.drawImage(esc_izq, 18, h - 12 - ALTO_ESC, ancho_esc, ALTO_ESC, mask='auto')
+            c.drawImage(cache_recursos.image_reader(esc_izq), 18, h - 12 - ALTO_ESC, ancho_esc, ALTO_ESC, mask='auto')
         except Exception:
             pass
     if Path(esc_der).exists():
         try:
-            from PIL import Image as PILImage
-            img2 = PILImage.open(esc_der)
+            img2 = cache_recursos.imagen(esc_der)
             iw2, ih2 = img2.size
             ancho_esc2 = ALTO_ESC * (iw2 / ih2)
             _alto_der = 80
             _ancho_der = _alto_der * (iw2 / ih2)
-            c.drawImage(esc_der, w - 18 - _ancho_der, h - 12 - _alto_der, _ancho_der, _alto_der, mask='auto')
+            c.drawImage(cache_recursos.image_reader(esc_der), w - 18 - _ancho_der, h - 12 - _alto_der, _ancho_der, _alto_der, mask='auto')
         except Exception:
             pass
 
@@ -25239,14 +24724,13 @@ def _pdf_pie_material(c, w, grado, area, semana, pagina=None):
     # Marca de agua GRANDE en cada página (sin duplicar con encabezado)
     if Path("escudo_upload.png").exists():
         try:
-            from PIL import Image as PILImage
-            img = PILImage.open("escudo_upload.png")
+            img = cache_recursos.imagen("escudo_upload.png")
             iw, ih = img.size
             ratio = iw / ih
             mw = 420; mh = mw / ratio
             c.saveState()
             c.setFillAlpha(0.35)
-            c.drawImage("escudo_upload.png", w/2 - mw/2, A4[1]/2 - mh/2, mw, mh, mask='auto')
+            c.drawImage(cache_recursos.image_reader("escudo_upload.png"), w/2 - mw/2, A4[1]/2 - mh/2, mw, mh, mask='auto')
             c.restoreState()
         except Exception:
             pass
@@ -25443,7 +24927,7 @@ def _generar_pdf_examen_semanal(preguntas_por_area, config, grado, semana, titul
     # Logo escudo (izquierda)
     if Path("escudo_upload.png").exists():
         try:
-            c_pdf.drawImage("escudo_upload.png", 25, h - 88, 60, 60, mask='auto')
+            c_pdf.drawImage(cache_recursos.image_reader("escudo_upload.png"), 25, h - 88, 60, 60, mask='auto')
         except Exception:
             pass
 
@@ -25486,7 +24970,7 @@ def _generar_pdf_examen_semanal(preguntas_por_area, config, grado, semana, titul
         try:
             c_pdf.saveState()
             c_pdf.setFillAlpha(0.35)
-            c_pdf.drawImage("escudo_upload.png", w/2 - 100, h/2 - 100, 200, 200, mask='auto')
+            c_pdf.drawImage(cache_recursos.image_reader("escudo_upload.png"), w/2 - 100, h/2 - 100, 200, 200, mask='auto')
             c_pdf.restoreState()
         except Exception:
             pass
@@ -25551,7 +25035,7 @@ def _generar_pdf_examen_semanal(preguntas_por_area, config, grado, semana, titul
             try:
                 c_pdf.saveState()
                 c_pdf.setFillAlpha(0.04)
-                c_pdf.drawImage("escudo_upload.png", w/2-80, h/2-80, 160, 160, mask='auto')
+                c_pdf.drawImage(cache_recursos.image_reader("escudo_upload.png"), w/2-80, h/2-80, 160, 160, mask='auto')
                 c_pdf.restoreState()
             except Exception:
                 pass
@@ -26587,7 +26071,7 @@ def _generar_pdf_examen_2columnas(titulo, area, grado, preguntas, config):
     
     if Path("escudo_upload.png").exists():
         try:
-            c_pdf.drawImage("escudo_upload.png", 25, h - 90, 62, 62, mask='auto')
+            c_pdf.drawImage(cache_recursos.image_reader("escudo_upload.png"), 25, h - 90, 62, 62, mask='auto')
         except Exception:
             pass
     
@@ -26673,13 +26157,12 @@ def _generar_pdf_examen_2columnas(titulo, area, grado, preguntas, config):
                 c_pdf.showPage()
                 if Path("escudo_upload.png").exists():
                     try:
-                        from PIL import Image as PILImage
-                        _img = PILImage.open("escudo_upload.png")
+                        _img = cache_recursos.imagen("escudo_upload.png")
                         _iw, _ih = _img.size
                         _mw = 420; _mh = _mw / (_iw / _ih)
                         c_pdf.saveState()
                         c_pdf.setFillAlpha(0.35)
-                        c_pdf.drawImage("escudo_upload.png", w/2-_mw/2, h/2-_mh/2, _mw, _mh, mask='auto')
+                        c_pdf.drawImage(cache_recursos.image_reader("escudo_upload.png"), w/2-_mw/2, h/2-_mh/2, _mw, _mh, mask='auto')
                         c_pdf.restoreState()
                     except Exception:
                         pass
@@ -26754,13 +26237,12 @@ def _generar_pdf_examen_2columnas(titulo, area, grado, preguntas, config):
     # Marca de agua en clave
     if Path("escudo_upload.png").exists():
         try:
-            from PIL import Image as PILImage
-            _img = PILImage.open("escudo_upload.png")
+            _img = cache_recursos.imagen("escudo_upload.png")
             _iw, _ih = _img.size
             _mw = 420; _mh = _mw / (_iw/_ih)
             c_pdf.saveState()
             c_pdf.setFillAlpha(0.35)
-            c_pdf.drawImage("escudo_upload.png", w/2-_mw/2, h/2-_mh/2, _mw, _mh, mask='auto')
+            c_pdf.drawImage(cache_recursos.image_reader("escudo_upload.png"), w/2-_mw/2, h/2-_mh/2, _mw, _mh, mask='auto')
             c_pdf.restoreState()
         except Exception:
             pass
@@ -27625,22 +27107,12 @@ def _qaway_guardar_musica(audio_bytes):
         try:
             gs = _gs()
             if gs:
-                ws = gs._get_hoja("config")
-                if ws:
-                    all_v = ws.get_all_values()
-                    found = False
-                    for idx, row in enumerate(all_v):
-                        if row and row[0] == "drive_qaway_mp3":
-                            ws.update_cell(idx + 1, 2, drive_fid)
-                            found = True
-                            break
-                    if not found:
-                        ws.append_row(["drive_qaway_mp3", drive_fid])
-                    # Limpiar base64 antiguo si existe
-                    for idx, row in enumerate(all_v):
-                        if row and row[0] == "bin_qaway_mp3" and len(row) > 1 and row[1]:
-                            ws.update_cell(idx + 1, 2, "")
-                            break
+                cfg = gs.config()
+                cambios = {"drive_qaway_mp3": drive_fid}
+                # Limpiar base64 antiguo si existe
+                if cfg.get("bin_qaway_mp3"):
+                    cambios["bin_qaway_mp3"] = ""
+                cfg.set_many(cambios)
         except Exception:
             pass
     return p, drive_fid
@@ -27651,12 +27123,7 @@ def _qaway_drive_file_id():
         gs = _gs()
         if not gs:
             return None
-        ws = gs._get_hoja("config")
-        if not ws:
-            return None
-        for row in ws.get_all_values():
-            if row and row[0] == "drive_qaway_mp3" and len(row) > 1 and row[1]:
-                return row[1]
+        return gs.config().get("drive_qaway_mp3") or None
     except Exception:
         pass
     return None
@@ -27684,45 +27151,31 @@ def _plk_sync_quiz_a_gs(sesion_id, quiz_data):
     try:
         gs = _gs()
         if gs:
-            ws = gs._get_hoja('config')
-            if ws:
-                key = f"qaway_quiz_{sesion_id}"
-                data_str = json.dumps(quiz_data, ensure_ascii=False, default=str)
-                # Buscar si ya existe para actualizar
-                all_data = ws.get_all_values()
-                found = False
-                for idx, row in enumerate(all_data):
-                    if row and row[0] == key:
-                        ws.update_cell(idx + 1, 2, data_str)
-                        found = True
-                        break
-                if not found:
-                    ws.append_row([key, data_str])
+            gs.config().set(f"qaway_quiz_{sesion_id}",
+                            json.dumps(quiz_data, ensure_ascii=False, default=str))
     except Exception:
         pass
 
 def _plk_sync_resp_a_gs(sesion_id):
-    """Sincroniza respuestas a Google Sheets"""
-    try:
-        gs = _gs()
-        if gs:
-            resp = _plk_cargar_respuestas(sesion_id)
-            if resp:
-                ws = gs._get_hoja('config')
-                if ws:
-                    key = f"qaway_resp_{sesion_id}"
-                    data_str = json.dumps(resp, ensure_ascii=False, default=str)
-                    all_data = ws.get_all_values()
-                    found = False
-                    for idx, row in enumerate(all_data):
-                        if row and row[0] == key:
-                            ws.update_cell(idx + 1, 2, data_str)
-                            found = True
-                            break
-                    if not found:
-                        ws.append_row([key, data_str])
-    except Exception:
-        pass
+    """Sincroniza respuestas a Google Sheets (sin esperar la ronda)"""
+    _qaway().forzar(sesion_id)
+
+def _plk_subir_lote_gs(lote):
+    """Sube a Config las respuestas de las sesiones del lote
+    {sesion_id: respuestas} vía la bandeja de salida: una sola escritura
+    pendiente por sesión (la más nueva reemplaza a la anterior)."""
+    for sesion_id, resp in lote.items():
+        if resp:
+            _encolar_gs('guardar_config',
+                        {f"qaway_resp_{sesion_id}": json.dumps(resp, ensure_ascii=False, default=str)},
+                        clave=f"qaway_resp:{sesion_id}", reemplazar=True)
+
+@st.cache_resource
+def _qaway():
+    """Respuestas de QAWAY del proceso: inserciones con lock, contadores
+    vivos por pregunta y subida agrupada a Sheets. Compartido por el
+    proyector y todos los celulares que escanean."""
+    return AgregadorQaway(_plk_dir(), sincronizar=_plk_subir_lote_gs)
 
 def _plk_restaurar_desde_gs():
     """Restaura quizzes y respuestas desde Google Sheets al iniciar"""
@@ -27730,16 +27183,9 @@ def _plk_restaurar_desde_gs():
         gs = _gs()
         if not gs:
             return
-        ws = gs._get_hoja('config')
-        if not ws:
-            return
-        data = ws.get_all_values()
         plk_dir = _plk_dir()
         restaurados = 0
-        for row in data:
-            if not row or len(row) < 2:
-                continue
-            key, val = row[0], row[1]
+        for key, val in gs.config().items('qaway_'):
             if key.startswith('qaway_quiz_'):
                 sesion_id = key.replace('qaway_quiz_', '')
                 p = plk_dir / f"quiz_{sesion_id}.json"
@@ -27776,22 +27222,54 @@ def _plk_cargar_sesion(sesion_id):
 
 def _plk_guardar_respuesta(sesion_id, dni, nombre, pregunta_idx, respuesta, correcta_es):
     """Guarda respuesta individual en archivo compartido"""
-    p = _plk_dir() / f"resp_{sesion_id}.json"
-    resp = {}
-    if p.exists():
-        with open(p, 'r', encoding='utf-8') as f:
-            resp = json.load(f)
-    if dni not in resp:
-        resp[dni] = {'nombre': nombre, 'respuestas': {}}
-    resp[dni]['respuestas'][str(pregunta_idx)] = {
-        'resp': respuesta, 'correcta': correcta_es,
-        'ok': respuesta == correcta_es
-    }
-    with open(p, 'w', encoding='utf-8') as f:
-        json.dump(resp, f, indent=2, ensure_ascii=False)
+    _plk_guardar_respuestas(sesion_id, pregunta_idx, correcta_es,
+                            [(dni, nombre, respuesta)])
+
+def _plk_guardar_respuestas(sesion_id, pregunta_idx, correcta_es, lecturas):
+    """Guarda de una vez las respuestas de varios alumnos a una pregunta
+    (foto del aula) en una sola línea de diario.
+    lecturas = [(dni, nombre, respuesta), ...]"""
+    _qaway().registrar(sesion_id, pregunta_idx, correcta_es, lecturas)
+
+def _plk_leer_tarjeta(texto):
+    """(dni, opción) de un QR de tarjeta QAWAY ('YP|dni|op|numero' o el
+    formato antiguo 'YQ_dni_op'), o None si no es una tarjeta válida."""
+    if not texto:
+        return None
+    if texto.startswith("YP|"):
+        partes = texto.split("|")
+    elif texto.startswith("YQ_"):
+        partes = texto.replace("YQ_", "").split("_")
+        partes = ["", partes[0], partes[1]] if len(partes) >= 2 else partes
+    else:
+        return None
+    if len(partes) < 3 or partes[2].upper() not in ('A', 'B', 'C', 'D'):
+        return None
+    return partes[1], partes[2].upper()
+
+def _plk_lecturas_aula(textos):
+    """De los QR de una foto del aula: ({dni: opción}, dnis ambiguos,
+    textos no reconocidos). Un DNI que aparece con dos opciones distintas
+    (tarjeta mal doblada) queda como ambiguo y no se registra."""
+    lecturas, ambiguos, otros = {}, set(), []
+    for texto in textos:
+        tarjeta = _plk_leer_tarjeta(texto)
+        if tarjeta is None:
+            otros.append(texto)
+            continue
+        dni, op = tarjeta
+        if dni in ambiguos:
+            continue
+        if lecturas.get(dni, op) != op:
+            ambiguos.add(dni)
+            lecturas.pop(dni, None)
+            continue
+        lecturas[dni] = op
+    return lecturas, ambiguos, otros
 
 def _plk_guardar_en_reportes(quiz_data, sesion_id):
-    """Guarda resultados de QAWAY en historial_evaluaciones y resultados.json"""
+    """Guarda resultados de QAWAY en el historial de evaluaciones y en los
+    resultados por alumno (portal de padres)"""
     try:
         resp = _plk_cargar_respuestas(sesion_id)
         if not resp:
@@ -27805,8 +27283,7 @@ def _plk_guardar_en_reportes(quiz_data, sesion_id):
         usuario = quiz_data.get('usuario', '')
         fecha = quiz_data.get('fecha', fecha_peru_str())
 
-        # 1. Guardar en historial_evaluaciones.json
-        hist = _cargar_historial_evaluaciones()
+        # 1. Guardar en el historial de evaluaciones
         clave = f"qaway_{sesion_id}"
         ranking_filas = []
         for dni_r, pr in resp.items():
@@ -27820,7 +27297,7 @@ def _plk_guardar_en_reportes(quiz_data, sesion_id):
             })
         ranking_filas.sort(key=lambda x: x['promedio'], reverse=True)
 
-        hist[clave] = {
+        _guardar_evaluacion(clave, {
             'id': sesion_id,
             'grado': grado,
             'periodo': 'QAWAY',
@@ -27832,11 +27309,10 @@ def _plk_guardar_en_reportes(quiz_data, sesion_id):
             'areas': [area] if area else [],
             'ranking': ranking_filas,
             'tipo': 'qaway'
-        }
-        _guardar_historial_evaluaciones(hist)
+        })
 
-        # 2. Guardar en resultados.json (por alumno)
-        resultados = BaseDatos.cargar_todos_resultados()
+        # 2. Guardar resultados por alumno
+        resultados = []
         for r_item in ranking_filas:
             reg = {
                 'dni': r_item['dni'],
@@ -27854,8 +27330,7 @@ def _plk_guardar_en_reportes(quiz_data, sesion_id):
                 'tipo': 'qaway'
             }
             resultados.append(reg)
-        with open('resultados.json', 'w', encoding='utf-8') as f:
-            json.dump(resultados, f, ensure_ascii=False, indent=2, default=str)
+        _guardar_resultados_reporte(resultados)
         return True
     except Exception:
         return False
@@ -27876,11 +27351,7 @@ def _plk_format_quiz(path):
 
 def _plk_cargar_respuestas(sesion_id):
     """Carga todas las respuestas"""
-    p = _plk_dir() / f"resp_{sesion_id}.json"
-    if p.exists():
-        with open(p, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return {}
+    return _qaway().sesion(sesion_id).respuestas()
 
 def _generar_tarjeta_plickers(nombre, dni, numero):
     """Tarjeta PLEGABLE: doblar en 4, cada cara = 1 QR"""
@@ -29244,47 +28715,14 @@ def _gs_guardar_mp3_chunks(modelo_id, audio_b64, extension="mp3"):
     try:
         gs = _gs()
         if not gs: return False
-        ws = gs._get_hoja('config')
-        if not ws: return False
         CHUNK = 45000
         chunks = [audio_b64[i:i+CHUNK] for i in range(0, len(audio_b64), CHUNK)]
-        meta_val = f"{len(chunks)}|{extension}|{len(audio_b64)}"
-
-        # Leer todas las filas una sola vez
-        all_v = ws.get_all_values()
-        rows_idx = {row[0]: idx for idx, row in enumerate(all_v) if row}
-
-        # Construir lista de filas a actualizar y nuevas filas a agregar
-        updates = []   # (row_idx, value)
-        new_rows = []  # [key, value]
-
-        meta_key = f"mp3_meta_{modelo_id}"
-        if meta_key in rows_idx:
-            updates.append((rows_idx[meta_key]+1, meta_val))
-        else:
-            new_rows.append([meta_key, meta_val])
-
+        valores = {f"mp3_meta_{modelo_id}": f"{len(chunks)}|{extension}|{len(audio_b64)}"}
         for ci, chunk in enumerate(chunks):
-            ck = f"mp3_chunk_{modelo_id}_{ci}"
-            if ck in rows_idx:
-                updates.append((rows_idx[ck]+1, chunk))
-            else:
-                new_rows.append([ck, chunk])
-
-        # Aplicar updates en batch
-        if updates:
-            cell_list = []
-            for row_n, val in updates:
-                cell = ws.cell(row_n, 2)
-                cell.value = val
-                cell_list.append(cell)
-            ws.update_cells(cell_list)
-
-        # Agregar filas nuevas en un solo append
-        if new_rows:
-            ws.append_rows(new_rows)
-
-        return True
+            valores[f"mp3_chunk_{modelo_id}_{ci}"] = chunk
+        # Un batch_update para los chunks existentes + un append_rows
+        # para los nuevos
+        return gs.config().set_many(valores)
     except Exception as _e:
         st.session_state['_mp3_save_error'] = str(_e)
         return False
@@ -29294,29 +28732,62 @@ def _gs_cargar_mp3_chunks(modelo_id):
     try:
         gs = _gs()
         if not gs: return None, None
-        ws = gs._get_hoja('config')
-        if not ws: return None, None
-        all_v = ws.get_all_values()
-        rows = {row[0]: row[1] for row in all_v if row and len(row)>1}
-        meta_key = f"mp3_meta_{modelo_id}"
-        if meta_key not in rows: return None, None
-        parts = rows[meta_key].split("|")
+        cfg = gs.config()
+        meta = cfg.get(f"mp3_meta_{modelo_id}")
+        if meta is None: return None, None
+        parts = meta.split("|")
         n_chunks = int(parts[0])
         extension = parts[1] if len(parts)>1 else "mp3"
         chunks = []
         for ci in range(n_chunks):
-            ck = f"mp3_chunk_{modelo_id}_{ci}"
-            if ck not in rows: return None, None
-            chunks.append(rows[ck])
+            chunk = cfg.get(f"mp3_chunk_{modelo_id}_{ci}")
+            if chunk is None: return None, None
+            chunks.append(chunk)
         return "".join(chunks), extension
     except Exception:
         return None, None
 
+def _guardar_mp3_pausa_gs(modelo_id, path, extension="mp3"):
+    """Persiste el MP3 de un modelo: en el almacén por SHA-256 (Drive) con
+    una sola fila de metadatos en GSheets; sin Drive, por chunks base64."""
+    try:
+        gs = _gs()
+        if not gs: return False
+        almacen = gs.blobs()
+        if not almacen.durable:
+            import base64 as _b64m
+            with open(path, "rb") as f:
+                audio_b64 = _b64m.b64encode(f.read()).decode("utf-8")
+            return _gs_guardar_mp3_chunks(modelo_id, audio_b64, extension)
+        mime = "audio/mpeg" if extension == "mp3" else f"audio/{extension}"
+        h, tam = almacen.guardar_archivo(path, mime)
+        cfg = gs.config()
+        cambios = {f"blob_mp3_{modelo_id}": meta_blob(h, tam, Path(path).name, mime,
+                                                      ext=extension)}
+        # Vaciar los chunks base64 antiguos: ya no hacen falta
+        for clave, valor in cfg.items(f"mp3_chunk_{modelo_id}_"):
+            if valor:
+                cambios[clave] = ""
+        if cfg.get(f"mp3_meta_{modelo_id}"):
+            cambios[f"mp3_meta_{modelo_id}"] = ""
+        return cfg.set_many(cambios)
+    except Exception as _e:
+        st.session_state['_mp3_save_error'] = str(_e)
+        return False
+
 def _restaurar_mp3_desde_gs(modelo_id):
     """Restaura MP3 local desde GSheets si no existe. Retorna True si se restauró."""
     for ext in ["mp3","ogg","wav"]:
         if Path(f"pausa_mp3_{modelo_id}.{ext}").exists():
             return True  # ya existe
+    try:
+        gs = _gs()
+        meta = gs.config().get_json(f"blob_mp3_{modelo_id}") if gs else None
+        if meta and gs.blobs().restaurar(meta.get("sha256", ""),
+                                         f"pausa_mp3_{modelo_id}.{meta.get('ext', 'mp3')}"):
+            return True
+    except Exception:
+        pass
     b64, ext = _gs_cargar_mp3_chunks(modelo_id)
     if b64 and ext:
         try:
@@ -29345,15 +28816,12 @@ def _cargar_pausa_config():
     try:
         gs = _gs()
         if gs:
-            ws = gs._get_hoja('config')
-            if ws:
-                for row in ws.get_all_values():
-                    if row and row[0] == 'pausa_musica_config' and len(row) > 1 and row[1]:
-                        data = json.loads(row[1])
-                        # Guardar localmente para próximas cargas
-                        with open(ARCHIVO_PAUSA_MUSICA, 'w', encoding='utf-8') as f:
-                            json.dump(data, f, ensure_ascii=False)
-                        return data
+            data = gs.config().get_json('pausa_musica_config')
+            if data is not None:
+                # Guardar localmente para próximas cargas
+                with open(ARCHIVO_PAUSA_MUSICA, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False)
+                return data
     except Exception:
         pass
     return {}
@@ -29369,17 +28837,7 @@ def _guardar_pausa_config(data):
     try:
         gs = _gs()
         if gs:
-            ws = gs._get_hoja('config')
-            if ws:
-                data_str = json.dumps(data, ensure_ascii=False)
-                all_v = ws.get_all_values()
-                found = False
-                for idx, row in enumerate(all_v):
-                    if row and row[0] == 'pausa_musica_config':
-                        ws.update_cell(idx + 1, 2, data_str)
-                        found = True; break
-                if not found:
-                    ws.append_row(['pausa_musica_config', data_str])
+            gs.config().set('pausa_musica_config', json.dumps(data, ensure_ascii=False))
     except Exception:
         pass
     return True
@@ -29567,7 +29025,6 @@ def tab_pausa_activa(config):
                         label_visibility="collapsed"
                     )
                     if _mp3_up is not None:
-                        import base64 as _b64m2
                         _audio_bytes_up = _mp3_up.read()
                         _ext_up = _mp3_up.name.split(".")[-1].lower()
                         _sz_mb = len(_audio_bytes_up)/(1024*1024)
@@ -29575,12 +29032,11 @@ def tab_pausa_activa(config):
                         _path_up = f"pausa_mp3_{m['id']}.{_ext_up}"
                         with open(_path_up, "wb") as _f_up:
                             _f_up.write(_audio_bytes_up)
-                        # 2. Guardar en GSheets por chunks (persiste entre reinicios)
-                        with st.spinner(f"Guardando {_sz_mb:.1f}MB en Google Sheets..."):
-                            _b64_up = _b64m2.b64encode(_audio_bytes_up).decode("utf-8")
-                            _ok_gs = _gs_guardar_mp3_chunks(m['id'], _b64_up, _ext_up)
+                        # 2. Guardar en la nube (persiste entre reinicios)
+                        with st.spinner(f"Guardando {_sz_mb:.1f}MB en la nube..."):
+                            _ok_gs = _guardar_mp3_pausa_gs(m['id'], _path_up, _ext_up)
                         if _ok_gs:
-                            st.success(f"✅ Guardado en GSheets ({_sz_mb:.1f}MB)")
+                            st.success(f"✅ Guardado en la nube ({_sz_mb:.1f}MB)")
                         else:
                             st.warning("⚠️ Solo local — GSheets falló")
                         st.session_state.pop('_pausa_cfg_cache', None)
@@ -29596,15 +29052,12 @@ def tab_pausa_activa(config):
                             try:
                                 _gs_inst = _gs()
                                 if _gs_inst:
-                                    _ws_del = _gs_inst._get_hoja('config')
-                                    if _ws_del:
-                                        _all_del = _ws_del.get_all_values()
-                                        for _ri_d, _row_d in enumerate(_all_del):
-                                            if _row_d and (
-                                                _row_d[0] == f"mp3_meta_{m['id']}" or
-                                                _row_d[0].startswith(f"mp3_chunk_{m['id']}_")
-                                            ):
-                                                _ws_del.update_cell(_ri_d+1, 2, '')
+                                    _cfg_del = _gs_inst.config()
+                                    _vaciar = {f"mp3_meta_{m['id']}": '',
+                                               f"blob_mp3_{m['id']}": ''}
+                                    for _k_d, _ in _cfg_del.items(f"mp3_chunk_{m['id']}_"):
+                                        _vaciar[_k_d] = ''
+                                    _cfg_del.set_many(_vaciar)
                             except Exception:
                                 pass
                             st.rerun()
@@ -30997,14 +30450,7 @@ def _horario_guardar(usuario, grado, horario_data, horas, dias, areas, docente_n
         try:
             gs = _gs()
             if gs:
-                hoja = gs._get_hoja('config')
-                if hoja:
-                    celdas = hoja.get_all_records()
-                    for i, row in enumerate(celdas):
-                        if str(row.get('clave','')).strip() == clave:
-                            hoja.update_cell(i+2, 2, valor)
-                            return
-                    hoja.append_row([clave, valor])
+                gs.config().set(clave, valor)
         except Exception: pass
     _iniciar_hilo(_bg)
 
@@ -31023,15 +30469,10 @@ def _horarios_cargar_todos():
     try:
         gs = _gs()
         if gs:
-            hoja = gs._get_hoja('config')
-            if hoja:
-                for row in hoja.get_all_records():
-                    clave = str(row.get('clave','')).strip()
-                    if clave.startswith('horario_'):
-                        try:
-                            datos = _j.loads(str(row.get('valor','{}')))
-                            horarios[clave] = datos
-                        except Exception: pass
+            for clave, valor in gs.config().items('horario_'):
+                try:
+                    horarios[clave] = _j.loads(valor or '{}')
+                except Exception: pass
     except Exception: pass
     return horarios
 
@@ -31052,15 +30493,12 @@ def _horarios_del_usuario(usuario):
     try:
         gs = _gs()
         if gs:
-            hoja = gs._get_hoja('config')
-            if hoja:
-                for row in hoja.get_all_records():
-                    k = str(row.get('clave', '')).strip()
-                    if k == pref or k.startswith(pref + "__"):
-                        try:
-                            salida[k] = _j.loads(str(row.get('valor', '{}')))
-                        except Exception:
-                            pass
+            for k, valor in gs.config().items(pref):
+                if k == pref or k.startswith(pref + "__"):
+                    try:
+                        salida[k] = _j.loads(valor or '{}')
+                    except Exception:
+                        pass
     except Exception:
         pass
     return salida
@@ -31085,11 +30523,9 @@ def _horario_cargar_usuario(usuario):
     try:
         gs = _gs()
         if gs:
-            hoja = gs._get_hoja('config')
-            if hoja:
-                for row in hoja.get_all_records():
-                    if str(row.get('clave','')).strip() == clave:
-                        return _j.loads(str(row.get('valor','{}')))
+            valor = gs.config().get(clave)
+            if valor is not None:
+                return _j.loads(valor or '{}')
     except Exception: pass
     return None
 
@@ -31129,13 +30565,17 @@ def _horario_enviar_telegram(texto):
     subs = _tg_cargar_subs()
     if not subs:
         return 0, 0
-    enviados = 0
+    # Se encolan todos y se espera el resultado: salen en paralelo, al
+    # ritmo que permite Telegram
+    trabajos = []
     for _dni, entry in subs.items():
         chat_id = entry if isinstance(entry, (int, str)) else entry.get("chat_id", "")
         if not chat_id:
             continue
-        if _tg_enviar(chat_id, texto, token):
-            enviados += 1
+        trabajos.append(_tg_encolar(chat_id, texto, token))
+    limite = time.time() + 120
+    enviados = sum(1 for t in trabajos
+                   if t is not None and t.esperar(max(0, limite - time.time())))
     return enviados, len(subs)
 
 def _tab_horario(config):
@@ -32272,12 +31712,8 @@ def tab_yachay_plickers(config):
                     try:
                         gs = _gs()
                         if gs:
-                            ws = gs._get_hoja("config")
-                            if ws:
-                                all_v = ws.get_all_values()
-                                for ri, row in enumerate(all_v):
-                                    if row and row[0] in ("drive_qaway_mp3", "bin_qaway_mp3"):
-                                        ws.update_cell(ri + 1, 2, "")
+                            gs.config().set_many({"drive_qaway_mp3": "",
+                                                  "bin_qaway_mp3": ""})
                     except Exception:
                         pass
                     st.success("Música eliminada")
@@ -32603,18 +32039,15 @@ def tab_yachay_plickers(config):
                     )
                     comp_giant.html(html_g, height=720, scrolling=False)
 
-                # PANEL LATERAL: nombres que respondieron (en vivo)
-                resp_all = _plk_cargar_respuestas(sesion_id)
-                resp_preg = {}
-                for dni_r, datos_r in resp_all.items():
-                    r_item = datos_r.get('respuestas', {}).get(str(pidx))
-                    if r_item:
-                        resp_preg[dni_r] = {'nombre': datos_r['nombre'], **r_item}
+                # PANEL LATERAL: nombres que respondieron (en vivo), desde
+                # los contadores del agregador
+                vivo = _qaway().sesion(sesion_id).pregunta(pidx)
+                resp_preg = vivo['alumnos']
 
                 # ── RESUMEN DE RESPUESTAS DE ESTA PREGUNTA ───────────────
                 st.markdown("---")
-                n_resp = len(resp_preg)
-                correctos = sum(1 for r in resp_preg.values() if r.get('ok'))
+                n_resp = vivo['respondieron']
+                correctos = vivo['correctas']
                 incorrectos = n_resp - correctos
                 st.markdown(
                     f'<div style="display:flex;gap:10px;margin-bottom:8px;">'
@@ -32628,8 +32061,19 @@ def tab_yachay_plickers(config):
 
                 if resp_preg:
                     st.progress(correctos / max(n_resp, 1))
+                    # Distribución A/B/C/D
+                    cols_dist = st.columns(4)
+                    for col_d, op_d in zip(cols_dist, ('A', 'B', 'C', 'D')):
+                        n_d = vivo['conteo'][op_d]
+                        marca_d = ' ✅' if op_d == preg.get('correcta') else ''
+                        col_d.markdown(
+                            f"<div style='text-align:center;font-weight:700;'>{op_d}{marca_d}: {n_d}"
+                            f"<div style='background:#e5e7eb;border-radius:6px;height:8px;'>"
+                            f"<div style='background:#7c3aed;height:8px;border-radius:6px;"
+                            f"width:{round(n_d / n_resp * 100)}%;'></div></div></div>",
+                            unsafe_allow_html=True)
                     cols_nombres = st.columns(4)
-                    for idx_r, (dni_r, r_data) in enumerate(resp_preg.items()):
+                    for idx_r, r_data in enumerate(resp_preg):
                         col_i = idx_r % 4
                         color = '#16a34a' if r_data.get('ok') else '#dc2626'
                         emoji = '✅' if r_data.get('ok') else '❌'
@@ -32702,14 +32146,11 @@ def tab_yachay_plickers(config):
                             st.rerun()
             else:
                 # ============ PODIUM ESTILO KAHOOT ============
-                resp_final = _plk_cargar_respuestas(sesion_id)
+                resp_final = _qaway().sesion(sesion_id).puntajes()
                 if resp_final:
                     tpr_f = len(quiz["preguntas"])
                     ranking = []
-                    for dni_f, pr_f in resp_final.items():
-                        nm_f = pr_f.get("nombre", dni_f)
-                        resps_f = pr_f.get("respuestas", {})
-                        cor_f = sum(1 for r in resps_f.values() if r.get("ok"))
+                    for dni_f, (nm_f, cor_f) in resp_final.items():
                         nota_f = round(cor_f / max(tpr_f, 1) * 20, 1)
                         ranking.append({"nombre": nm_f, "correctas": cor_f, "total": tpr_f, "nota": nota_f, "dni": dni_f})
                     ranking.sort(key=lambda x: x["nota"], reverse=True)
@@ -32832,31 +32273,79 @@ def tab_yachay_plickers(config):
                         pass
 
                 # CAMARA PARA ESCANEAR
-                scan_modo = st.radio("Modo de escaneo:", ["Manual", "Camara QR"], horizontal=True, key="plik_scan_m")
-
-                if scan_modo == "Camara QR":
+                scan_modo = st.radio("Modo de escaneo:", ["Foto del aula", "Camara QR", "Manual"],
+                                     horizontal=True, key="plik_scan_m")
+
+                if scan_modo == "Foto del aula":
+                    # UNA foto de todo el salón con las tarjetas en alto:
+                    # se leen todos los QR y se guardan de una vez
+                    st.caption("Tome una sola foto del aula con todos los alumnos mostrando su tarjeta. "
+                               "Use la cámara del celular (más resolución) o la de abajo.")
+                    foto_aula = st.file_uploader("Foto del aula:", type=['jpg', 'jpeg', 'png'],
+                                                 key=f"plik_aula_up_{pidx2}")
+                    if foto_aula is None:
+                        foto_aula = st.camera_input("O capture aquí:", key=f"plik_aula_cam_{pidx2}")
+                    if foto_aula:
+                        ib_aula = foto_aula.getvalue()
+                        gsc_aula = quiz2.get('grado', '')
+                        dfs_aula = BaseDatos.obtener_estudiantes_grado(gsc_aula, "Todas") if gsc_aula else pd.DataFrame()
+                        nombres_aula = {}
+                        if not dfs_aula.empty and 'DNI' in dfs_aula.columns:
+                            nombres_aula = {str(r.get('DNI', '')).strip(): str(r.get('Nombre', '')).strip()
+                                            for _, r in dfs_aula.iterrows()}
+                        with st.spinner("Leyendo tarjetas..."):
+                            textos_aula = decodificar_qrs_imagen(ib_aula, esperados=len(nombres_aula) or None)
+                        lect_aula, amb_aula, otros_aula = _plk_lecturas_aula(textos_aula)
+                        if lect_aula:
+                            # Guardar una sola vez por foto (los reruns reenvían la misma)
+                            clave_aula = f"{sesion_id2}|{pidx2}|{hashlib.md5(ib_aula).hexdigest()}"
+                            if st.session_state.get('_plik_aula_guardada') != clave_aula:
+                                filas_aula = []
+                                for dni_a, op_a in lect_aula.items():
+                                    nom_a = nombres_aula.get(dni_a)
+                                    if not nom_a:
+                                        pa = BaseDatos.buscar_por_dni(dni_a)
+                                        nom_a = pa.get('Nombre', dni_a) if pa else dni_a
+                                    filas_aula.append((dni_a, nom_a, op_a))
+                                _plk_guardar_respuestas(sesion_id2, pidx2, preg2['correcta'], filas_aula)
+                                st.session_state['_plk_aula_guardada'] = clave_aula
+                                reproducir_beep_exitoso()
+                            n_ok_aula = sum(1 for op_a in lect_aula.values() if op_a == preg2['correcta'])
+                            st.success(f"✅ {len(lect_aula)} tarjetas leídas — {n_ok_aula} correctas, "
+                                       f"{len(lect_aula) - n_ok_aula} incorrectas")
+                            for op_a in ('A', 'B', 'C', 'D'):
+                                quienes = [nombres_aula.get(d, d) for d, o in lect_aula.items() if o == op_a]
+                                if quienes:
+                                    marca = "✅" if op_a == preg2['correcta'] else "❌"
+                                    st.markdown(f"{marca} **{op_a}** ({len(quienes)}): {', '.join(sorted(quienes))}")
+                        else:
+                            st.warning("No se detectaron tarjetas QAWAY en la foto.")
+                        if amb_aula:
+                            st.warning("Tarjetas con dos caras visibles (no registradas): "
+                                       + ", ".join(nombres_aula.get(d, d) for d in sorted(amb_aula)))
+                        if otros_aula:
+                            st.caption(f"{len(otros_aula)} código(s) que no son tarjetas QAWAY se ignoraron.")
+                        faltan_aula = [n for d, n in nombres_aula.items() if d not in lect_aula and d not in amb_aula]
+                        if lect_aula and faltan_aula:
+                            with st.expander(f"⏳ {len(faltan_aula)} alumno(s) sin leer en esta foto"):
+                                st.write(", ".join(sorted(faltan_aula)))
+
+                elif scan_modo == "Camara QR":
                     foto = st.camera_input("Apunte al QR del alumno:", key="plik_foto2")
                     if foto:
                         d = decodificar_qr_imagen(foto.getvalue())
-                        if d and (d.startswith("YP|") or d.startswith("YQ_")):
-                            if d.startswith("YP|"):
-                                partes = d.split("|")
-                            else:
-                                partes = d.replace("YQ_", "").split("_")
-                                partes = ["", partes[0], partes[1]] if len(partes) >= 2 else partes
-                            if len(partes) >= 3:
-                                dni_qr = partes[1]
-                                resp_qr = partes[2].upper()
-                                if resp_qr in ('A','B','C','D'):
-                                    pqr = BaseDatos.buscar_por_dni(dni_qr)
-                                    nqr = pqr.get('Nombre', dni_qr) if pqr else dni_qr
-                                    esc = resp_qr == preg2['correcta']
-                                    # GUARDAR EN ARCHIVO (sync con PC)
-                                    _plk_guardar_respuesta(sesion_id2, dni_qr, nqr, pidx2, resp_qr, preg2['correcta'])
-                                    col_r = "#16a34a" if esc else "#dc2626"
-                                    em = "CORRECTO" if esc else "INCORRECTO"
-                                    st.markdown(f"<div style='background:{col_r};color:white;padding:12px;border-radius:8px;text-align:center;font-size:1.3rem;'>{em}: <strong>{nqr}</strong> = <strong>{resp_qr}</strong></div>", unsafe_allow_html=True)
-                                    reproducir_beep_exitoso()
+                        tarjeta = _plk_leer_tarjeta(d)
+                        if tarjeta:
+                            dni_qr, resp_qr = tarjeta
+                            pqr = BaseDatos.buscar_por_dni(dni_qr)
+                            nqr = pqr.get('Nombre', dni_qr) if pqr else dni_qr
+                            esc = resp_qr == preg2['correcta']
+                            # GUARDAR EN ARCHIVO (sync con PC)
+                            _plk_guardar_respuesta(sesion_id2, dni_qr, nqr, pidx2, resp_qr, preg2['correcta'])
+                            col_r = "#16a34a" if esc else "#dc2626"
+                            em = "CORRECTO" if esc else "INCORRECTO"
+                            st.markdown(f"<div style='background:{col_r};color:white;padding:12px;border-radius:8px;text-align:center;font-size:1.3rem;'>{em}: <strong>{nqr}</strong> = <strong>{resp_qr}</strong></div>", unsafe_allow_html=True)
+                            reproducir_beep_exitoso()
                         elif d:
                             st.warning(f"QR no reconocido: {d[:30]}")
                         else:
@@ -32877,8 +32366,7 @@ def tab_yachay_plickers(config):
                             st.rerun()
 
                 # Resumen de esta pregunta
-                resp_scan = _plk_cargar_respuestas(sesion_id2)
-                n_scan = sum(1 for d in resp_scan.values() if str(pidx2) in d.get('respuestas', {}))
+                n_scan = _qaway().sesion(sesion_id2).pregunta(pidx2)['respondieron']
                 st.caption(f"{n_scan} respuestas registradas para esta pregunta")
 
                 # Sync: refrescar para ver siguiente pregunta
@@ -33287,31 +32775,69 @@ def _guardar_ausencias_auto_flags(data):
         pass
 
 
-def _es_nivel_turno_tarde(nivel_str, grado_str):
-    """Solo Secundaria y Academia Pre-U tienen turno tarde."""
-    n = str(nivel_str).strip().upper()
-    if n in _NIVELES_TURNO_TARDE:
-        return True
-    g = str(grado_str).strip()
-    return g in NIVELES_GRADOS.get('SECUNDARIA', []) or g in NIVELES_GRADOS.get('PREUNIVERSITARIO', [])
+@contextmanager
+def _bloqueo_archivo(ruta):
+    """Candado entre procesos (varios workers de Streamlit) sobre `ruta`.
+    Sin fcntl (Windows) solo queda el candado del proceso."""
+    with open(ruta, 'a') as fh:
+        if fcntl is not None:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def _faltantes_turno(df_mat, presentes, suscritos, turno_tarde):
+    """Anti-join vectorizado: alumnos de la matrícula con apoderado
+    suscrito que NO están en `presentes`. Lista de {dni, nombre, grado}."""
+    dnis = df_mat['DNI'].astype(str).str.strip()
+    mascara = (dnis != '') & dnis.isin(suscritos) & ~dnis.isin(presentes)
+    if turno_tarde:
+        niveles = df_mat.get('Nivel', pd.Series('', index=df_mat.index))
+        grados = df_mat.get('Grado', pd.Series('', index=df_mat.index))
+        grados_tarde = (NIVELES_GRADOS.get('SECUNDARIA', [])
+                        + NIVELES_GRADOS.get('PREUNIVERSITARIO', []))
+        mascara &= (niveles.astype(str).str.strip().str.upper().isin(_NIVELES_TURNO_TARDE)
+                    | grados.astype(str).str.strip().isin(grados_tarde))
+    sel = df_mat.loc[mascara]
+    return [{'dni': d, 'nombre': n, 'grado': g} for d, n, g in zip(
+        dnis[mascara], sel.get('Nombre', pd.Series('', index=sel.index)),
+        sel.get('Grado', pd.Series('', index=sel.index)))]
 
 
 def _verificar_y_enviar_ausencias_automatico():
-    """Se ejecuta en cada carga de página (de cualquier usuario logueado).
-    Si ya pasaron las 9:00am (turno mañana, todos) o las 4:00pm (turno
+    """Si ya pasaron las 9:00am (turno mañana, todos) o las 4:00pm (turno
     tarde, SOLO Secundaria y Academia Pre-U) y todavía no se avisó hoy
     para ese turno, manda automáticamente 'FALTA' por Telegram a los
     apoderados de quienes no registraron entrada. Se manda una sola vez
-    por turno por día (se guarda un flag para no duplicar avisos)."""
-    try:
-        ahora = hora_peru()
-        if ahora.weekday() == 6:  # domingo: no hay clases
-            return
-        fecha_hoy = fecha_peru_str()
-        mins_ahora = ahora.hour * 60 + ahora.minute
-
+    por turno por día (se guarda un flag para no duplicar avisos).
+    La llama el hilo de _programador_ausencias(), nunca una página."""
+    ahora = hora_peru()
+    if ahora.weekday() == 6:  # domingo: no hay clases
+        return
+    fecha_hoy = fecha_peru_str()
+    mins_ahora = ahora.hour * 60 + ahora.minute
+
+    def _turnos_pendientes(flags):
+        dia = flags.get(fecha_hoy, {})
+        turnos = []
+        if mins_ahora >= 9 * 60 and not dia.get('manana_enviado'):
+            turnos.append('manana')
+        if mins_ahora >= 16 * 60 and ahora.weekday() != 5 and not dia.get('tarde_enviado'):
+            turnos.append('tarde')
+        return turnos
+
+    # Chequeo barato (un JSON chico) antes de tomar el candado
+    if not _turnos_pendientes(_cargar_ausencias_auto_flags()):
+        return
+    with _bloqueo_archivo(ARCHIVO_AUSENCIAS_AUTO + '.lock'):
+        # Releer dentro del candado: otro worker pudo haberlo enviado ya
         flags = _cargar_ausencias_auto_flags()
-        flags.setdefault(fecha_hoy, {})
+        turnos = _turnos_pendientes(flags)
+        if not turnos:
+            return
 
         cfg_tg = _tg_cargar_config()
         token = _tg_limpiar_token(cfg_tg.get("bot_token", ""))
@@ -33319,68 +32845,66 @@ def _verificar_y_enviar_ausencias_automatico():
         if not token or not subs_tg:
             return
 
-        asis_hoy = {}
-        if Path(ARCHIVO_ASISTENCIAS).exists():
-            with open(ARCHIVO_ASISTENCIAS, 'r', encoding='utf-8') as f:
-                asis_hoy = json.load(f).get(fecha_hoy, {})
-
-        df_mat = BaseDatos.cargar_matricula()
+        # Sin sesión: la matrícula se lee de GS / disco, no de session_state
+        df_mat, _ = BaseDatos.leer_matricula_fuentes()
         if df_mat.empty or 'DNI' not in df_mat.columns:
             return
+        asis_hoy = _diario_asistencias().leer_dia(fecha_hoy)
 
-        # ── Turno mañana: después de las 9:00am, aplica a TODOS ──────────
-        if mins_ahora >= 9 * 60 and not flags[fecha_hoy].get('manana_enviado'):
-            flags[fecha_hoy]['manana_enviado'] = True
-            _guardar_ausencias_auto_flags(flags)
-            faltantes = []
-            for _, row in df_mat.iterrows():
-                dni_r = str(row.get('DNI', '')).strip()
-                if not dni_r or dni_r not in subs_tg:
-                    continue
-                reg = asis_hoy.get(dni_r, {})
-                if not (reg.get('entrada') or reg.get('tardanza')):
-                    faltantes.append({'dni': dni_r, 'nombre': row.get('Nombre', ''), 'grado': row.get('Grado', '')})
-            if faltantes:
-                def _enviar_faltas_manana(lista):
-                    for f_ in lista:
-                        ent = subs_tg.get(f_['dni'])
-                        cid = ent if isinstance(ent, (int, str)) else ent.get("chat_id", "")
-                        if not cid:
-                            continue
-                        msg = (f"\U0001f6a8 YACHAY PRO - Falta\n\n{f_['nombre']}\nGrado: {f_['grado']}\n\n"
-                               f"No registra ENTRADA hoy {fecha_hoy} (turno mañana).\n\n"
-                               f"I.E.P. Alternativo Yachay - Chinchero\n\U0001f4de 084-750071")
-                        _tg_enviar(cid, msg, token)
-                _iniciar_hilo(_enviar_faltas_manana, args=(faltantes,))
-
-        # ── Turno tarde: después de las 4:00pm, SOLO Secundaria/Pre-U ────
-        if mins_ahora >= 16 * 60 and ahora.weekday() != 5 and not flags[fecha_hoy].get('tarde_enviado'):
-            flags[fecha_hoy]['tarde_enviado'] = True
-            _guardar_ausencias_auto_flags(flags)
-            faltantes_t = []
-            for _, row in df_mat.iterrows():
-                if not _es_nivel_turno_tarde(row.get('Nivel', ''), row.get('Grado', '')):
-                    continue
-                dni_r = str(row.get('DNI', '')).strip()
-                if not dni_r or dni_r not in subs_tg:
-                    continue
-                reg = asis_hoy.get(dni_r, {})
-                if not reg.get('entrada_tarde'):
-                    faltantes_t.append({'dni': dni_r, 'nombre': row.get('Nombre', ''), 'grado': row.get('Grado', '')})
-            if faltantes_t:
-                def _enviar_faltas_tarde(lista):
-                    for f_ in lista:
-                        ent = subs_tg.get(f_['dni'])
-                        cid = ent if isinstance(ent, (int, str)) else ent.get("chat_id", "")
-                        if not cid:
-                            continue
-                        msg = (f"\U0001f6a8 YACHAY PRO - Falta\n\n{f_['nombre']}\nGrado: {f_['grado']}\n\n"
-                               f"No registra ENTRADA hoy {fecha_hoy} (turno tarde).\n\n"
-                               f"I.E.P. Alternativo Yachay - Chinchero\n\U0001f4de 084-750071")
-                        _tg_enviar(cid, msg, token)
-                _iniciar_hilo(_enviar_faltas_tarde, args=(faltantes_t,))
-    except Exception:
-        pass  # Nunca debe tumbar la app — esto es un extra, no algo crítico
+        flags.setdefault(fecha_hoy, {})
+        for turno in turnos:
+            flags[fecha_hoy][f'{turno}_enviado'] = True
+        # Solo interesan los flags recientes
+        for fecha_vieja in sorted(flags)[:-14]:
+            flags.pop(fecha_vieja, None)
+        _guardar_ausencias_auto_flags(flags)
+
+    suscritos = set(subs_tg)
+    for turno in turnos:
+        if turno == 'manana':
+            presentes = {d for d, r in asis_hoy.items()
+                         if r.get('entrada') or r.get('tardanza')}
+            etiqueta = 'turno mañana'
+        else:
+            presentes = {d for d, r in asis_hoy.items() if r.get('entrada_tarde')}
+            etiqueta = 'turno tarde'
+        for f_ in _faltantes_turno(df_mat, presentes, suscritos, turno == 'tarde'):
+            ent = subs_tg.get(f_['dni'])
+            cid = ent if isinstance(ent, (int, str)) else ent.get("chat_id", "")
+            if not cid:
+                continue
+            msg = (f"\U0001f6a8 YACHAY PRO - Falta\n\n{f_['nombre']}\nGrado: {f_['grado']}\n\n"
+                   f"No registra ENTRADA hoy {fecha_hoy} ({etiqueta}).\n\n"
+                   f"I.E.P. Alternativo Yachay - Chinchero\n\U0001f4de 084-750071")
+            _tg_encolar(cid, msg, token)
+
+
+def _segundos_hasta_barrido():
+    """Segundos hasta las próximas 9:00 o 16:00 (hora de Perú), como
+    máximo 10 minutos para tolerar cambios de hora del servidor."""
+    ahora = hora_peru()
+    for h in (9, 16):
+        objetivo = ahora.replace(hour=h, minute=0, second=5, microsecond=0)
+        if objetivo > ahora:
+            return min(600, (objetivo - ahora).total_seconds())
+    return 600
+
+
+@st.cache_resource
+def _programador_ausencias():
+    """Hilo ÚNICO por proceso que dispara los avisos de faltas de las
+    9:00 y las 16:00. Las páginas no hacen nada para esta función.
+    El hilo vive más que la sesión que lo creó: no se le adjunta su
+    ScriptRunContext. Entre workers serializa _bloqueo_archivo."""
+    def _bucle():
+        while True:
+            try:
+                _verificar_y_enviar_ausencias_automatico()
+            except Exception:
+                pass  # Nunca debe tumbar el hilo — esto es un extra
+            time.sleep(_segundos_hasta_barrido())
+
+    return _iniciar_hilo(_bucle, contexto=False)
 
 
 def main():
@@ -33394,11 +32918,15 @@ def main():
         tab_portal_estudiante()
         st.stop()
 
+    # Arranca (una vez por proceso) la restauración en segundo plano: el
+    # login se dibuja mientras tanto
+    _restauracion = _restauracion_arranque()
+
     if st.session_state.rol is None:
         pantalla_login()
         st.stop()
 
-    _verificar_y_enviar_ausencias_automatico()
+    _programador_ausencias()
 
     # JS global — pinta rojo los botones de peligro por texto
     import streamlit.components.v1 as _comp_gjs
@@ -33456,16 +32984,11 @@ def main():
     })();
     </script>""", height=0)
 
-    # Restaurar datos desde Google Sheets + Drive si archivos locales no existen
-    if 'datos_restaurados' not in st.session_state:
-        try:
-            _restaurar_datos_desde_gs()
-            _restaurar_todos_archivos_binarios()  # escudos, fondo, mp3 pausas y qaway
-            # Restaurar desde Drive backups si GSheets no tenía los datos
-            _restaurar_desde_drive_backups()
-            st.session_state.datos_restaurados = True
-        except Exception:
-            st.session_state.datos_restaurados = True
+    # La restauración suele terminar mientras se escribe la contraseña;
+    # si no, se espera aquí antes de leer los archivos restaurados
+    if not _restauracion.terminado:
+        with st.spinner("Restaurando datos desde Google Sheets y Drive..."):
+            _restauracion.esperar(timeout=90)
 
     config = configurar_sidebar()
 
@@ -34835,44 +34358,30 @@ def tab_analisis_predictivo(config):
         return
 
     st.info(f"👥 Analizando {len(df_p)} estudiantes de {grado_p}")
-    asis_all = {}
-    try:
-        if Path(ARCHIVO_ASISTENCIAS).exists():
-            with open(ARCHIVO_ASISTENCIAS,"r",encoding="utf-8") as f: asis_all = json.load(f)
-    except Exception: pass
-    notas_all = {}
+    hoy = hora_peru()
+    # Totales del año ya contados (antes: todo el historial × cada alumno).
+    # Tardanza con el mismo criterio que los rankings (campo tardanza o
+    # entrada después del límite)
+    asis_anio = _resumen_asistencias().resumen_anio(hoy.year)
     try:
-        if Path("notas.json").exists():
-            with open("notas.json","r",encoding="utf-8") as f: notas_all = json.load(f)
-    except Exception: pass
+        notas_grado_p = _almacen_notas().notas_grado(grado_p)
+    except Exception:
+        notas_grado_p = {}
 
-    hoy = hora_peru()
+    dias_anio = next(iter(asis_anio.values()), {}).get("dias", 0)
     perfiles = []
     for _, row in df_p.iterrows():
         dni_e = str(row.get("DNI",row.get("dni",""))).strip()
         nom_e = str(row.get("Nombre",row.get("nombre",""))).strip()
         if not dni_e: continue
-        td = 0; da = 0; dt = 0; df2 = 0
-        for fk, fd in asis_all.items():
-            try:
-                ft = datetime.strptime(fk,"%Y-%m-%d") if "-" in fk else datetime.strptime(fk,"%d/%m/%Y")
-                if ft.year != hoy.year or ft.weekday() >= 5: continue
-                td += 1
-                if dni_e in fd:
-                    re2 = fd[dni_e]
-                    if re2.get("tardanza"): dt += 1
-                    else: da += 1
-                else: df2 += 1
-            except Exception: continue
+        ra = asis_anio.get(dni_e)
+        td = dias_anio
+        dt = ra["tardanza"] if ra else 0
+        da = ra["registrado"] - dt if ra else 0
+        df2 = ra["faltas"] if ra else td
         pct_a = round(da/td*100,1) if td else 0
         pct_t = round(dt/td*100,1) if td else 0
-        proms = []
-        for k,v in notas_all.items():
-            if isinstance(v,dict) and str(v.get("grado",""))==grado_p:
-                n = v.get("notas",{}).get(dni_e) or v.get("notas",{}).get(nom_e)
-                if n is not None:
-                    try: proms.append(float(n))
-                    except Exception: pass
+        proms = notas_grado_p.get(dni_e) or notas_grado_p.get(nom_e) or []
         pn = round(sum(proms)/len(proms),1) if proms else None
         riesgo = min(100, round(max(0,(75-pct_a))*1.2 + pct_t*0.5 + (max(0,(13-(pn or 13)))*3.5)))
         nivel = "🔴 ALTO" if riesgo>=60 else ("🟡 MEDIO" if riesgo>=35 else "🟢 BAJO")
@@ -35135,23 +34644,20 @@ def tab_libro_reclamaciones(config):
                     codigo_rec = f"REC-{hora_peru().year}-{int(time.time()) % 10000:04d}"
                     if gs:
                         try:
-                            ws = gs._get_hoja('config')
-                            if ws:
-                                ws.append_row([
-                                    f"reclamo_{codigo_rec}",
-                                    json.dumps({
-                                        'codigo': codigo_rec,
-                                        'nombre': r_nombre,
-                                        'dni': r_dni,
-                                        'celular': r_celular,
-                                        'correo': r_correo,
-                                        'tipo': r_tipo,
-                                        'detalle': r_detalle,
-                                        'fecha': fecha_peru_str(),
-                                        'hora': hora_peru_str(),
-                                        'estado': 'Pendiente',
-                                    }, ensure_ascii=False)
-                                ])
+                            gs.config().agregar(
+                                f"reclamo_{codigo_rec}",
+                                json.dumps({
+                                    'codigo': codigo_rec,
+                                    'nombre': r_nombre,
+                                    'dni': r_dni,
+                                    'celular': r_celular,
+                                    'correo': r_correo,
+                                    'tipo': r_tipo,
+                                    'detalle': r_detalle,
+                                    'fecha': fecha_peru_str(),
+                                    'hora': hora_peru_str(),
+                                    'estado': 'Pendiente',
+                                }, ensure_ascii=False))
                         except Exception:
                             pass
                     st.success(f"✅ Reclamo registrado. Código: **{codigo_rec}**")
@@ -35169,27 +34675,24 @@ def tab_libro_reclamaciones(config):
         st.markdown("### 📋 Reclamos Recibidos")
         if gs:
             try:
-                ws = gs._get_hoja('config')
-                if ws:
-                    data = ws.get_all_records()
-                    reclamos = [json.loads(d['valor']) for d in data
-                               if str(d.get('clave', '')).startswith('reclamo_')]
-                    if reclamos:
-                        for rec in reversed(reclamos[-15:]):
-                            estado = rec.get('estado', 'Pendiente')
-                            emoji = "🟡" if estado == "Pendiente" else "🟢"
-                            with st.expander(
-                                f"{emoji} {rec.get('codigo', '')} — {rec.get('nombre', '')}"):
-                                st.write(f"**Tipo:** {rec.get('tipo', '')}")
-                                st.write(f"**Fecha:** {rec.get('fecha', '')} {rec.get('hora','')}")
-                                st.write(f"**Detalle:** {rec.get('detalle', '')}")
-                                if rec.get('correo'):
-                                    st.write(f"**Correo:** {rec.get('correo', '')}")
-                                if rec.get('celular'):
-                                    st.write(f"**Celular:** {rec.get('celular', '')}")
-                                st.write(f"**Estado:** {estado}")
-                    else:
-                        st.info("📭 Sin reclamos registrados")
+                reclamos = [json.loads(valor)
+                            for _clave, valor in gs.config().items('reclamo_')]
+                if reclamos:
+                    for rec in reversed(reclamos[-15:]):
+                        estado = rec.get('estado', 'Pendiente')
+                        emoji = "🟡" if estado == "Pendiente" else "🟢"
+                        with st.expander(
+                            f"{emoji} {rec.get('codigo', '')} — {rec.get('nombre', '')}"):
+                            st.write(f"**Tipo:** {rec.get('tipo', '')}")
+                            st.write(f"**Fecha:** {rec.get('fecha', '')} {rec.get('hora','')}")
+                            st.write(f"**Detalle:** {rec.get('detalle', '')}")
+                            if rec.get('correo'):
+                                st.write(f"**Correo:** {rec.get('correo', '')}")
+                            if rec.get('celular'):
+                                st.write(f"**Celular:** {rec.get('celular', '')}")
+                            st.write(f"**Estado:** {estado}")
+                else:
+                    st.info("📭 Sin reclamos registrados")
             except Exception:
                 st.info("📭 Sin reclamos aún")
         else:
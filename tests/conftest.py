@@ -0,0 +1,37 @@
+"""
+Fixtures comunes de las pruebas de rendimiento. Si falta OpenCV (o
+alguna otra dependencia del módulo probado) las pruebas se saltan.
+"""
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+RAIZ = Path(__file__).resolve().parent.parent
+if str(RAIZ) not in sys.path:
+    sys.path.insert(0, str(RAIZ))
+
+
+@pytest.fixture(scope="session")
+def omr():
+    pytest.importorskip("cv2")
+    return pytest.importorskip("escaner_omr")
+
+
+@pytest.fixture(scope="session")
+def sw():
+    """sistema_web completo (Streamlit, ReportLab, ...), p. ej. para
+    GeneradorCarnet."""
+    pytest.importorskip("cv2")
+    return pytest.importorskip("sistema_web")
+
+
+def cronometrar(funcion, repeticiones=5):
+    """Mejor tiempo (segundos) de `repeticiones` llamadas a funcion()."""
+    mejor = float("inf")
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        funcion()
+        mejor = min(mejor, time.perf_counter() - t0)
+    return mejor
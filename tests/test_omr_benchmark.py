@@ -0,0 +1,107 @@
+"""
+Lector OMR vectorizado (_leer_burbujas) sobre hojas sintéticas hechas
+con generar_hoja_respuestas: mismas decisiones A/B/C/D/?/- que el lector
+anterior (hoja entera binarizada + una máscara OpenCV por burbuja) y al
+menos 10 veces más rápido que él por hoja.
+"""
+import numpy as np
+import pytest
+
+from conftest import cronometrar
+
+LETRAS = ['A', 'B', 'C', 'D']
+
+
+def _decidir_referencia(omr, thresh, num_preguntas):
+    """Lector anterior a la versión vectorizada: una máscara OpenCV por
+    burbuja, sobre la misma hoja binarizada."""
+    cv2 = omr.cv2
+    r = int(omr.HOJA_BUBBLE_R * 0.60)
+    respuestas = []
+    for i in range(num_preguntas):
+        intensidades = []
+        for j in range(4):
+            cx, cy = omr._posicion_burbuja(i, j)
+            if (cy - r < 0 or cy + r >= omr.HOJA_H or
+                    cx - r < 0 or cx + r >= omr.HOJA_W):
+                intensidades.append(0.0)
+                continue
+            y1, y2 = max(0, cy - r - 5), min(omr.HOJA_H, cy + r + 5)
+            x1, x2 = max(0, cx - r - 5), min(omr.HOJA_W, cx + r + 5)
+            roi = thresh[y1:y2, x1:x2]
+            mask = np.zeros_like(roi, dtype="uint8")
+            cv2.circle(mask, (cx - x1, cy - y1), r, 255, -1)
+            masked = cv2.bitwise_and(roi, roi, mask=mask)
+            total = cv2.countNonZero(mask)
+            intensidades.append(cv2.countNonZero(masked) / total if total else 0.0)
+        max_val = max(intensidades)
+        segunda = sorted(intensidades, reverse=True)[1]
+        if max_val < 0.45:
+            respuestas.append('-')
+        elif segunda > 0 and max_val / segunda < 1.4:
+            respuestas.append('?')
+        else:
+            respuestas.append(LETRAS[intensidades.index(max_val)])
+    return respuestas
+
+
+def _hoja_sintetica(omr, num_preguntas, semilla):
+    """Hoja en blanco de generar_hoja_respuestas con burbujas rellenas al
+    azar: una marca (la mayoría), ninguna ('-') o dos ('?')."""
+    cv2 = omr.cv2
+    png = omr.generar_hoja_respuestas(num_preguntas, "Prueba").getvalue()
+    gray = cv2.imdecode(np.frombuffer(png, np.uint8), cv2.IMREAD_GRAYSCALE)
+    rng = np.random.default_rng(semilla)
+    esperadas = []
+    for i in range(num_preguntas):
+        tipo = rng.choice(['una', 'blanco', 'doble'], p=[0.8, 0.1, 0.1])
+        if tipo == 'blanco':
+            esperadas.append('-')
+            continue
+        opciones = rng.choice(4, size=1 if tipo == 'una' else 2, replace=False)
+        for j in opciones:
+            cv2.circle(gray, omr._posicion_burbuja(i, int(j)),
+                       omr.HOJA_BUBBLE_R - 4, 0, -1)
+        esperadas.append(LETRAS[int(opciones[0])] if tipo == 'una' else '?')
+    return gray, esperadas
+
+
+def _como_foto(omr, gray, semilla):
+    """La hoja con menos contraste, iluminación desigual, ruido y un poco
+    de desenfoque, como queda una foto ya enderezada."""
+    cv2 = omr.cv2
+    rng = np.random.default_rng(semilla)
+    gradiente = 25 * np.linspace(0, 1, gray.shape[1])[None, :]
+    foto = gray * 0.7 + 40 + gradiente + rng.normal(0, 8, gray.shape)
+    return cv2.GaussianBlur(np.clip(foto, 0, 255).astype(np.uint8), (3, 3), 0)
+
+
+@pytest.mark.parametrize("foto", [False, True])
+@pytest.mark.parametrize("num_preguntas", [20, 40, 60])
+def test_mismas_respuestas_que_el_lector_anterior(omr, num_preguntas, foto):
+    gray, esperadas = _hoja_sintetica(omr, num_preguntas, semilla=num_preguntas)
+    if foto:
+        gray = _como_foto(omr, gray, semilla=num_preguntas)
+    nuevas = omr._leer_burbujas(gray, num_preguntas)
+    thresh = omr._binarizar_hoja(gray)
+    assert nuevas == _decidir_referencia(omr, thresh, num_preguntas)
+    assert nuevas == esperadas
+
+
+def test_benchmark_lectura_por_hoja(omr):
+    # 60 = tres columnas de 20, lo máximo que entra en la plantilla
+    num_preguntas = 60
+    gray, _ = _hoja_sintetica(omr, num_preguntas, semilla=7)
+    omr._leer_burbujas(gray, num_preguntas)   # calienta los bancos
+
+    def _anterior():
+        thresh = omr._binarizar_hoja(gray)
+        return _decidir_referencia(omr, thresh, num_preguntas)
+
+    t_nuevo = cronometrar(lambda: omr._leer_burbujas(gray, num_preguntas), 20)
+    t_ref = cronometrar(_anterior, 10)
+    print(f"\nhoja de {num_preguntas} preguntas: {t_nuevo * 1000:.2f} ms "
+          f"vs {t_ref * 1000:.2f} ms (x{t_ref / t_nuevo:.1f})")
+    # Hoja completa: la binarización ahora es solo de los parches de las
+    # burbujas, no de los 8.7 Mpx de la hoja
+    assert t_ref / t_nuevo >= 10
@@ -0,0 +1,119 @@
+"""
+Decodificación de QR de la cámara de asistencia (decodificar_qr_imagen)
+sobre fotos simuladas de carnets de GeneradorCarnet: el carnet reducido
+y un poco girado sobre un fondo, en JPEG como lo envía st.camera_input.
+Objetivo: menos de 50 ms por frame en un núcleo.
+
+pyzbar (con libzbar0 de packages.txt) es el primer decodificador del
+pipeline; sin él esas pruebas se saltan. Las *_solo_cv2 desactivan pyzbar
+y miden el camino que queda (detector de cv2), que corre en cualquier
+máquina con OpenCV.
+"""
+import io
+import statistics
+import time
+
+import pytest
+from PIL import Image, ImageOps
+
+DNIS = ['70123456', '71234567', '72345678', '60000001', '45678912', '80808080']
+
+
+def _frame(sw, dni, angulo, escala=0.8, fondo=(150, 140, 130)):
+    carnet = sw.GeneradorCarnet({'Nombre': 'QUISPE MAMANI ROSA', 'DNI': dni,
+                                 'Grado': '3° SECUNDARIA'}, 2026).renderizar()
+    carnet = carnet.resize((int(carnet.width * escala),
+                            int(carnet.height * escala)))
+    carnet = carnet.rotate(angulo, expand=True, fillcolor=fondo)
+    frame = Image.new('RGB', (1280, 720), fondo)
+    frame.paste(carnet, ((1280 - carnet.width) // 2, (720 - carnet.height) // 2))
+    return frame
+
+
+def _jpeg(img):
+    out = io.BytesIO()
+    img.save(out, format='JPEG', quality=85)
+    return out.getvalue()
+
+
+@pytest.fixture(scope="module")
+def zbar(omr):
+    if not omr.HAS_PYZBAR:
+        pytest.skip("pyzbar/libzbar no instalado")
+    return omr
+
+
+@pytest.fixture
+def solo_cv2(omr, monkeypatch):
+    monkeypatch.setattr(omr, 'HAS_PYZBAR', False)
+    with omr._qr_cache_lock:
+        omr._qr_cache.clear()
+    yield omr
+    # Lo leído sin zbar no debe contestar por las pruebas con zbar
+    with omr._qr_cache_lock:
+        omr._qr_cache.clear()
+
+
+@pytest.fixture(scope="module")
+def frames(sw):
+    return [(dni, _jpeg(_frame(sw, dni, angulo)))
+            for dni in DNIS for angulo in (0, 4, -7)]
+
+
+def test_lee_el_dni_de_cada_carnet(zbar, frames):
+    for dni, ib in frames:
+        assert zbar.decodificar_qr_imagen(ib) == dni
+
+
+def test_codigo_en_negativo(zbar, sw):
+    ib = _jpeg(ImageOps.invert(_frame(sw, DNIS[0], 0)))
+    assert zbar.decodificar_qr_imagen(ib) == DNIS[0]
+
+
+def _mediana_por_frame(omr, frames, etiqueta):
+    tiempos = []
+    for _, ib in frames:
+        with omr._qr_cache_lock:
+            omr._qr_cache.clear()
+        t0 = time.perf_counter()
+        omr.decodificar_qr_imagen(ib)
+        tiempos.append(time.perf_counter() - t0)
+    mediana = statistics.median(tiempos)
+    print(f"\ndecodificar_qr_imagen ({etiqueta}): mediana {mediana * 1000:.1f} ms, "
+          f"peor {max(tiempos) * 1000:.1f} ms ({len(tiempos)} frames 1280x720)")
+    return mediana
+
+
+def test_benchmark_por_frame(zbar, frames):
+    assert _mediana_por_frame(zbar, frames, 'zbar') < 0.050
+
+    # El mismo frame otra vez (rerun de Streamlit) sale de la caché
+    t0 = time.perf_counter()
+    zbar.decodificar_qr_imagen(frames[-1][1])
+    assert time.perf_counter() - t0 < 0.005
+
+
+def test_lee_el_dni_de_cada_carnet_solo_cv2(solo_cv2, frames):
+    for dni, ib in frames:
+        assert solo_cv2.decodificar_qr_imagen(ib) == dni
+
+
+def test_codigo_en_negativo_solo_cv2(solo_cv2, sw):
+    ib = _jpeg(ImageOps.invert(_frame(sw, DNIS[0], 4)))
+    assert solo_cv2.decodificar_qr_imagen(ib) == DNIS[0]
+
+
+def test_benchmark_por_frame_solo_cv2(solo_cv2, frames):
+    assert _mediana_por_frame(solo_cv2, frames, 'solo cv2') < 0.050
+
+
+@pytest.mark.parametrize("alto, ancho", [(1440, 3200), (2133, 3200), (720, 1280)])
+def test_mosaicos_cubren_bordes(omr, alto, ancho):
+    # Fotos del aula (QR en alto): los mosaicos llegan al borde inferior
+    # y al derecho, y se solapan entre sí
+    lado = omr._QR_AULA_MOSAICO
+    for largo in (alto, ancho):
+        origenes = omr._origenes_mosaico(largo)
+        assert origenes[0] == 0
+        assert origenes[-1] + lado >= largo
+        assert all(b - a < lado for a, b in zip(origenes, origenes[1:]))